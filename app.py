@@ -1,16 +1,79 @@
 """app.py"""
 from __future__ import annotations
+from os import environ
 from flask import Flask
 from werkzeug.middleware.proxy_fix import ProxyFix
-from config import Config
-from extensions import db, login_manager, csrf, migrate, argon2
-from blueprints.main import main_bp
-from blueprints.auth import auth_bp
-from blueprints.admin import admin_bp
-from blueprints.errors import errors_bp
+from audit import audit
+from config import Config, config_for
+from extensions import (db, replicas, sqlite_pragmas, login_manager, csrf,
+                        argon2, password_hashing, user_cache, ratelimiter,
+                        page_cache, compression, static_assets,
+                        template_cache)
+from lockout import lockout
+from metrics import metrics
+from profiler import profiler
+from querybudget import query_budget
+from scheduler import scheduler
+from sessions import session_store
+from username_index import username_index
 
+ROLES = ("web", "cli", "worker")
 
-def create_app() -> Flask:
+
+def register_blueprints(app: Flask) -> None:
+    """
+    Register the blueprints that serve requests.
+
+    Imported here so that processes that never serve requests do not load
+    the views, forms and their dependencies.
+
+    Args:
+        app (Flask): The Flask application object.
+    """
+    # pylint: disable=import-outside-toplevel
+    from blueprints.main import main_bp
+    from blueprints.auth import auth_bp
+    from blueprints.admin import admin_bp
+    from blueprints.errors import errors_bp
+    app.register_blueprint(main_bp)
+    app.register_blueprint(auth_bp, url_prefix="/auth")
+    app.register_blueprint(admin_bp, url_prefix="/admin")
+    app.register_blueprint(errors_bp)
+
+
+def register_commands(app: Flask) -> None:
+    """
+    Register Flask-Migrate and the application's CLI commands.
+
+    Flask-Migrate pulls in Alembic, which only the command line needs, so it
+    is imported here rather than with the other extensions.
+
+    Args:
+        app (Flask): The Flask application object.
+    """
+    # pylint: disable=import-outside-toplevel
+    from flask_migrate import Migrate
+    from calibrate import argon2_calibrate
+    from loadtest import loadtest
+    from lockout import lockout_cli
+    from provisioning import users_cli
+    from scheduler import scheduler_cli
+    from sessions import sessions_cli
+    from static_assets import assets_cli
+    from template_cache import templates_cli
+    Migrate(app, db)
+    app.cli.add_command(argon2_calibrate)
+    app.cli.add_command(assets_cli)
+    app.cli.add_command(loadtest)
+    app.cli.add_command(lockout_cli)
+    app.cli.add_command(scheduler_cli)
+    app.cli.add_command(sessions_cli)
+    app.cli.add_command(templates_cli)
+    app.cli.add_command(users_cli)
+
+
+def create_app(config: type[Config] | None = None,
+               role: str = "cli") -> Flask:
     """
     Create and configure the Flask application.
 
@@ -19,28 +82,72 @@ def create_app() -> Flask:
     and migrations), and registers blueprints for different parts of the
     application.
 
-    The app is configured from the `Config` object, and certain middleware,
-    such as `ProxyFix`, is applied.
+    The app is configured from the given `Config` profile, or the one named
+    by the `ENVIRONMENT` variable, and certain middleware, such as
+    `ProxyFix`, is applied so that `request.remote_addr` is the real client
+    address when running behind a reverse proxy.
+
+    The role decides what is loaded. "web" (WSGI workers) serves requests
+    and leaves out migrations and CLI commands. "worker" (scripts and
+    background jobs) only gets the database layer, without views, forms or
+    templates. "cli", the default used by the `flask` command, loads
+    everything.
+
+    Args:
+        config (type[Config] | None): The configuration profile to use.
+        role (str): "web", "cli" or "worker".
 
     Returns:
         Flask: The configured Flask application instance.
+
+    Raises:
+        ValueError: If the role is unknown.
     """
+    if role not in ROLES:
+        raise ValueError(f"Unknown role {role!r}; expected one of "
+                         f"{', '.join(ROLES)}")
     app = Flask(__name__)
-    ProxyFix(app.wsgi_app, x_proto=1, x_host=1)
-    app.config.from_object(Config)
+    app.config.from_object(config or config_for(environ["ENVIRONMENT"]))
+    app.wsgi_app = ProxyFix(  # type: ignore[method-assign]
+        app.wsgi_app,
+        x_for=app.config["PROXY_FIX_X_FOR"],
+        x_proto=app.config["PROXY_FIX_X_PROTO"],
+        x_host=app.config["PROXY_FIX_X_HOST"])
+
+    app.config["APP_ROLE"] = role
 
     # Initialize extensions
     db.init_app(app)
+    sqlite_pragmas.init_app(app)
+    replicas.init_app(app)
+    argon2.init_app(app)
+    password_hashing.init_app(app)
+    user_cache.init_app(app)
+    lockout.init_app(app)
+    username_index.init_app(app)
+    if role == "worker":
+        return app
+
+    # First, so that its after_request hook runs after everyone else's
+    compression.init_app(app)
+    session_store.init_app(app)
     login_manager.init_app(app)
     csrf.init_app(app)
-    argon2.init_app(app)
-    migrate.init_app(app, db)
+    ratelimiter.init_app(app)
+    page_cache.init_app(app)
+    metrics.init_app(app)
+    audit.init_app(app)
+    profiler.init_app(app)
+    query_budget.init_app(app)
+    scheduler.init_app(app)
+    register_blueprints(app)
 
-    # Register blueprints
-    app.register_blueprint(main_bp)
-    app.register_blueprint(auth_bp, url_prefix="/auth")
-    app.register_blueprint(admin_bp, url_prefix="/admin")
-    app.register_blueprint(errors_bp)
+    # Templates and static folders can only be listed once blueprints are in
+    static_assets.init_app(app)
+    template_cache.init_app(app)
+
+    if role == "cli":
+        register_commands(app)
     return app
 
 
@@ -0,0 +1,15 @@
+"""asgi.py
+
+The entry point for ASGI servers, e.g. `uvicorn asgi:app`.
+
+The server's event loop holds the connections, so idle keep-alive clients
+and clients still sending their request cost no thread. Each request is
+handed to the Flask application on a pool of `ASGI_THREADS` threads once
+it has arrived, and runs there as it would under a WSGI server.
+"""
+from __future__ import annotations
+from a2wsgi import WSGIMiddleware
+from app import create_app
+
+application = create_app(role="web")
+app = WSGIMiddleware(application, workers=application.config["ASGI_THREADS"])
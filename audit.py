@@ -0,0 +1,313 @@
+"""audit.py"""
+from __future__ import annotations
+import atexit
+import json
+import logging
+import os
+import queue
+import threading
+import time
+from datetime import datetime, timezone
+from logging.handlers import RotatingFileHandler
+from typing import Any
+from flask import Flask, current_app, request
+from sqlalchemy import insert
+from extensions import db
+from metrics import metrics
+from models import AuditEvent
+
+LOGIN_SUCCESS = "login_success"
+LOGIN_FAILURE = "login_failure"
+LOGIN_LOCKED = "login_locked"
+LOCKOUT = "lockout"
+LOGOUT = "logout"
+REGISTER = "register"
+LOCKOUT_RESET = "lockout_reset"
+EVENTS = (LOGIN_SUCCESS, LOGIN_FAILURE, LOGIN_LOCKED, LOCKOUT, LOGOUT,
+          REGISTER, LOCKOUT_RESET)
+OVERFLOW_POLICIES = ("drop_newest", "drop_oldest", "block")
+# Values are cut to their column's length, as databases that enforce it
+# would otherwise reject the whole batch
+_MAX_LENGTHS: dict[str, int] = {
+    "username": getattr(AuditEvent.username.type, "length"),
+    "detail": getattr(AuditEvent.detail.type, "length"),
+}
+
+
+def _clip(value: str | None, name: str) -> str | None:
+    return None if value is None else value[:_MAX_LENGTHS[name]]
+
+
+class _AuditState:
+    """The event queue, flusher thread and sink of one application."""
+
+    def __init__(self, app: Flask) -> None:
+        self.app = app
+        config = app.config
+        self.queue: queue.Queue[dict[str, Any]] = queue.Queue(
+            int(config["AUDIT_QUEUE_SIZE"]))
+        self.overflow = config["AUDIT_OVERFLOW"]
+        if self.overflow not in OVERFLOW_POLICIES:
+            raise ValueError(f"Unknown AUDIT_OVERFLOW {self.overflow!r}; "
+                             f"expected one of {', '.join(OVERFLOW_POLICIES)}")
+        if config["AUDIT_BACKEND"] not in ("database", "file"):
+            raise ValueError(f"Unknown AUDIT_BACKEND "
+                             f"{config['AUDIT_BACKEND']!r}; expected "
+                             "'database' or 'file'")
+        self.block_timeout = float(config["AUDIT_BLOCK_TIMEOUT"])
+        self.batch_size = int(config["AUDIT_BATCH_SIZE"])
+        self.interval = float(config["AUDIT_FLUSH_INTERVAL"])
+        self.lock = threading.Lock()
+        self.write_lock = threading.Lock()
+        self.thread: threading.Thread | None = None
+        self.pid: int | None = None
+        self.stopping = threading.Event()
+        self.file_logger: logging.Logger | None = None
+        self.written = 0
+        self.dropped = 0
+        self.failed = 0
+
+    def put(self, event: dict[str, Any]) -> None:
+        """Queue an event, applying the overflow policy when full."""
+        try:
+            if self.overflow == "block":
+                self.queue.put(event, timeout=self.block_timeout)
+            else:
+                self.queue.put_nowait(event)
+            return
+        except queue.Full:
+            pass
+        if self.overflow == "drop_oldest":
+            try:
+                self.queue.get_nowait()
+                self.queue.put_nowait(event)
+            except (queue.Empty, queue.Full):
+                pass
+        with self.lock:
+            self.dropped += 1
+        metrics.audit_events("dropped")
+
+    def take(self, wait: bool) -> list[dict[str, Any]]:
+        """
+        Take a batch of events off the queue.
+
+        With `wait`, up to `AUDIT_FLUSH_INTERVAL` seconds are spent filling
+        the batch; otherwise only the events already queued are taken.
+        """
+        batch: list[dict[str, Any]] = []
+        deadline = time.monotonic() + self.interval
+        while len(batch) < self.batch_size:
+            timeout = deadline - time.monotonic()
+            try:
+                if wait and timeout > 0:
+                    batch.append(self.queue.get(timeout=timeout))
+                else:
+                    batch.append(self.queue.get_nowait())
+            except queue.Empty:
+                break
+        return batch
+
+    def write(self, batch: list[dict[str, Any]]) -> None:
+        """Write a batch of events to the configured sink."""
+        with self.app.app_context():
+            try:
+                if self.app.config["AUDIT_BACKEND"] == "file":
+                    self.write_file(batch)
+                else:
+                    # One executemany INSERT and one commit for the batch
+                    db.session.execute(insert(AuditEvent), batch)
+                    db.session.commit()
+            # Anything else too (e.g. a value that cannot be serialized),
+            # so that a bad batch never stops the flusher thread
+            except Exception:  # pylint: disable=broad-except
+                db.session.rollback()
+                self.app.logger.exception("Failed to write %d audit events",
+                                          len(batch))
+                with self.lock:
+                    self.failed += len(batch)
+                metrics.audit_events("failed", len(batch))
+                return
+            finally:
+                db.session.remove()
+            with self.lock:
+                self.written += len(batch)
+            metrics.audit_events("written", len(batch))
+
+    def write_file(self, batch: list[dict[str, Any]]) -> None:
+        """Append a batch of events to the audit file, as JSON lines."""
+        if self.file_logger is None:
+            config = self.app.config
+            path = config["AUDIT_FILE"]
+            os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+            handler = RotatingFileHandler(
+                path,
+                maxBytes=int(config["AUDIT_FILE_MAX_BYTES"]),
+                backupCount=int(config["AUDIT_FILE_BACKUPS"]),
+                encoding="utf-8")
+            # Not registered with logging, so that it is not configured by,
+            # or propagated to, the application's loggers
+            self.file_logger = logging.Logger(f"audit.{id(self)}")
+            self.file_logger.addHandler(handler)
+        lines = (json.dumps(event, default=datetime.isoformat)
+                 for event in batch)
+        self.file_logger.info("\n".join(lines))
+
+    def flush(self) -> int:
+        """Write every queued event now, returning how many were taken."""
+        taken = 0
+        with self.write_lock:
+            while batch := self.take(wait=False):
+                self.write(batch)
+                taken += len(batch)
+        return taken
+
+    def loop(self) -> None:
+        """Write batches until stopped, then write what is left."""
+        while not self.stopping.is_set():
+            try:
+                batch = self.take(wait=True)
+                if batch:
+                    with self.write_lock:
+                        self.write(batch)
+            except Exception:  # pylint: disable=broad-except
+                # The thread is not restarted, so it must not die
+                self.app.logger.exception("Audit flusher failed")
+        self.flush()
+
+    def start(self) -> None:
+        """Start the flusher thread, once per process."""
+        with self.lock:
+            if self.thread is not None and self.pid == os.getpid():
+                return
+            # A forked worker inherits the state but not the thread
+            self.pid = os.getpid()
+            self.stopping.clear()
+            self.thread = threading.Thread(target=self.loop,
+                                           name="audit",
+                                           daemon=True)
+            self.thread.start()
+        atexit.register(self.close)
+
+    def close(self) -> None:
+        """Stop the flusher thread and write the events still queued."""
+        with self.lock:
+            thread, self.thread = self.thread, None
+        self.stopping.set()
+        if thread is not None and thread.is_alive():
+            thread.join()
+        else:
+            self.flush()
+
+
+class Audit:
+    """
+    Write-behind audit log of logins, logouts, registrations and lockouts.
+
+    `record` only queues the event, so the request path pays microseconds
+    rather than an `INSERT` and a commit. A flusher thread, started by the
+    first event, writes the queue in batches of up to `AUDIT_BATCH_SIZE`
+    events, or whatever has arrived after `AUDIT_FLUSH_INTERVAL` seconds,
+    with one executemany `INSERT` into the append-only `audit_event` table
+    (or, with `AUDIT_BACKEND="file"`, as JSON lines appended to a rotating
+    file). The queue holds at most `AUDIT_QUEUE_SIZE` events; when it is
+    full `AUDIT_OVERFLOW` drops the new event ("drop_newest"), the oldest
+    ("drop_oldest"), or waits up to `AUDIT_BLOCK_TIMEOUT` seconds for room
+    before dropping it ("block"). Queued events are written when the
+    process exits. With `AUDIT_FLUSHER="manual"`, as under test, there is
+    no thread and events are written by `flush`.
+
+    Args:
+        app (Flask | None): The Flask application object.
+    """
+
+    def __init__(self, app: Flask | None = None) -> None:
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app: Flask) -> None:
+        """
+        Initialize the extension for an application.
+
+        Args:
+            app (Flask): The Flask application object.
+        """
+        app.config.setdefault("AUDIT_ENABLED", True)
+        app.config.setdefault("AUDIT_BACKEND", "database")
+        app.config.setdefault("AUDIT_FILE", "audit.log")
+        app.config.setdefault("AUDIT_FILE_MAX_BYTES", 10 * 2**20)
+        app.config.setdefault("AUDIT_FILE_BACKUPS", 5)
+        app.config.setdefault("AUDIT_FLUSHER", "thread")
+        app.config.setdefault("AUDIT_QUEUE_SIZE", 10000)
+        app.config.setdefault("AUDIT_BATCH_SIZE", 500)
+        app.config.setdefault("AUDIT_FLUSH_INTERVAL", 1.0)
+        app.config.setdefault("AUDIT_OVERFLOW", "drop_newest")
+        app.config.setdefault("AUDIT_BLOCK_TIMEOUT", 0.01)
+        app.extensions["audit"] = _AuditState(app)
+
+    @staticmethod
+    def _state() -> _AuditState:
+        state: _AuditState = current_app.extensions["audit"]
+        return state
+
+    def record(self,
+               event: str,
+               username: str | None = None,
+               user_id: int | None = None,
+               detail: str | None = None) -> None:
+        """
+        Queue an audit event.
+
+        Args:
+            event (str): What happened, one of `EVENTS`.
+            username (str | None): The account concerned.
+            user_id (int | None): The account's ID, if it exists.
+            detail (str | None): More about the event.
+        """
+        state = self._state()
+        if not state.app.config["AUDIT_ENABLED"]:
+            return
+        state.put({
+            "created": datetime.now(timezone.utc),
+            "event": event,
+            "username": _clip(username, "username"),
+            "user_id": user_id,
+            # An unbound request proxy is false outside of requests
+            "remote_addr": request.remote_addr if request else None,
+            "detail": _clip(detail, "detail"),
+        })
+        if state.pid != os.getpid() and \
+                state.app.config["AUDIT_FLUSHER"] == "thread":
+            state.start()
+
+    def flush(self) -> int:
+        """
+        Write the current application's queued events now.
+
+        Returns:
+            int: The number of events taken off the queue.
+        """
+        return self._state().flush()
+
+    def close(self) -> None:
+        """Stop the flusher thread and write the events still queued."""
+        self._state().close()
+
+    def stats(self) -> dict[str, int]:
+        """
+        Return the current application's audit counters.
+
+        Returns:
+            dict[str, int]: Events `queued`, and `written`, `dropped` and
+            `failed` so far.
+        """
+        state = self._state()
+        with state.lock:
+            return {
+                "queued": state.queue.qsize(),
+                "written": state.written,
+                "dropped": state.dropped,
+                "failed": state.failed,
+            }
+
+
+audit = Audit()
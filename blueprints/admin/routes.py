@@ -1,15 +1,107 @@
 """routes.py"""
 from __future__ import annotations
-from flask import redirect, url_for, flash, render_template
+from datetime import datetime, timezone
+from functools import wraps
+from typing import Any, Callable, Iterator, ParamSpec
+from flask import (abort, redirect, url_for, flash, render_template, jsonify,
+                   request, stream_with_context)
 from flask_login import login_required, current_user
+from sqlalchemy import literal, select
+from sqlalchemy.orm import InstrumentedAttribute, load_only
 from werkzeug.wrappers import Response
-from extensions import db
+from audit import audit, LOCKOUT_RESET
+from extensions import login_manager, replicas
+from lockout import lockout
+from metrics import metrics
+from pagination import keyset_page, starts_with
+from profiler import profiler
+from querybudget import query_budget
 from models import User
+from sessions import session_store
 from . import admin_bp
 
+_P = ParamSpec("_P")
+
+USERS_PER_PAGE = 50
+
+
+def admin_required(view: Callable[_P, Any]) -> Callable[_P, Any]:
+    """
+    Restrict a view to logged in admins.
+
+    Anonymous users are sent to the login page, and other users to the home
+    page with an "Access denied" message.
+
+    Args:
+        view (Callable): The view to restrict.
+
+    Returns:
+        Callable: The wrapped view.
+    """
+
+    @wraps(view)
+    @login_required
+    def wrapper(*args: _P.args, **kwargs: _P.kwargs) -> Any:
+        if not current_user.is_admin:
+            flash("Access denied.", "danger")
+            return redirect(url_for("main.home"))
+        return view(*args, **kwargs)
+
+    return wrapper
+
+
+@admin_bp.route("/users")
+@admin_required
+@query_budget.limit(2)
+def users() -> str:
+    """
+    List users, a page at a time.
+
+    Users are listed newest first, or, with `locked=1`, only those locked
+    out, by when their lockout ends, or, with a `prefix`, only those whose
+    username starts with it (case-sensitively), by username. Pages are
+    fetched by keyset pagination from the `after` cursor of the previous
+    page, each sort order backed by an index, so a page deep in a large
+    table costs the same as the first. Reads go to a replica when there is
+    one.
+
+    Returns:
+        str: The rendered user list, or a 400 if the cursor is malformed.
+    """
+    prefix = request.args.get("prefix", "").strip()
+    locked = request.args.get("locked") == "1"
+    now = datetime.now(timezone.utc)
+    stmt = select(User).options(
+        load_only(User.username, User.created, User.failed_attempts,
+                  User.lockout_until, User.is_admin))
+    if locked:
+        stmt = stmt.where(
+            User.lockout_until > literal(now, User.lockout_until.type))
+    columns: list[InstrumentedAttribute[Any]]
+    descending = False
+    if prefix:
+        columns = [User.username]
+        stmt = stmt.where(starts_with(User.username, prefix))
+    elif locked:
+        columns = [User.lockout_until, User.id]
+    else:
+        columns = [User.created, User.id]
+        descending = True
+    try:
+        with replicas.read_only():
+            page = keyset_page(stmt, columns, request.args.get("after"),
+                               USERS_PER_PAGE, descending)
+    except ValueError:
+        abort(400, "Malformed cursor.")
+    return render_template("users.html",
+                           page=page,
+                           prefix=prefix,
+                           locked=locked)
+
 
 @admin_bp.route("/reset_lockout/<int:user_id>", methods=["POST"])
 @login_required
+@query_budget.limit(5)
 def reset_lockout(user_id: str) -> str | Response:
     """
     Reset the lockout status of a user.
@@ -31,8 +123,138 @@ def reset_lockout(user_id: str) -> str | Response:
         return redirect(url_for("main.home"))
 
     user = User.query.get_or_404(user_id)
-    user.failed_attempts = 0
-    user.lockout_until = None
-    db.session.commit()
+    lockout.reset(user)
+    # Whoever caused the lockout may hold one of the user's sessions
+    session_store.revoke_user(user.id)
+    audit.record(LOCKOUT_RESET, user.username, user.id,
+                 f"by {current_user.username}")
     flash(f"Lockout reset for user {user.username}.", "success")
     return redirect(url_for("main.home"))
+
+
+@admin_bp.route("/reset_lockouts/<any(all, expired, matching):scope>",
+                methods=["POST"])
+@admin_required
+@query_budget.limit(1)
+def reset_lockouts(scope: str) -> Response:
+    """
+    Reset the lockout status of many users at once.
+
+    "all" resets every user with failed attempts or a lockout, "expired"
+    those whose lockout has ended, and "matching" those whose username
+    matches the `pattern` form field, where `*` matches any characters and
+    `?` any one. Users are reset in chunks of `LOCKOUT_RESET_CHUNK_SIZE`,
+    each a single `UPDATE`, while the response streams a line of progress
+    per chunk.
+
+    Args:
+        scope (str): "all", "expired" or "matching".
+
+    Returns:
+        Response: The progress, as plain text, or a 400 if "matching" is
+        missing its pattern.
+    """
+    pattern = None
+    if scope == "matching":
+        pattern = request.form.get("pattern", "").strip()
+        if not pattern:
+            abort(400, "Missing pattern.")
+    chunks = lockout.reset_many(pattern, expired=scope == "expired")
+    admin = current_user.username
+
+    def progress() -> Iterator[str]:
+        total = 0
+        for chunk, count in enumerate(chunks, 1):
+            total += count
+            yield f"Chunk {chunk}: reset {count} accounts ({total} total)\n"
+        audit.record(LOCKOUT_RESET, pattern,
+                     detail=f"{scope}, {total} accounts, by {admin}")
+        yield f"Reset {total} accounts\n"
+
+    # The chunks run as the body streams, after the statement budget of the
+    # request has been checked
+    return Response(stream_with_context(progress()), mimetype="text/plain")
+
+
+@admin_bp.route("/metrics")
+@query_budget.limit(1)
+def metrics_endpoint() -> str | Response:
+    """
+    Expose the application's metrics in the Prometheus text format.
+
+    Admins can read the metrics from a logged in session. A scraper, which
+    cannot log in, is let in by sending the `METRICS_TOKEN` as a bearer
+    token. Anyone else is sent to the login page, or to the home page with
+    an "Access denied" message if they are logged in.
+
+    Returns:
+        str | Response: The metrics, or a redirect if access is denied.
+    """
+    if not metrics.authorized():
+        if not current_user.is_authenticated:
+            unauthorized: Response = login_manager.unauthorized()
+            return unauthorized
+        if not current_user.is_admin:
+            flash("Access denied.", "danger")
+            return redirect(url_for("main.home"))
+    return Response(metrics.exposition(),
+                    mimetype="text/plain; version=0.0.4")
+
+
+@admin_bp.route("/profiles")
+@admin_required
+@query_budget.limit(1)
+def profiles() -> Response:
+    """
+    List the request profiles kept by the sampling profiler.
+
+    Returns:
+        Response: The profiles as JSON, newest first, with the URLs to
+        download each one as collapsed stacks or pstats.
+    """
+    response: Response = jsonify(profiles=[
+        {
+            **profile.summary(),
+            "collapsed":
+            url_for("admin.profile_download",
+                    profile_id=profile.id,
+                    kind="collapsed"),
+            "pstats":
+            url_for("admin.profile_download",
+                    profile_id=profile.id,
+                    kind="pstats"),
+        } for profile in profiler.profiles()
+    ])
+    return response
+
+
+@admin_bp.route("/profiles/<int:profile_id>.<any(collapsed, pstats):kind>")
+@admin_required
+@query_budget.limit(1)
+def profile_download(profile_id: int, kind: str) -> Response:
+    """
+    Download a request profile.
+
+    Collapsed stacks can be turned into a flame graph by flamegraph.pl or
+    opened in speedscope; pstats files load with `python -m pstats` or
+    snakeviz.
+
+    Args:
+        profile_id (int): The profile's ID.
+        kind (str): "collapsed" or "pstats".
+
+    Returns:
+        Response: The profile as an attachment, or a 404 if it is no longer
+        kept.
+    """
+    profile = profiler.profile(profile_id)
+    if profile is None:
+        abort(404)
+    if kind == "collapsed":
+        response = Response(profile.collapsed(), mimetype="text/plain")
+    else:
+        response = Response(profile.pstats(),
+                            mimetype="application/octet-stream")
+    response.headers["Content-Disposition"] = (
+        f"attachment; filename=profile-{profile_id}.{kind}")
+    return response
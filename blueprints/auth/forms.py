@@ -5,7 +5,12 @@ from wtforms import StringField, PasswordField, SubmitField
 from wtforms.validators import (DataRequired, Length, EqualTo, Regexp,
                                 ValidationError)
 from wtforms.fields.core import Field
-from models import User
+from extensions import replicas
+from username_index import username_index
+
+USERNAME_TAKEN = "Username is already taken."
+USERNAME_MIN_LENGTH = 8
+USERNAME_MAX_LENGTH = 150
 
 
 class RegistrationForm(FlaskForm):
@@ -33,8 +38,11 @@ class RegistrationForm(FlaskForm):
             is taken.
     """
     username = StringField("Username",
-                           validators=[DataRequired(),
-                                       Length(min=8, max=150)])
+                           validators=[
+                               DataRequired(),
+                               Length(min=USERNAME_MIN_LENGTH,
+                                      max=USERNAME_MAX_LENGTH)
+                           ])
     password = PasswordField(
         "Password",
         validators=[
@@ -56,8 +64,10 @@ class RegistrationForm(FlaskForm):
         """
         Ensure the username is not already taken.
 
-        This method checks the database to see if the username provided in the
-        form already exists. If it does, a `ValidationError` is raised.
+        This method checks the username index to see if the username provided
+        in the form already exists, which only queries the database when the
+        index cannot rule the username out. If it does, a `ValidationError`
+        is raised.
 
         Args:
             username (Field): The form field for the username to validate.
@@ -65,9 +75,10 @@ class RegistrationForm(FlaskForm):
         Raises:
             ValidationError: If the username already exists in the database.
         """
-        user = User.query.filter_by(username=username.data).first()
-        if user:
-            raise ValidationError("Username is already taken.")
+        with replicas.read_only():
+            available = username_index.is_available(username.data)
+        if not available:
+            raise ValidationError(USERNAME_TAKEN)
 
 
 class LoginForm(FlaskForm):
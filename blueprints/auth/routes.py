@@ -1,17 +1,26 @@
 """routes.py"""
 from __future__ import annotations
-from datetime import datetime, timedelta, timezone
+from datetime import datetime, timezone
 from urllib.parse import urlparse, urljoin
-from flask import render_template, redirect, url_for, flash, request
+from flask import (render_template, redirect, url_for, flash, request,
+                   current_app, jsonify)
 from flask_login import login_user, logout_user, login_required, current_user
+from sqlalchemy.exc import IntegrityError
 from werkzeug.wrappers import Response
-from extensions import db, argon2
+from audit import (audit, LOCKOUT, LOGIN_FAILURE, LOGIN_LOCKED,
+                   LOGIN_SUCCESS, LOGOUT, REGISTER)
+from extensions import (db, password_hashing, user_cache, ratelimiter,
+                        replicas)
+from hashing import HashingQueueFull
+from lockout import lockout
+from metrics import metrics
+from querybudget import query_budget
 from models import User
+from username_index import username_index
 from . import auth_bp
-from .forms import RegistrationForm, LoginForm
+from .forms import (RegistrationForm, LoginForm, USERNAME_TAKEN,
+                    USERNAME_MIN_LENGTH, USERNAME_MAX_LENGTH)
 
-LOCKOUT_THRESHOLD = 5  # Maximum allowed failed attempts
-LOCKOUT_DURATION = timedelta(minutes=15)  # Lockout duration
 MAIN_HOME = "main.home"
 allowed_next_page = ["/dashboard"]
 
@@ -34,6 +43,7 @@ def is_safe_url(target: str) -> bool:
 
 
 @auth_bp.route("/register", methods=["GET", "POST"])
+@query_budget.limit(4)
 def register() -> str | Response:
     """
     Handle user registration.
@@ -41,7 +51,9 @@ def register() -> str | Response:
     This route allows users to register for an account. If the user is already
     authenticated, they are redirected to the home page. On successful
     registration, the user's account is created and stored in the database,
-    and they are redirected to the login page.
+    and they are redirected to the login page. A username taken between
+    validation and insert is caught by the unique constraint and reported on
+    the form.
 
     Returns:
         str | Response: Redirects to the home page if the user is already
@@ -54,17 +66,54 @@ def register() -> str | Response:
 
     form = RegistrationForm()
     if request.method == "POST" and form.validate_on_submit():
-        hashed_password = argon2.generate_password_hash(form.password.data)
+        hashed_password = password_hashing.generate_password_hash(
+            form.password.data)
         new_user = User(username=form.username.data, password=hashed_password)
         db.session.add(new_user)
-        db.session.commit()
+        try:
+            db.session.commit()
+        except IntegrityError:
+            db.session.rollback()
+            username_index.add(form.username.data)
+            form.username.errors.append(USERNAME_TAKEN)
+            return render_template("register.html", form=form)
+        username_index.add(new_user.username)
+        audit.record(REGISTER, new_user.username, new_user.id)
         flash("Account created successfully! Please log in.", "success")
         return redirect(url_for("auth.login"))
 
     return render_template("register.html", form=form)
 
 
+@auth_bp.route("/username-available")
+@query_budget.limit(2)
+def username_available() -> Response:
+    """
+    Report whether a username can be registered.
+
+    This route backs the live availability check on the registration page.
+    Usernames the in-process index has never seen are reported as available
+    without querying the database. Lookups are rate limited per client
+    address.
+
+    Returns:
+        Response: A JSON object with the `username`, whether it is `valid`
+        (of an acceptable length) and whether it is `available`.
+    """
+    ratelimiter.check("username_available_ip", request.remote_addr or "",
+                      current_app.config["RATELIMIT_USERNAME_AVAILABLE_IP"])
+    username = request.args.get("username", "")
+    valid = USERNAME_MIN_LENGTH <= len(username) <= USERNAME_MAX_LENGTH
+    with replicas.read_only():
+        available = valid and username_index.is_available(username)
+    response: Response = jsonify(username=username,
+                                 valid=valid,
+                                 available=available)
+    return response
+
+
 @auth_bp.route("/login", methods=["GET", "POST"])
+@query_budget.limit(5)
 def login() -> str | Response:
     """
     Handle user login.
@@ -72,7 +121,9 @@ def login() -> str | Response:
     This route allows users to log in to their account. If the user is already
     authenticated, they are redirected to the home page. The route checks the
     provided username and password, manages failed login attempts, and
-    enforces account lockout after a set threshold. On successful login, the
+    enforces account lockout after a set threshold. Login attempts are rate
+    limited per client address and per username before any of that work is
+    done. On successful login, the
     user is redirected to the home page or to a next page if provided.
 
     Returns:
@@ -85,36 +136,58 @@ def login() -> str | Response:
         if current_user.is_authenticated:
             return redirect(url_for(MAIN_HOME))
 
+    if request.method == "POST":
+        # Throttle before any validation, database lookup or hashing
+        ratelimiter.check("login_ip", request.remote_addr or "",
+                          current_app.config["RATELIMIT_LOGIN_IP"])
+        ratelimiter.check("login_username",
+                          request.form.get("username", "").lower(),
+                          current_app.config["RATELIMIT_LOGIN_USERNAME"])
+
     form = LoginForm()
     if request.method == "POST":
         if form.validate_on_submit():
-            user = User.query.filter_by(username=form.username.data).first()
+            with replicas.read_only():
+                user = User.query.filter_by(
+                    username=form.username.data).first()
             now = datetime.now(timezone.utc)
 
             # Check if user exists
             if user:
                 # Check if account is locked
-                if user.lockout_until:
-                    if user.lockout_until.tzinfo is None:
-                        # Assume the naive datetime is in UTC
-                        user.lockout_until = user.lockout_until.replace(
-                            tzinfo=timezone.utc)
-                    if user.lockout_until > now:
-                        remaining = user.lockout_until - now
-                        flash(
-                            "Account is locked. Try again in "
-                            f"{remaining.seconds // 60} minutes.", "danger")
-                        return render_template("login.html", form=form)
+                lockout_until = lockout.locked_until(user, now)
+                if lockout_until:
+                    metrics.login_attempt("locked")
+                    audit.record(LOGIN_LOCKED, user.username, user.id)
+                    remaining = lockout_until - now
+                    flash(
+                        "Account is locked. Try again in "
+                        f"{remaining.seconds // 60} minutes.", "danger")
+                    return render_template("login.html", form=form)
 
                 # Verify password
-                if argon2.check_password_hash(user.password,
-                                              form.password.data):
+                if password_hashing.check_password_hash(
+                        user.password, form.password.data):
                     # Reset failed attempts
-                    user.failed_attempts = 0
-                    user.lockout_until = None
-                    db.session.commit()
+                    lockout.reset(user)
+
+                    # Upgrade hashes made with outdated Argon2 parameters.
+                    # Optional, so a busy pool leaves it to a later login
+                    # rather than failing this one
+                    if password_hashing.needs_rehash(user.password):
+                        try:
+                            user.password = (
+                                password_hashing.generate_password_hash(
+                                    form.password.data))
+                        except HashingQueueFull:
+                            pass
+                        else:
+                            db.session.commit()
+                            user_cache.invalidate(user.id)
 
                     login_user(user)
+                    metrics.login_attempt("success")
+                    audit.record(LOGIN_SUCCESS, user.username, user.id)
                     flash("Logged in successfully.", "success")
                     next_page = request.args.get("next")
                     if next_page and is_safe_url(next_page):
@@ -122,21 +195,22 @@ def login() -> str | Response:
                     return redirect(url_for(MAIN_HOME))
 
                 # Increment failed attempts
-                user.failed_attempts += 1
-
-                if user.failed_attempts >= LOCKOUT_THRESHOLD:
-                    user.lockout_until = now + LOCKOUT_DURATION
+                metrics.login_attempt("failure")
+                audit.record(LOGIN_FAILURE, user.username, user.id)
+                state = lockout.record_failure(user.id, now)
+                if state.locked:
+                    audit.record(LOCKOUT, user.username, user.id)
                     flash(
                         "Account locked due to too many failed login "
                         "attempts. Please try again later.", "danger")
                 else:
-                    attempts_left = LOCKOUT_THRESHOLD - user.failed_attempts
+                    attempts_left = lockout.threshold - state.failed_attempts
                     flash(
                         f"Login unsuccessful. You have {attempts_left} "
                         "more attempt(s) before account lockout.", "danger")
-
-                db.session.commit()
             else:
+                metrics.login_attempt("failure")
+                audit.record(LOGIN_FAILURE, form.username.data)
                 flash(
                     "Login unsuccessful. Please check username and password.",
                     "danger")
@@ -146,6 +220,7 @@ def login() -> str | Response:
 
 @auth_bp.route("/logout")
 @login_required
+@query_budget.limit(1)
 def logout() -> str | Response:
     """
     Handle user logout.
@@ -156,6 +231,7 @@ def logout() -> str | Response:
     Returns:
         str | Response: Redirects to the home page after logout.
     """
+    audit.record(LOGOUT, current_user.username, current_user.id)
     logout_user()
     flash("You have been logged out.", "info")
     return redirect(url_for(MAIN_HOME))
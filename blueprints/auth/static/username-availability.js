@@ -0,0 +1,24 @@
+// Tell the user whether the username they are typing is still free
+(function () {
+    const input = document.getElementById("username");
+    const status = document.getElementById("username-availability");
+    const url = document.currentScript.dataset.url;
+    let timer = null;
+    input.addEventListener("input", function () {
+        clearTimeout(timer);
+        status.textContent = "";
+        timer = setTimeout(function () {
+            fetch(url + "?username=" + encodeURIComponent(input.value))
+                .then(function (response) { return response.json(); })
+                .then(function (result) {
+                    if (!result.valid || result.username !== input.value) {
+                        return;
+                    }
+                    status.textContent = result.available ?
+                        "Username is available." : "Username is already taken.";
+                    status.style.color = result.available ? "green" : "red";
+                })
+                .catch(function () {});
+        }, 300);
+    });
+})();
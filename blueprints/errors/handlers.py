@@ -2,17 +2,38 @@
 from __future__ import annotations
 from flask import render_template
 from werkzeug.wrappers import Response
-from werkzeug.exceptions import NotFound, InternalServerError
+from extensions import page_cache
+from werkzeug.exceptions import (HTTPException, NotFound,
+                                 InternalServerError, ServiceUnavailable,
+                                 TooManyRequests)
 from . import errors_bp
 
 
+def retry_after_headers(e: HTTPException) -> dict[str, str]:
+    """
+    Return the `Retry-After` header of an error, if it has one.
+
+    Args:
+        e (HTTPException): The error being handled.
+
+    Returns:
+        dict[str, str]: The `Retry-After` header, or an empty dict.
+    """
+    return {
+        key: value
+        for key, value in e.get_headers() if key == "Retry-After"
+    }
+
+
 @errors_bp.app_errorhandler(404)  # type: ignore
+@page_cache.cached
 def page_not_found(e: NotFound) -> tuple[str, int] | Response:
     """
     Handle 404 errors by rendering the 'page not found' template.
 
     This route is triggered when a 404 (Not Found) error occurs. It renders
-    a custom '404.html' template.
+    a custom '404.html' template, which anonymous visitors (and scanners
+    probing random paths) get from the page cache.
 
     Args:
         e (NotFound): The 404 error that triggered this handler.
@@ -41,3 +62,43 @@ def internal_server_error(
         500 status code.
     """
     return render_template('500.html'), 500
+
+
+@errors_bp.app_errorhandler(503)  # type: ignore
+def service_unavailable(
+        e: ServiceUnavailable) -> tuple[str, int, dict[str, str]] | Response:
+    """
+    Handle 503 errors by rendering the 'service unavailable' template.
+
+    This route is triggered when the server sheds load, for example when the
+    password hashing queue is full. The `Retry-After` header of the error is
+    preserved so that clients know when to try again.
+
+    Args:
+        e (ServiceUnavailable): The 503 error that triggered this handler.
+
+    Returns:
+        tuple[str, int, dict[str, str]] | Response: The rendered '503.html'
+        template, the 503 status code and the `Retry-After` header.
+    """
+    return render_template('503.html'), 503, retry_after_headers(e)
+
+
+@errors_bp.app_errorhandler(429)  # type: ignore
+def too_many_requests(
+        e: TooManyRequests) -> tuple[str, int, dict[str, str]] | Response:
+    """
+    Handle 429 errors by rendering the 'too many requests' template.
+
+    This route is triggered when a client exceeds a rate limit. The
+    `Retry-After` header of the error is preserved so that clients know when
+    to try again.
+
+    Args:
+        e (TooManyRequests): The 429 error that triggered this handler.
+
+    Returns:
+        tuple[str, int, dict[str, str]] | Response: The rendered '429.html'
+        template, the 429 status code and the `Retry-After` header.
+    """
+    return render_template('429.html'), 429, retry_after_headers(e)
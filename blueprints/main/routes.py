@@ -3,15 +3,21 @@ from __future__ import annotations
 from flask import render_template
 from werkzeug.wrappers import Response
 from flask_login import login_required
+from extensions import page_cache
+from querybudget import query_budget
 from . import main_bp
 
 
 @main_bp.route("/")
+@page_cache.cached
+@query_budget.limit(1)
 def home() -> str | Response:
     """
     Render the home page.
 
-    This route renders the main home page of the application.
+    This route renders the main home page of the application. The anonymous
+    variant is the same for every visitor, so it is served from the page
+    cache.
 
     Returns:
         str | Response: The rendered home page template.
@@ -21,6 +27,7 @@ def home() -> str | Response:
 
 @main_bp.route("/dashboard")
 @login_required
+@query_budget.limit(1)
 def dashboard() -> str | Response:
     """
     Render the dashboard page.
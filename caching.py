@@ -0,0 +1,192 @@
+"""caching.py"""
+from __future__ import annotations
+import threading
+import time
+from collections import OrderedDict
+from typing import Callable, Generic, Hashable, TypeVar
+from flask import Flask, current_app
+
+_K = TypeVar("_K", bound=Hashable)
+_V = TypeVar("_V")
+
+
+class TTLCache(Generic[_K, _V]):
+    """
+    A thread-safe, bounded LRU cache whose entries expire after a TTL.
+
+    Entries are kept in least-recently-used order; when the cache is full the
+    least recently used entry is evicted. Entries older than `ttl` seconds are
+    treated as misses and dropped when they are next looked up.
+
+    Args:
+        maxsize (int): Maximum number of entries held.
+        ttl (float): Seconds an entry stays valid after it was stored.
+        clock (Callable[[], float]): Monotonic clock used for expiry.
+    """
+
+    def __init__(self,
+                 maxsize: int,
+                 ttl: float,
+                 clock: Callable[[], float] = time.monotonic) -> None:
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.clock = clock
+        self._data: OrderedDict[_K, tuple[float, _V]] = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+        self.invalidations = 0
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+    def get(self, key: _K) -> _V | None:
+        """
+        Return the cached value for a key, or `None` on a miss.
+
+        Args:
+            key (_K): The cache key.
+
+        Returns:
+            _V | None: The cached value, or `None` if absent or expired.
+        """
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            expires, value = entry
+            if expires <= self.clock():
+                del self._data[key]
+                self.expirations += 1
+                self.misses += 1
+                return None
+            self._data.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def set(self, key: _K, value: _V) -> None:
+        """
+        Store a value, evicting the least recently used entry if full.
+
+        Args:
+            key (_K): The cache key.
+            value (_V): The value to cache.
+        """
+        if self.maxsize <= 0:
+            return
+        with self._lock:
+            self._data[key] = (self.clock() + self.ttl, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+                self.evictions += 1
+
+    def invalidate(self, key: _K) -> None:
+        """
+        Drop a key from the cache, if present.
+
+        Args:
+            key (_K): The cache key.
+        """
+        with self._lock:
+            if self._data.pop(key, None) is not None:
+                self.invalidations += 1
+
+    def clear(self) -> None:
+        """Drop every entry from the cache."""
+        with self._lock:
+            self.invalidations += len(self._data)
+            self._data.clear()
+
+    def stats(self) -> dict[str, int]:
+        """
+        Return the cache counters.
+
+        Returns:
+            dict[str, int]: Hits, misses, capacity evictions, TTL expirations,
+                explicit invalidations and the current size.
+        """
+        with self._lock:
+            return {
+                "size": len(self._data),
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "expirations": self.expirations,
+                "invalidations": self.invalidations,
+            }
+
+
+class AppCache(Generic[_K, _V]):
+    """
+    A Flask extension giving each application its own `TTLCache`.
+
+    The size and TTL are read from `<prefix>_SIZE` and `<prefix>_TTL` in the
+    application config. The cache lives in the process, so every worker keeps
+    its own copy; the TTL bounds how long a worker may serve an entry that
+    another worker has changed.
+
+    Args:
+        prefix (str): The config key prefix, e.g. `"USER_CACHE"`.
+        maxsize (int): Default maximum number of entries.
+        ttl (float): Default entry lifetime in seconds.
+        app (Flask | None): The Flask application object.
+    """
+
+    def __init__(self,
+                 prefix: str,
+                 maxsize: int,
+                 ttl: float,
+                 app: Flask | None = None) -> None:
+        self.prefix = prefix
+        self.maxsize = maxsize
+        self.ttl = ttl
+        if app is not None:
+            self.init_app(app)
+
+    @property
+    def name(self) -> str:
+        """The key under which the cache is stored in `app.extensions`."""
+        return self.prefix.lower()
+
+    def init_app(self, app: Flask) -> None:
+        """
+        Initialize the cache for an application.
+
+        Args:
+            app (Flask): The Flask application object.
+        """
+        app.config.setdefault(f"{self.prefix}_SIZE", self.maxsize)
+        app.config.setdefault(f"{self.prefix}_TTL", self.ttl)
+        app.extensions[self.name] = TTLCache[_K, _V](
+            int(app.config[f"{self.prefix}_SIZE"]),
+            float(app.config[f"{self.prefix}_TTL"]))
+
+    @property
+    def cache(self) -> TTLCache[_K, _V]:
+        """The cache of the current application."""
+        cache: TTLCache[_K, _V] = current_app.extensions[self.name]
+        return cache
+
+    def get(self, key: _K) -> _V | None:
+        """Return the cached value for a key, or `None` on a miss."""
+        return self.cache.get(key)
+
+    def set(self, key: _K, value: _V) -> None:
+        """Store a value in the cache."""
+        self.cache.set(key, value)
+
+    def invalidate(self, key: _K) -> None:
+        """Drop a key from the cache."""
+        self.cache.invalidate(key)
+
+    def clear(self) -> None:
+        """Drop every entry from the cache."""
+        self.cache.clear()
+
+    def stats(self) -> dict[str, int]:
+        """Return the counters of the current application's cache."""
+        return self.cache.stats()
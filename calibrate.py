@@ -0,0 +1,185 @@
+"""calibrate.py"""
+from __future__ import annotations
+import math
+import os
+import time
+from dataclasses import dataclass
+from itertools import product
+import click
+from argon2 import PasswordHasher
+from flask.cli import with_appcontext
+from extensions import argon2
+
+CALIBRATION_PASSWORD = "Calibrati0n-Passw0rd!"
+
+
+@dataclass(frozen=True)
+class CalibrationResult:
+    """
+    Verify latency measured for one set of Argon2 parameters.
+
+    Attributes:
+        time_cost (int): Number of Argon2 iterations.
+        memory_cost (int): Memory used by Argon2, in KiB.
+        parallelism (int): Number of Argon2 lanes.
+        p50 (float): Median verify latency, in seconds.
+        p99 (float): 99th percentile verify latency, in seconds.
+        mean (float): Mean verify latency, in seconds.
+    """
+    time_cost: int
+    memory_cost: int
+    parallelism: int
+    p50: float
+    p99: float
+    mean: float
+
+    @property
+    def per_core_throughput(self) -> float:
+        """Verifications per second a single core can sustain."""
+        return 1 / self.mean if self.mean else 0.0
+
+    @property
+    def strength(self) -> int:
+        """A rough ordering of how expensive the parameters are to attack."""
+        return self.time_cost * self.memory_cost
+
+
+def percentile(samples: list[float], pct: float) -> float:
+    """
+    Return the nearest-rank percentile of already sorted samples.
+
+    Args:
+        samples (list[float]): The samples, sorted in ascending order.
+        pct (float): The percentile to compute, between 0 and 100.
+
+    Returns:
+        float: The sample at the requested percentile.
+    """
+    if not samples:
+        return 0.0
+    rank = math.ceil(pct / 100 * len(samples)) - 1
+    return samples[min(max(rank, 0), len(samples) - 1)]
+
+
+def benchmark(time_cost: int, memory_cost: int, parallelism: int,
+              samples: int) -> CalibrationResult:
+    """
+    Measure the verify latency of a set of Argon2 parameters.
+
+    Args:
+        time_cost (int): Number of Argon2 iterations.
+        memory_cost (int): Memory used by Argon2, in KiB.
+        parallelism (int): Number of Argon2 lanes.
+        samples (int): Number of verifications to time.
+
+    Returns:
+        CalibrationResult: The measured latencies.
+    """
+    hasher = PasswordHasher(time_cost=time_cost,
+                            memory_cost=memory_cost,
+                            parallelism=parallelism)
+    pw_hash = hasher.hash(CALIBRATION_PASSWORD)
+    timings = []
+    for _ in range(samples):
+        start = time.perf_counter()
+        hasher.verify(pw_hash, CALIBRATION_PASSWORD)
+        timings.append(time.perf_counter() - start)
+    timings.sort()
+    return CalibrationResult(time_cost=time_cost,
+                             memory_cost=memory_cost,
+                             parallelism=parallelism,
+                             p50=percentile(timings, 50),
+                             p99=percentile(timings, 99),
+                             mean=sum(timings) / len(timings))
+
+
+def _int_list(_ctx: click.Context, _param: click.Parameter,
+              value: str) -> list[int]:
+    try:
+        return [int(item) for item in value.split(",") if item.strip()]
+    except ValueError as exc:
+        raise click.BadParameter(
+            "must be a comma separated list of integers") from exc
+
+
+@click.command("argon2-calibrate")
+@click.option("--time-cost",
+              "time_costs",
+              default="1,2,3,4",
+              callback=_int_list,
+              show_default=True,
+              help="Comma separated time costs to try.")
+@click.option("--memory-cost",
+              "memory_costs",
+              default="19456,47104,65536",
+              callback=_int_list,
+              show_default=True,
+              help="Comma separated memory costs (KiB) to try.")
+@click.option("--parallelism",
+              "parallelisms",
+              default="1,2,4",
+              callback=_int_list,
+              show_default=True,
+              help="Comma separated parallelism values to try.")
+@click.option("--p50-ms",
+              default=50.0,
+              show_default=True,
+              help="Target median verify latency in milliseconds.")
+@click.option("--p99-ms",
+              default=100.0,
+              show_default=True,
+              help="Target 99th percentile verify latency in milliseconds.")
+@click.option("--samples",
+              type=click.IntRange(min=1),
+              default=20,
+              show_default=True,
+              help="Verifications timed per parameter set.")
+@with_appcontext
+def argon2_calibrate(time_costs: list[int], memory_costs: list[int],
+                     parallelisms: list[int], p50_ms: float, p99_ms: float,
+                     samples: int) -> None:
+    """
+    Benchmark Argon2 parameters on this machine.
+
+    Every combination of the given time costs, memory costs and parallelism
+    values is timed, and the most expensive combination whose verify latency
+    stays within the p50 and p99 targets is recommended. Existing hashes are
+    upgraded to the new parameters on the next successful login.
+    """
+    cores = os.cpu_count() or 1
+    click.echo(f"Calibrating Argon2 on {cores} core(s), {samples} samples "
+               "per parameter set.")
+    click.echo(f"Current: time_cost={argon2.time_cost} "
+               f"memory_cost={argon2.memory_cost} "
+               f"parallelism={argon2.parallelism}")
+    click.echo(f"{'time':>5} {'memory':>8} {'par':>4} {'p50 ms':>8} "
+               f"{'p99 ms':>8} {'/s/core':>8} {'/s total':>9}")
+
+    passing = []
+    for time_cost, memory_cost, parallelism in product(
+            time_costs, memory_costs, parallelisms):
+        if memory_cost < 8 * parallelism:
+            continue
+        result = benchmark(time_cost, memory_cost, parallelism, samples)
+        ok = result.p50 * 1000 <= p50_ms and result.p99 * 1000 <= p99_ms
+        if ok:
+            passing.append(result)
+        click.echo(f"{time_cost:>5} {memory_cost:>8} {parallelism:>4} "
+                   f"{result.p50 * 1000:>8.1f} {result.p99 * 1000:>8.1f} "
+                   f"{result.per_core_throughput:>8.1f} "
+                   f"{result.per_core_throughput * cores:>9.1f}"
+                   f"{'' if ok else '  (over target)'}")
+
+    if not passing:
+        raise click.ClickException(
+            "No parameter set met the latency targets; try lower costs or "
+            "relax --p50-ms/--p99-ms.")
+
+    best = max(passing, key=lambda r: (r.strength, -r.parallelism))
+    click.echo("")
+    click.echo(f"Recommended (p50 {best.p50 * 1000:.1f} ms, "
+               f"p99 {best.p99 * 1000:.1f} ms, "
+               f"~{best.per_core_throughput * cores:.0f} verifications/s):")
+    click.echo(f"ARGON2_TIME_COST={best.time_cost}")
+    click.echo(f"ARGON2_MEMORY_COST={best.memory_cost}")
+    click.echo(f"ARGON2_PARALLELISM={best.parallelism}")
@@ -0,0 +1,152 @@
+"""compression.py"""
+from __future__ import annotations
+import zlib
+from typing import Iterable, Iterator
+from flask import Flask, current_app, request
+from flask.wrappers import Response
+from werkzeug.http import quote_etag, unquote_etag
+
+# zlib's window bits for a gzip header and trailer
+GZIP_WBITS = 16 + zlib.MAX_WBITS
+
+DEFAULT_MIMETYPES = ("text/html", "text/css", "text/plain", "text/xml",
+                     "text/javascript", "application/javascript",
+                     "application/json", "application/xml", "image/svg+xml")
+
+
+def gzip_stream(chunks: Iterable[bytes], level: int) -> Iterator[bytes]:
+    """
+    Gzip a response body chunk by chunk.
+
+    Each chunk is flushed as soon as it is compressed, so a streamed
+    response reaches the client as it is produced rather than when the
+    compressor's buffer fills.
+
+    Args:
+        chunks (Iterable[bytes]): The body.
+        level (int): The compression level, 1 (fastest) to 9 (smallest).
+
+    Yields:
+        bytes: The gzip stream.
+    """
+    compressor = zlib.compressobj(level, zlib.DEFLATED, GZIP_WBITS)
+    for chunk in chunks:
+        if chunk:
+            yield (compressor.compress(chunk)
+                   + compressor.flush(zlib.Z_SYNC_FLUSH))
+    yield compressor.flush()
+
+
+def add_vary(response: Response, header: str) -> None:
+    """
+    Add a request header to a response's `Vary` header.
+
+    Args:
+        response (Response): The response.
+        header (str): The request header the response depends on.
+    """
+    vary = response.headers.get("Vary", "")
+    if header.lower() not in (value.strip().lower()
+                              for value in vary.split(",")):
+        response.headers["Vary"] = f"{vary}, {header}" if vary else header
+
+
+def weaken_etag(response: Response) -> None:
+    """
+    Make a response's strong `ETag`, if any, weak.
+
+    A strong ETag promises byte-identical bodies, which the compressed and
+    uncompressed representations are not; a weak one still lets
+    `If-None-Match` revalidate either of them.
+
+    Args:
+        response (Response): The response.
+    """
+    etag, weak = unquote_etag(response.headers.get("ETag"))
+    if etag and not weak:
+        response.headers["ETag"] = quote_etag(etag, weak=True)
+
+
+class Compression:
+    """
+    Gzip compression of dynamic responses.
+
+    Responses whose mimetype is in `COMPRESSION_MIMETYPES` are gzipped at
+    `COMPRESSION_LEVEL` for clients that accept it, and get
+    `Vary: Accept-Encoding` whether or not they were compressed. Buffered
+    bodies shorter than `COMPRESSION_MIN_SIZE` bytes are sent as they are,
+    as are files (which `flask assets build` compresses ahead of time),
+    partial content and responses that already have a `Content-Encoding`.
+    Streamed responses are compressed chunk by chunk as they are sent,
+    without buffering them. `COMPRESSION_ENABLED` turns it off, e.g. when a
+    reverse proxy compresses instead.
+
+    Compressing a page that shows both a secret, such as a CSRF token, and
+    text an attacker controls can leak the secret through the compressed
+    size (BREACH), so keep reflected input off pages that carry secrets.
+
+    Args:
+        app (Flask | None): The Flask application object.
+    """
+
+    def __init__(self, app: Flask | None = None) -> None:
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app: Flask) -> None:
+        """
+        Compress an application's responses.
+
+        Args:
+            app (Flask): The Flask application object.
+        """
+        app.config.setdefault("COMPRESSION_ENABLED", True)
+        app.config.setdefault("COMPRESSION_LEVEL", 3)
+        app.config.setdefault("COMPRESSION_MIN_SIZE", 500)
+        app.config.setdefault("COMPRESSION_MIMETYPES", DEFAULT_MIMETYPES)
+        if app.config["COMPRESSION_ENABLED"]:
+            app.after_request(self.compress)
+
+    @staticmethod
+    def compress(response: Response) -> Response:
+        """
+        Gzip a response if it is worth it and the client accepts it.
+
+        Args:
+            response (Response): The response.
+
+        Returns:
+            Response: The same response, compressed or not.
+        """
+        config = current_app.config
+        if (response.direct_passthrough
+                or response.mimetype not in config["COMPRESSION_MIMETYPES"]
+                or "Content-Encoding" in response.headers):
+            return response
+        add_vary(response, "Accept-Encoding")
+        if request.accept_encodings["gzip"] <= 0:
+            return response
+        if response.status_code == 304:
+            # Revalidating a compressed 200, so keep its weak ETag
+            weaken_etag(response)
+            return response
+        if response.status_code < 200 or response.status_code in (204, 206):
+            return response
+
+        level = int(config["COMPRESSION_LEVEL"])
+        if response.is_streamed:
+            body = response.response
+            response.response = gzip_stream(response.iter_encoded(), level)
+            close = getattr(body, "close", None)
+            if close is not None:
+                response.call_on_close(close)
+            response.headers.pop("Content-Length", None)
+        else:
+            data = response.get_data()
+            if len(data) < config["COMPRESSION_MIN_SIZE"]:
+                return response
+            compressor = zlib.compressobj(level, zlib.DEFLATED, GZIP_WBITS)
+            response.set_data(compressor.compress(data) + compressor.flush())
+        response.headers["Content-Encoding"] = "gzip"
+        weaken_etag(response)
+        return response
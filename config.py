@@ -1,10 +1,34 @@
 """config.py"""
 from __future__ import annotations
+from datetime import timedelta
 from pathlib import Path
 from os import environ
-from dotenv import load_dotenv
+from typing import Any
+from argon2 import (DEFAULT_TIME_COST, DEFAULT_MEMORY_COST,
+                    DEFAULT_PARALLELISM)
+from compression import DEFAULT_MIMETYPES
 
-load_dotenv()
+REQUIRED_VARIABLES = ("ENVIRONMENT", "SECRET_KEY")
+
+
+def load_environment() -> None:
+    """
+    Load variables from the `.env` file unless the environment is complete.
+
+    Process managers and containers usually set the variables themselves, in
+    which case looking for and parsing a `.env` file would only slow every
+    worker's start, so python-dotenv is only imported when one of
+    `REQUIRED_VARIABLES` is missing. Variables already set are never
+    overridden.
+    """
+    if all(name in environ for name in REQUIRED_VARIABLES):
+        return
+    # pylint: disable-next=import-outside-toplevel
+    from dotenv import load_dotenv
+    load_dotenv()
+
+
+load_environment()
 
 APP_PATH = str(Path(__file__).parent.resolve())
 
@@ -26,16 +50,293 @@ def str_to_bool(value: str) -> bool:
     return value.lower() in ("true", "1", "t")
 
 
+def engine_options(uri: str | None) -> dict[str, Any]:
+    """
+    Return the SQLAlchemy engine options for a database URI.
+
+    Server databases get a bounded connection pool whose connections are
+    checked before use and recycled before the server or a proxy drops them.
+    SQLite keeps Flask-SQLAlchemy's defaults, as its connections are local
+    files that do not go stale; it is tuned with `SQLITE_PRAGMAS` instead.
+
+    Args:
+        uri (str | None): The database URI.
+
+    Returns:
+        dict[str, Any]: The options passed to `create_engine`.
+    """
+    if uri is None or uri.startswith("sqlite"):
+        return {}
+    return {
+        "pool_size": int(environ.get("DB_POOL_SIZE", "10")),
+        "max_overflow": int(environ.get("DB_MAX_OVERFLOW", "20")),
+        "pool_timeout": float(environ.get("DB_POOL_TIMEOUT", "30")),
+        "pool_recycle": int(environ.get("DB_POOL_RECYCLE", "1800")),
+        "pool_pre_ping": str_to_bool(environ.get("DB_POOL_PRE_PING", "True")),
+    }
+
+
 class Config:
     """
-    Configuration settings for the application.
+    Configuration settings shared by every environment.
 
     This class sets various configuration settings based on environment
-    variables. In production, certain security-related settings are enabled,
-    and the database connection string is sourced from environment variables.
+    variables. The `DevelopmentConfig`, `ProductionConfig` and
+    `TestingConfig` profiles extend it, and `config_for` picks one from the
+    `ENVIRONMENT` variable.
+
+    Attributes:
+        SQLALCHEMY_DATABASE_URI (str): The database URI, a local SQLite
+            database unless a profile says otherwise.
+        SQLALCHEMY_ENGINE_OPTIONS (dict[str, Any]): Options passed to
+            `create_engine`, see `engine_options`.
+        SQLALCHEMY_REPLICA_URIS (list[str]): Read replica URIs, from a comma
+            separated `SQLALCHEMY_REPLICA_URIS` variable. Reads that tolerate
+            replication lag are spread over them.
+        REPLICA_RETRY_AFTER (float): Seconds a failed replica is left out of
+            rotation.
+        SQLITE_PRAGMAS (dict[str, str | int]): PRAGMAs run on every new SQLite
+            connection: WAL journaling so readers do not block on writers,
+            `synchronous=NORMAL` (durable at checkpoints, safe with WAL), how
+            long to wait for a lock, the mmap and page cache sizes, and
+            `auto_vacuum=INCREMENTAL` (which only applies to a database
+            created with it) so the scheduler can return free pages.
+        SECRET_KEY (str): Secret key used for session management and
+            security.
+        ASGI_THREADS (int): Threads that run requests when served by an
+            ASGI server through `asgi.py`.
+        ARGON2_TIME_COST (int): Argon2 iterations used for new hashes.
+        ARGON2_MEMORY_COST (int): Argon2 memory cost (KiB) for new hashes.
+        ARGON2_PARALLELISM (int): Argon2 lanes used for new hashes.
+        AUDIT_ENABLED (bool): Whether logins, logouts, registrations and
+            lockouts are written to the audit log.
+        AUDIT_BACKEND (str): Where audit events go: "database" (the
+            `audit_event` table, the default) or "file".
+        AUDIT_FILE (str): The JSON lines file of the "file" backend.
+        AUDIT_FILE_MAX_BYTES (int): Size at which the audit file is
+            rotated.
+        AUDIT_FILE_BACKUPS (int): Rotated audit files kept.
+        AUDIT_FLUSHER (str): "thread" to write audit events from a
+            background thread, or "manual" to leave them queued until
+            `audit.flush()`.
+        AUDIT_QUEUE_SIZE (int): Audit events held in memory before the
+            overflow policy applies.
+        AUDIT_BATCH_SIZE (int): Most audit events written per `INSERT`.
+        AUDIT_FLUSH_INTERVAL (float): Most seconds an audit event waits for
+            its batch to fill.
+        AUDIT_OVERFLOW (str): What happens to an audit event when the queue
+            is full: "drop_newest", "drop_oldest" or "block".
+        AUDIT_BLOCK_TIMEOUT (float): Seconds "block" waits for room before
+            dropping the event.
+        COMPRESSION_ENABLED (bool): Whether dynamic responses are gzipped.
+        COMPRESSION_LEVEL (int): gzip level, 1 (fastest) to 9 (smallest);
+            see `tests/benchmarks/bench_compression.py`.
+        COMPRESSION_MIN_SIZE (int): Bytes below which a response is sent
+            uncompressed.
+        COMPRESSION_MIMETYPES (tuple[str, ...]): Mimetypes that are
+            compressed.
+        HASHING_EXECUTOR (str): Where Argon2 work runs: "process" (a process
+            pool, the default), "thread" or "inline".
+        HASHING_WORKERS (int): Number of hashing workers, `0` for one per
+            CPU core.
+        HASHING_QUEUE_DEPTH (int): Hashing jobs allowed to wait for a worker
+            before requests are rejected with a 503.
+        HASHING_TIMEOUT (float): Seconds a request waits for its hashing job.
+        HASHING_RETRY_AFTER (int): `Retry-After` seconds sent with the 503.
+        LOCKOUT_BACKEND (str): Where failed-login counters are kept:
+            "database" (the default) or "memory".
+        LOCKOUT_THRESHOLD (int): Failed attempts that lock an account.
+        LOCKOUT_DURATION (timedelta): How long an account stays locked.
+        LOCKOUT_RESET_CHUNK_SIZE (int): Accounts reset per statement by the
+            bulk lockout resets.
+        METRICS_ENABLED (bool): Whether request, database, hashing and login
+            metrics are recorded.
+        METRICS_TOKEN (str | None): Bearer token that lets a scraper read
+            `/admin/metrics` without an admin session; `None` allows admins
+            only.
+        PAGE_CACHE_ENABLED (bool): Whether anonymous pages are cached.
+        PAGE_CACHE_SIZE (int): Rendered pages kept in the page cache.
+        PAGE_CACHE_TTL (float): Seconds a rendered page is served.
+        PROFILER_ENABLED (bool): Whether requests are sampled by the
+            profiler, see `/admin/profiles`.
+        PROFILER_THRESHOLD (float): Seconds after which a request's profile
+            is always kept.
+        PROFILER_SAMPLE_RATE (float): Share of faster requests whose profile
+            is kept anyway.
+        PROFILER_INTERVAL (float): Seconds between stack samples.
+        PROFILER_KEEP (int): Profiles kept, the oldest being dropped first.
+        QUERY_BUDGET_MODE (str): What a request that breaks its SQL
+            statement budget does: "off", "warn" or "raise".
+        QUERY_BUDGET_DEFAULT (int | None): Statement budget of endpoints
+            that declare none; `None` for no limit.
+        QUERY_BUDGETS (dict[str, int]): Statement budgets by endpoint,
+            overriding those the views declare.
+        QUERY_REPEAT_THRESHOLD (int): Runs of one statement shape in a
+            request that count as a query in a loop.
+        PROXY_FIX_X_FOR (int): Number of trusted proxies setting
+            `X-Forwarded-For`. `0` (the default) uses the connecting
+            address, as any client can send the header; set it to the
+            number of proxies when running behind them.
+        PROXY_FIX_X_PROTO (int): Number of trusted `X-Forwarded-Proto`
+            values.
+        PROXY_FIX_X_HOST (int): Number of trusted `X-Forwarded-Host` values.
+        RATELIMIT_ENABLED (bool): Whether rate limits are enforced.
+        RATELIMIT_LOGIN_IP (str): Login attempts allowed per client address,
+            e.g. "30/minute".
+        RATELIMIT_LOGIN_USERNAME (str): Login attempts allowed per username.
+        RATELIMIT_USERNAME_AVAILABLE_IP (str): Username availability checks
+            allowed per client address.
+        SCHEDULER_ENABLED (bool): Whether web workers run the maintenance
+            jobs in a background thread; otherwise run `flask scheduler
+            run`.
+        SCHEDULER_INTERVALS (dict[str, float]): Seconds between runs by
+            job name, overriding their defaults; `0` disables a job.
+        SCHEDULER_JITTER (float): Fraction of a job's interval by which
+            each worker's checks vary.
+        SESSION_BACKEND (str): Where sessions are kept: "database" (the
+            `user_session` table, the default), "memory", or "cookie" for
+            Flask's signed cookies.
+        SESSION_CACHE_SIZE (int): Server-side sessions each worker caches.
+        SESSION_CACHE_TTL (float): Seconds a worker may serve a cached
+            session after another worker revoked it.
+        SESSION_EXPIRE_CHUNK_SIZE (int): Expired sessions deleted per
+            statement.
+        STATIC_ASSETS_DIR (str | None): Where `flask assets build` writes
+            fingerprinted static files and their manifest; `None` serves
+            static files from the static folders only.
+        TEMPLATE_CACHE_DIR (str | None): Where compiled templates are
+            cached, shared by all workers; `None` disables the cache.
+        TEMPLATE_PRELOAD (bool): Load every template when the application is
+            created rather than on first use.
+        USERNAME_INDEX_CAPACITY (int): Usernames the in-process username
+            index is sized for.
+        USERNAME_INDEX_ERROR_RATE (float): Target false positive rate of the
+            username index.
+        USERNAME_INDEX_REFRESH (float): Seconds between picking up users
+            registered by other workers.
+        USER_CACHE_SIZE (int): Users kept in the per-process identity cache.
+        USER_CACHE_TTL (float): Seconds a cached user stays valid.
+    """
+    SECRET_KEY = environ["SECRET_KEY"]
+    SQLALCHEMY_DATABASE_URI: str | None = f"sqlite:///{APP_PATH}/site.db"
+    SQLALCHEMY_ENGINE_OPTIONS: dict[str, Any] = {}
+    SQLALCHEMY_TRACK_MODIFICATIONS = str_to_bool(
+        environ.get("SQLALCHEMY_TRACK_MODIFICATIONS", "False"))
+    SQLALCHEMY_REPLICA_URIS = [
+        uri.strip()
+        for uri in environ.get("SQLALCHEMY_REPLICA_URIS", "").split(",")
+        if uri.strip()
+    ]
+    REPLICA_RETRY_AFTER = float(environ.get("REPLICA_RETRY_AFTER", "30"))
+    SQLITE_PRAGMAS: dict[str, str | int] = {
+        # Before journal_mode, as it must be set before the file is written
+        "auto_vacuum": environ.get("SQLITE_AUTO_VACUUM", "incremental"),
+        "journal_mode": environ.get("SQLITE_JOURNAL_MODE", "wal"),
+        "synchronous": environ.get("SQLITE_SYNCHRONOUS", "normal"),
+        "busy_timeout": int(environ.get("SQLITE_BUSY_TIMEOUT_MS", "5000")),
+        "mmap_size": int(environ.get("SQLITE_MMAP_SIZE", str(256 * 2**20))),
+        "cache_size": int(environ.get("SQLITE_CACHE_SIZE", "-65536")),
+    }
+    ASGI_THREADS = int(environ.get("ASGI_THREADS", "16"))
+    ARGON2_TIME_COST = int(
+        environ.get("ARGON2_TIME_COST", str(DEFAULT_TIME_COST)))
+    ARGON2_MEMORY_COST = int(
+        environ.get("ARGON2_MEMORY_COST", str(DEFAULT_MEMORY_COST)))
+    ARGON2_PARALLELISM = int(
+        environ.get("ARGON2_PARALLELISM", str(DEFAULT_PARALLELISM)))
+    AUDIT_ENABLED = str_to_bool(environ.get("AUDIT_ENABLED", "True"))
+    AUDIT_BACKEND = environ.get("AUDIT_BACKEND", "database")
+    AUDIT_FILE = environ.get("AUDIT_FILE", f"{APP_PATH}/instance/audit.log")
+    AUDIT_FILE_MAX_BYTES = int(
+        environ.get("AUDIT_FILE_MAX_BYTES", str(10 * 2**20)))
+    AUDIT_FILE_BACKUPS = int(environ.get("AUDIT_FILE_BACKUPS", "5"))
+    AUDIT_FLUSHER = environ.get("AUDIT_FLUSHER", "thread")
+    AUDIT_QUEUE_SIZE = int(environ.get("AUDIT_QUEUE_SIZE", "10000"))
+    AUDIT_BATCH_SIZE = int(environ.get("AUDIT_BATCH_SIZE", "500"))
+    AUDIT_FLUSH_INTERVAL = float(environ.get("AUDIT_FLUSH_INTERVAL", "1"))
+    AUDIT_OVERFLOW = environ.get("AUDIT_OVERFLOW", "drop_newest")
+    AUDIT_BLOCK_TIMEOUT = float(environ.get("AUDIT_BLOCK_TIMEOUT", "0.01"))
+    COMPRESSION_ENABLED = str_to_bool(
+        environ.get("COMPRESSION_ENABLED", "True"))
+    COMPRESSION_LEVEL = int(environ.get("COMPRESSION_LEVEL", "3"))
+    COMPRESSION_MIN_SIZE = int(environ.get("COMPRESSION_MIN_SIZE", "500"))
+    COMPRESSION_MIMETYPES = DEFAULT_MIMETYPES
+    HASHING_EXECUTOR = environ.get("HASHING_EXECUTOR", "process")
+    HASHING_WORKERS = int(environ.get("HASHING_WORKERS", "0"))
+    HASHING_QUEUE_DEPTH = int(environ.get("HASHING_QUEUE_DEPTH", "16"))
+    HASHING_TIMEOUT = float(environ.get("HASHING_TIMEOUT", "10"))
+    HASHING_RETRY_AFTER = int(environ.get("HASHING_RETRY_AFTER", "1"))
+    LOCKOUT_BACKEND = environ.get("LOCKOUT_BACKEND", "database")
+    LOCKOUT_THRESHOLD = int(environ.get("LOCKOUT_THRESHOLD", "5"))
+    LOCKOUT_DURATION = timedelta(
+        minutes=float(environ.get("LOCKOUT_DURATION_MINUTES", "15")))
+    LOCKOUT_RESET_CHUNK_SIZE = int(
+        environ.get("LOCKOUT_RESET_CHUNK_SIZE", "1000"))
+    METRICS_ENABLED = str_to_bool(environ.get("METRICS_ENABLED", "True"))
+    METRICS_TOKEN = environ.get("METRICS_TOKEN") or None
+    PAGE_CACHE_ENABLED = str_to_bool(environ.get("PAGE_CACHE_ENABLED", "True"))
+    PAGE_CACHE_SIZE = int(environ.get("PAGE_CACHE_SIZE", "256"))
+    PAGE_CACHE_TTL = float(environ.get("PAGE_CACHE_TTL", "300"))
+    PROFILER_ENABLED = str_to_bool(environ.get("PROFILER_ENABLED", "False"))
+    PROFILER_THRESHOLD = float(environ.get("PROFILER_THRESHOLD", "0.5"))
+    PROFILER_SAMPLE_RATE = float(environ.get("PROFILER_SAMPLE_RATE", "0.01"))
+    PROFILER_INTERVAL = float(environ.get("PROFILER_INTERVAL", "0.005"))
+    PROFILER_KEEP = int(environ.get("PROFILER_KEEP", "50"))
+    QUERY_BUDGET_MODE = environ.get("QUERY_BUDGET_MODE", "off")
+    QUERY_BUDGET_DEFAULT: int | None = None
+    QUERY_BUDGETS: dict[str, int] = {}
+    QUERY_REPEAT_THRESHOLD = int(environ.get("QUERY_REPEAT_THRESHOLD", "5"))
+    PROXY_FIX_X_FOR = int(environ.get("PROXY_FIX_X_FOR", "0"))
+    PROXY_FIX_X_PROTO = int(environ.get("PROXY_FIX_X_PROTO", "1"))
+    PROXY_FIX_X_HOST = int(environ.get("PROXY_FIX_X_HOST", "1"))
+    RATELIMIT_ENABLED = str_to_bool(environ.get("RATELIMIT_ENABLED", "True"))
+    RATELIMIT_LOGIN_IP = environ.get("RATELIMIT_LOGIN_IP", "30/minute")
+    RATELIMIT_LOGIN_USERNAME = environ.get("RATELIMIT_LOGIN_USERNAME",
+                                           "10/minute")
+    RATELIMIT_USERNAME_AVAILABLE_IP = environ.get(
+        "RATELIMIT_USERNAME_AVAILABLE_IP", "120/minute")
+    SCHEDULER_ENABLED = str_to_bool(environ.get("SCHEDULER_ENABLED", "False"))
+    SCHEDULER_INTERVALS: dict[str, float] = {}
+    SCHEDULER_JITTER = float(environ.get("SCHEDULER_JITTER", "0.1"))
+    SESSION_BACKEND = environ.get("SESSION_BACKEND", "database")
+    SESSION_CACHE_SIZE = int(environ.get("SESSION_CACHE_SIZE", "10000"))
+    SESSION_CACHE_TTL = float(environ.get("SESSION_CACHE_TTL", "10"))
+    SESSION_EXPIRE_CHUNK_SIZE = int(
+        environ.get("SESSION_EXPIRE_CHUNK_SIZE", "1000"))
+    STATIC_ASSETS_DIR: str | None = environ.get(
+        "STATIC_ASSETS_DIR", f"{APP_PATH}/instance/assets")
+    TEMPLATE_CACHE_DIR: str | None = environ.get(
+        "TEMPLATE_CACHE_DIR", f"{APP_PATH}/instance/jinja")
+    TEMPLATE_PRELOAD = str_to_bool(environ.get("TEMPLATE_PRELOAD", "False"))
+    USERNAME_INDEX_CAPACITY = int(
+        environ.get("USERNAME_INDEX_CAPACITY", "1000000"))
+    USERNAME_INDEX_ERROR_RATE = float(
+        environ.get("USERNAME_INDEX_ERROR_RATE", "0.01"))
+    USERNAME_INDEX_REFRESH = float(
+        environ.get("USERNAME_INDEX_REFRESH", "30"))
+    USER_CACHE_SIZE = int(environ.get("USER_CACHE_SIZE", "10000"))
+    USER_CACHE_TTL = float(environ.get("USER_CACHE_TTL", "60"))
+
+
+class DevelopmentConfig(Config):
+    """
+    Configuration for local development, using `site.db`.
+
+    Requests that break their SQL statement budget log a warning.
+    """
+    QUERY_BUDGET_MODE = environ.get("QUERY_BUDGET_MODE", "warn")
+
+
+class ProductionConfig(Config):
+    """
+    Configuration for production deployments.
+
+    Security-related cookie settings are enabled, the database URI is read
+    from the `SQLALCHEMY_DATABASE_URI` environment variable, and templates
+    are preloaded unless `TEMPLATE_PRELOAD` says otherwise.
 
     Attributes:
-        DEBUG (bool): Set to `False` in production to disable debug mode.
+        DEBUG (bool): Set to `False` to disable debug mode.
         SESSION_COOKIE_SECURE (bool): Ensures cookies are only sent over
             HTTPS.
         REMEMBER_COOKIE_SECURE (bool): Ensures "remember me" cookies are
@@ -44,18 +345,59 @@ class Config:
             cookies.
         REMEMBER_COOKIE_HTTPONLY (bool): Makes "remember me" cookies
             HTTP-only.
-        SQLALCHEMY_DATABASE_URI (str): The database URI, either from
-            environment variables or defaults to a local SQLite database.
-        SECRET_KEY (str): Secret key used for session management and
-            security.
     """
-    if environ["ENVIRONMENT"] == "prod":
-        DEBUG = False
-        SESSION_COOKIE_SECURE = True
-        REMEMBER_COOKIE_SECURE = True
-        SESSION_COOKIE_HTTPONLY = True
-        REMEMBER_COOKIE_HTTPONLY = True
-        SQLALCHEMY_DATABASE_URI = environ["SQLALCHEMY_DATABASE_URI"]
-    SECRET_KEY = environ["SECRET_KEY"]
-    SQLALCHEMY_DATABASE_URI = f"sqlite:///{APP_PATH}/site.db"
-    str_to_bool(environ.get("SQLALCHEMY_TRACK_MODIFICATIONS", "False"))
+    DEBUG = False
+    SESSION_COOKIE_SECURE = True
+    REMEMBER_COOKIE_SECURE = True
+    SESSION_COOKIE_HTTPONLY = True
+    REMEMBER_COOKIE_HTTPONLY = True
+    SQLALCHEMY_DATABASE_URI = environ.get("SQLALCHEMY_DATABASE_URI")
+    SQLALCHEMY_ENGINE_OPTIONS = engine_options(SQLALCHEMY_DATABASE_URI)
+    TEMPLATE_PRELOAD = str_to_bool(environ.get("TEMPLATE_PRELOAD", "True"))
+
+
+class TestingConfig(Config):
+    """
+    Configuration for the test suite.
+
+    Tests run against an in-memory database with CSRF protection disabled,
+    hash passwords in the test thread, leave audit events queued until they
+    are flushed, and do not write compiled templates or look for built
+    static files.
+    A request that breaks its SQL statement budget fails the test.
+    """
+    TESTING = True
+    SQLALCHEMY_DATABASE_URI = "sqlite://"
+    STATIC_ASSETS_DIR: str | None = None
+    TEMPLATE_CACHE_DIR: str | None = None
+    WTF_CSRF_ENABLED = False
+    HASHING_EXECUTOR = "inline"
+    AUDIT_FLUSHER = "manual"
+    QUERY_BUDGET_MODE = "raise"
+
+
+CONFIGS: dict[str, type[Config]] = {
+    "dev": DevelopmentConfig,
+    "prod": ProductionConfig,
+    "test": TestingConfig,
+}
+
+
+def config_for(environment: str) -> type[Config]:
+    """
+    Return the configuration profile of an environment.
+
+    Args:
+        environment (str): The environment name: "dev", "prod" or "test".
+
+    Returns:
+        type[Config]: The configuration class.
+
+    Raises:
+        ValueError: If the environment is unknown.
+    """
+    try:
+        return CONFIGS[environment]
+    except KeyError:
+        raise ValueError(f"Unknown ENVIRONMENT {environment!r}; expected one "
+                         f"of {', '.join(CONFIGS)}") from None
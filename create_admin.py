@@ -3,7 +3,7 @@ from __future__ import annotations
 import string
 import random
 from app import create_app
-from extensions import db, argon2
+from extensions import db, argon2, replicas, user_cache
 from models import User
 
 
@@ -62,7 +62,8 @@ def create_admin_account() -> tuple[str | None, str | None]:
             username and password.
     """
     # Check for existing admin account
-    admin_user = User.query.filter_by(is_admin=True).first()
+    with replicas.read_only():
+        admin_user = User.query.filter_by(is_admin=True).first()
     if admin_user:
         print(f"Admin already exists: {admin_user.username}")  # Debugging line
         return None, None
@@ -76,12 +77,13 @@ def create_admin_account() -> tuple[str | None, str | None]:
                      is_admin=True)
     db.session.add(new_admin)
     db.session.commit()
+    user_cache.invalidate(new_admin.id)
 
     return admin_username, admin_password
 
 
 def run_create_admin() -> None:
-    app = create_app()
+    app = create_app(role="worker")
     with app.app_context():
         username, password = create_admin_account()
         if username and password:
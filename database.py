@@ -0,0 +1,78 @@
+"""database.py"""
+from __future__ import annotations
+from typing import Any, Mapping
+from flask import Flask
+from flask_sqlalchemy import SQLAlchemy
+from sqlalchemy import Engine, event
+
+
+def apply_pragmas(dbapi_connection: Any,
+                  pragmas: Mapping[str, str | int]) -> None:
+    """
+    Run PRAGMA statements on a new SQLite connection.
+
+    Args:
+        dbapi_connection (Any): The `sqlite3` connection.
+        pragmas (Mapping[str, str | int]): PRAGMA values by name.
+    """
+    cursor = dbapi_connection.cursor()
+    try:
+        for name, value in pragmas.items():
+            cursor.execute(f"PRAGMA {name}={value}")
+    finally:
+        cursor.close()
+
+
+class SQLitePragmas:
+    """
+    Tune every connection of the application's SQLite engines.
+
+    SQLite's defaults favour safety on any filesystem over concurrency: in
+    rollback-journal mode a writer locks out every reader, so each failed
+    login blocks the page loads around it. The PRAGMAs in `SQLITE_PRAGMAS`
+    are run on each new connection; journal mode is stored in the database
+    file, while the others last for the connection. Engines of other
+    databases are left alone.
+
+    Args:
+        db (SQLAlchemy): The Flask-SQLAlchemy extension whose engines are
+            tuned. It must be initialized for the application first.
+        app (Flask | None): The Flask application object.
+    """
+
+    def __init__(self, db: SQLAlchemy, app: Flask | None = None) -> None:
+        self.db = db
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app: Flask) -> None:
+        """
+        Register the PRAGMAs with the SQLite engines of an application.
+
+        Args:
+            app (Flask): The Flask application object.
+        """
+        app.config.setdefault("SQLITE_PRAGMAS", {})
+        pragmas = dict(app.config["SQLITE_PRAGMAS"])
+        if not pragmas:
+            return
+        with app.app_context():
+            engines = list(self.db.engines.values())
+        for engine in engines:
+            if engine.dialect.name == "sqlite":
+                self.listen(engine, pragmas)
+
+    @staticmethod
+    def listen(engine: Engine, pragmas: Mapping[str, str | int]) -> None:
+        """
+        Run the PRAGMAs on every new connection of an engine.
+
+        Args:
+            engine (Engine): A SQLite engine.
+            pragmas (Mapping[str, str | int]): PRAGMA values by name.
+        """
+
+        def on_connect(dbapi_connection: Any, _record: Any) -> None:
+            apply_pragmas(dbapi_connection, pragmas)
+
+        event.listen(engine, "connect", on_connect)
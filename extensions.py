@@ -1,15 +1,34 @@
 """extensions.py"""
 from __future__ import annotations
+from typing import Any
 from flask_sqlalchemy import SQLAlchemy
 from flask_login import LoginManager
 from flask_wtf.csrf import CSRFProtect
 from flask_argon2 import Argon2
-from flask_migrate import Migrate
+from hashing import PasswordHashing
+from caching import AppCache
+from compression import Compression
+from database import SQLitePragmas
+from replicas import ReplicaRouter, RoutingSession
+from pagecache import PageCache
+from ratelimit import RateLimiter
+from static_assets import StaticAssets
+from template_cache import TemplateCache
 
-db: SQLAlchemy = SQLAlchemy()
+db: SQLAlchemy = SQLAlchemy(session_options={"class_": RoutingSession})
+replicas: ReplicaRouter = ReplicaRouter(db)
+sqlite_pragmas: SQLitePragmas = SQLitePragmas(db)
 login_manager: LoginManager = LoginManager()
 csrf: CSRFProtect = CSRFProtect()
 login_manager.login_view = "auth.login"
 login_manager.login_message_category = "info"
 argon2: Argon2 = Argon2()
-migrate: Migrate = Migrate()
+password_hashing: PasswordHashing = PasswordHashing(argon2)
+ratelimiter: RateLimiter = RateLimiter()
+page_cache: PageCache = PageCache()
+compression: Compression = Compression()
+static_assets: StaticAssets = StaticAssets()
+template_cache: TemplateCache = TemplateCache()
+user_cache: AppCache[int, dict[str, Any]] = AppCache("USER_CACHE",
+                                                     maxsize=10000,
+                                                     ttl=60)
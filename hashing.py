@@ -0,0 +1,366 @@
+"""hashing.py"""
+from __future__ import annotations
+import os
+import threading
+import time
+from concurrent.futures import (CancelledError, Executor, Future,
+                                ThreadPoolExecutor)
+from concurrent.futures import TimeoutError as FutureTimeoutError
+from functools import lru_cache
+from typing import Any, Callable, TypeVar
+from argon2 import PasswordHasher
+from argon2.exceptions import VerificationError, InvalidHash
+from flask import Flask, current_app
+from flask_argon2 import Argon2
+from werkzeug.exceptions import ServiceUnavailable
+from metrics import metrics
+
+_T = TypeVar("_T")
+
+# (time_cost, memory_cost, parallelism, hash_len, salt_len, encoding)
+HasherParams = tuple[int, int, int, int, int, str]
+
+
+@lru_cache(maxsize=8)
+def _password_hasher(params: HasherParams) -> PasswordHasher:
+    return PasswordHasher(*params)
+
+
+def _hash_password(params: HasherParams,
+                   password: str) -> tuple[str, float, float]:
+    """
+    Hash a password inside a pool worker.
+
+    Args:
+        params (HasherParams): The Argon2 parameters to hash with.
+        password (str): The plaintext password.
+
+    Returns:
+        tuple (str, float, float): The password hash, the monotonic time at
+            which the worker picked up the job and the time spent hashing.
+    """
+    started = time.monotonic()
+    pw_hash = _password_hasher(params).hash(password)
+    return pw_hash, started, time.monotonic() - started
+
+
+def hash_passwords(params: HasherParams, passwords: list[str]) -> list[str]:
+    """
+    Hash a batch of passwords, as one task of a pool worker.
+
+    Submitting a batch rather than each password pays the pool's overhead
+    once per batch, for bulk jobs such as `flask users import`.
+
+    Args:
+        params (HasherParams): The Argon2 parameters to hash with.
+        passwords (list[str]): The plaintext passwords.
+
+    Returns:
+        list[str]: The hashes, in order.
+    """
+    hasher = _password_hasher(params)
+    return [hasher.hash(password) for password in passwords]
+
+
+def _verify_password(params: HasherParams, pw_hash: str,
+                     password: str) -> tuple[bool, float, float]:
+    """
+    Verify a password against a hash inside a pool worker.
+
+    Args:
+        params (HasherParams): The Argon2 parameters of the hasher.
+        pw_hash (str): The stored password hash.
+        password (str): The candidate plaintext password.
+
+    Returns:
+        tuple (bool, float, float): Whether the password matches, the
+            monotonic time at which the worker picked up the job and the time
+            spent verifying.
+    """
+    started = time.monotonic()
+    try:
+        matches: bool = _password_hasher(params).verify(pw_hash, password)
+    except (VerificationError, InvalidHash):
+        matches = False
+    return matches, started, time.monotonic() - started
+
+
+class HashingQueueFull(ServiceUnavailable):
+    """
+    Raised when the hashing executor cannot accept more work.
+
+    Being a `ServiceUnavailable`, it is rendered as a 503 response carrying a
+    `Retry-After` header when it escapes a view.
+    """
+    description = "The server is busy processing logins. Please retry shortly."
+
+
+class InlineExecutor(Executor):
+    """An executor running every job in the calling thread."""
+
+    def submit(self, fn: Callable[..., _T], /, *args: Any,
+               **kwargs: Any) -> Future[_T]:
+        future: Future[_T] = Future()
+        try:
+            future.set_result(fn(*args, **kwargs))
+        except Exception as exc:  # pylint: disable=broad-except
+            future.set_exception(exc)
+        return future
+
+
+class _HashingState:
+    """
+    Per-application executor, admission slots and metrics.
+
+    The executor is created on first use rather than in `init_app` so that
+    pre-forking servers start their pool inside each worker process, and so
+    that configuration changes made after `create_app` are honoured.
+    """
+
+    def __init__(self, app: Flask) -> None:
+        self.app = app
+        self.lock = threading.Lock()
+        self.executor: Executor | None = None
+        self.slots: threading.BoundedSemaphore | None = None
+        self.workers = 0
+        self.capacity = 0
+        self.submitted = 0
+        self.completed = 0
+        self.rejected = 0
+        self.timeouts = 0
+        self.in_flight = 0
+        self.queue_wait_total = 0.0
+        self.queue_wait_max = 0.0
+        self.hash_seconds_total = 0.0
+
+    def start(self) -> tuple[Executor, threading.BoundedSemaphore]:
+        """
+        Return the executor and its admission slots, creating them if needed.
+
+        Returns:
+            tuple (Executor, BoundedSemaphore): The executor and the semaphore
+                bounding the number of jobs it may hold.
+        """
+        with self.lock:
+            if self.executor is None or self.slots is None:
+                config = self.app.config
+                mode = config["HASHING_EXECUTOR"]
+                self.workers = int(config["HASHING_WORKERS"]
+                                   or os.cpu_count() or 1)
+                self.capacity = self.workers + int(
+                    config["HASHING_QUEUE_DEPTH"])
+                self.slots = threading.BoundedSemaphore(self.capacity)
+                if mode == "process":
+                    # Imported here as it loads multiprocessing, which the
+                    # other modes (and processes that never hash) skip
+                    # pylint: disable-next=import-outside-toplevel
+                    from concurrent.futures import ProcessPoolExecutor
+                    self.executor = ProcessPoolExecutor(
+                        max_workers=self.workers)
+                elif mode == "thread":
+                    self.executor = ThreadPoolExecutor(
+                        max_workers=self.workers,
+                        thread_name_prefix="argon2")
+                elif mode == "inline":
+                    self.executor = InlineExecutor()
+                else:
+                    raise ValueError(
+                        f"Unknown HASHING_EXECUTOR {mode!r}; expected "
+                        "'process', 'thread' or 'inline'")
+            return self.executor, self.slots
+
+    def release(self, slots: threading.BoundedSemaphore) -> None:
+        """Free an admission slot once a job has finished."""
+        with self.lock:
+            self.in_flight -= 1
+        slots.release()
+
+    def record(self, submitted: float, started: float,
+               elapsed: float) -> None:
+        """Record the queue wait and hashing time of a completed job."""
+        wait = max(started - submitted, 0.0)
+        with self.lock:
+            self.completed += 1
+            self.queue_wait_total += wait
+            self.queue_wait_max = max(self.queue_wait_max, wait)
+            self.hash_seconds_total += elapsed
+
+    def shutdown(self) -> None:
+        """Stop the executor, abandoning queued jobs."""
+        with self.lock:
+            executor, self.executor = self.executor, None
+            self.slots = None
+        # Outside the lock, which the jobs' done callbacks take
+        if executor is not None:
+            executor.shutdown(wait=True, cancel_futures=True)
+
+
+class PasswordHashing:
+    """
+    Argon2 hashing offloaded to a bounded worker pool.
+
+    Hashing and verification are submitted to an executor (a process pool
+    sized to the number of cores by default) so that a burst of logins cannot
+    pin every request thread on Argon2. At most `HASHING_WORKERS +
+    HASHING_QUEUE_DEPTH` jobs are admitted at once; once that bound is reached
+    further requests are rejected immediately with a 503 and a `Retry-After`
+    header instead of queueing without limit.
+
+    The Argon2 parameters are taken from the `Argon2` extension, so both
+    extensions always agree on the cost settings.
+
+    Args:
+        hasher (Argon2): The configured Flask-Argon2 extension.
+        app (Flask | None): The Flask application object.
+    """
+
+    def __init__(self, hasher: Argon2, app: Flask | None = None) -> None:
+        self.hasher = hasher
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app: Flask) -> None:
+        """
+        Initialize the extension for an application.
+
+        Args:
+            app (Flask): The Flask application object.
+        """
+        app.config.setdefault("HASHING_EXECUTOR", "process")
+        app.config.setdefault("HASHING_WORKERS", 0)
+        app.config.setdefault("HASHING_QUEUE_DEPTH", 16)
+        app.config.setdefault("HASHING_TIMEOUT", 10.0)
+        app.config.setdefault("HASHING_RETRY_AFTER", 1)
+        app.extensions["password_hashing"] = _HashingState(app)
+
+    @property
+    def params(self) -> HasherParams:
+        """The Argon2 parameters currently configured on the hasher."""
+        return (self.hasher.time_cost, self.hasher.memory_cost,
+                self.hasher.parallelism, self.hasher.hash_len,
+                self.hasher.salt_len, self.hasher.encoding)
+
+    @staticmethod
+    def _state() -> _HashingState:
+        state: _HashingState = current_app.extensions["password_hashing"]
+        return state
+
+    def _run(self, operation: str, fn: Callable[..., tuple[_T, float, float]],
+             *args: str) -> _T:
+        state = self._state()
+        executor, slots = state.start()
+        retry_after = int(state.app.config["HASHING_RETRY_AFTER"])
+        if not slots.acquire(blocking=False):
+            with state.lock:
+                state.rejected += 1
+            raise HashingQueueFull(retry_after=retry_after)
+
+        submitted = time.monotonic()
+        with state.lock:
+            state.submitted += 1
+            state.in_flight += 1
+        try:
+            future = executor.submit(fn, self.params, *args)
+        except BaseException:
+            state.release(slots)
+            raise
+        future.add_done_callback(lambda _: state.release(slots))
+
+        try:
+            result, started, elapsed = future.result(
+                timeout=float(state.app.config["HASHING_TIMEOUT"]))
+        except FutureTimeoutError as exc:
+            future.cancel()
+            with state.lock:
+                state.timeouts += 1
+            raise HashingQueueFull(retry_after=retry_after) from exc
+        except CancelledError as exc:
+            # Abandoned by a shutdown while it waited for a worker
+            with state.lock:
+                state.rejected += 1
+            raise HashingQueueFull(retry_after=retry_after) from exc
+        state.record(submitted, started, elapsed)
+        metrics.observe_hash(operation, elapsed,
+                             max(started - submitted, 0.0))
+        return result
+
+    def generate_password_hash(self, password: str) -> str:
+        """
+        Hash a password on the worker pool.
+
+        Args:
+            password (str): The plaintext password.
+
+        Returns:
+            str: The Argon2 hash of the password.
+
+        Raises:
+            ValueError: If the password is empty.
+            HashingQueueFull: If the pool is saturated or the job timed out.
+        """
+        if not password:
+            raise ValueError("Password must be non-empty.")
+        return self._run("hash", _hash_password, password)
+
+    def check_password_hash(self, pw_hash: str, password: str) -> bool:
+        """
+        Verify a password against a hash on the worker pool.
+
+        Args:
+            pw_hash (str): The stored password hash.
+            password (str): The candidate plaintext password.
+
+        Returns:
+            bool: `True` if the password matches the hash, `False` otherwise.
+
+        Raises:
+            HashingQueueFull: If the pool is saturated or the job timed out.
+        """
+        return self._run("verify", _verify_password, pw_hash,
+                         password)
+
+    def needs_rehash(self, pw_hash: str) -> bool:
+        """
+        Check whether a hash was made with outdated Argon2 parameters.
+
+        This only parses the parameters encoded in the hash, so it is cheap
+        enough to run in the request thread.
+
+        Args:
+            pw_hash (str): The stored password hash.
+
+        Returns:
+            bool: `True` if the hash should be regenerated with the current
+            parameters.
+        """
+        try:
+            return _password_hasher(self.params).check_needs_rehash(pw_hash)
+        except (VerificationError, InvalidHash, ValueError):
+            return True
+
+    def stats(self) -> dict[str, float]:
+        """
+        Return a snapshot of the executor metrics for the current app.
+
+        Returns:
+            dict[str, float]: Job counters, the current number of admitted
+                jobs and the total and maximum time jobs spent queued.
+        """
+        state = self._state()
+        with state.lock:
+            return {
+                "workers": state.workers,
+                "capacity": state.capacity,
+                "submitted": state.submitted,
+                "completed": state.completed,
+                "rejected": state.rejected,
+                "timeouts": state.timeouts,
+                "in_flight": state.in_flight,
+                "queue_wait_seconds_total": state.queue_wait_total,
+                "queue_wait_seconds_max": state.queue_wait_max,
+                "hash_seconds_total": state.hash_seconds_total,
+            }
+
+    def shutdown(self) -> None:
+        """Shut down the executor of the current app."""
+        self._state().shutdown()
@@ -0,0 +1,632 @@
+"""loadtest.py"""
+from __future__ import annotations
+import random
+import re
+import secrets
+import select
+import socket
+import ssl
+import tempfile
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass, field
+from http.cookiejar import CookieJar
+from types import TracebackType
+from typing import Any, Protocol
+from urllib.error import HTTPError
+from urllib.parse import urlencode, urlsplit
+from urllib.request import (HTTPCookieProcessor, HTTPRedirectHandler,
+                            OpenerDirector, Request, build_opener)
+import click
+from flask import Flask, current_app
+from flask.cli import with_appcontext
+
+SCENARIOS: dict[str, tuple[str, str, int]] = {
+    # name: (method, path, expected status)
+    "home": ("GET", "/", 200),
+    "login": ("POST", "/auth/login", 302),
+    "login_failed": ("POST", "/auth/login", 200),
+    "register": ("POST", "/auth/register", 302),
+    "dashboard": ("GET", "/dashboard", 200),
+}
+DEFAULT_MIX = "home=40,dashboard=25,login=15,login_failed=10,register=10"
+LOADTEST_PASSWORD = "L0adtest-Passw0rd!"
+PERCENTILES = (50.0, 75.0, 90.0, 95.0, 99.0, 99.9, 100.0)
+
+_CSRF_TOKEN = re.compile(r'name="csrf_token" type="hidden" value="([^"]+)"')
+
+
+class LatencyHistogram:
+    """
+    An HDR-style latency histogram.
+
+    Latencies are counted in microsecond buckets that are exact up to 128 us
+    and then keep 7 significant bits, so every recorded value is within
+    1/64 (about 1.6%) of its bucket whatever its magnitude, and histograms
+    from different threads or processes can be merged.
+    """
+    SIGNIFICANT_BITS = 7
+
+    def __init__(self) -> None:
+        self.counts: dict[int, int] = {}
+        self.total = 0
+        self.max = 0
+
+    @classmethod
+    def bucket(cls, value: int) -> int:
+        """
+        Return the lowest value of the bucket holding a value.
+
+        Args:
+            value (int): The latency, in microseconds.
+
+        Returns:
+            int: The bucket's lower bound, in microseconds.
+        """
+        shift = max(value.bit_length() - cls.SIGNIFICANT_BITS, 0)
+        return (value >> shift) << shift
+
+    def record(self, seconds: float) -> None:
+        """
+        Count one latency.
+
+        Args:
+            seconds (float): The latency, in seconds.
+        """
+        value = max(int(seconds * 1_000_000), 0)
+        bucket = self.bucket(value)
+        self.counts[bucket] = self.counts.get(bucket, 0) + 1
+        self.total += 1
+        self.max = max(self.max, value)
+
+    def merge(self, other: LatencyHistogram) -> None:
+        """
+        Add another histogram's counts to this one.
+
+        Args:
+            other (LatencyHistogram): The histogram to add.
+        """
+        for bucket, count in other.counts.items():
+            self.counts[bucket] = self.counts.get(bucket, 0) + count
+        self.total += other.total
+        self.max = max(self.max, other.max)
+
+    def percentile(self, pct: float) -> float:
+        """
+        Return the nearest-rank percentile latency.
+
+        Args:
+            pct (float): The percentile, between 0 and 100.
+
+        Returns:
+            float: The highest latency of the bucket holding the percentile,
+                in seconds, or 0 if nothing was recorded.
+        """
+        if not self.total:
+            return 0.0
+        if pct >= 100:
+            return self.max / 1_000_000
+        rank = max(int(pct / 100 * self.total + 0.5), 1)
+        seen = 0
+        for bucket in sorted(self.counts):
+            seen += self.counts[bucket]
+            if seen >= rank:
+                shift = max(bucket.bit_length() - self.SIGNIFICANT_BITS, 0)
+                return min(bucket + (1 << shift) - 1,
+                           self.max) / 1_000_000
+        return self.max / 1_000_000
+
+
+@dataclass
+class EndpointStats:
+    """
+    Latencies and failures of one scenario.
+
+    Attributes:
+        latencies (LatencyHistogram): Latency of every request.
+        errors (int): Requests that failed or got an unexpected status.
+        statuses (dict[int, int]): Unexpected statuses seen, by status;
+            0 counts requests that raised.
+    """
+    latencies: LatencyHistogram = field(default_factory=LatencyHistogram)
+    errors: int = 0
+    statuses: dict[int, int] = field(default_factory=dict)
+
+    def merge(self, other: EndpointStats) -> None:
+        """Add another run's numbers to these."""
+        self.latencies.merge(other.latencies)
+        self.errors += other.errors
+        for status, count in other.statuses.items():
+            self.statuses[status] = self.statuses.get(status, 0) + count
+
+
+@dataclass(frozen=True)
+class LoadSpec:
+    """
+    What every load-generating worker runs.
+
+    Attributes:
+        mix (dict[str, int]): Scenario weights.
+        duration (float): Seconds each worker sends requests for.
+        run_id (str): Prefix that keeps this run's usernames unique.
+        seed (int | None): Seed of the scenario choice, for repeatable runs.
+        url (str | None): Base URL of a running server, or `None` to use a
+            test client.
+        settings (dict[str, Any] | None): Settings of the in-process app.
+    """
+    mix: dict[str, int]
+    duration: float
+    run_id: str
+    seed: int | None = None
+    url: str | None = None
+    settings: dict[str, Any] | None = None
+
+
+class Transport(Protocol):
+    """A client session sending requests to the application."""
+
+    def request(self, method: str, path: str,
+                data: dict[str, str] | None) -> tuple[int, str]:
+        """Send a request, returning its status and body."""
+
+
+class TestClientTransport:
+    """A session on an in-process application's test client."""
+    __test__ = False  # Not a pytest test class
+
+    def __init__(self, app: Flask) -> None:
+        self.client = app.test_client()
+
+    def request(self, method: str, path: str,
+                data: dict[str, str] | None) -> tuple[int, str]:
+        response = self.client.open(path, method=method, data=data)
+        return response.status_code, response.get_data(as_text=True)
+
+
+class _NoRedirect(HTTPRedirectHandler):
+
+    def redirect_request(self, *args: Any, **kwargs: Any) -> None:
+        return None
+
+
+class HTTPTransport:
+    """A cookie-keeping session on a server, without following redirects."""
+
+    def __init__(self, url: str) -> None:
+        self.url = url.rstrip("/")
+        self.opener: OpenerDirector = build_opener(
+            HTTPCookieProcessor(CookieJar()), _NoRedirect)
+
+    def request(self, method: str, path: str,
+                data: dict[str, str] | None) -> tuple[int, str]:
+        body = urlencode(data).encode() if data is not None else None
+        try:
+            with self.opener.open(Request(self.url + path,
+                                          data=body,
+                                          method=method),
+                                  timeout=30) as response:
+                return response.status, response.read().decode()
+        except HTTPError as exc:
+            return exc.code, exc.read().decode()
+
+
+class IdleConnections:
+    """
+    Connections to a server that send part of a request and then wait.
+
+    They stand for slow clients and idle keep-alive connections. A WSGI
+    server gives each one a thread or a worker until it times out, while an
+    ASGI server only holds them in its event loop, so running the same load
+    with and without them shows how many the server can carry.
+
+    Args:
+        url (str): Base URL of the server.
+        count (int): Number of connections to hold.
+    """
+
+    def __init__(self, url: str, count: int) -> None:
+        parts = urlsplit(url)
+        self.host = parts.hostname or "localhost"
+        self.secure = parts.scheme == "https"
+        self.port = parts.port or (443 if self.secure else 80)
+        self.count = count
+        self.sockets: list[socket.socket] = []
+
+    def __enter__(self) -> IdleConnections:
+        context = ssl.create_default_context() if self.secure else None
+        for _ in range(self.count):
+            try:
+                sock = socket.create_connection((self.host, self.port),
+                                                timeout=10)
+                if context is not None:
+                    sock = context.wrap_socket(sock,
+                                               server_hostname=self.host)
+                # The headers are never finished
+                sock.sendall(f"GET / HTTP/1.1\r\nHost: {self.host}\r\n"
+                             .encode())
+            except OSError:
+                continue
+            self.sockets.append(sock)
+        return self
+
+    def open(self) -> int:
+        """
+        Count the connections the server has neither closed nor answered.
+
+        Returns:
+            int: The connections still waiting.
+        """
+        if not self.sockets:
+            return 0
+        answered, _, _ = select.select(self.sockets, [], [], 0)
+        return len(self.sockets) - len(answered)
+
+    def __exit__(self, _type: type[BaseException] | None,
+                 _value: BaseException | None,
+                 _traceback: TracebackType | None) -> None:
+        for sock in self.sockets:
+            sock.close()
+        self.sockets.clear()
+
+
+class VirtualUser:
+    """
+    One simulated visitor with an account.
+
+    Anonymous requests, failed logins and registrations use an anonymous
+    session; logins and the dashboard use a session logged in to the user's
+    own account. CSRF tokens are read from the forms, untimed, whenever a
+    session needs one.
+
+    Args:
+        spec (LoadSpec): The run being generated.
+        index (int): The worker's number, used in its usernames.
+        app (Flask | None): The in-process application, without a URL.
+    """
+
+    def __init__(self, spec: LoadSpec, index: int,
+                 app: Flask | None) -> None:
+        self.prefix = f"lt{spec.run_id}w{index:03d}"
+        self.username = f"{self.prefix}user"
+        self.registered = 0
+        self.anonymous = self._transport(spec, app)
+        self.session = self._transport(spec, app)
+        self.tokens: dict[int, str] = {}
+
+    @staticmethod
+    def _transport(spec: LoadSpec, app: Flask | None) -> Transport:
+        if spec.url is not None:
+            return HTTPTransport(spec.url)
+        assert app is not None
+        return TestClientTransport(app)
+
+    def _form(self, transport: Transport, path: str,
+              data: dict[str, str]) -> dict[str, str]:
+        token = self.tokens.get(id(transport))
+        if token is None:
+            _, body = transport.request("GET", path, None)
+            match = _CSRF_TOKEN.search(body)
+            token = match.group(1) if match else ""
+            self.tokens[id(transport)] = token
+        return {**data, "csrf_token": token} if token else data
+
+    def _credentials(self, password: str) -> dict[str, str]:
+        return {"username": self.username, "password": password}
+
+    def setup(self) -> None:
+        """Create the user's account and log its session in."""
+        self.anonymous.request(
+            "POST", "/auth/register",
+            self._form(self.anonymous, "/auth/register", {
+                **self._credentials(LOADTEST_PASSWORD),
+                "confirm_password": LOADTEST_PASSWORD
+            }))
+        self.session.request(
+            "POST", "/auth/login",
+            self._form(self.session, "/auth/login",
+                       self._credentials(LOADTEST_PASSWORD)))
+
+    def prepare(self, scenario: str) -> tuple[Transport, dict[str, str]
+                                              | None]:
+        """
+        Return the session and form data of a scenario's next request.
+
+        Args:
+            scenario (str): The scenario name.
+
+        Returns:
+            tuple (Transport, dict | None): The session to use and the data
+                to post, if any.
+        """
+        if scenario == "home":
+            return self.anonymous, None
+        if scenario == "dashboard":
+            return self.session, None
+        if scenario == "login":
+            return self.session, self._form(
+                self.session, "/auth/login",
+                self._credentials(LOADTEST_PASSWORD))
+        if scenario == "login_failed":
+            return self.anonymous, self._form(
+                self.anonymous, "/auth/login",
+                self._credentials("Wr0ng-Passw0rd!"))
+        self.registered += 1
+        username = f"{self.prefix}n{self.registered:07d}"
+        return self.anonymous, self._form(
+            self.anonymous, "/auth/register", {
+                "username": username,
+                "password": LOADTEST_PASSWORD,
+                "confirm_password": LOADTEST_PASSWORD
+            })
+
+
+def run_worker(spec: LoadSpec,
+               index: int,
+               app: Flask | None = None) -> dict[str, EndpointStats]:
+    """
+    Send requests from one virtual user until the duration has passed.
+
+    Args:
+        spec (LoadSpec): The run being generated.
+        index (int): The worker's number.
+        app (Flask | None): The in-process application; created from
+            `spec.settings` when needed and not given, as in a new process.
+
+    Returns:
+        dict[str, EndpointStats]: The results by scenario.
+    """
+    if spec.url is None and app is None:
+        app = loadtest_app(spec.settings or {})
+        try:
+            return run_worker(spec, index, app)
+        finally:
+            # A process pool left running would keep this process from
+            # exiting
+            # pylint: disable-next=import-outside-toplevel
+            from extensions import password_hashing
+            with app.app_context():
+                password_hashing.shutdown()
+    user = VirtualUser(spec, index, app)
+    user.setup()
+    rng = random.Random(None if spec.seed is None else spec.seed + index)
+    names = list(spec.mix)
+    weights = list(spec.mix.values())
+    stats = {name: EndpointStats() for name in names}
+    deadline = time.monotonic() + spec.duration
+    while time.monotonic() < deadline:
+        scenario = rng.choices(names, weights)[0]
+        method, path, expected = SCENARIOS[scenario]
+        transport, data = user.prepare(scenario)
+        start = time.perf_counter()
+        try:
+            status, _ = transport.request(method, path, data)
+        except Exception:  # pylint: disable=broad-except
+            status = 0
+        stats[scenario].latencies.record(time.perf_counter() - start)
+        if status != expected:
+            stats[scenario].errors += 1
+            stats[scenario].statuses[status] = (
+                stats[scenario].statuses.get(status, 0) + 1)
+    return stats
+
+
+def loadtest_app(settings: dict[str, Any]) -> Flask:
+    """
+    Create a web application from the given settings.
+
+    Args:
+        settings (dict[str, Any]): The configuration values to use.
+
+    Returns:
+        Flask: The application.
+    """
+    # pylint: disable=import-outside-toplevel
+    from app import create_app
+    from config import Config
+    config = type("LoadTestConfig", (Config, ), settings)
+    return create_app(config, role="web")
+
+
+def run_load(spec: LoadSpec, concurrency: int,
+             mode: str) -> dict[str, EndpointStats]:
+    """
+    Run virtual users in parallel threads or processes and merge results.
+
+    Args:
+        spec (LoadSpec): The run being generated.
+        concurrency (int): The number of virtual users.
+        mode (str): "thread" or "process".
+
+    Returns:
+        dict[str, EndpointStats]: The merged results by scenario.
+    """
+    results: list[dict[str, EndpointStats]] = []
+    if mode == "process":
+        with ProcessPoolExecutor(max_workers=concurrency) as pool:
+            results = list(
+                pool.map(run_worker, [spec] * concurrency,
+                         range(concurrency)))
+    else:
+        app = None if spec.url is not None else loadtest_app(
+            spec.settings or {})
+        lock = threading.Lock()
+
+        def target(index: int) -> None:
+            result = run_worker(spec, index, app)
+            with lock:
+                results.append(result)
+
+        threads = [
+            threading.Thread(target=target, args=(index, ))
+            for index in range(concurrency)
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+    merged = {name: EndpointStats() for name in spec.mix}
+    for result in results:
+        for name, stats in result.items():
+            merged[name].merge(stats)
+    return merged
+
+
+def _mix(_ctx: click.Context, _param: click.Parameter,
+         value: str) -> dict[str, int]:
+    mix = {}
+    for item in value.split(","):
+        name, _, weight = item.strip().partition("=")
+        if name not in SCENARIOS or not weight.isdigit():
+            raise click.BadParameter(
+                "must be comma separated name=weight pairs with names from "
+                f"{', '.join(SCENARIOS)}")
+        if int(weight):
+            mix[name] = int(weight)
+    if not mix:
+        raise click.BadParameter("needs at least one positive weight")
+    return mix
+
+
+def _ms(seconds: float) -> str:
+    return f"{seconds * 1000:.1f}"
+
+
+def report(stats: dict[str, EndpointStats], elapsed: float,
+           histograms: bool) -> None:
+    """
+    Print throughput, latency percentiles and error rates per scenario.
+
+    Args:
+        stats (dict[str, EndpointStats]): The results by scenario.
+        elapsed (float): How long the virtual users sent requests for, in
+            seconds.
+        histograms (bool): Whether to print each scenario's percentile
+            distribution as well.
+    """
+    total = EndpointStats()
+    click.echo(f"{'scenario':<14} {'requests':>9} {'req/s':>8} "
+               f"{'errors':>7} {'p50 ms':>8} {'p90 ms':>8} {'p99 ms':>8} "
+               f"{'max ms':>8}")
+    for name, endpoint in [*stats.items(), ("total", total)]:
+        if name != "total":
+            total.merge(endpoint)
+        latencies = endpoint.latencies
+        rate = endpoint.errors / latencies.total if latencies.total else 0
+        click.echo(f"{name:<14} {latencies.total:>9} "
+                   f"{latencies.total / elapsed:>8.1f} {rate:>7.1%} "
+                   f"{_ms(latencies.percentile(50)):>8} "
+                   f"{_ms(latencies.percentile(90)):>8} "
+                   f"{_ms(latencies.percentile(99)):>8} "
+                   f"{_ms(latencies.percentile(100)):>8}")
+    for name, endpoint in stats.items():
+        if endpoint.statuses:
+            click.echo(f"{name}: unexpected statuses " + ", ".join(
+                f"{status or 'exception'} x{count}"
+                for status, count in sorted(endpoint.statuses.items())))
+    if not histograms:
+        return
+    for name, endpoint in stats.items():
+        click.echo(f"\n{name} ({endpoint.latencies.total} requests)")
+        click.echo(f"{'percentile':>12} {'ms':>10}")
+        for pct in PERCENTILES:
+            click.echo(f"{pct:>12g} "
+                       f"{_ms(endpoint.latencies.percentile(pct)):>10}")
+
+
+@click.command("loadtest")
+@click.option("--url",
+              help="Base URL of a running server. By default requests go "
+              "through the test client of a copy of this app on a temporary "
+              "database.")
+@click.option("--concurrency",
+              default=4,
+              show_default=True,
+              help="Number of virtual users.")
+@click.option("--mode",
+              type=click.Choice(["thread", "process"]),
+              default="thread",
+              show_default=True,
+              help="Run virtual users as threads or processes.")
+@click.option("--duration",
+              default=10.0,
+              show_default=True,
+              help="Seconds each virtual user sends requests for.")
+@click.option("--mix",
+              default=DEFAULT_MIX,
+              callback=_mix,
+              show_default=True,
+              help="Scenario weights.")
+@click.option("--seed", type=int, help="Seed for repeatable mixes.")
+@click.option("--ratelimit/--no-ratelimit",
+              default=False,
+              show_default=True,
+              help="Keep rate limits on in the in-process app.")
+@click.option("--histograms",
+              is_flag=True,
+              help="Print each scenario's latency distribution.")
+@click.option("--idle-connections",
+              default=0,
+              show_default=True,
+              help="Connections to --url held open with an unfinished "
+              "request for the whole run, as slow clients would.")
+@with_appcontext
+def loadtest(url: str | None, concurrency: int, mode: str, duration: float,
+             mix: dict[str, int], seed: int | None, ratelimit: bool,
+             histograms: bool, idle_connections: int) -> None:
+    """
+    Drive a mix of traffic at the application and report latencies.
+
+    Each virtual user registers its own account, then picks scenarios by
+    weight: anonymous home page views, successful and failed logins,
+    registrations and dashboard views. Logins and registrations hash a
+    password, so comparing runs at different concurrencies shows how many
+    workers the Argon2 settings allow. Against a server, failed logins count
+    towards the lockout of the virtual user's account, so raise
+    `LOCKOUT_THRESHOLD` there for long runs.
+
+    With `--idle-connections`, compare the same load on a WSGI server
+    (`wsgi.py`) and an ASGI server (`asgi.py`) to see which keeps serving
+    while slow clients hold connections.
+    """
+    if idle_connections and url is None:
+        raise click.BadParameter("needs --url",
+                                 param_hint="--idle-connections")
+    run_id = secrets.token_hex(3)
+    with tempfile.TemporaryDirectory() as directory:
+        settings = None
+        if url is None:
+            settings = {
+                key: value
+                for key, value in current_app.config.items()
+                if key.isupper()
+            }
+            settings.update(
+                SQLALCHEMY_DATABASE_URI=f"sqlite:///{directory}/loadtest.db",
+                SQLALCHEMY_REPLICA_URIS=[],
+                RATELIMIT_ENABLED=ratelimit,
+                LOCKOUT_THRESHOLD=2**31 - 1,
+                TEMPLATE_PRELOAD=False)
+            # pylint: disable-next=import-outside-toplevel
+            from extensions import db
+            with loadtest_app(settings).app_context():
+                db.create_all()
+        spec = LoadSpec(mix=mix,
+                        duration=duration,
+                        run_id=run_id,
+                        seed=seed,
+                        url=url,
+                        settings=settings)
+        target = url or "in-process test client"
+        click.echo(f"{concurrency} virtual users ({mode}s) for {duration:g}s "
+                   f"against {target}")
+        with IdleConnections(url or "", idle_connections) as idle:
+            if idle_connections:
+                click.echo(f"Holding {len(idle.sockets)} of "
+                           f"{idle_connections} idle connections")
+            stats = run_load(spec, concurrency, mode)
+            still_open = idle.open()
+    report(stats, duration, histograms)
+    if idle_connections:
+        click.echo(f"{still_open} idle connections still open at the end")
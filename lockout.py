@@ -0,0 +1,480 @@
+"""lockout.py"""
+from __future__ import annotations
+import threading
+from abc import ABC, abstractmethod
+from dataclasses import dataclass
+from datetime import datetime, timedelta, timezone
+from typing import Iterator
+import click
+from flask import Flask, current_app
+from flask.cli import with_appcontext
+from sqlalchemy import (ColumnElement, and_, case, literal, null, or_, select,
+                        true, update)
+from extensions import db, user_cache
+from models import User
+
+
+def as_utc(value: datetime | None) -> datetime | None:
+    """
+    Return a datetime as an aware UTC datetime.
+
+    SQLite does not store time zones, so naive datetimes read back from the
+    database are assumed to be in UTC.
+
+    Args:
+        value (datetime | None): The datetime to normalize.
+
+    Returns:
+        datetime | None: The aware datetime, or `None`.
+    """
+    if value is not None and value.tzinfo is None:
+        return value.replace(tzinfo=timezone.utc)
+    return value
+
+
+def like_pattern(pattern: str) -> str:
+    """
+    Turn a username pattern with shell-style wildcards into a LIKE pattern.
+
+    `*` matches any run of characters and `?` any one character; `%`, `_`
+    and the escape character itself are matched literally.
+
+    Args:
+        pattern (str): The pattern, e.g. "bot-*".
+
+    Returns:
+        str: The LIKE pattern, using `\\` as the escape character.
+    """
+    escaped = (pattern.replace("\\", "\\\\").replace("%", "\\%").replace(
+        "_", "\\_"))
+    return escaped.replace("*", "%").replace("?", "_")
+
+
+def user_filter(pattern: str | None,
+                expired_before: datetime | None) -> ColumnElement[bool]:
+    """
+    Build the condition selecting users for a bulk reset.
+
+    Args:
+        pattern (str | None): Only users whose username matches this
+            pattern, see `like_pattern`.
+        expired_before (datetime | None): Only users whose lockout ended
+            at or before this time.
+
+    Returns:
+        ColumnElement[bool]: The condition on the `user` table.
+    """
+    condition: ColumnElement[bool] = true()
+    if pattern is not None:
+        condition = and_(
+            condition,
+            User.username.like(like_pattern(pattern), escape="\\"))
+    if expired_before is not None:
+        condition = and_(
+            condition,
+            User.lockout_until <= literal(expired_before,
+                                          User.lockout_until.type))
+    return condition
+
+
+@dataclass(frozen=True)
+class LockoutState:
+    """
+    The failed-login state of a user after a failed attempt.
+
+    Attributes:
+        failed_attempts (int): Consecutive failed attempts, including the one
+            just recorded.
+        lockout_until (datetime | None): When the lockout ends, or `None` if
+            the account is not locked.
+    """
+    failed_attempts: int
+    lockout_until: datetime | None
+
+    @property
+    def locked(self) -> bool:
+        """Whether this attempt locked (or kept locked) the account."""
+        return self.lockout_until is not None
+
+
+class LockoutStore(ABC):
+    """
+    Storage for failed-login counters.
+
+    Implementations must make `record_failure` atomic: concurrent failures
+    for the same user must each be counted exactly once.
+    """
+
+    @abstractmethod
+    def locked_until(self, user: User, now: datetime) -> datetime | None:
+        """
+        Return when the user's lockout ends, if they are locked out.
+
+        Args:
+            user (User): The user attempting to log in.
+            now (datetime): The current time.
+
+        Returns:
+            datetime | None: The end of the lockout, or `None`.
+        """
+
+    @abstractmethod
+    def record_failure(self, user_id: int, now: datetime, threshold: int,
+                       duration: timedelta) -> LockoutState:
+        """
+        Count a failed attempt and lock the account at the threshold.
+
+        A failure after an expired lockout starts a new count.
+
+        Args:
+            user_id (int): The ID of the user.
+            now (datetime): The current time.
+            threshold (int): Failed attempts that trigger a lockout.
+            duration (timedelta): How long a lockout lasts.
+
+        Returns:
+            LockoutState: The state after counting this failure.
+        """
+
+    @abstractmethod
+    def reset(self, user: User) -> bool:
+        """
+        Clear the failed attempts and lockout of a user.
+
+        Args:
+            user (User): The user to reset.
+
+        Returns:
+            bool: `True` if there was anything to reset.
+        """
+
+    @abstractmethod
+    def reset_many(self, pattern: str | None, expired_before: datetime | None,
+                   chunk_size: int) -> Iterator[list[int]]:
+        """
+        Clear the failed attempts and lockouts of many users, in chunks.
+
+        Each chunk is committed before it is yielded, so stopping early
+        keeps the chunks already reset.
+
+        Args:
+            pattern (str | None): Only users whose username matches this
+                pattern, see `like_pattern`.
+            expired_before (datetime | None): Only users whose lockout ended
+                at or before this time.
+            chunk_size (int): Users reset per chunk.
+
+        Yields:
+            list[int]: The IDs of the users reset by each chunk.
+        """
+
+
+class DatabaseLockoutStore(LockoutStore):
+    """
+    Keeps the counters on the `user` row, updated by single statements.
+
+    Each failure is one `UPDATE ... RETURNING` that increments the counter
+    and sets the lockout in the database, so no increments are lost to
+    concurrent read-modify-write cycles and the write lock is held for a
+    single statement.
+    """
+
+    def locked_until(self, user: User, now: datetime) -> datetime | None:
+        lockout_until = as_utc(user.lockout_until)
+        if lockout_until is not None and lockout_until > now:
+            return lockout_until
+        return None
+
+    def record_failure(self, user_id: int, now: datetime, threshold: int,
+                       duration: timedelta) -> LockoutState:
+        column_type = User.lockout_until.type
+        expired = and_(User.lockout_until.is_not(None),
+                       User.lockout_until <= literal(now, column_type))
+        attempts = case((expired, 1), else_=User.failed_attempts + 1)
+        stmt = (update(User).where(User.id == user_id).values(
+            failed_attempts=attempts,
+            lockout_until=case(
+                (attempts >= threshold, literal(now + duration,
+                                                column_type)),
+                (expired, null()),
+                else_=User.lockout_until)).returning(
+                    User.failed_attempts,
+                    User.lockout_until).execution_options(
+                        synchronize_session=False))
+        row = db.session.execute(stmt).one()
+        db.session.commit()
+        return LockoutState(row.failed_attempts, as_utc(row.lockout_until))
+
+    def reset(self, user: User) -> bool:
+        # Decided by the primary's row, not `user`, which may have been read
+        # from a lagging replica; the condition makes a clean row a no-op
+        stmt = (update(User).where(
+            User.id == user.id,
+            or_(User.failed_attempts != 0,
+                User.lockout_until.is_not(None))).values(
+                    failed_attempts=0, lockout_until=None).returning(
+                        User.id).execution_options(
+                            synchronize_session=False))
+        changed = db.session.execute(stmt).first() is not None
+        db.session.commit()
+        return changed
+
+    def reset_many(self, pattern: str | None, expired_before: datetime | None,
+                   chunk_size: int) -> Iterator[list[int]]:
+        # One UPDATE per chunk, picking the next rows by ID in a subquery,
+        # so no rows are loaded and each write lock is held briefly
+        condition = and_(
+            user_filter(pattern, expired_before),
+            or_(User.failed_attempts != 0, User.lockout_until.is_not(None)))
+        last = 0
+        while True:
+            chunk = (select(User.id).where(User.id > last,
+                                           condition).order_by(
+                                               User.id).limit(chunk_size))
+            stmt = (update(User).where(User.id.in_(chunk)).values(
+                failed_attempts=0, lockout_until=None).returning(
+                    User.id).execution_options(synchronize_session=False))
+            ids = sorted(db.session.execute(stmt).scalars())
+            db.session.commit()
+            if not ids:
+                return
+            yield ids
+            if len(ids) < chunk_size:
+                return
+            last = ids[-1]
+
+
+class MemoryLockoutStore(LockoutStore):
+    """
+    Keeps the counters in process memory, guarded by a lock.
+
+    Counting never touches the database, but every process keeps its own
+    counters, so this store is meant for single-process deployments and
+    tests.
+    """
+
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self._state: dict[int, LockoutState] = {}
+
+    def locked_until(self, user: User, now: datetime) -> datetime | None:
+        state = self._state.get(user.id)
+        if state is not None and state.lockout_until is not None \
+                and state.lockout_until > now:
+            return state.lockout_until
+        return None
+
+    def record_failure(self, user_id: int, now: datetime, threshold: int,
+                       duration: timedelta) -> LockoutState:
+        with self._lock:
+            state = self._state.get(user_id, LockoutState(0, None))
+            if state.lockout_until is not None and state.lockout_until <= now:
+                state = LockoutState(0, None)
+            attempts = state.failed_attempts + 1
+            lockout_until = (now + duration
+                             if attempts >= threshold else state.lockout_until)
+            state = LockoutState(attempts, lockout_until)
+            self._state[user_id] = state
+            return state
+
+    def reset(self, user: User) -> bool:
+        with self._lock:
+            return self._state.pop(user.id, None) is not None
+
+    def reset_many(self, pattern: str | None, expired_before: datetime | None,
+                   chunk_size: int) -> Iterator[list[int]]:
+        with self._lock:
+            ids = sorted(
+                user_id for user_id, state in self._state.items()
+                if expired_before is None or (
+                    state.lockout_until is not None
+                    and state.lockout_until <= expired_before))
+        for start in range(0, len(ids), chunk_size):
+            chunk = ids[start:start + chunk_size]
+            if pattern is not None:
+                # Usernames are only in the database
+                chunk = sorted(
+                    db.session.execute(
+                        select(User.id).where(User.id.in_(chunk),
+                                              user_filter(pattern,
+                                                          None))).scalars())
+            with self._lock:
+                chunk = [
+                    user_id for user_id in chunk
+                    if self._state.pop(user_id, None) is not None
+                ]
+            if chunk:
+                yield chunk
+
+
+class Lockout:
+    """
+    Failed-login counting and account lockout.
+
+    The backend is chosen with `LOCKOUT_BACKEND` ("database" or "memory"),
+    and accounts are locked for `LOCKOUT_DURATION` once they reach
+    `LOCKOUT_THRESHOLD` consecutive failed attempts.
+
+    Args:
+        app (Flask | None): The Flask application object.
+    """
+
+    def __init__(self, app: Flask | None = None) -> None:
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app: Flask) -> None:
+        """
+        Initialize the lockout store for an application.
+
+        Args:
+            app (Flask): The Flask application object.
+        """
+        app.config.setdefault("LOCKOUT_BACKEND", "database")
+        app.config.setdefault("LOCKOUT_THRESHOLD", 5)
+        app.config.setdefault("LOCKOUT_DURATION", timedelta(minutes=15))
+        app.config.setdefault("LOCKOUT_RESET_CHUNK_SIZE", 1000)
+        backend = app.config["LOCKOUT_BACKEND"]
+        store: LockoutStore
+        if backend == "database":
+            store = DatabaseLockoutStore()
+        elif backend == "memory":
+            store = MemoryLockoutStore()
+        else:
+            raise ValueError(f"Unknown LOCKOUT_BACKEND {backend!r}; expected "
+                             "'database' or 'memory'")
+        app.extensions["lockout"] = store
+
+    @property
+    def store(self) -> LockoutStore:
+        """The lockout store of the current application."""
+        store: LockoutStore = current_app.extensions["lockout"]
+        return store
+
+    @property
+    def threshold(self) -> int:
+        """Failed attempts that trigger a lockout."""
+        return int(current_app.config["LOCKOUT_THRESHOLD"])
+
+    def locked_until(self, user: User,
+                     now: datetime | None = None) -> datetime | None:
+        """
+        Return when the user's lockout ends, if they are locked out.
+
+        Args:
+            user (User): The user attempting to log in.
+            now (datetime | None): The current time, defaults to now.
+
+        Returns:
+            datetime | None: The end of the lockout, or `None`.
+        """
+        return self.store.locked_until(user, now or datetime.now(timezone.utc))
+
+    def record_failure(self,
+                       user_id: int,
+                       now: datetime | None = None) -> LockoutState:
+        """
+        Count a failed login attempt for a user.
+
+        Args:
+            user_id (int): The ID of the user.
+            now (datetime | None): The current time, defaults to now.
+
+        Returns:
+            LockoutState: The state after counting this failure.
+        """
+        state = self.store.record_failure(
+            user_id, now or datetime.now(timezone.utc), self.threshold,
+            current_app.config["LOCKOUT_DURATION"])
+        user_cache.invalidate(user_id)
+        return state
+
+    def reset(self, user: User) -> bool:
+        """
+        Clear the failed attempts and lockout of a user.
+
+        Args:
+            user (User): The user to reset.
+
+        Returns:
+            bool: `True` if there was anything to reset.
+        """
+        changed = self.store.reset(user)
+        if changed:
+            user_cache.invalidate(user.id)
+        return changed
+
+    def reset_many(self,
+                   pattern: str | None = None,
+                   expired: bool = False,
+                   now: datetime | None = None,
+                   chunk_size: int | None = None) -> Iterator[int]:
+        """
+        Clear the failed attempts and lockouts of many users, in chunks.
+
+        With neither filter, every user with failed attempts or a lockout
+        is reset. The work is done as the generator is consumed, one
+        statement per `LOCKOUT_RESET_CHUNK_SIZE` users, and each chunk is
+        committed before its count is yielded.
+
+        Args:
+            pattern (str | None): Only users whose username matches this
+                pattern, where `*` matches any characters and `?` any one.
+            expired (bool): Only users whose lockout has ended.
+            now (datetime | None): The current time, defaults to now.
+            chunk_size (int | None): Users reset per chunk, defaults to
+                `LOCKOUT_RESET_CHUNK_SIZE`.
+
+        Yields:
+            int: The number of users reset by each chunk.
+        """
+        expired_before = (now or datetime.now(timezone.utc)
+                          if expired else None)
+        chunks = self.store.reset_many(
+            pattern, expired_before, chunk_size
+            or int(current_app.config["LOCKOUT_RESET_CHUNK_SIZE"]))
+        for ids in chunks:
+            for user_id in ids:
+                user_cache.invalidate(user_id)
+            yield len(ids)
+
+
+lockout: Lockout = Lockout()
+
+lockout_cli = click.Group("lockout", help="Manage account lockouts.")
+
+
+@lockout_cli.command("reset")
+@click.option("--all",
+              "reset_all",
+              is_flag=True,
+              help="Reset every locked out or failing account.")
+@click.option("--expired",
+              is_flag=True,
+              help="Only accounts whose lockout has ended.")
+@click.option("--match",
+              "pattern",
+              metavar="PATTERN",
+              help="Only usernames matching PATTERN, e.g. 'bot-*'.")
+@click.option("--chunk-size",
+              type=click.IntRange(min=1),
+              help="Accounts reset per statement "
+              "[default: LOCKOUT_RESET_CHUNK_SIZE].")
+@with_appcontext
+def reset_lockouts(reset_all: bool, expired: bool, pattern: str | None,
+                   chunk_size: int | None) -> None:
+    """
+    Clear the failed attempts and lockouts of many accounts.
+
+    Pass `--all`, or narrow the accounts down with `--expired` and
+    `--match`, which can be combined.
+    """
+    if reset_all == (expired or pattern is not None):
+        raise click.UsageError(
+            "Pass either --all, or --expired and/or --match.")
+    total = 0
+    for chunk, count in enumerate(
+            lockout.reset_many(pattern, expired, chunk_size=chunk_size), 1):
+        total += count
+        click.echo(f"Chunk {chunk}: reset {count} accounts ({total} total)")
+    click.echo(f"Reset {total} accounts")
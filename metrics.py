@@ -0,0 +1,415 @@
+"""metrics.py"""
+from __future__ import annotations
+import hmac
+import threading
+import time
+import weakref
+from bisect import bisect_left
+from dataclasses import dataclass
+from typing import Any, Callable
+from flask import Flask, current_app, g, request
+from sqlalchemy import Engine, event
+from sqlalchemy.pool import Pool
+from flask.wrappers import Response
+
+REQUEST_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0,
+                   10.0)
+QUERY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25,
+                 0.5, 1.0)
+HASH_BUCKETS = (0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+JOB_BUCKETS = (0.01, 0.05, 0.1, 0.5, 1.0, 5.0, 10.0, 30.0, 60.0, 300.0)
+LOGIN_OUTCOMES = ("success", "failure", "locked")
+AUDIT_OUTCOMES = ("written", "dropped", "failed")
+
+
+@dataclass(frozen=True)
+class MetricFamily:
+    """
+    A metric and its Prometheus metadata.
+
+    Attributes:
+        name (str): The metric name.
+        kind (str): "counter", "gauge" or "histogram".
+        help (str): The description shown by Prometheus.
+        labels (tuple[str, ...]): The label names, in order.
+        buckets (tuple[float, ...]): Upper bounds of a histogram's buckets.
+    """
+    name: str
+    kind: str
+    help: str
+    labels: tuple[str, ...]
+    buckets: tuple[float, ...] = ()
+
+
+FAMILIES = {
+    family.name: family
+    for family in (
+        MetricFamily("http_requests_total", "counter",
+                     "Requests handled, by endpoint, method and status.",
+                     ("endpoint", "method", "status")),
+        MetricFamily("http_request_duration_seconds", "histogram",
+                     "Time spent handling requests, by endpoint.",
+                     ("endpoint", ), REQUEST_BUCKETS),
+        MetricFamily("db_query_duration_seconds", "histogram",
+                     "Time spent executing SQL statements, by engine.",
+                     ("engine", ), QUERY_BUCKETS),
+        MetricFamily("db_pool_checkout_duration_seconds", "histogram",
+                     "Time spent getting a connection from the pool, "
+                     "including waiting for one, by engine.", ("engine", ),
+                     QUERY_BUCKETS),
+        MetricFamily("db_pool_connections_in_use", "gauge",
+                     "Connections currently checked out, by engine.",
+                     ("engine", )),
+        MetricFamily("password_hash_duration_seconds", "histogram",
+                     "Time spent in Argon2, by operation.", ("operation", ),
+                     HASH_BUCKETS),
+        MetricFamily("password_hash_queue_wait_seconds", "histogram",
+                     "Time Argon2 jobs waited for a worker, by operation.",
+                     ("operation", ), HASH_BUCKETS),
+        MetricFamily("login_attempts_total", "counter",
+                     "Login form submissions, by outcome.", ("outcome", )),
+        MetricFamily("audit_events_total", "counter",
+                     "Audit events, by outcome: written, dropped when the "
+                     "queue was full, or failed to write.", ("outcome", )),
+        MetricFamily("scheduler_job_runs_total", "counter",
+                     "Maintenance job runs, by job and outcome.",
+                     ("job", "outcome")),
+        MetricFamily("scheduler_job_duration_seconds", "histogram",
+                     "Time spent running maintenance jobs, by job.",
+                     ("job", ), JOB_BUCKETS),
+        MetricFamily("scheduler_job_rows_total", "counter",
+                     "Rows (or pages) touched by maintenance jobs, by job.",
+                     ("job", )),
+    )
+}
+
+_Key = tuple[str, tuple[str, ...]]
+
+
+class _Shard:
+    """The counters and histograms recorded by one thread."""
+    __slots__ = ("counters", "histograms", "__weakref__")
+
+    def __init__(self) -> None:
+        self.counters: dict[_Key, float] = {}
+        # Per-bucket counts (the last one for +Inf), then the sum
+        self.histograms: dict[_Key, list[float]] = {}
+
+    def merge(self, other: _Shard) -> None:
+        for key, value in list(other.counters.items()):
+            self.counters[key] = self.counters.get(key, 0) + value
+        for key, values in list(other.histograms.items()):
+            mine = self.histograms.setdefault(key, [0.0] * len(values))
+            for index, value in enumerate(list(values)):
+                mine[index] += value
+
+
+class _MetricsState:
+    """
+    The metrics of one application, kept in one shard per thread.
+
+    A thread only ever writes to its own shard, so recording takes no lock.
+    The shard of a thread that has finished is folded into `retired`.
+    """
+
+    def __init__(self) -> None:
+        self.local = threading.local()
+        self.lock = threading.Lock()
+        self.shards: list[_Shard] = []
+        self.retired = _Shard()
+        self.engines: dict[str, Engine] = {}
+
+    def shard(self) -> _Shard:
+        try:
+            shard: _Shard = self.local.shard
+            return shard
+        except AttributeError:
+            pass
+        shard = self.local.shard = _Shard()
+        with self.lock:
+            self.shards.append(shard)
+        weakref.finalize(threading.current_thread(), self.retire, shard)
+        return shard
+
+    def retire(self, shard: _Shard) -> None:
+        with self.lock:
+            self.shards.remove(shard)
+            self.retired.merge(shard)
+
+    def inc(self, name: str, labels: tuple[str, ...],
+            amount: float = 1) -> None:
+        counters = self.shard().counters
+        key = (name, labels)
+        counters[key] = counters.get(key, 0) + amount
+
+    def observe(self, name: str, labels: tuple[str, ...],
+                value: float) -> None:
+        histograms = self.shard().histograms
+        key = (name, labels)
+        values = histograms.get(key)
+        buckets = FAMILIES[name].buckets
+        if values is None:
+            values = histograms[key] = [0.0] * (len(buckets) + 2)
+        values[bisect_left(buckets, value)] += 1
+        values[-1] += value
+
+    def collect(self) -> _Shard:
+        total = _Shard()
+        with self.lock:
+            total.merge(self.retired)
+            for shard in self.shards:
+                total.merge(shard)
+        for name, engine in self.engines.items():
+            checkedout = getattr(engine.pool, "checkedout", None)
+            if checkedout is not None:
+                total.counters[("db_pool_connections_in_use",
+                                (name, ))] = checkedout()
+        return total
+
+
+def _labels(family: MetricFamily, values: tuple[str, ...],
+            extra: str = "") -> str:
+    pairs = [
+        f'{name}="{_escape(value)}"'
+        for name, value in zip(family.labels, values)
+    ]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace(
+        "\n", "\\n")
+
+
+def _number(value: float) -> str:
+    return str(int(value)) if value == int(value) else repr(value)
+
+
+def render(shard: _Shard) -> str:
+    """
+    Render collected metrics in the Prometheus text exposition format.
+
+    Args:
+        shard (_Shard): The merged metrics of every thread.
+
+    Returns:
+        str: The metrics, one family after the other.
+    """
+    lines: list[str] = []
+    for family in FAMILIES.values():
+        lines.append(f"# HELP {family.name} {family.help}")
+        lines.append(f"# TYPE {family.name} {family.kind}")
+        if family.kind != "histogram":
+            for (name, values), value in sorted(shard.counters.items()):
+                if name == family.name:
+                    lines.append(f"{name}{_labels(family, values)} "
+                                 f"{_number(value)}")
+            continue
+        for (name, values), counts in sorted(shard.histograms.items()):
+            if name != family.name:
+                continue
+            cumulative = 0.0
+            for bound, count in zip((*family.buckets, float("inf")), counts):
+                cumulative += count
+                le = "+Inf" if bound == float("inf") else repr(bound)
+                bucket = _labels(family, values, f'le="{le}"')
+                lines.append(f"{name}_bucket{bucket} {_number(cumulative)}")
+            lines.append(f"{name}_sum{_labels(family, values)} "
+                         f"{_number(counts[-1])}")
+            lines.append(f"{name}_count{_labels(family, values)} "
+                         f"{_number(cumulative)}")
+    return "\n".join(lines) + "\n"
+
+
+class Metrics:
+    """
+    Request, database, hashing and login metrics in Prometheus format.
+
+    Every request is counted and timed by endpoint, every SQL statement is
+    timed by engine (the primary's bind name, or the replica's name), as is
+    getting a connection from each engine's pool. `PasswordHashing` reports
+    the Argon2 time and queue wait of each job, the login view reports
+    each attempt's outcome, the audit log how many events it wrote or
+    dropped, and the scheduler the duration and rows touched of each
+    maintenance job. `METRICS_ENABLED` turns recording off.
+
+    Each thread records into its own shard, without locking, and the shards
+    are only merged when the metrics are read, so recording costs a few
+    dictionary updates per event.
+
+    Args:
+        app (Flask | None): The Flask application object.
+    """
+
+    def __init__(self, app: Flask | None = None) -> None:
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app: Flask) -> None:
+        """
+        Start recording the metrics of an application.
+
+        The database extensions must be initialized first, so that their
+        engines can be instrumented.
+
+        Args:
+            app (Flask): The Flask application object.
+        """
+        app.config.setdefault("METRICS_ENABLED", True)
+        app.config.setdefault("METRICS_TOKEN", None)
+        if not app.config["METRICS_ENABLED"]:
+            return
+        state = _MetricsState()
+        app.extensions["metrics"] = state
+        app.before_request(self._start)
+        app.after_request(self._finish)
+
+        with app.app_context():
+            engines = {
+                "primary" if key is None else key: engine
+                for key, engine in app.extensions["sqlalchemy"].engines.items()
+            }
+        replicas = app.extensions.get("replicas")
+        if replicas is not None:
+            engines.update(replicas.engines)
+        state.engines = engines
+        for name, engine in engines.items():
+            self._instrument(state, name, engine)
+
+    @staticmethod
+    def _state() -> _MetricsState | None:
+        state: _MetricsState | None = current_app.extensions.get("metrics")
+        return state
+
+    @staticmethod
+    def _start() -> None:
+        g.metrics_started = time.perf_counter()
+
+    def _finish(self, response: Response) -> Response:
+        state = self._state()
+        started = g.pop("metrics_started", None)
+        if state is not None and started is not None:
+            endpoint = request.endpoint or "none"
+            state.inc("http_requests_total",
+                      (endpoint, request.method, str(response.status_code)))
+            state.observe("http_request_duration_seconds", (endpoint, ),
+                          time.perf_counter() - started)
+        return response
+
+    @staticmethod
+    def _instrument(state: _MetricsState, name: str, engine: Engine) -> None:
+        labels = (name, )
+
+        def before_execute(conn: Any, *_args: Any) -> None:
+            conn.info.setdefault("metrics_started",
+                                 []).append(time.perf_counter())
+
+        def after_execute(conn: Any, *_args: Any) -> None:
+            started = conn.info["metrics_started"].pop()
+            state.observe("db_query_duration_seconds", labels,
+                          time.perf_counter() - started)
+
+        def time_checkouts(pool: Pool) -> None:
+            connect: Callable[[], Any] = pool.connect
+
+            def timed_connect() -> Any:
+                started = time.perf_counter()
+                try:
+                    return connect()
+                finally:
+                    state.observe("db_pool_checkout_duration_seconds",
+                                  labels,
+                                  time.perf_counter() - started)
+
+            pool.connect = timed_connect  # type: ignore[method-assign]
+
+        event.listen(engine, "before_cursor_execute", before_execute)
+        event.listen(engine, "after_cursor_execute", after_execute)
+        # dispose() replaces the pool
+        event.listen(engine, "engine_disposed",
+                     lambda disposed: time_checkouts(disposed.pool))
+        time_checkouts(engine.pool)
+
+    def observe_hash(self, operation: str, seconds: float,
+                     queue_wait: float) -> None:
+        """
+        Record one Argon2 job.
+
+        Args:
+            operation (str): "hash" or "verify".
+            seconds (float): Time spent hashing.
+            queue_wait (float): Time the job waited for a worker.
+        """
+        state = self._state()
+        if state is not None:
+            state.observe("password_hash_duration_seconds", (operation, ),
+                          seconds)
+            state.observe("password_hash_queue_wait_seconds",
+                          (operation, ), queue_wait)
+
+    def login_attempt(self, outcome: str) -> None:
+        """
+        Count one login form submission.
+
+        Args:
+            outcome (str): One of `LOGIN_OUTCOMES`.
+        """
+        state = self._state()
+        if state is not None:
+            state.inc("login_attempts_total", (outcome, ))
+
+    def audit_events(self, outcome: str, count: int = 1) -> None:
+        """
+        Count audit events.
+
+        Args:
+            outcome (str): One of `AUDIT_OUTCOMES`.
+            count (int): The number of events.
+        """
+        state = self._state()
+        if state is not None:
+            state.inc("audit_events_total", (outcome, ), count)
+
+    def observe_job(self, job: str, outcome: str, seconds: float,
+                    rows: int) -> None:
+        """
+        Record one maintenance job run.
+
+        Args:
+            job (str): The job name.
+            outcome (str): "success", "skipped" or "error".
+            seconds (float): Time the job took.
+            rows (int): Rows (or pages) the job touched.
+        """
+        state = self._state()
+        if state is not None:
+            state.inc("scheduler_job_runs_total", (job, outcome))
+            state.observe("scheduler_job_duration_seconds", (job, ), seconds)
+            state.inc("scheduler_job_rows_total", (job, ), rows)
+
+    def authorized(self) -> bool:
+        """
+        Check the request's bearer token against `METRICS_TOKEN`.
+
+        Returns:
+            bool: `True` if a token is configured and the request carries it.
+        """
+        token = current_app.config["METRICS_TOKEN"]
+        header = request.headers.get("Authorization", "")
+        return bool(token) and hmac.compare_digest(header.encode(),
+                                                   f"Bearer {token}".encode())
+
+    def exposition(self) -> str:
+        """
+        Render the current application's metrics for Prometheus.
+
+        Returns:
+            str: The metrics in the Prometheus text format.
+        """
+        state = self._state()
+        return render(state.collect()) if state is not None else ""
+
+
+metrics = Metrics()
@@ -1,11 +1,13 @@
 """models.py"""
 from __future__ import annotations
 from datetime import datetime, timezone
-from typing import TYPE_CHECKING, cast
+from typing import TYPE_CHECKING, Any
 from flask_login import UserMixin
-from sqlalchemy.orm import Mapped, mapped_column
-from sqlalchemy import String, DateTime
-from extensions import db, login_manager
+from sqlalchemy.orm import (Mapped, mapped_column, class_mapper,
+                            make_transient_to_detached)
+from sqlalchemy.orm.attributes import set_committed_value
+from sqlalchemy import String, DateTime, Index, Text
+from extensions import db, login_manager, replicas, user_cache
 
 if TYPE_CHECKING:
     from flask_sqlalchemy.model import Model
@@ -20,6 +22,10 @@ def load_user(user_id: str) -> User | None:
 
     This function retrieves a user from the database based on their user ID.
     It is used by Flask-Login to load the authenticated user during a request.
+    Users are served from the per-process identity cache when possible, so
+    most authenticated requests do not query the database at all. Cache
+    misses are read from a replica, falling back to the primary for users
+    the replica does not have yet.
 
     Args:
         user_id (str): The ID of the user to load.
@@ -27,7 +33,18 @@ def load_user(user_id: str) -> User | None:
     Returns:
         User | None: The user object if found, otherwise `None`.
     """
-    return cast(User | None, User.query.get(int(user_id)))
+    ident = int(user_id)
+    cached = user_cache.get(ident)
+    if cached is not None:
+        return User.from_cache(cached)
+
+    with replicas.read_only():
+        user: User | None = db.session.get(User, ident)
+    if user is None and replicas.enabled:
+        user = db.session.get(User, ident)
+    if user is not None:
+        user_cache.set(ident, user.to_cache())
+    return user
 
 
 class User(Model, UserMixin):
@@ -47,6 +64,11 @@ class User(Model, UserMixin):
         is_admin (bool): Whether the user has admin privileges.
     """
     __tablename__ = "user"
+    __table_args__ = (
+        # Sort keys of the admin user list, see `pagination.keyset_page`
+        Index("ix_user_created_id", "created", "id"),
+        Index("ix_user_lockout_until_id", "lockout_until", "id"),
+    )
 
     id: Mapped[int] = mapped_column(primary_key=True)
     username: Mapped[str] = mapped_column(String(150),
@@ -67,3 +89,123 @@ class User(Model, UserMixin):
 
     def __repr__(self) -> str:
         return f"<User {self.username}>"
+
+    def to_cache(self) -> dict[str, Any]:
+        """
+        Snapshot the loaded column values for the identity cache.
+
+        Returns:
+            dict[str, Any]: The column values keyed by attribute name.
+        """
+        return {
+            attr.key: getattr(self, attr.key)
+            for attr in class_mapper(User).column_attrs
+        }
+
+    @classmethod
+    def from_cache(cls, values: dict[str, Any]) -> User:
+        """
+        Rebuild a persistent user from a snapshot without querying.
+
+        The instance is attached to the current session with
+        `merge(load=False)`, so later changes to it are flushed as usual.
+
+        Args:
+            values (dict[str, Any]): A snapshot made by `to_cache`.
+
+        Returns:
+            User: The user, attached to the current session.
+        """
+        user: User = class_mapper(cls).class_manager.new_instance()
+        for key, value in values.items():
+            set_committed_value(user, key, value)
+        make_transient_to_detached(user)
+        merged: User = db.session.merge(user, load=False)
+        return merged
+
+
+class JobLease(Model):
+    """
+    Scheduler lease and last run of a maintenance job.
+
+    A worker runs a job only after taking its lease, which it holds until
+    the job is next due, so each job runs once per interval however many
+    workers run the scheduler.
+
+    Attributes:
+        name (str): The job name.
+        holder (str): The worker that last took the lease, "host:pid".
+        expires (datetime): When the lease ends and the job is due again.
+        last_started (datetime | None): When the last run started.
+        last_duration (float | None): Seconds the last run took.
+        last_rows (int | None): Rows (or pages) the last run touched, or
+            `None` if it had nothing to do on this database.
+        last_error (str | None): The error of the last run, if it failed.
+    """
+    __tablename__ = "job_lease"
+
+    name: Mapped[str] = mapped_column(String(64), primary_key=True)
+    holder: Mapped[str] = mapped_column(String(255))
+    expires: Mapped[datetime] = mapped_column(DateTime(timezone=True))
+    last_started: Mapped[datetime | None] = mapped_column(
+        DateTime(timezone=True), nullable=True)
+    last_duration: Mapped[float | None] = mapped_column(nullable=True)
+    last_rows: Mapped[int | None] = mapped_column(nullable=True)
+    last_error: Mapped[str | None] = mapped_column(String(255),
+                                                   nullable=True)
+
+
+class AuditEvent(Model):
+    """
+    An entry in the append-only audit log of account events.
+
+    Rows are written in batches by `audit.py`, never updated, and keep the
+    username rather than a foreign key so that they outlive the user.
+
+    Attributes:
+        id (int): The event's ID.
+        created (datetime): When the event happened.
+        event (str): What happened, one of `audit.EVENTS`.
+        username (str | None): The account concerned, as entered.
+        user_id (int | None): The account's ID, if it exists.
+        remote_addr (str | None): The client address of the request.
+        detail (str | None): More about the event, e.g. the admin who reset
+            a lockout.
+    """
+    __tablename__ = "audit_event"
+    __table_args__ = (Index("ix_audit_event_username_created", "username",
+                            "created"), )
+
+    id: Mapped[int] = mapped_column(primary_key=True)
+    created: Mapped[datetime] = mapped_column(DateTime(timezone=True))
+    event: Mapped[str] = mapped_column(String(32))
+    username: Mapped[str | None] = mapped_column(String(150), nullable=True)
+    user_id: Mapped[int | None] = mapped_column(nullable=True)
+    remote_addr: Mapped[str | None] = mapped_column(String(45),
+                                                    nullable=True)
+    detail: Mapped[str | None] = mapped_column(String(255), nullable=True)
+
+
+class UserSession(Model):
+    """
+    A server-side session, see `sessions.py`.
+
+    Attributes:
+        key (str): The SHA-256 of the session ID, so that the IDs sent as
+            cookies are not stored.
+        user_id (int | None): The logged in user, indexed for revoking all
+            of a user's sessions.
+        version (int): Incremented on every write, and sent in the cookie so
+            that workers can tell whether their cached copy is current.
+        payload (str): The session data, serialized as tagged JSON.
+        expires (datetime): When the session expires, indexed for purging.
+    """
+    __tablename__ = "user_session"
+    __table_args__ = (Index("ix_user_session_user_id", "user_id"),
+                      Index("ix_user_session_expires", "expires"))
+
+    key: Mapped[str] = mapped_column(String(64), primary_key=True)
+    user_id: Mapped[int | None] = mapped_column(nullable=True)
+    version: Mapped[int] = mapped_column()
+    payload: Mapped[str] = mapped_column(Text)
+    expires: Mapped[datetime] = mapped_column(DateTime(timezone=True))
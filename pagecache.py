@@ -0,0 +1,172 @@
+"""pagecache.py"""
+from __future__ import annotations
+import hashlib
+from dataclasses import dataclass
+from functools import wraps
+from typing import Any, Callable, ParamSpec
+from flask import Flask, current_app, request, session
+from flask_login import current_user
+from werkzeug.wrappers import Response
+from caching import TTLCache
+
+_P = ParamSpec("_P")
+
+CACHEABLE_METHODS = frozenset({"GET", "HEAD"})
+
+
+@dataclass(frozen=True)
+class CachedPage:
+    """
+    A rendered response kept by the page cache.
+
+    Attributes:
+        body (bytes): The response body.
+        status (int): The response status code.
+        mimetype (str): The response mimetype.
+        etag (str): The strong ETag of the body, without quotes.
+    """
+    body: bytes
+    status: int
+    mimetype: str
+    etag: str
+
+
+class _PageCacheState:
+    """The cached pages of one application and the bypass counters."""
+
+    def __init__(self, maxsize: int, ttl: float) -> None:
+        self.pages: TTLCache[str, CachedPage] = TTLCache(maxsize, ttl)
+        self.bypassed = 0
+        self.not_modified = 0
+
+
+class PageCache:
+    """
+    A full-page cache for anonymous GET requests.
+
+    Views decorated with `cached` are rendered once per `PAGE_CACHE_TTL`
+    seconds for anonymous visitors; later anonymous GETs get the stored
+    bytes with a strong `ETag`, and a request for a 200 page whose
+    `If-None-Match` matches gets an empty 304. Requests from logged in
+    users, requests with flashed messages waiting to be shown, and other
+    methods always run the view, as their pages differ per visitor.
+
+    Only pages that are the same for every anonymous visitor may be cached,
+    so a cached view must not render forms (their CSRF token is per session)
+    or depend on the query string.
+
+    Args:
+        app (Flask | None): The Flask application object.
+    """
+
+    def __init__(self, app: Flask | None = None) -> None:
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app: Flask) -> None:
+        """
+        Initialize the page cache for an application.
+
+        Args:
+            app (Flask): The Flask application object.
+        """
+        app.config.setdefault("PAGE_CACHE_ENABLED", True)
+        app.config.setdefault("PAGE_CACHE_SIZE", 256)
+        app.config.setdefault("PAGE_CACHE_TTL", 300.0)
+        app.extensions["page_cache"] = _PageCacheState(
+            int(app.config["PAGE_CACHE_SIZE"]),
+            float(app.config["PAGE_CACHE_TTL"]))
+
+    @staticmethod
+    def _state() -> _PageCacheState:
+        state: _PageCacheState = current_app.extensions["page_cache"]
+        return state
+
+    @staticmethod
+    def cacheable() -> bool:
+        """
+        Check whether the current request may be served from the cache.
+
+        Returns:
+            bool: `True` for anonymous GET and HEAD requests without pending
+            flashed messages.
+        """
+        return (current_app.config["PAGE_CACHE_ENABLED"]
+                and request.method in CACHEABLE_METHODS
+                and "_flashes" not in session
+                and not current_user.is_authenticated)
+
+    def cached(self, view: Callable[_P, Any]) -> Callable[_P, Response]:
+        """
+        Serve a view, or an error handler, from the page cache.
+
+        Pages are keyed by the view and the visitor's auth state, so every
+        URL handled by the same view (e.g. every 404) shares one entry.
+
+        Args:
+            view (Callable): The view or error handler to cache.
+
+        Returns:
+            Callable: The wrapped view, returning a `Response`.
+        """
+        key = f"{view.__module__}.{view.__qualname__}:anonymous"
+
+        @wraps(view)
+        def wrapper(*args: _P.args, **kwargs: _P.kwargs) -> Response:
+            state = self._state()
+            response: Response
+            if not self.cacheable():
+                state.bypassed += 1
+                response = current_app.make_response(view(*args, **kwargs))
+                return response
+
+            page = state.pages.get(key)
+            if page is None:
+                response = current_app.make_response(view(*args, **kwargs))
+                if response.direct_passthrough or session.modified:
+                    state.bypassed += 1
+                    return response
+                body = response.get_data()
+                page = CachedPage(body=body,
+                                  status=response.status_code,
+                                  mimetype=response.mimetype or "text/html",
+                                  etag=hashlib.blake2b(
+                                      body, digest_size=16).hexdigest())
+                state.pages.set(key, page)
+            return self._respond(state, page)
+
+        return wrapper
+
+    @staticmethod
+    def _respond(state: _PageCacheState, page: CachedPage) -> Response:
+        if page.status == 200 and request.if_none_match.contains_weak(
+                page.etag):
+            state.not_modified += 1
+            response = Response(status=304)
+        else:
+            response = Response(page.body,
+                                status=page.status,
+                                mimetype=page.mimetype)
+        response.set_etag(page.etag)
+        response.headers["Vary"] = "Cookie"
+        response.cache_control.no_cache = True
+        return response
+
+    def clear(self) -> None:
+        """Drop every cached page of the current application."""
+        self._state().pages.clear()
+
+    def stats(self) -> dict[str, int]:
+        """
+        Return the page cache counters.
+
+        Returns:
+            dict[str, int]: The cache counters plus requests that bypassed
+                the cache and those answered with a 304.
+        """
+        state = self._state()
+        return {
+            **state.pages.stats(),
+            "bypassed": state.bypassed,
+            "not_modified": state.not_modified,
+        }
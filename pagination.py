@@ -0,0 +1,164 @@
+"""pagination.py"""
+from __future__ import annotations
+import base64
+import binascii
+import json
+import sys
+from dataclasses import dataclass
+from datetime import datetime
+from typing import Any, Generic, Sequence, TypeVar
+from sqlalchemy import ColumnElement, DateTime, Select, and_, literal, tuple_
+from sqlalchemy.orm import InstrumentedAttribute
+from extensions import db
+
+_T = TypeVar("_T")
+
+
+@dataclass(frozen=True)
+class Page(Generic[_T]):
+    """
+    One page of a keyset-paginated query.
+
+    Attributes:
+        items (list[_T]): The rows of the page.
+        next_cursor (str | None): The cursor of the next page, or `None` on
+            the last page.
+    """
+    items: list[_T]
+    next_cursor: str | None
+
+
+def encode_cursor(values: Sequence[Any]) -> str:
+    """
+    Encode the sort key of a row as an opaque, URL-safe cursor.
+
+    Args:
+        values (Sequence[Any]): The sort key; datetimes are stored in ISO
+            format.
+
+    Returns:
+        str: The cursor.
+    """
+    key = [
+        value.isoformat() if isinstance(value, datetime) else value
+        for value in values
+    ]
+    data = json.dumps(key, separators=(",", ":")).encode()
+    return base64.urlsafe_b64encode(data).rstrip(b"=").decode()
+
+
+def decode_cursor(cursor: str,
+                  columns: Sequence[InstrumentedAttribute[Any]]) -> list[Any]:
+    """
+    Decode a cursor made by `encode_cursor` for the given sort columns.
+
+    Args:
+        cursor (str): The cursor.
+        columns (Sequence[InstrumentedAttribute[Any]]): The sort columns.
+
+    Returns:
+        list[Any]: The sort key, with datetimes restored.
+
+    Raises:
+        ValueError: If the cursor is malformed or its values do not match
+            the types of the columns.
+    """
+    try:
+        data = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))
+        key = json.loads(data)
+    except (binascii.Error, UnicodeDecodeError, json.JSONDecodeError) as exc:
+        raise ValueError(f"Malformed cursor {cursor!r}") from exc
+    if not isinstance(key, list) or len(key) != len(columns):
+        raise ValueError(f"Malformed cursor {cursor!r}")
+    for index, column in enumerate(columns):
+        value = key[index]
+        expected = column.type.python_type
+        if isinstance(column.type, DateTime) and isinstance(value, str):
+            try:
+                value = datetime.fromisoformat(value)
+            except ValueError as exc:
+                raise ValueError(f"Malformed cursor {cursor!r}") from exc
+        # Checked here, as the database driver would only reject them once
+        # the query runs; JSON booleans are ints to Python
+        if not isinstance(value, expected) or \
+                isinstance(value, bool) and expected is not bool:
+            raise ValueError(f"Malformed cursor {cursor!r}")
+        key[index] = value
+    return key
+
+
+def starts_with(column: InstrumentedAttribute[str],
+                prefix: str) -> ColumnElement[bool]:
+    """
+    Match the values of a string column that start with a prefix.
+
+    Written as a range, `column >= prefix AND column < successor`, rather
+    than `LIKE 'prefix%'`, so that a plain index on the column serves it:
+    SQLite only uses an index for `LIKE` when the index and the `LIKE`
+    agree on case sensitivity. The match is case-sensitive.
+
+    Args:
+        column (InstrumentedAttribute[str]): The column.
+        prefix (str): The prefix, not empty.
+
+    Returns:
+        ColumnElement[bool]: The condition.
+    """
+    # The smallest string greater than every string starting with prefix.
+    # The last code point has no successor, and the surrogates cannot be
+    # encoded, so they are skipped
+    stem = prefix.rstrip(chr(sys.maxunicode))
+    if not stem:
+        return column >= prefix
+    successor = ord(stem[-1]) + 1
+    if 0xD800 <= successor <= 0xDFFF:
+        successor = 0xE000
+    return and_(column >= prefix, column < stem[:-1] + chr(successor))
+
+
+def keyset_page(stmt: Select[_T],
+                columns: Sequence[InstrumentedAttribute[Any]],
+                cursor: str | None,
+                per_page: int,
+                descending: bool = False) -> Page[_T]:
+    """
+    Fetch a page of ORM rows by seeking past the last row of the previous
+    page.
+
+    The rows are ordered by `columns`, which must end with a unique column
+    so that the order is total, and the page starts after the row the
+    cursor was made from, with a row value comparison on the sort key.
+    With an index on the sort columns the database seeks straight to the
+    page, so every page costs the same however deep it is, unlike `OFFSET`,
+    which reads and discards all the rows before it.
+
+    Args:
+        stmt (Select[_T]): The query, with its filters but no order.
+        columns (Sequence[InstrumentedAttribute[Any]]): The sort columns.
+        cursor (str | None): The `next_cursor` of the previous page, or
+            `None` for the first page.
+        per_page (int): Rows per page.
+        descending (bool): Sort in descending order.
+
+    Returns:
+        Page[_T]: The page.
+
+    Raises:
+        ValueError: If the cursor is malformed.
+    """
+    if cursor is not None:
+        key = tuple_(*columns)
+        after = tuple_(*(literal(value, column.type) for value, column in zip(
+            decode_cursor(cursor, columns), columns)))
+        stmt = stmt.where(key < after if descending else key > after)
+    order = [column.desc() if descending else column for column in columns]
+    # One extra row tells whether there is a next page
+    items = list(
+        db.session.execute(stmt.order_by(*order).limit(per_page +
+                                                       1)).scalars())
+    next_cursor = None
+    if len(items) > per_page:
+        items = items[:per_page]
+        next_cursor = encode_cursor(
+            [getattr(items[-1], column.key) for column in columns])
+    return Page(items, next_cursor)
@@ -0,0 +1,275 @@
+"""profiler.py"""
+from __future__ import annotations
+import marshal
+import random
+import sys
+import threading
+import time
+from collections import Counter, deque
+from dataclasses import dataclass, field
+from itertools import count
+from types import FrameType
+from typing import Any
+from flask import Flask, current_app, g, request
+from flask.wrappers import Response
+
+# (filename, first line, qualified name, module) of a sampled function
+FrameKey = tuple[str, int, str, str]
+Stack = tuple[FrameKey, ...]
+
+
+@dataclass(frozen=True)
+class Profile:
+    """
+    The stack samples of one request.
+
+    Attributes:
+        id (int): Number of the profile, increasing per application.
+        endpoint (str): The request's endpoint, or its path if unrouted.
+        method (str): The request method.
+        status (int): The response status code.
+        started (float): When the request started, as a Unix timestamp.
+        duration (float): Seconds the request took.
+        interval (float): Seconds between samples.
+        stacks (Counter[Stack]): Samples per stack, outermost frame first.
+    """
+    id: int
+    endpoint: str
+    method: str
+    status: int
+    started: float
+    duration: float
+    interval: float
+    stacks: Counter[Stack] = field(default_factory=Counter)
+
+    @property
+    def samples(self) -> int:
+        """int: Number of samples taken."""
+        return sum(self.stacks.values())
+
+    def summary(self) -> dict[str, Any]:
+        """
+        Describe the profile without its stacks.
+
+        Returns:
+            dict[str, Any]: The profile's attributes and sample count.
+        """
+        return {
+            "id": self.id,
+            "endpoint": self.endpoint,
+            "method": self.method,
+            "status": self.status,
+            "started": self.started,
+            "duration_ms": round(self.duration * 1000, 3),
+            "samples": self.samples,
+        }
+
+    def collapsed(self) -> str:
+        """
+        Render the samples as collapsed stacks.
+
+        One line per stack, `module:function;module:function count`, as read
+        by flamegraph.pl, speedscope and similar tools.
+
+        Returns:
+            str: The collapsed stacks, most sampled first.
+        """
+        return "".join(
+            ";".join(f"{module}:{name}"
+                     for _file, _line, name, module in stack) + f" {samples}\n"
+            for stack, samples in self.stacks.most_common())
+
+    def pstats(self) -> bytes:
+        """
+        Render the samples in the format `pstats.Stats` loads.
+
+        Each sample counts as one call of every function on its stack, the
+        leaf function's own time is one interval per sample, and cumulative
+        time is one interval per sample the function appears in.
+
+        Returns:
+            bytes: The marshalled statistics, as `cProfile` dumps them.
+        """
+        stats: dict[tuple[str, int, str], list[Any]] = {}
+        for stack, samples in self.stacks.items():
+            seconds = samples * self.interval
+            keys = [frame[:3] for frame in stack]
+            for key in set(keys):
+                entry = stats.setdefault(key, [0, 0, 0.0, 0.0, {}])
+                entry[0] += samples
+                entry[1] += samples
+                entry[3] += seconds
+            stats[keys[-1]][2] += seconds
+            for caller, callee in set(zip(keys, keys[1:])):
+                callers = stats[callee][4]
+                own = seconds if callee == keys[-1] else 0.0
+                before = callers.get(caller, (0, 0, 0.0, 0.0))
+                callers[caller] = (before[0] + samples, before[1] + samples,
+                                   before[2] + own, before[3] + seconds)
+        return marshal.dumps({key: tuple(entry)
+                              for key, entry in stats.items()})
+
+
+def _stack(frame: FrameType | None) -> Stack:
+    frames = []
+    while frame is not None:
+        code = frame.f_code
+        frames.append((code.co_filename, code.co_firstlineno,
+                       code.co_qualname, frame.f_globals.get("__name__", "?")))
+        frame = frame.f_back
+    return tuple(reversed(frames))
+
+
+class _ProfilerState:
+    """
+    The requests being sampled and the profiles kept for one application.
+
+    A sampler thread runs while requests are in flight, and exits once the
+    last one has finished.
+    """
+
+    def __init__(self, interval: float, keep: int) -> None:
+        self.interval = interval
+        self.lock = threading.Lock()
+        self.active: dict[int, Counter[Stack]] = {}
+        self.profiles: deque[Profile] = deque(maxlen=keep)
+        self.ids = count(1)
+        self.sampler: threading.Thread | None = None
+
+    def start(self) -> None:
+        with self.lock:
+            self.active[threading.get_ident()] = Counter()
+            if self.sampler is None:
+                self.sampler = threading.Thread(target=self.sample,
+                                                name="profiler",
+                                                daemon=True)
+                self.sampler.start()
+
+    def stop(self) -> Counter[Stack] | None:
+        with self.lock:
+            return self.active.pop(threading.get_ident(), None)
+
+    def sample(self) -> None:
+        while True:
+            time.sleep(self.interval)
+            frames = sys._current_frames()  # pylint: disable=protected-access
+            with self.lock:
+                if not self.active:
+                    self.sampler = None
+                    return
+                for ident, stacks in self.active.items():
+                    frame = frames.get(ident)
+                    if frame is not None:
+                        stacks[_stack(frame)] += 1
+
+    def keep(self, profile: Profile) -> None:
+        with self.lock:
+            self.profiles.append(profile)
+
+
+class Profiler:
+    """
+    A sampling profiler for slow requests.
+
+    While `PROFILER_ENABLED` is set, a background thread samples the stack
+    of every request in flight each `PROFILER_INTERVAL` seconds. Requests
+    that take `PROFILER_THRESHOLD` seconds or longer, and a random
+    `PROFILER_SAMPLE_RATE` share of the others, keep their samples as a
+    `Profile`; the last `PROFILER_KEEP` profiles are kept, and admins can
+    download them from `/admin/profiles`.
+
+    Sampling reads the stacks from outside the request threads, so the
+    requests themselves only pay for registering with the sampler, and no
+    thread runs between requests.
+
+    Args:
+        app (Flask | None): The Flask application object.
+    """
+
+    def __init__(self, app: Flask | None = None) -> None:
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app: Flask) -> None:
+        """
+        Start profiling an application's requests, if enabled.
+
+        Args:
+            app (Flask): The Flask application object.
+        """
+        app.config.setdefault("PROFILER_ENABLED", False)
+        app.config.setdefault("PROFILER_THRESHOLD", 0.5)
+        app.config.setdefault("PROFILER_SAMPLE_RATE", 0.01)
+        app.config.setdefault("PROFILER_INTERVAL", 0.005)
+        app.config.setdefault("PROFILER_KEEP", 50)
+        if not app.config["PROFILER_ENABLED"]:
+            return
+        app.extensions["profiler"] = _ProfilerState(
+            float(app.config["PROFILER_INTERVAL"]),
+            int(app.config["PROFILER_KEEP"]))
+        app.before_request(self._start)
+        app.after_request(self._finish)
+        app.teardown_request(self._stop)
+
+    @staticmethod
+    def _state() -> _ProfilerState | None:
+        state: _ProfilerState | None = current_app.extensions.get("profiler")
+        return state
+
+    def _start(self) -> None:
+        state = self._state()
+        if state is not None:
+            g.profiler_started = (time.time(), time.perf_counter())
+            state.start()
+
+    def _finish(self, response: Response) -> Response:
+        state = self._state()
+        started = g.pop("profiler_started", None)
+        if state is None or started is None:
+            return response
+        stacks = state.stop()
+        duration = time.perf_counter() - started[1]
+        config = current_app.config
+        if stacks is not None and (
+                duration >= config["PROFILER_THRESHOLD"]
+                or random.random() < config["PROFILER_SAMPLE_RATE"]):
+            state.keep(
+                Profile(next(state.ids), request.endpoint or request.path,
+                        request.method, response.status_code, started[0],
+                        duration, state.interval, stacks))
+        return response
+
+    def _stop(self, _exc: BaseException | None) -> None:
+        # Requests that raised never reach _finish
+        state = self._state()
+        if state is not None:
+            state.stop()
+
+    def profiles(self) -> list[Profile]:
+        """
+        Return the kept profiles of the current application.
+
+        Returns:
+            list[Profile]: The profiles, newest first.
+        """
+        state = self._state()
+        if state is None:
+            return []
+        with state.lock:
+            return list(reversed(state.profiles))
+
+    def profile(self, profile_id: int) -> Profile | None:
+        """
+        Return a kept profile of the current application.
+
+        Args:
+            profile_id (int): The profile's ID.
+
+        Returns:
+            Profile | None: The profile, or `None` if it is not kept.
+        """
+        return next((profile for profile in self.profiles()
+                     if profile.id == profile_id), None)
+
+
+profiler = Profiler()
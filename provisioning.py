@@ -0,0 +1,408 @@
+"""provisioning.py"""
+from __future__ import annotations
+import csv
+import json
+import os
+import time
+from collections import deque
+from concurrent.futures import Executor, Future
+from dataclasses import dataclass, field
+from datetime import datetime, timezone
+from itertools import islice
+from typing import IO, Any, Callable, Iterable, Iterator
+import click
+from flask import current_app
+from flask.cli import with_appcontext
+from sqlalchemy import insert, select
+from sqlalchemy.exc import IntegrityError
+from blueprints.auth.forms import USERNAME_MAX_LENGTH, USERNAME_MIN_LENGTH
+from config import str_to_bool
+from create_admin import generate_random_password
+from extensions import db, password_hashing
+from hashing import HasherParams, InlineExecutor, hash_passwords
+from models import User
+
+FORMATS = ("csv", "jsonl")
+
+
+@dataclass(frozen=True)
+class UserRecord:
+    """
+    A valid account read from an import file.
+
+    Attributes:
+        number (int): The record's position in the file, from 1.
+        username (str): The username.
+        password (str | None): The password, or `None` to generate one.
+        is_admin (bool): Whether the user is an admin.
+    """
+    number: int
+    username: str
+    password: str | None
+    is_admin: bool
+
+
+@dataclass
+class ImportStats:
+    """
+    Progress of an import.
+
+    Attributes:
+        position (int): Records handled and committed, counting from the
+            start of the file, including those skipped on resume.
+        created (int): Users inserted.
+        existing (int): Records whose username was already taken.
+        invalid (int): Records rejected, with the reason logged.
+        started (float): Monotonic time at which the import started.
+    """
+    position: int = 0
+    created: int = 0
+    existing: int = 0
+    invalid: int = 0
+    started: float = field(default_factory=time.monotonic)
+
+    @property
+    def rate(self) -> float:
+        """Users created per second so far."""
+        elapsed = time.monotonic() - self.started
+        return self.created / elapsed if elapsed > 0 else 0.0
+
+
+def read_records(file: IO[str], fmt: str) -> Iterator[dict[str, Any]]:
+    """
+    Stream the raw records of an import file.
+
+    Args:
+        file (IO[str]): The file, read as it is iterated.
+        fmt (str): "csv", with a header row, or "jsonl", one JSON object
+            per line.
+
+    Yields:
+        dict[str, Any]: Each record; a blank JSONL line yields `{}`.
+
+    Raises:
+        ValueError: If a JSONL line is not valid JSON.
+    """
+    if fmt == "csv":
+        yield from csv.DictReader(file)
+        return
+    for line in file:
+        if not line.strip():
+            yield {}
+            continue
+        record = json.loads(line)
+        yield record if isinstance(record, dict) else {}
+
+
+def parse_record(number: int, raw: dict[str, Any]) -> UserRecord:
+    """
+    Validate a raw record.
+
+    Usernames follow the registration form's length limits. Passwords are
+    taken as given, as they come from another system's policy; an empty or
+    missing password is generated.
+
+    Args:
+        number (int): The record's position in the file, from 1.
+        raw (dict[str, Any]): The record.
+
+    Returns:
+        UserRecord: The account to create.
+
+    Raises:
+        ValueError: If the record is invalid.
+    """
+    username = str(raw.get("username") or "").strip()
+    if not USERNAME_MIN_LENGTH <= len(username) <= USERNAME_MAX_LENGTH:
+        raise ValueError(
+            f"username must be {USERNAME_MIN_LENGTH} to "
+            f"{USERNAME_MAX_LENGTH} characters, got {username!r}")
+    is_admin = raw.get("is_admin") or False
+    if isinstance(is_admin, str):
+        is_admin = str_to_bool(is_admin)
+    return UserRecord(number, username,
+                      str(raw.get("password") or "") or None,
+                      bool(is_admin))
+
+
+@dataclass
+class _Batch:
+    position: int
+    records: list[UserRecord]
+    generated: dict[str, str]
+    hashes: Future[list[str]]
+
+
+class UserImporter:
+    """
+    Create users in bulk from a stream of records.
+
+    Records are read in batches of `batch_size`. Invalid records and
+    usernames that are taken are dropped with one `SELECT` per batch, the
+    passwords of the rest are hashed on `executor` (a process pool, so
+    every core runs Argon2), and each batch is inserted with a single
+    executemany `INSERT` and committed in file order. Up to `max_pending`
+    batches are hashed ahead of the one being inserted, so at most
+    `(max_pending + 1) * batch_size` records are held at once, whatever the
+    size of the file.
+
+    Args:
+        executor (Executor): Where passwords are hashed.
+        params (HasherParams): The Argon2 parameters to hash with.
+        batch_size (int): Records per batch.
+        max_pending (int): Batches hashed ahead of the insert.
+        on_error (Callable[[int, str], None]): Called with the number of
+            each invalid record and the reason.
+        on_batch (Callable[[ImportStats, dict[str, str]], None]): Called
+            after each commit with the progress and the passwords generated
+            for the batch, by username.
+    """
+
+    def __init__(self, executor: Executor, params: HasherParams,
+                 batch_size: int, max_pending: int,
+                 on_error: Callable[[int, str], None],
+                 on_batch: Callable[[ImportStats, dict[str, str]],
+                                    None]) -> None:
+        self.executor = executor
+        self.params = params
+        self.batch_size = batch_size
+        self.max_pending = max_pending
+        self.on_error = on_error
+        self.on_batch = on_batch
+        self.stats = ImportStats()
+        # Usernames hashed but not yet inserted, which the database cannot
+        # report as taken yet
+        self.pending_names: set[str] = set()
+
+    def run(self, records: Iterable[dict[str, Any]],
+            start: int = 0) -> ImportStats:
+        """
+        Import the records, skipping the first `start` of them.
+
+        Args:
+            records (Iterable[dict[str, Any]]): The raw records.
+            start (int): Records already imported by an earlier run.
+
+        Returns:
+            ImportStats: The final progress.
+        """
+        self.stats.position = start
+        numbered = enumerate(islice(records, start, None), start + 1)
+        pending: deque[_Batch] = deque()
+        while True:
+            chunk = list(islice(numbered, self.batch_size))
+            if not chunk:
+                break
+            pending.append(self._submit(chunk))
+            if len(pending) > self.max_pending:
+                self._insert(pending.popleft())
+        while pending:
+            self._insert(pending.popleft())
+        return self.stats
+
+    def _submit(self, chunk: list[tuple[int, dict[str, Any]]]) -> _Batch:
+        records: dict[str, UserRecord] = {}
+        for number, raw in chunk:
+            try:
+                record = parse_record(number, raw)
+            except ValueError as exc:
+                self.stats.invalid += 1
+                self.on_error(number, str(exc))
+                continue
+            if record.username in records or \
+                    record.username in self.pending_names:
+                self.stats.existing += 1
+                continue
+            records[record.username] = record
+        taken = self._taken(list(records))
+        self.stats.existing += len(taken)
+        kept = [
+            record for name, record in records.items() if name not in taken
+        ]
+        generated = {
+            record.username: generate_random_password()
+            for record in kept if record.password is None
+        }
+        passwords = [
+            record.password or generated[record.username] for record in kept
+        ]
+        self.pending_names.update(record.username for record in kept)
+        return _Batch(chunk[-1][0], kept, generated,
+                      self.executor.submit(hash_passwords, self.params,
+                                           passwords))
+
+    @staticmethod
+    def _taken(usernames: list[str]) -> set[str]:
+        if not usernames:
+            return set()
+        return set(
+            db.session.execute(
+                select(User.username).where(
+                    User.username.in_(usernames))).scalars())
+
+    def _insert(self, batch: _Batch) -> None:
+        hashes = batch.hashes.result()
+        now = datetime.now(timezone.utc)
+        rows: list[dict[str, Any]] = [{
+            "username": record.username,
+            "password": pw_hash,
+            "is_admin": record.is_admin,
+            "created": now,
+        } for record, pw_hash in zip(batch.records, hashes)]
+        try:
+            self._execute(rows)
+        except IntegrityError:
+            # Someone registered one of the names since the batch was
+            # checked, so drop the names that are taken now and retry
+            db.session.rollback()
+            taken = self._taken([row["username"] for row in rows])
+            self.stats.existing += len(taken)
+            rows = [row for row in rows if row["username"] not in taken]
+            self._execute(rows)
+        self.pending_names.difference_update(record.username
+                                             for record in batch.records)
+        self.stats.position = batch.position
+        self.stats.created += len(rows)
+        created = {row["username"] for row in rows}
+        self.on_batch(
+            self.stats, {
+                name: password
+                for name, password in batch.generated.items()
+                if name in created
+            })
+
+    @staticmethod
+    def _execute(rows: list[dict[str, Any]]) -> None:
+        if rows:
+            db.session.execute(insert(User), rows)
+        db.session.commit()
+
+
+def _require_passwords(records: Iterator[dict[str, Any]],
+                       start: int) -> Iterator[dict[str, Any]]:
+    for number, raw in enumerate(records, 1):
+        if number > start and raw and not raw.get("password"):
+            raise ValueError(f"record {number} has no password; pass "
+                             "--generated to generate passwords")
+        yield raw
+
+
+def _read_checkpoint(path: str, source: str) -> int:
+    if not os.path.exists(path):
+        return 0
+    with open(path, encoding="utf-8") as file:
+        checkpoint = json.load(file)
+    if checkpoint["input"] != source:
+        raise click.ClickException(
+            f"Checkpoint {path} is for {checkpoint['input']}, not {source}")
+    position: int = checkpoint["position"]
+    return position
+
+
+def _write_checkpoint(path: str, source: str, position: int) -> None:
+    # Through a temporary file, so a crash never leaves half a checkpoint
+    temporary = f"{path}.tmp"
+    with open(temporary, "w", encoding="utf-8") as file:
+        json.dump({"input": source, "position": position}, file)
+    os.replace(temporary, path)
+
+
+users_cli = click.Group("users", help="Manage user accounts.")
+
+
+@users_cli.command("import")
+@click.argument("source", type=click.Path(exists=True, dir_okay=False))
+@click.option("--format",
+              "fmt",
+              type=click.Choice(FORMATS),
+              help="Input format [default: from the file extension].")
+@click.option("--generated",
+              type=click.Path(dir_okay=False, writable=True),
+              help="Append the generated passwords to this CSV file. "
+              "Required when records have no password.")
+@click.option("--checkpoint",
+              type=click.Path(dir_okay=False),
+              help="Record progress here after every batch, and resume "
+              "from it.")
+@click.option("--workers",
+              type=click.IntRange(min=0),
+              help="Hashing processes, 0 to hash in this process "
+              "[default: HASHING_WORKERS, or one per core].")
+@click.option("--batch-size",
+              type=click.IntRange(min=1),
+              default=500,
+              show_default=True,
+              help="Records hashed per task and inserted per transaction.")
+@click.option("--max-pending",
+              type=click.IntRange(min=1),
+              help="Batches hashed ahead of the insert, which bounds memory "
+              "[default: twice the workers].")
+@with_appcontext
+def import_users(source: str, fmt: str | None, generated: str | None,
+                 checkpoint: str | None, workers: int | None,
+                 batch_size: int, max_pending: int | None) -> None:
+    """
+    Create users from a CSV or JSONL file.
+
+    Each record has a `username`, and optionally a `password` (generated if
+    missing) and `is_admin`; CSV files name them in a header row. Usernames
+    that are already taken are skipped, so an import can safely be run
+    again. With `--checkpoint`, an interrupted import resumes after the last
+    committed batch.
+    """
+    if fmt is None:
+        fmt = "jsonl" if source.endswith((".jsonl", ".ndjson")) else "csv"
+    if workers is None:
+        workers = int(current_app.config["HASHING_WORKERS"]
+                      or os.cpu_count() or 1)
+    start = _read_checkpoint(checkpoint, source) if checkpoint else 0
+    executor: Executor
+    if workers == 0:
+        executor = InlineExecutor()
+    else:
+        # pylint: disable-next=import-outside-toplevel
+        from concurrent.futures import ProcessPoolExecutor
+        executor = ProcessPoolExecutor(max_workers=workers)
+
+    # Created readable by its owner only, as it holds plaintext passwords
+    generated_file = (os.fdopen(
+        os.open(generated, os.O_WRONLY | os.O_CREAT | os.O_APPEND, 0o600),
+        "a",
+        newline="",
+        encoding="utf-8") if generated else None)
+    writer = csv.writer(generated_file) if generated_file else None
+
+    def on_error(number: int, reason: str) -> None:
+        click.echo(f"Record {number}: {reason}", err=True)
+
+    def on_batch(stats: ImportStats, passwords: dict[str, str]) -> None:
+        if writer is not None and generated_file is not None:
+            writer.writerows(passwords.items())
+            generated_file.flush()
+        if checkpoint:
+            _write_checkpoint(checkpoint, source, stats.position)
+        click.echo(f"{stats.position} records, {stats.created} created, "
+                   f"{stats.existing} existing, {stats.invalid} invalid "
+                   f"({stats.rate:.0f} users/s)")
+
+    importer = UserImporter(executor, password_hashing.params, batch_size,
+                            max_pending or 2 * max(workers, 1), on_error,
+                            on_batch)
+    try:
+        with open(source, newline="", encoding="utf-8") as file:
+            if generated_file is None:
+                records = _require_passwords(read_records(file, fmt), start)
+            else:
+                records = read_records(file, fmt)
+            stats = importer.run(records, start)
+    except (ValueError, csv.Error) as exc:
+        raise click.ClickException(f"Cannot read {source}: {exc}") from None
+    finally:
+        executor.shutdown(cancel_futures=True)
+        if generated_file is not None:
+            generated_file.close()
+    if start:
+        click.echo(f"Resumed after record {start}")
+    click.echo(f"Imported {stats.created} users in "
+               f"{time.monotonic() - stats.started:.1f}s "
+               f"({stats.rate:.0f} users/s)")
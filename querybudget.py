@@ -0,0 +1,276 @@
+"""querybudget.py"""
+from __future__ import annotations
+import re
+import threading
+import warnings
+from collections import Counter
+from contextlib import contextmanager
+from typing import Any, Callable, Iterator, TypeVar
+from flask import Flask, current_app, g, request
+from flask.wrappers import Response
+from sqlalchemy import Engine, event
+
+_F = TypeVar("_F", bound=Callable[..., Any])
+
+MODES = ("off", "warn", "raise")
+BUDGET_ATTRIBUTE = "query_budget"
+
+_STRING = re.compile(r"'(?:[^']|'')*'")
+_NUMBER = re.compile(r"\b\d+(?:\.\d+)?\b")
+_PLACEHOLDERS = re.compile(r"\(\s*\?(?:\s*,\s*\?)*\s*\)")
+_SPACE = re.compile(r"\s+")
+
+
+class QueryBudgetExceeded(AssertionError):
+    """Raised when a request breaks its query budget in "raise" mode."""
+
+
+class QueryBudgetWarning(UserWarning):
+    """Issued when a request breaks its query budget in "warn" mode."""
+
+
+def statement_shape(statement: str) -> str:
+    """
+    Reduce a SQL statement to its shape.
+
+    Literals become `?` and lists of placeholders, as in an expanded
+    `IN (?, ?, ?)`, become `(?)`, so the statements an N+1 loop runs for
+    different rows all have the same shape.
+
+    Args:
+        statement (str): The SQL sent to the database.
+
+    Returns:
+        str: The statement with literals and list lengths removed.
+    """
+    shape = _STRING.sub("?", statement)
+    shape = _NUMBER.sub("?", shape)
+    shape = _PLACEHOLDERS.sub("(?)", shape)
+    return _SPACE.sub(" ", shape).strip()
+
+
+class _QueryBudgetState:
+    """The statement logs being recorded, per thread."""
+
+    def __init__(self) -> None:
+        self.local = threading.local()
+
+    def logs(self) -> list[list[str]]:
+        try:
+            logs: list[list[str]] = self.local.logs
+        except AttributeError:
+            logs = self.local.logs = []
+        return logs
+
+    def discard(self, log: list[str]) -> None:
+        # By identity, as logs with the same statements compare equal
+        logs = self.logs()
+        logs[:] = [other for other in logs if other is not log]
+
+
+class QueryBudget:
+    """
+    Per-request SQL statement budgets and an N+1 query detector.
+
+    Every statement sent to the application's engines during a request is
+    recorded. A view declares how many statements it may issue with the
+    `limit` decorator, or the `QUERY_BUDGETS` setting maps endpoints to
+    budgets; endpoints without either get `QUERY_BUDGET_DEFAULT`, if set.
+    A request also breaks its budget when one statement shape runs
+    `QUERY_REPEAT_THRESHOLD` times or more, the mark of a query in a loop.
+
+    `QUERY_BUDGET_MODE` decides what happens then: "warn" issues a
+    `QueryBudgetWarning` and logs it, "raise" raises `QueryBudgetExceeded`
+    (failing the test that made the request), and "off" records nothing.
+
+    Args:
+        app (Flask | None): The Flask application object.
+    """
+
+    def __init__(self, app: Flask | None = None) -> None:
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app: Flask) -> None:
+        """
+        Start recording the statements of an application's requests.
+
+        The database extensions must be initialized first, so that their
+        engines can be listened to.
+
+        Args:
+            app (Flask): The Flask application object.
+        """
+        app.config.setdefault("QUERY_BUDGET_MODE", "off")
+        app.config.setdefault("QUERY_BUDGET_DEFAULT", None)
+        app.config.setdefault("QUERY_BUDGETS", {})
+        app.config.setdefault("QUERY_REPEAT_THRESHOLD", 5)
+        mode = app.config["QUERY_BUDGET_MODE"]
+        if mode not in MODES:
+            raise ValueError(f"Unknown QUERY_BUDGET_MODE {mode!r}; expected "
+                             f"one of {', '.join(MODES)}")
+        state = _QueryBudgetState()
+        app.extensions["query_budget"] = state
+
+        with app.app_context():
+            engines = list(app.extensions["sqlalchemy"].engines.values())
+        replicas = app.extensions.get("replicas")
+        if replicas is not None:
+            engines += replicas.engines.values()
+        for engine in engines:
+            self._listen(state, engine)
+
+        if mode != "off":
+            app.before_request(self._start)
+            app.after_request(self._check)
+            app.teardown_request(self._stop)
+
+    @staticmethod
+    def _listen(state: _QueryBudgetState, engine: Engine) -> None:
+
+        def before_execute(_conn: Any, _cursor: Any, statement: str,
+                           *_args: Any) -> None:
+            for log in state.logs():
+                log.append(statement)
+
+        event.listen(engine, "before_cursor_execute", before_execute)
+
+    @staticmethod
+    def _state() -> _QueryBudgetState:
+        state: _QueryBudgetState = current_app.extensions["query_budget"]
+        return state
+
+    @staticmethod
+    def limit(budget: int) -> Callable[[_F], _F]:
+        """
+        Declare how many SQL statements a view may issue per request.
+
+        Must be the innermost decorator, so that the wrappers of
+        `login_required` and `page_cache.cached` copy the budget.
+
+        Args:
+            budget (int): The maximum number of statements.
+
+        Returns:
+            Callable: A decorator recording the budget on the view.
+        """
+
+        def decorator(view: _F) -> _F:
+            setattr(view, BUDGET_ATTRIBUTE, budget)
+            return view
+
+        return decorator
+
+    @contextmanager
+    def capture(self) -> Iterator[list[str]]:
+        """
+        Record the statements this thread sends inside the block.
+
+        Yields:
+            list[str]: The statements, filled in as they run.
+        """
+        log: list[str] = []
+        state = self._state()
+        state.logs().append(log)
+        try:
+            yield log
+        finally:
+            state.discard(log)
+
+    @contextmanager
+    def assert_max_queries(self,
+                           budget: int,
+                           repeat_threshold: int | None = None
+                           ) -> Iterator[list[str]]:
+        """
+        Fail if the block sends more than `budget` statements.
+
+        Args:
+            budget (int): The maximum number of statements.
+            repeat_threshold (int | None): Also fail if one statement shape
+                runs this many times or more.
+
+        Yields:
+            list[str]: The statements, filled in as they run.
+
+        Raises:
+            QueryBudgetExceeded: If the block breaks the budget.
+        """
+        with self.capture() as log:
+            yield log
+        problem = self.problem(log, budget, repeat_threshold)
+        if problem:
+            raise QueryBudgetExceeded(f"Block {problem}")
+
+    @staticmethod
+    def problem(log: list[str], budget: int | None,
+                repeat_threshold: int | None) -> str | None:
+        """
+        Describe how a statement log breaks a budget.
+
+        Args:
+            log (list[str]): The statements sent.
+            budget (int | None): The maximum number of statements, if any.
+            repeat_threshold (int | None): How many runs of one statement
+                shape count as a query in a loop, if checked.
+
+        Returns:
+            str | None: The problem, or `None` if the log is within budget.
+        """
+        if budget is not None and len(log) > budget:
+            return f"sent {len(log)} SQL statements, budget is {budget}"
+        if repeat_threshold:
+            counts = Counter(statement_shape(statement) for statement in log)
+            if counts:
+                shape, runs = counts.most_common(1)[0]
+                if runs >= repeat_threshold:
+                    return f"ran the same statement {runs} times: {shape}"
+        return None
+
+    def budget(self, endpoint: str | None) -> int | None:
+        """
+        Return the statement budget of an endpoint.
+
+        Args:
+            endpoint (str | None): The endpoint name, e.g. "auth.login".
+
+        Returns:
+            int | None: The budget, or `None` if the endpoint has none.
+        """
+        config = current_app.config
+        if endpoint in config["QUERY_BUDGETS"]:
+            budget: int = config["QUERY_BUDGETS"][endpoint]
+            return budget
+        view = current_app.view_functions.get(endpoint or "")
+        declared: int | None = getattr(view, BUDGET_ATTRIBUTE, None)
+        if declared is not None:
+            return declared
+        default: int | None = config["QUERY_BUDGET_DEFAULT"]
+        return default
+
+    def _start(self) -> None:
+        log: list[str] = []
+        g.query_log = log
+        self._state().logs().append(log)
+
+    def _check(self, response: Response) -> Response:
+        log = g.get("query_log")
+        if log is None:
+            return response
+        problem = self.problem(log, self.budget(request.endpoint),
+                               current_app.config["QUERY_REPEAT_THRESHOLD"])
+        if problem:
+            message = f"{request.endpoint or request.path} {problem}"
+            if current_app.config["QUERY_BUDGET_MODE"] == "raise":
+                raise QueryBudgetExceeded(message)
+            current_app.logger.warning(message)
+            warnings.warn(message, QueryBudgetWarning, stacklevel=2)
+        return response
+
+    def _stop(self, _exc: BaseException | None) -> None:
+        log = g.pop("query_log", None)
+        if log is not None:
+            self._state().discard(log)
+
+
+query_budget = QueryBudget()
@@ -0,0 +1,202 @@
+"""ratelimit.py"""
+from __future__ import annotations
+import math
+import re
+import threading
+import time
+from collections import OrderedDict
+from functools import lru_cache
+from typing import Callable
+from flask import Flask, current_app
+from werkzeug.exceptions import TooManyRequests
+
+_RULE = re.compile(r"^\s*(\d+)\s*/\s*(\d*)\s*(second|minute|hour|day|[smhd])"
+                   r"\s*$")
+_PERIODS = {"s": 1, "m": 60, "h": 3600, "d": 86400}
+
+
+@lru_cache(maxsize=64)
+def parse_rule(rule: str) -> tuple[int, float]:
+    """
+    Parse a rate rule such as "10/minute" or "100/5m".
+
+    Args:
+        rule (str): The rule, as `<count>/<period>` where the period is a unit
+            (second, minute, hour, day or s, m, h, d) with an optional
+            multiplier.
+
+    Returns:
+        tuple (int, float): The burst size and the period in seconds.
+
+    Raises:
+        ValueError: If the rule cannot be parsed, or allows no requests or
+            has an empty period.
+    """
+    match = _RULE.match(rule)
+    if match is None:
+        raise ValueError(f"Invalid rate limit rule {rule!r}")
+    count, multiplier, unit = match.groups()
+    capacity, period = int(count), int(multiplier or 1) * _PERIODS[unit[0]]
+    if capacity <= 0 or period <= 0:
+        raise ValueError(f"Invalid rate limit rule {rule!r}")
+    return capacity, period
+
+
+class RateLimited(TooManyRequests):
+    """
+    Raised when a client exceeds a rate limit.
+
+    Being a `TooManyRequests`, it is rendered as a 429 response carrying a
+    `Retry-After` header when it escapes a view.
+    """
+    description = "Too many attempts. Please slow down and retry later."
+
+
+class TokenBuckets:
+    """
+    Token buckets for one limit, keyed by client identifier.
+
+    Each key holds a bucket of `capacity` tokens refilled at `capacity` per
+    `period` seconds, stored as a two-item list so that a hit mutates it in
+    place. At most `max_keys` buckets are kept; the least recently used one
+    is dropped to make room, which at worst gives that client a fresh
+    bucket.
+
+    Args:
+        max_keys (int): Maximum number of buckets kept.
+        clock (Callable[[], float]): Monotonic clock used for refills.
+    """
+
+    def __init__(self,
+                 max_keys: int,
+                 clock: Callable[[], float] = time.monotonic) -> None:
+        self.max_keys = max_keys
+        self.clock = clock
+        self._buckets: OrderedDict[str, list[float]] = OrderedDict()
+        self._lock = threading.Lock()
+        self.allowed = 0
+        self.rejected = 0
+
+    def __len__(self) -> int:
+        return len(self._buckets)
+
+    def hit(self, key: str, capacity: int, period: float) -> float:
+        """
+        Take a token from a bucket.
+
+        Args:
+            key (str): The client identifier.
+            capacity (int): Bucket size (the allowed burst).
+            period (float): Seconds it takes to refill a whole bucket.
+
+        Returns:
+            float: `0` if the hit is allowed, otherwise the number of seconds
+            until a token becomes available.
+        """
+        now = self.clock()
+        rate = capacity / period
+        with self._lock:
+            bucket = self._buckets.get(key)
+            if bucket is None:
+                bucket = [float(capacity), now]
+                self._buckets[key] = bucket
+                if len(self._buckets) > self.max_keys:
+                    self._buckets.popitem(last=False)
+            else:
+                self._buckets.move_to_end(key)
+                bucket[0] = min(capacity, bucket[0] + (now - bucket[1]) * rate)
+                bucket[1] = now
+            if bucket[0] >= 1:
+                bucket[0] -= 1
+                self.allowed += 1
+                return 0.0
+            self.rejected += 1
+            return (1 - bucket[0]) / rate
+
+
+class RateLimiter:
+    """
+    In-process token-bucket rate limiting.
+
+    Limits are checked before any expensive work (form validation, database
+    lookups, Argon2) so that rejected requests cost a dictionary lookup.
+    Every process keeps its own buckets, so the effective limit across a
+    deployment is the per-process limit times the number of workers.
+
+    Args:
+        app (Flask | None): The Flask application object.
+    """
+
+    def __init__(self, app: Flask | None = None) -> None:
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app: Flask) -> None:
+        """
+        Initialize the rate limiter for an application.
+
+        Args:
+            app (Flask): The Flask application object.
+        """
+        app.config.setdefault("RATELIMIT_ENABLED", True)
+        app.config.setdefault("RATELIMIT_MAX_KEYS", 100000)
+        app.extensions["ratelimit"] = {}
+
+    @staticmethod
+    def _limits() -> dict[str, TokenBuckets]:
+        limits: dict[str, TokenBuckets] = current_app.extensions["ratelimit"]
+        return limits
+
+    def buckets(self, scope: str) -> TokenBuckets:
+        """
+        Return the buckets of a scope, creating them if needed.
+
+        Args:
+            scope (str): The limit name, e.g. `"login_ip"`.
+
+        Returns:
+            TokenBuckets: The buckets for that limit.
+        """
+        limits = self._limits()
+        buckets = limits.get(scope)
+        if buckets is None:
+            buckets = limits.setdefault(
+                scope,
+                TokenBuckets(int(current_app.config["RATELIMIT_MAX_KEYS"])))
+        return buckets
+
+    def check(self, scope: str, key: str, rule: str) -> None:
+        """
+        Count a hit against a limit and reject it if the limit is exceeded.
+
+        Args:
+            scope (str): The limit name, e.g. `"login_ip"`.
+            key (str): The client identifier, e.g. an IP address.
+            rule (str): The rate rule, e.g. `"10/minute"`.
+
+        Raises:
+            RateLimited: If the client has no tokens left.
+        """
+        if not current_app.config["RATELIMIT_ENABLED"]:
+            return
+        capacity, period = parse_rule(rule)
+        retry_after = self.buckets(scope).hit(key, capacity, period)
+        if retry_after:
+            raise RateLimited(retry_after=max(math.ceil(retry_after), 1))
+
+    def stats(self) -> dict[str, dict[str, int]]:
+        """
+        Return the counters of every limit.
+
+        Returns:
+            dict[str, dict[str, int]]: Allowed and rejected hits and the
+                number of tracked keys, by scope.
+        """
+        return {
+            scope: {
+                "allowed": buckets.allowed,
+                "rejected": buckets.rejected,
+                "keys": len(buckets),
+            }
+            for scope, buckets in list(self._limits().items())
+        }
@@ -0,0 +1,254 @@
+"""replicas.py"""
+from __future__ import annotations
+import itertools
+import threading
+import time
+from contextlib import contextmanager
+from typing import Any, Callable, Iterator, TypeVar
+from flask import Flask, current_app
+from flask_sqlalchemy import SQLAlchemy
+from flask_sqlalchemy.session import Session
+from sqlalchemy import Connection, Engine, Select, create_engine, event, text
+from sqlalchemy.engine import ExceptionContext
+from sqlalchemy.exc import DBAPIError
+from database import SQLitePragmas
+
+REPLICA_NAME_PREFIX = "replica"
+_T = TypeVar("_T")
+
+
+class _ReplicaState:
+    """The replica binds of one application and their health."""
+
+    def __init__(self, router: ReplicaRouter, engines: dict[str, Engine],
+                 retry_after: float) -> None:
+        self.router = router
+        self.engines = engines
+        self.names = list(engines)
+        self.retry_after = retry_after
+        self.counter = itertools.count()
+        self.lock = threading.Lock()
+        self.watched: set[str] = set()
+        # Monotonic time until which a replica is skipped; replicas start
+        # unchecked and are probed before their first use
+        self.down_until = dict.fromkeys(self.names, 0.0)
+        self.checked: set[str] = set()
+
+    def mark_down(self, name: str) -> None:
+        with self.lock:
+            self.down_until[name] = time.monotonic() + self.retry_after
+            self.checked.discard(name)
+
+    def is_down(self, engine: Engine) -> bool:
+        return any(self.engines[name] is engine
+                   and self.down_until[name] > time.monotonic()
+                   for name in self.names)
+
+
+class RoutingSession(Session):
+    """
+    A session that sends reads inside `ReplicaRouter.read_only` to replicas.
+
+    Only `SELECT` statements are routed, and only until the session writes:
+    once it has flushed or executed an `INSERT`, `UPDATE` or `DELETE`, every
+    later query of the request goes to the primary so that it sees its own
+    writes. Everything else uses Flask-SQLAlchemy's bind selection.
+
+    A read whose replica fails while it runs, and is taken out of rotation
+    for it, is retried on the next healthy replica or the primary rather
+    than failing the request.
+    """
+
+    def _with_failover(self, method: Callable[..., _T], *args: Any,
+                       **kwargs: Any) -> _T:
+        while True:
+            self.info.pop("replica", None)
+            try:
+                return method(*args, **kwargs)
+            except DBAPIError:
+                engine = self.info.pop("replica", None)
+                state: _ReplicaState | None = current_app.extensions.get(
+                    "replicas")
+                if engine is None or state is None or \
+                        not state.is_down(engine):
+                    raise
+                # Nothing was written, so only the failed replica
+                # connection is given up
+                self.rollback()
+
+    def execute(self, *args: Any, **kwargs: Any) -> Any:
+        return self._with_failover(super().execute, *args, **kwargs)
+
+    def scalar(self, *args: Any, **kwargs: Any) -> Any:
+        return self._with_failover(super().scalar, *args, **kwargs)
+
+    def scalars(self, *args: Any, **kwargs: Any) -> Any:
+        return self._with_failover(super().scalars, *args, **kwargs)
+
+    def get_bind(self,
+                 mapper: Any | None = None,
+                 clause: Any | None = None,
+                 bind: Engine | Connection | None = None,
+                 **kwargs: Any) -> Engine | Connection:
+        if bind is None:
+            if self._flushing or clause is not None and not isinstance(
+                    clause, Select):
+                self.info["wrote"] = True
+            elif self.info.get("read_only") and not self.info.get("wrote"):
+                state: _ReplicaState | None = current_app.extensions.get(
+                    "replicas")
+                engine = state.router.choose() if state is not None else None
+                if engine is not None:
+                    self.info["replica"] = engine
+                    return engine
+        return super().get_bind(mapper=mapper,
+                                clause=clause,
+                                bind=bind,
+                                **kwargs)
+
+
+class ReplicaRouter:
+    """
+    Read-replica routing for read-only queries.
+
+    An engine is created for each URI in `SQLALCHEMY_REPLICA_URIS`, with the
+    primary's engine options (and `SQLITE_PRAGMAS` for SQLite). Replicas
+    are not binds of `db`, so `create_all` and migrations only ever touch
+    the primary. Reads made inside `read_only()` are spread over the healthy
+    replicas round-robin. A replica whose connection
+    fails is skipped for `REPLICA_RETRY_AFTER` seconds and probed with
+    `SELECT 1` before it is used again, and the read that failed is retried;
+    with no healthy replica, reads go to the primary.
+
+    Replicas lag behind the primary, so only reads that tolerate slightly
+    stale data belong in `read_only()`.
+
+    Args:
+        db (SQLAlchemy): The Flask-SQLAlchemy extension, created with
+            `session_options={"class_": RoutingSession}`.
+        app (Flask | None): The Flask application object.
+    """
+
+    def __init__(self, db: SQLAlchemy, app: Flask | None = None) -> None:
+        self.db = db
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app: Flask) -> None:
+        """
+        Create the replica engines of an application.
+
+        Args:
+            app (Flask): The Flask application object.
+        """
+        app.config.setdefault("SQLALCHEMY_REPLICA_URIS", [])
+        app.config.setdefault("REPLICA_RETRY_AFTER", 30.0)
+        options = dict(app.config.get("SQLALCHEMY_ENGINE_OPTIONS") or {})
+        pragmas = dict(app.config.get("SQLITE_PRAGMAS") or {})
+        engines = {}
+        for index, uri in enumerate(app.config["SQLALCHEMY_REPLICA_URIS"]):
+            engine = create_engine(uri, **options)
+            if engine.dialect.name == "sqlite" and pragmas:
+                SQLitePragmas.listen(engine, pragmas)
+            engines[f"{REPLICA_NAME_PREFIX}{index}"] = engine
+        app.extensions["replicas"] = _ReplicaState(
+            self, engines, float(app.config["REPLICA_RETRY_AFTER"]))
+
+    @staticmethod
+    def _state() -> _ReplicaState:
+        state: _ReplicaState = current_app.extensions["replicas"]
+        return state
+
+    def engines(self) -> dict[str, Engine]:
+        """
+        Return the replica engines of the current application.
+
+        Returns:
+            dict[str, Engine]: The engines by replica name.
+        """
+        return self._state().engines
+
+    @property
+    def enabled(self) -> bool:
+        """Whether the current application has any replicas."""
+        return bool(self._state().names)
+
+    @contextmanager
+    def read_only(self) -> Iterator[None]:
+        """
+        Route the reads made inside the block to a replica.
+
+        Can be nested, and used as a decorator.
+        """
+        info = self.db.session().info
+        info["read_only"] = info.get("read_only", 0) + 1
+        try:
+            yield
+        finally:
+            info["read_only"] -= 1
+
+    def choose(self) -> Engine | None:
+        """
+        Pick the next healthy replica, round-robin.
+
+        Returns:
+            Engine | None: The replica engine, or `None` if none is healthy.
+        """
+        state = self._state()
+        if not state.names:
+            return None
+        start = next(state.counter)
+        for offset in range(len(state.names)):
+            name = state.names[(start + offset) % len(state.names)]
+            if state.down_until[name] > time.monotonic():
+                continue
+            engine = state.engines[name]
+            self._watch(state, name, engine)
+            if name in state.checked or self._probe(state, name, engine):
+                return engine
+        return None
+
+    def mark_down(self, name: str) -> None:
+        """
+        Skip a replica until `REPLICA_RETRY_AFTER` seconds have passed.
+
+        Args:
+            name (str): The name of the replica, e.g. `"replica0"`.
+        """
+        self._state().mark_down(name)
+
+    def health(self) -> dict[str, bool]:
+        """
+        Return whether each replica is currently in rotation.
+
+        Returns:
+            dict[str, bool]: Health by replica name.
+        """
+        state = self._state()
+        now = time.monotonic()
+        return {name: state.down_until[name] <= now for name in state.names}
+
+    def _probe(self, state: _ReplicaState, name: str, engine: Engine) -> bool:
+        try:
+            with engine.connect() as conn:
+                conn.execute(text("SELECT 1"))
+        except Exception:  # pylint: disable=broad-except
+            state.mark_down(name)
+            return False
+        with state.lock:
+            state.checked.add(name)
+        return True
+
+    def _watch(self, state: _ReplicaState, name: str, engine: Engine) -> None:
+        if name in state.watched:
+            return
+        with state.lock:
+            if name in state.watched:
+                return
+            state.watched.add(name)
+
+        def handle_error(context: ExceptionContext) -> None:
+            if context.is_disconnect or context.connection is None:
+                state.mark_down(name)
+
+        event.listen(engine, "handle_error", handle_error)
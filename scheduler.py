@@ -0,0 +1,514 @@
+"""scheduler.py"""
+from __future__ import annotations
+import os
+import random
+import socket
+import threading
+import time
+from dataclasses import dataclass
+from datetime import datetime, timedelta, timezone
+from typing import Any, Callable
+import click
+from flask import Flask, current_app
+from flask.cli import with_appcontext
+from sqlalchemy import insert, literal, select, text, update
+from sqlalchemy.exc import IntegrityError
+from extensions import db
+from lockout import as_utc, lockout
+from metrics import metrics
+from models import JobLease
+from sessions import session_store
+
+# A job returns the rows (or pages) it touched, or None if it does not
+# apply to the database
+JobFunction = Callable[[], int | None]
+
+
+@dataclass(frozen=True)
+class Job:
+    """
+    A periodic maintenance job.
+
+    Attributes:
+        name (str): The job name, also the name of its lease.
+        interval (float): Default seconds between runs, overridden by
+            `SCHEDULER_INTERVALS`.
+        function (JobFunction): The job, run in an application context.
+    """
+    name: str
+    interval: float
+    function: JobFunction
+
+
+@dataclass(frozen=True)
+class JobRun:
+    """
+    The outcome of one run of a job.
+
+    Attributes:
+        name (str): The job name.
+        started (datetime): When the run started.
+        duration (float): Seconds the run took.
+        rows (int | None): Rows (or pages) touched, or `None` if the job
+            does not apply to the database.
+        error (str | None): The error, if the job failed.
+    """
+    name: str
+    started: datetime
+    duration: float
+    rows: int | None
+    error: str | None = None
+
+    @property
+    def outcome(self) -> str:
+        """"success", "skipped" or "error"."""
+        if self.error is not None:
+            return "error"
+        return "skipped" if self.rows is None else "success"
+
+
+def worker_id() -> str:
+    """Identify this process across hosts, as "host:pid"."""
+    return f"{socket.gethostname()}:{os.getpid()}"
+
+
+def acquire_lease(name: str, holder: str, now: datetime,
+                  duration: timedelta) -> bool:
+    """
+    Take a job's lease if it is free or has expired.
+
+    The lease is taken by a single `UPDATE` guarded by its expiry, or by
+    inserting it the first time, so when several workers race for it only
+    one succeeds.
+
+    Args:
+        name (str): The job name.
+        holder (str): The worker taking the lease.
+        now (datetime): The current time.
+        duration (timedelta): How long to hold the lease.
+
+    Returns:
+        bool: `True` if this worker now holds the lease.
+    """
+    column_type = JobLease.expires.type
+    expires = literal(now + duration, column_type)
+    stmt = update(JobLease).where(
+        JobLease.name == name,
+        JobLease.expires <= literal(now, column_type)).values(
+            holder=holder, expires=expires).returning(
+                JobLease.name).execution_options(synchronize_session=False)
+    if db.session.execute(stmt).first() is not None:
+        db.session.commit()
+        return True
+    try:
+        db.session.execute(
+            insert(JobLease).values(name=name,
+                                    holder=holder,
+                                    expires=now + duration))
+        db.session.commit()
+    except IntegrityError:
+        # Held by another worker
+        db.session.rollback()
+        return False
+    return True
+
+
+def run_job(job: Job) -> JobRun:
+    """
+    Run a job, recording its outcome on its lease and in the metrics.
+
+    Args:
+        job (Job): The job.
+
+    Returns:
+        JobRun: The outcome.
+    """
+    started = datetime.now(timezone.utc)
+    clock = time.perf_counter()
+    rows = error = None
+    try:
+        rows = job.function()
+    except Exception as exc:  # pylint: disable=broad-except
+        db.session.rollback()
+        error = f"{type(exc).__name__}: {exc}"[:255]
+        current_app.logger.exception("Job %s failed", job.name)
+    run = JobRun(job.name, started, time.perf_counter() - clock, rows, error)
+    db.session.execute(
+        update(JobLease).where(JobLease.name == job.name).values(
+            last_started=started,
+            last_duration=run.duration,
+            last_rows=rows,
+            last_error=error).execution_options(synchronize_session=False))
+    db.session.commit()
+    metrics.observe_job(job.name, run.outcome, run.duration, rows or 0)
+    return run
+
+
+class _SchedulerState:
+    """The jobs of one application and this process's scheduler thread."""
+
+    def __init__(self, app: Flask, jobs: list[Job]) -> None:
+        self.app = app
+        self.jobs = jobs
+        self.lock = threading.Lock()
+        self.thread: threading.Thread | None = None
+        self.pid: int | None = None
+        self.stopping = threading.Event()
+        self.next_due: dict[str, float] = {}
+
+    def interval(self, job: Job) -> float:
+        intervals = self.app.config["SCHEDULER_INTERVALS"]
+        return float(intervals.get(job.name, job.interval))
+
+    def tick(self, now: datetime | None = None) -> list[JobRun]:
+        """Run the jobs that are due here and whose lease is free."""
+        runs = []
+        clock = time.monotonic()
+        holder = worker_id()
+        jitter = float(self.app.config["SCHEDULER_JITTER"])
+        for job in self.jobs:
+            interval = self.interval(job)
+            if interval <= 0 or self.next_due.get(job.name, 0) > clock:
+                continue
+            # Jittered, so workers that start together spread their checks
+            self.next_due[job.name] = clock + interval * random.uniform(
+                1 - jitter, 1 + jitter)
+            with self.app.app_context():
+                try:
+                    if acquire_lease(job.name, holder, now
+                                     or datetime.now(timezone.utc),
+                                     timedelta(seconds=interval)):
+                        runs.append(run_job(job))
+                finally:
+                    db.session.remove()
+        return runs
+
+    def wait(self) -> float:
+        """Seconds until the next job is due here."""
+        clock = time.monotonic()
+        due = [
+            self.next_due.get(job.name, clock) for job in self.jobs
+            if self.interval(job) > 0
+        ]
+        return max(min(due, default=60.0) - clock, 0.0)
+
+    def loop(self) -> None:
+        """Run due jobs until stopped."""
+        while not self.stopping.is_set():
+            try:
+                self.tick()
+            except Exception:  # pylint: disable=broad-except
+                # E.g. the database is unreachable; try again later
+                self.app.logger.exception("Scheduler tick failed")
+            self.stopping.wait(max(self.wait(), 1.0))
+
+    def running(self) -> bool:
+        """Whether this process's thread is running."""
+        thread = self.thread
+        return thread is not None and self.pid == os.getpid() \
+            and thread.is_alive()
+
+    def start(self) -> None:
+        """Start the thread, once per process."""
+        # Called before every request, so the lock is only taken to start it
+        if self.running():
+            return
+        with self.lock:
+            if self.running():
+                return
+            # A forked worker inherits the state but not the thread
+            self.pid = os.getpid()
+            self.stopping.clear()
+            self.next_due.clear()
+            self.thread = threading.Thread(target=self.loop,
+                                           name="scheduler",
+                                           daemon=True)
+            self.thread.start()
+
+    def stop(self) -> None:
+        """Stop the thread and wait for the job in progress."""
+        with self.lock:
+            thread, self.thread = self.thread, None
+        self.stopping.set()
+        if thread is not None:
+            thread.join()
+
+
+class Scheduler:
+    """
+    Periodic maintenance jobs, each run by one worker at a time.
+
+    Jobs are registered with the `job` decorator and run every
+    `SCHEDULER_INTERVALS[name]` seconds (their declared interval by
+    default, `0` to disable). Before running a job a worker takes the job's
+    lease in the `job_lease` table until the job is next due, so a job runs
+    once per interval across every worker and host sharing the database,
+    and the worker that runs it is whichever checks first. Each worker
+    checks on its own jittered schedule, `SCHEDULER_JITTER` being the
+    fraction of the interval by which it varies. Jobs must be idempotent:
+    a run that outlasts its interval can overlap the next one.
+
+    With `SCHEDULER_ENABLED`, each web worker starts a scheduler thread on
+    its first request; otherwise run `flask scheduler run` as a separate
+    process. Each run's duration and rows touched are kept on its lease
+    (see `flask scheduler status`) and exported as metrics.
+
+    Args:
+        app (Flask | None): The Flask application object.
+    """
+
+    def __init__(self, app: Flask | None = None) -> None:
+        self.jobs: list[Job] = []
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app: Flask) -> None:
+        """
+        Initialize the scheduler for an application.
+
+        Args:
+            app (Flask): The Flask application object.
+        """
+        app.config.setdefault("SCHEDULER_ENABLED", False)
+        app.config.setdefault("SCHEDULER_INTERVALS", {})
+        app.config.setdefault("SCHEDULER_JITTER", 0.1)
+        state = _SchedulerState(app, self.jobs)
+        app.extensions["scheduler"] = state
+        if app.config["SCHEDULER_ENABLED"] and \
+                app.config["APP_ROLE"] == "web":
+            app.before_request(state.start)
+
+    def job(self, name: str,
+            interval: float) -> Callable[[JobFunction], JobFunction]:
+        """
+        Register a periodic job.
+
+        Args:
+            name (str): The job name.
+            interval (float): Default seconds between runs.
+
+        Returns:
+            Callable: A decorator registering the function.
+        """
+
+        def decorator(function: JobFunction) -> JobFunction:
+            self.jobs.append(Job(name, interval, function))
+            return function
+
+        return decorator
+
+    @staticmethod
+    def _state() -> _SchedulerState:
+        state: _SchedulerState = current_app.extensions["scheduler"]
+        return state
+
+    def get(self, name: str) -> Job | None:
+        """
+        Return a registered job.
+
+        Args:
+            name (str): The job name.
+
+        Returns:
+            Job | None: The job, or `None` if there is none by that name.
+        """
+        return next((job for job in self.jobs if job.name == name), None)
+
+    def interval(self, job: Job) -> float:
+        """
+        Return the seconds between runs of a job in the current application.
+
+        Args:
+            job (Job): The job.
+
+        Returns:
+            float: The interval, `0` if the job is disabled.
+        """
+        return self._state().interval(job)
+
+    def tick(self, now: datetime | None = None) -> list[JobRun]:
+        """
+        Run the current application's jobs that are due.
+
+        Args:
+            now (datetime | None): The current time, defaults to now.
+
+        Returns:
+            list[JobRun]: The jobs this worker ran.
+        """
+        return self._state().tick(now)
+
+    def run(self) -> None:
+        """Run the current application's jobs in this thread until stopped."""
+        self._state().loop()
+
+    def start(self) -> None:
+        """Start the current application's scheduler thread."""
+        self._state().start()
+
+    def stop(self) -> None:
+        """Stop the current application's scheduler thread."""
+        self._state().stop()
+
+
+scheduler = Scheduler()
+
+# Free pages returned to the filesystem per incremental vacuum run
+VACUUM_PAGES = 4096
+
+
+def _dialect() -> str:
+    name: str = db.engine.dialect.name
+    return name
+
+
+@scheduler.job("clear_expired_lockouts", 300)
+def clear_expired_lockouts() -> int | None:
+    """Reset the failed attempts of accounts whose lockout has ended."""
+    return sum(lockout.reset_many(expired=True))
+
+
+@scheduler.job("expire_sessions", 300)
+def expire_sessions() -> int | None:
+    """Delete expired server-side sessions, or `None` with cookie sessions."""
+    if current_app.config["SESSION_BACKEND"] == "cookie":
+        return None
+    return sum(session_store.expire())
+
+
+@scheduler.job("wal_checkpoint", 300)
+def wal_checkpoint() -> int | None:
+    """
+    Copy the SQLite write-ahead log into the database and truncate it.
+
+    Returns the frames checkpointed, or `None` if the database is not a
+    SQLite database in WAL mode.
+    """
+    if _dialect() != "sqlite":
+        return None
+    row: Any = db.session.execute(
+        text("PRAGMA wal_checkpoint(TRUNCATE)")).one()
+    # (busy, frames in the log, frames checkpointed), -1 if not in WAL mode
+    if row[1] < 0:
+        return None
+    count: int = row[2]
+    return count
+
+
+@scheduler.job("optimize", 3600)
+def optimize() -> int | None:
+    """
+    Refresh the query planner's statistics.
+
+    SQLite's `PRAGMA optimize` only analyzes the tables whose statistics
+    are out of date; other databases run `ANALYZE`.
+    """
+    if _dialect() == "sqlite":
+        db.session.execute(text("PRAGMA optimize"))
+    else:
+        db.session.execute(text("ANALYZE"))
+    db.session.commit()
+    return 0
+
+
+@scheduler.job("incremental_vacuum", 3600)
+def incremental_vacuum() -> int | None:
+    """
+    Return the free pages of a SQLite database to the filesystem.
+
+    Returns the pages freed, or `None` unless the database uses
+    `auto_vacuum=INCREMENTAL`.
+    """
+    if _dialect() != "sqlite" or db.session.execute(
+            text("PRAGMA auto_vacuum")).scalar() != 2:
+        return None
+    before = int(db.session.execute(text("PRAGMA freelist_count")).scalar()
+                 or 0)
+    # The PRAGMA frees a page each time it is stepped, and sqlite3 steps
+    # a statement once per execute, or once per parameter set in
+    # executemany; capped so that writers are not held up for long
+    pages = min(before, VACUUM_PAGES)
+    if pages:
+        db.session().connection().exec_driver_sql("PRAGMA incremental_vacuum",
+                                                  [()] * pages)
+    db.session.commit()
+    after = db.session.execute(text("PRAGMA freelist_count")).scalar()
+    return before - int(after or 0)
+
+
+scheduler_cli = click.Group("scheduler",
+                            help="Run the maintenance job scheduler.")
+
+
+@scheduler_cli.command("run")
+@with_appcontext
+def run_scheduler() -> None:
+    """Run due jobs in this process until interrupted."""
+    names = ", ".join(job.name for job in scheduler.jobs
+                      if scheduler.interval(job) > 0)
+    click.echo(f"Scheduling {names} as {worker_id()}")
+    try:
+        scheduler.run()
+    except KeyboardInterrupt:
+        pass
+
+
+@scheduler_cli.command("run-job")
+@click.argument("name")
+@click.option("--force",
+              is_flag=True,
+              help="Run even if another worker holds the job's lease.")
+@with_appcontext
+def run_one_job(name: str, force: bool) -> None:
+    """Run the job NAME now, whether or not it is due."""
+    job = scheduler.get(name)
+    if job is None:
+        raise click.ClickException(
+            f"Unknown job {name!r}; expected one of "
+            f"{', '.join(job.name for job in scheduler.jobs)}")
+    if not acquire_lease(name, worker_id(), datetime.now(timezone.utc),
+                         timedelta(seconds=scheduler.interval(job))):
+        lease = db.session.get(JobLease, name)
+        holder = "another worker" if lease is None else (
+            f"{lease.holder} until {as_utc(lease.expires):%Y-%m-%d %H:%M:%S}")
+        if not force:
+            raise click.ClickException(
+                f"{name} is leased by {holder}; it may be running there. "
+                "Use --force to run it anyway.")
+        click.echo(f"{name} is leased by {holder}; running it anyway")
+    run = run_job(job)
+    if run.error is not None:
+        raise click.ClickException(f"{name} failed: {run.error}")
+    rows = "-" if run.rows is None else run.rows
+    click.echo(f"{name}: {run.outcome} in {run.duration * 1000:.1f} ms, "
+               f"{rows} rows")
+
+
+@scheduler_cli.command("status")
+@with_appcontext
+def scheduler_status() -> None:
+    """Show when each job last ran and what it did."""
+    leases = {
+        lease.name: lease
+        for lease in db.session.execute(select(JobLease)).scalars()
+    }
+    click.echo(f"{'job':<24} {'interval':>8} {'last run':<19} {'ms':>8} "
+               f"{'rows':>8} {'next due':<19} holder")
+    for job in scheduler.jobs:
+        lease = leases.get(job.name)
+        fields: list[Any] = ["-"] * 5
+        if lease is not None:
+            started = as_utc(lease.last_started)
+            if started is not None:
+                fields[0] = f"{started:%Y-%m-%d %H:%M:%S}"
+            if lease.last_duration is not None:
+                fields[1] = f"{lease.last_duration * 1000:.1f}"
+            if lease.last_error is not None:
+                fields[2] = "error"
+            elif lease.last_rows is not None:
+                fields[2] = lease.last_rows
+            fields[3] = f"{as_utc(lease.expires):%Y-%m-%d %H:%M:%S}"
+            fields[4] = lease.holder
+        click.echo(f"{job.name:<24} {scheduler.interval(job):>8.0f} "
+                   f"{fields[0]:<19} {fields[1]:>8} {fields[2]:>8} "
+                   f"{fields[3]:<19} {fields[4]}")
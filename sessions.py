@@ -0,0 +1,576 @@
+"""sessions.py"""
+from __future__ import annotations
+import hashlib
+import secrets
+import threading
+from abc import ABC, abstractmethod
+from dataclasses import dataclass, replace
+from datetime import datetime, timezone
+from typing import Any, Iterator
+import click
+from flask import Flask, current_app, request, session
+from flask.sessions import (SecureCookieSession,
+                            SecureCookieSessionInterface, SessionInterface,
+                            session_json_serializer)
+from flask.cli import with_appcontext
+from sqlalchemy import delete, insert, literal, select, update
+from flask.wrappers import Request, Response
+from itsdangerous import BadSignature
+from caching import TTLCache
+from compression import add_vary
+from extensions import db
+from lockout import as_utc
+from models import User, UserSession
+
+BACKENDS = ("database", "memory", "cookie")
+# What the sessions of visitors who are not logged in hold: Flask-WTF's CSRF
+# token, and Flask-Login marking the session as not fresh
+ANONYMOUS_KEYS = frozenset({"csrf_token", "_fresh"})
+
+
+def session_key(sid: str) -> str:
+    """
+    Return the key a session is stored under: the SHA-256 of its ID.
+
+    Args:
+        sid (str): The session ID, as sent in the cookie.
+
+    Returns:
+        str: The key, as 64 hex digits.
+    """
+    return hashlib.sha256(sid.encode()).hexdigest()
+
+
+@dataclass(frozen=True)
+class StoredSession:
+    """
+    A session as stored by a backend and cached by the workers.
+
+    The data is kept serialized, so that a request changing its session in
+    place cannot change the cached copy.
+
+    Attributes:
+        payload (str): The session data, serialized as tagged JSON.
+        version (int): Incremented on every write.
+        user_id (int | None): The logged in user.
+        expires (datetime): When the session expires.
+    """
+    payload: str
+    version: int
+    user_id: int | None
+    expires: datetime
+
+
+class SessionBackend(ABC):
+    """
+    Durable storage for server-side sessions.
+
+    Sessions are stored by key and written with `create` or `update` as a
+    whole; `update` never recreates a session that has been revoked.
+    """
+
+    @abstractmethod
+    def load(self, key: str) -> StoredSession | None:
+        """
+        Return a stored session.
+
+        Args:
+            key (str): The session key.
+
+        Returns:
+            StoredSession | None: The session, or `None` if there is none.
+        """
+
+    @abstractmethod
+    def create(self, key: str, stored: StoredSession) -> None:
+        """
+        Store a new session.
+
+        Args:
+            key (str): The session key.
+            stored (StoredSession): The session.
+        """
+
+    @abstractmethod
+    def update(self, key: str, stored: StoredSession) -> bool:
+        """
+        Replace a stored session.
+
+        Args:
+            key (str): The session key.
+            stored (StoredSession): The session.
+
+        Returns:
+            bool: `False` if the session no longer exists.
+        """
+
+    @abstractmethod
+    def delete(self, keys: list[str]) -> None:
+        """
+        Delete sessions.
+
+        Args:
+            keys (list[str]): The session keys.
+        """
+
+    @abstractmethod
+    def delete_user(self, user_id: int, keep: str | None) -> list[str]:
+        """
+        Delete all of a user's sessions.
+
+        Args:
+            user_id (int): The ID of the user.
+            keep (str | None): The key of a session to keep.
+
+        Returns:
+            list[str]: The keys of the sessions deleted.
+        """
+
+    @abstractmethod
+    def expire(self, now: datetime, chunk_size: int) -> Iterator[list[str]]:
+        """
+        Delete the sessions that have expired, in chunks.
+
+        Args:
+            now (datetime): The current time.
+            chunk_size (int): Sessions deleted per chunk.
+
+        Yields:
+            list[str]: The keys of the sessions deleted by each chunk.
+        """
+
+
+class DatabaseSessionBackend(SessionBackend):
+    """
+    Keeps sessions in the `user_session` table.
+
+    Every operation is a single statement on its own connection from the
+    primary engine, so saving a session never commits the request's ORM
+    session, and a session written by one request is read by the next
+    even when reads go to replicas.
+    """
+
+    def load(self, key: str) -> StoredSession | None:
+        with db.engine.connect() as conn:
+            row = conn.execute(
+                select(UserSession.payload, UserSession.version,
+                       UserSession.user_id, UserSession.expires).where(
+                           UserSession.key == key)).first()
+        if row is None:
+            return None
+        expires = as_utc(row.expires)
+        assert expires is not None
+        return StoredSession(row.payload, row.version, row.user_id, expires)
+
+    def create(self, key: str, stored: StoredSession) -> None:
+        with db.engine.begin() as conn:
+            conn.execute(
+                insert(UserSession).values(key=key,
+                                           payload=stored.payload,
+                                           version=stored.version,
+                                           user_id=stored.user_id,
+                                           expires=stored.expires))
+
+    def update(self, key: str, stored: StoredSession) -> bool:
+        with db.engine.begin() as conn:
+            row = conn.execute(
+                update(UserSession).where(UserSession.key == key).values(
+                    payload=stored.payload,
+                    version=stored.version,
+                    user_id=stored.user_id,
+                    expires=stored.expires).returning(
+                        UserSession.key)).first()
+        return row is not None
+
+    def delete(self, keys: list[str]) -> None:
+        if keys:
+            with db.engine.begin() as conn:
+                conn.execute(
+                    delete(UserSession).where(UserSession.key.in_(keys)))
+
+    def delete_user(self, user_id: int, keep: str | None) -> list[str]:
+        stmt = delete(UserSession).where(UserSession.user_id == user_id)
+        if keep is not None:
+            stmt = stmt.where(UserSession.key != keep)
+        with db.engine.begin() as conn:
+            return list(
+                conn.execute(stmt.returning(UserSession.key)).scalars())
+
+    def expire(self, now: datetime, chunk_size: int) -> Iterator[list[str]]:
+        # One DELETE per chunk, picking the rows through the expires index,
+        # so each write lock is held briefly
+        expired = UserSession.expires <= literal(now,
+                                                 UserSession.expires.type)
+        while True:
+            chunk = select(UserSession.key).where(expired).limit(chunk_size)
+            with db.engine.begin() as conn:
+                keys = list(
+                    conn.execute(
+                        delete(UserSession).where(
+                            UserSession.key.in_(chunk)).returning(
+                                UserSession.key)).scalars())
+            if not keys:
+                return
+            yield keys
+            if len(keys) < chunk_size:
+                return
+
+
+class MemorySessionBackend(SessionBackend):
+    """
+    Keeps sessions in process memory, guarded by a lock.
+
+    Every process keeps its own sessions, so this backend is meant for
+    single-process deployments and tests.
+    """
+
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self._sessions: dict[str, StoredSession] = {}
+
+    def load(self, key: str) -> StoredSession | None:
+        return self._sessions.get(key)
+
+    def create(self, key: str, stored: StoredSession) -> None:
+        with self._lock:
+            self._sessions[key] = stored
+
+    def update(self, key: str, stored: StoredSession) -> bool:
+        with self._lock:
+            if key not in self._sessions:
+                return False
+            self._sessions[key] = stored
+            return True
+
+    def delete(self, keys: list[str]) -> None:
+        with self._lock:
+            for key in keys:
+                self._sessions.pop(key, None)
+
+    def delete_user(self, user_id: int, keep: str | None) -> list[str]:
+        with self._lock:
+            keys = [
+                key for key, stored in self._sessions.items()
+                if stored.user_id == user_id and key != keep
+            ]
+            for key in keys:
+                del self._sessions[key]
+        return keys
+
+    def expire(self, now: datetime, chunk_size: int) -> Iterator[list[str]]:
+        with self._lock:
+            expired = [
+                key for key, stored in self._sessions.items()
+                if stored.expires <= now
+            ]
+        for start in range(0, len(expired), chunk_size):
+            keys = expired[start:start + chunk_size]
+            self.delete(keys)
+            yield keys
+
+
+class ServerSession(SecureCookieSession):
+    """
+    A session whose data is kept on the server.
+
+    Args:
+        initial (dict[str, Any] | None): The session data.
+        sid (str | None): The session ID, `None` until it is first saved.
+        stored (StoredSession | None): The session as it was loaded.
+    """
+
+    def __init__(self,
+                 initial: dict[str, Any] | None = None,
+                 sid: str | None = None,
+                 stored: StoredSession | None = None) -> None:
+        super().__init__(initial)
+        self.sid = sid
+        self.stored = stored
+
+
+class _SessionState:
+    """The backend and cache tier of one application."""
+
+    def __init__(self, backend: SessionBackend,
+                 cache: TTLCache[str, StoredSession]) -> None:
+        self.backend = backend
+        self.cache = cache
+
+    def load(self, key: str, version: str) -> StoredSession | None:
+        """Return a session from the cache if current, else the backend."""
+        stored = self.cache.get(key)
+        if stored is not None and str(stored.version) == version:
+            return stored
+        stored = self.backend.load(key)
+        if stored is not None:
+            self.cache.set(key, stored)
+        return stored
+
+    def delete(self, keys: list[str]) -> None:
+        """Delete sessions from the backend and this worker's cache."""
+        self.backend.delete(keys)
+        for key in keys:
+            self.cache.invalidate(key)
+
+
+def _user_id(data: ServerSession) -> int | None:
+    # Flask-Login keeps the logged in user's ID as a string
+    user_id = dict.get(data, "_user_id")
+    return int(user_id) if isinstance(user_id, str) and \
+        user_id.isdigit() else None
+
+
+class ServerSessionInterface(SessionInterface):
+    """
+    Keeps the session data on the server and an opaque ID in the cookie.
+
+    The cookie holds a random session ID and the version of the session,
+    `<id>.<version>`. The data is looked up by the SHA-256 of the ID, first
+    in the worker's LRU cache, used only if its version matches the
+    cookie's (so a session written by another worker is never read stale),
+    then in the backend. Nothing is written unless the session changed or
+    is past half its lifetime, and the ID is replaced when the logged in
+    user changes, so a session ID set before login cannot be reused.
+
+    A session holding nothing but `ANONYMOUS_KEYS` is kept in a signed
+    cookie instead, as with the "cookie" backend, so that visitors and bots
+    fetching the login and registration forms add no rows. Server cookies
+    are told apart by their `<id>.<version>` shape.
+    """
+    serializer = session_json_serializer
+    session_class = ServerSession
+    signed = SecureCookieSessionInterface()
+
+    @staticmethod
+    def _state(app: Flask) -> _SessionState:
+        state: _SessionState = app.extensions["session_store"]
+        return state
+
+    def open_session(  # type: ignore[override]
+            self, app: Flask, request: Request) -> ServerSession:
+        cookie = request.cookies.get(app.config["SESSION_COOKIE_NAME"])
+        if not cookie:
+            return ServerSession()
+        sid, _, version = cookie.partition(".")
+        if not version.isdigit():
+            return self._open_signed(app, cookie)
+        stored = self._state(app).load(session_key(sid), version)
+        if stored is None or stored.expires <= datetime.now(timezone.utc):
+            # Revoked or expired: start over, replacing the cookie
+            fresh = ServerSession()
+            fresh.modified = True
+            return fresh
+        return ServerSession(self.serializer.loads(stored.payload), sid,
+                             stored)
+
+    def _open_signed(self, app: Flask, cookie: str) -> ServerSession:
+        signer = self.signed.get_signing_serializer(app)
+        if signer is not None:
+            try:
+                return ServerSession(
+                    signer.loads(cookie,
+                                 max_age=int(app.permanent_session_lifetime.
+                                             total_seconds())))
+            except BadSignature:
+                pass
+        # Tampered with or expired: start over, replacing the cookie
+        fresh = ServerSession()
+        fresh.modified = True
+        return fresh
+
+    def _set_cookie(self, app: Flask, session: ServerSession,
+                    response: Response, value: str) -> None:
+        response.set_cookie(app.config["SESSION_COOKIE_NAME"],
+                            value,
+                            expires=self.get_expiration_time(app, session),
+                            httponly=self.get_cookie_httponly(app),
+                            domain=self.get_cookie_domain(app),
+                            path=self.get_cookie_path(app),
+                            secure=self.get_cookie_secure(app),
+                            samesite=self.get_cookie_samesite(app))
+        add_vary(response, "Cookie")
+
+    def save_session(self, app: Flask, session: ServerSession,
+                     response: Response) -> None:
+        name = app.config["SESSION_COOKIE_NAME"]
+        domain = self.get_cookie_domain(app)
+        path = self.get_cookie_path(app)
+        if session.accessed:
+            add_vary(response, "Cookie")
+        state = self._state(app)
+        stored = session.stored
+        key = session_key(session.sid) if session.sid else None
+
+        if not session:
+            if key is not None:
+                state.delete([key])
+            if session.modified or key is not None:
+                response.delete_cookie(name, domain=domain, path=path)
+                add_vary(response, "Cookie")
+            return
+
+        signer = self.signed.get_signing_serializer(app)
+        if signer is not None and ANONYMOUS_KEYS.issuperset(session):
+            if key is not None:
+                # E.g. after logging out
+                state.delete([key])
+                session.sid = session.stored = None
+            elif not session.modified:
+                return
+            self._set_cookie(app, session, response,
+                             signer.dumps(dict(session)))
+            return
+
+        now = datetime.now(timezone.utc)
+        lifetime = app.permanent_session_lifetime
+        stale = stored is not None and \
+            app.config["SESSION_REFRESH_EACH_REQUEST"] and \
+            stored.expires - now < lifetime / 2
+        if not session.modified and not stale:
+            return
+
+        user_id = _user_id(session)
+        new = StoredSession(self.serializer.dumps(dict(session)), 1, user_id,
+                            now + lifetime)
+        if key is None or stored is None or stored.user_id != user_id:
+            if key is not None:
+                state.delete([key])
+            session.sid = secrets.token_urlsafe(32)
+            key = session_key(session.sid)
+            state.backend.create(key, new)
+        else:
+            new = replace(new, version=stored.version + 1)
+            if not state.backend.update(key, new):
+                # Revoked while this request ran
+                state.cache.invalidate(key)
+                response.delete_cookie(name, domain=domain, path=path)
+                add_vary(response, "Cookie")
+                return
+        state.cache.set(key, new)
+        session.stored = new
+        self._set_cookie(app, session, response,
+                         f"{session.sid}.{new.version}")
+
+
+class SessionStore:
+    """
+    Server-side sessions with an in-process cache tier.
+
+    With `SESSION_BACKEND` "database" (the `user_session` table) or
+    "memory", the session data stays on the server and the cookie only
+    carries an opaque ID, so requests skip verifying a signature over the
+    whole cookie, the cookie does not grow with the session, and sessions
+    can be revoked. Each worker caches up to `SESSION_CACHE_SIZE` sessions;
+    a revoked session is dropped at once from the revoking worker's cache,
+    and after at most `SESSION_CACHE_TTL` seconds from the others'.
+    Sessions expire `PERMANENT_SESSION_LIFETIME` after they were last
+    written, and the scheduler's `expire_sessions` job deletes expired
+    sessions in chunks of `SESSION_EXPIRE_CHUNK_SIZE`. "cookie" keeps
+    Flask's signed cookie sessions.
+
+    Args:
+        app (Flask | None): The Flask application object.
+    """
+
+    def __init__(self, app: Flask | None = None) -> None:
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app: Flask) -> None:
+        """
+        Install the session interface of an application.
+
+        Args:
+            app (Flask): The Flask application object.
+        """
+        app.config.setdefault("SESSION_BACKEND", "database")
+        app.config.setdefault("SESSION_CACHE_SIZE", 10000)
+        app.config.setdefault("SESSION_CACHE_TTL", 10.0)
+        app.config.setdefault("SESSION_EXPIRE_CHUNK_SIZE", 1000)
+        name = app.config["SESSION_BACKEND"]
+        backend: SessionBackend
+        if name == "database":
+            backend = DatabaseSessionBackend()
+        elif name == "memory":
+            backend = MemorySessionBackend()
+        elif name == "cookie":
+            return
+        else:
+            raise ValueError(f"Unknown SESSION_BACKEND {name!r}; expected "
+                             f"one of {', '.join(BACKENDS)}")
+        app.extensions["session_store"] = _SessionState(
+            backend,
+            TTLCache(int(app.config["SESSION_CACHE_SIZE"]),
+                     float(app.config["SESSION_CACHE_TTL"])))
+        app.session_interface = ServerSessionInterface()
+
+    @staticmethod
+    def _state() -> _SessionState | None:
+        state: _SessionState | None = current_app.extensions.get(
+            "session_store")
+        return state
+
+    def revoke_user(self, user_id: int) -> int:
+        """
+        Revoke all of a user's sessions, except the current request's.
+
+        Args:
+            user_id (int): The ID of the user.
+
+        Returns:
+            int: The number of sessions revoked.
+        """
+        state = self._state()
+        if state is None:
+            return 0
+        # An unbound request proxy is false outside of requests
+        sid = getattr(session, "sid", None) if request else None
+        keys = state.backend.delete_user(
+            user_id,
+            session_key(sid) if sid is not None else None)
+        for key in keys:
+            state.cache.invalidate(key)
+        return len(keys)
+
+    def expire(self, now: datetime | None = None) -> Iterator[int]:
+        """
+        Delete the sessions that have expired, in chunks.
+
+        Args:
+            now (datetime | None): The current time, defaults to now.
+
+        Yields:
+            int: The number of sessions deleted by each chunk.
+        """
+        state = self._state()
+        if state is None:
+            return
+        chunk_size = int(current_app.config["SESSION_EXPIRE_CHUNK_SIZE"])
+        for keys in state.backend.expire(now or datetime.now(timezone.utc),
+                                         chunk_size):
+            for key in keys:
+                state.cache.invalidate(key)
+            yield len(keys)
+
+    def stats(self) -> dict[str, int]:
+        """Return the counters of the current application's cache tier."""
+        state = self._state()
+        return state.cache.stats() if state is not None else {}
+
+
+session_store = SessionStore()
+
+
+sessions_cli = click.Group("sessions", help="Manage server-side sessions.")
+
+
+@sessions_cli.command("revoke")
+@click.argument("username")
+@with_appcontext
+def revoke_sessions(username: str) -> None:
+    """Log USERNAME out everywhere, e.g. after a password change."""
+    user_id = db.session.execute(
+        select(User.id).where(User.username == username)).scalar()
+    if user_id is None:
+        raise click.ClickException(f"No user named {username!r}")
+    click.echo(f"Revoked {session_store.revoke_user(user_id)} sessions")
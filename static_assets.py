@@ -0,0 +1,346 @@
+"""static_assets.py"""
+from __future__ import annotations
+import gzip
+import hashlib
+import json
+import mimetypes
+import os
+from dataclasses import asdict, dataclass
+from typing import TYPE_CHECKING, Any, Iterable
+import click
+from flask import Flask, current_app, url_for
+from flask.cli import with_appcontext
+from werkzeug.http import parse_accept_header
+from werkzeug.wrappers import Response
+from werkzeug.wsgi import wrap_file
+
+if TYPE_CHECKING:
+    from _typeshed.wsgi import (StartResponse, WSGIApplication,
+                                WSGIEnvironment)
+
+URL_PATH = "/assets"
+MANIFEST = "manifest.json"
+ONE_YEAR = 365 * 24 * 60 * 60
+
+COMPRESSIBLE_TYPES = frozenset({
+    "application/javascript", "application/json", "application/xml",
+    "image/svg+xml", "text/javascript"
+})
+
+
+@dataclass(frozen=True)
+class Asset:
+    """
+    A fingerprinted static file.
+
+    Attributes:
+        path (str): Where the file is stored and served, relative to
+            `STATIC_ASSETS_DIR` and `/assets`.
+        digest (str): The start of the SHA-256 of the file's content.
+        size (int): Size of the file, in bytes.
+        gzip_size (int | None): Size of its gzip variant, or `None` if it is
+            not compressed.
+    """
+    path: str
+    digest: str
+    size: int
+    gzip_size: int | None = None
+
+
+def static_folders(app: Flask) -> dict[str, str]:
+    """
+    Map the static endpoint of the application and each blueprint to its
+    static folder, for those that have one.
+
+    Args:
+        app (Flask): The Flask application object.
+
+    Returns:
+        dict[str, str]: Static folders by endpoint, e.g. "auth.static".
+    """
+    folders: dict[str, str] = {}
+    if app.static_folder and os.path.isdir(app.static_folder):
+        folders["static"] = app.static_folder
+    for name, blueprint in app.blueprints.items():
+        folder = blueprint.static_folder
+        if folder and os.path.isdir(folder):
+            folders[f"{name}.static"] = folder
+    return folders
+
+
+def compressible(filename: str) -> bool:
+    """
+    Check whether a file's type is worth compressing.
+
+    Args:
+        filename (str): The file name.
+
+    Returns:
+        bool: `True` for text, scripts, JSON, XML and SVG.
+    """
+    mimetype = mimetypes.guess_type(filename)[0] or ""
+    return mimetype.startswith("text/") or mimetype in COMPRESSIBLE_TYPES
+
+
+def fingerprint(filename: str, digest: str) -> str:
+    """
+    Insert a digest before a file name's extension.
+
+    Args:
+        filename (str): The file name, e.g. "js/app.js".
+        digest (str): The content digest.
+
+    Returns:
+        str: The fingerprinted name, e.g. "js/app.0123456789ab.js".
+    """
+    root, extension = os.path.splitext(filename)
+    return f"{root}.{digest}{extension}"
+
+
+def build(app: Flask) -> dict[str, dict[str, Asset]]:
+    """
+    Fingerprint and precompress every static file and write the manifest.
+
+    Each file is copied into `STATIC_ASSETS_DIR` under a name that includes
+    a digest of its content, with a `.gz` variant next to it if its type is
+    compressible and compressing makes it smaller. Files from earlier builds
+    are left in place, so pages rendered by workers still running the old
+    manifest keep working during a deploy.
+
+    Args:
+        app (Flask): The Flask application object.
+
+    Returns:
+        dict[str, dict[str, Asset]]: The manifest: assets by file name, by
+            static endpoint.
+
+    Raises:
+        RuntimeError: If `STATIC_ASSETS_DIR` is not set.
+    """
+    directory = app.config["STATIC_ASSETS_DIR"]
+    if not directory:
+        raise RuntimeError("STATIC_ASSETS_DIR is not set")
+    directory = os.path.join(app.root_path, directory)
+    manifest: dict[str, dict[str, Asset]] = {}
+    for endpoint, folder in static_folders(app).items():
+        owner = endpoint.rpartition(".")[0] or "app"
+        assets = manifest[endpoint] = {}
+        for parent, _, files in os.walk(folder):
+            for name in sorted(files):
+                source = os.path.join(parent, name)
+                filename = os.path.relpath(source, folder).replace(os.sep, "/")
+                with open(source, "rb") as file:
+                    content = file.read()
+                digest = hashlib.sha256(content).hexdigest()[:12]
+                path = f"{owner}/{fingerprint(filename, digest)}"
+                target = os.path.join(directory, path)
+                os.makedirs(os.path.dirname(target), exist_ok=True)
+                _write(target, content)
+                gzip_size = None
+                if compressible(filename):
+                    # mtime=0 makes the output depend on the content only
+                    compressed = gzip.compress(content, 9, mtime=0)
+                    if len(compressed) < len(content):
+                        _write(f"{target}.gz", compressed)
+                        gzip_size = len(compressed)
+                assets[filename] = Asset(path, digest, len(content),
+                                         gzip_size)
+    _write(
+        os.path.join(directory, MANIFEST),
+        json.dumps(
+            {
+                endpoint: {
+                    filename: asdict(asset)
+                    for filename, asset in sorted(assets.items())
+                }
+                for endpoint, assets in manifest.items()
+            },
+            indent=4).encode() + b"\n")
+    return manifest
+
+
+def _write(path: str, content: bytes) -> None:
+    # Through a temporary file, so a running worker never serves half a file
+    temporary = f"{path}.{os.getpid()}.tmp"
+    with open(temporary, "wb") as file:
+        file.write(content)
+    os.replace(temporary, path)
+
+
+class AssetMiddleware:
+    """
+    WSGI middleware serving fingerprinted files ahead of the application.
+
+    Requests for paths in the manifest never reach Flask, so they open no
+    session (which would add `Vary: Cookie` and keep shared caches from
+    storing them) and run no request hooks. Anything else, including paths
+    missing from the manifest, is passed on to the application.
+
+    Args:
+        wsgi_app (WSGIApplication): The application to wrap.
+        directory (str): Where the fingerprinted files are stored.
+        manifest (dict[str, dict[str, Asset]]): Assets by file name, by
+            static endpoint.
+    """
+
+    def __init__(self, wsgi_app: WSGIApplication, directory: str,
+                 manifest: dict[str, dict[str, Asset]]) -> None:
+        self.wsgi_app = wsgi_app
+        self.directory = directory
+        self.manifest = manifest
+        self.paths = {
+            asset.path: asset
+            for assets in manifest.values()
+            for asset in assets.values()
+        }
+
+    def __call__(self, environ: WSGIEnvironment,
+                 start_response: StartResponse) -> Iterable[bytes]:
+        path: str = environ.get("PATH_INFO", "")
+        asset = None
+        if (path.startswith(f"{URL_PATH}/")
+                and environ["REQUEST_METHOD"] in ("GET", "HEAD")):
+            asset = self.paths.get(path[len(URL_PATH) + 1:])
+        if asset is None:
+            return self.wsgi_app(environ, start_response)
+        body: Iterable[bytes] = self.respond(environ, asset)(environ,
+                                                             start_response)
+        return body
+
+    def respond(self, environ: WSGIEnvironment, asset: Asset) -> Response:
+        """
+        Build the response for an asset, gzipped if the client accepts it.
+
+        Args:
+            environ (WSGIEnvironment): The request's WSGI environment.
+            asset (Asset): The requested asset.
+
+        Returns:
+            Response: The file, cacheable for a year, or a 304 if the
+            client's copy is current.
+        """
+        encoded = (asset.gzip_size is not None and parse_accept_header(
+            environ.get("HTTP_ACCEPT_ENCODING"))["gzip"] > 0)
+        response = Response(mimetype=mimetypes.guess_type(asset.path)[0]
+                            or "application/octet-stream")
+        response.set_etag(f"{asset.digest}-gzip" if encoded else asset.digest)
+        response.cache_control.public = True
+        response.cache_control.max_age = ONE_YEAR
+        response.cache_control.immutable = True
+        if asset.gzip_size is not None:
+            response.headers["Vary"] = "Accept-Encoding"
+        if encoded:
+            response.headers["Content-Encoding"] = "gzip"
+        response.make_conditional(environ)
+        if response.status_code == 200:
+            filename = os.path.join(self.directory, asset.path)
+            if encoded:
+                filename += ".gz"
+            response.content_length = os.path.getsize(filename)
+            if environ["REQUEST_METHOD"] == "GET":
+                # pylint: disable-next=consider-using-with
+                response.response = wrap_file(environ, open(filename, "rb"))
+                response.direct_passthrough = True
+        return response
+
+
+class StaticAssets:
+    """
+    Fingerprinted, precompressed static files with immutable caching.
+
+    `flask assets build` copies the files of every static folder into
+    `STATIC_ASSETS_DIR` under names that include a digest of their content,
+    gzips the compressible ones ahead of time, and writes a manifest. When
+    a manifest is found, the `asset_url` template global, which takes the
+    same arguments as `url_for` for a static file, returns the
+    fingerprinted URL under `/assets`, and `AssetMiddleware` serves those
+    URLs. They change whenever the content does, so they are served with
+    `Cache-Control: immutable` and a one year `max-age`; clients that
+    accept gzip get the compressed variant, and nothing is compressed while
+    serving. Without a manifest, as in development, `asset_url` falls back
+    to the plain static URL.
+
+    The extension must be initialized after the blueprints are registered.
+
+    Args:
+        app (Flask | None): The Flask application object.
+    """
+
+    def __init__(self, app: Flask | None = None) -> None:
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app: Flask) -> None:
+        """
+        Load the manifest and serve the fingerprinted files of an application.
+
+        Args:
+            app (Flask): The Flask application object.
+        """
+        app.config.setdefault("STATIC_ASSETS_DIR",
+                              os.path.join(app.instance_path, "assets"))
+        app.add_template_global(self.asset_url, "asset_url")
+        directory = app.config["STATIC_ASSETS_DIR"]
+        manifest_path = os.path.join(directory or "", MANIFEST)
+        if not directory or not os.path.exists(manifest_path):
+            return
+        with open(manifest_path, encoding="utf-8") as file:
+            manifest = {
+                endpoint: {
+                    filename: Asset(**asset)
+                    for filename, asset in assets.items()
+                }
+                for endpoint, assets in json.load(file).items()
+            }
+        middleware = AssetMiddleware(app.wsgi_app,
+                                     os.path.join(app.root_path, directory),
+                                     manifest)
+        app.extensions["static_assets"] = middleware
+        app.wsgi_app = middleware  # type: ignore[method-assign]
+        # Only builds URLs; the middleware answers them
+        app.add_url_rule(f"{URL_PATH}/<path:path>",
+                         "static_assets",
+                         build_only=True)
+
+    @staticmethod
+    def asset_url(endpoint: str, **values: Any) -> str:
+        """
+        Build the URL of a static file, fingerprinted if it has been built.
+
+        Args:
+            endpoint (str): The static endpoint, e.g. "auth.static".
+            **values (Any): The `url_for` arguments, including `filename`.
+
+        Returns:
+            str: The fingerprinted URL, or the static URL without a build.
+        """
+        middleware: AssetMiddleware | None = current_app.extensions.get(
+            "static_assets")
+        if middleware is not None:
+            asset = middleware.manifest.get(endpoint,
+                                            {}).get(values["filename"])
+            if asset is not None:
+                values.pop("filename")
+                return url_for("static_assets", path=asset.path, **values)
+        return url_for(endpoint, **values)
+
+
+assets_cli = click.Group("assets", help="Manage fingerprinted static files.")
+
+
+@assets_cli.command("build")
+@with_appcontext
+def build_assets() -> None:
+    """Fingerprint and precompress every static file."""
+    app = current_app
+    try:
+        manifest = build(app)
+    except RuntimeError as error:
+        raise click.ClickException(str(error)) from None
+    click.echo(f"{'asset':<48} {'bytes':>8} {'gzip':>8}")
+    for assets in manifest.values():
+        for asset in assets.values():
+            click.echo(f"{asset.path:<48} {asset.size:>8} "
+                       f"{asset.gzip_size or '-':>8}")
+    count = sum(len(assets) for assets in manifest.values())
+    click.echo(f"Built {count} assets into {app.config['STATIC_ASSETS_DIR']}")
@@ -1,9 +1,17 @@
 """__init__.pyi"""
 from __future__ import annotations
 from typing import Any
+from argon2 import PasswordHasher
 
 
 class Argon2:
+    time_cost: int
+    memory_cost: int
+    parallelism: int
+    hash_len: int
+    salt_len: int
+    encoding: str
+    ph: PasswordHasher
 
     def __init__(self, app: Any = ...) -> None:
         ...
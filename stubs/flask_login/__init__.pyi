@@ -28,6 +28,9 @@ class LoginManager:
                                              _T]) -> Callable[[str], _T]:
         ...
 
+    def unauthorized(self) -> Any:
+        ...
+
     login_view: str | None
     login_message_category: str
 
@@ -1,9 +1,12 @@
 """__init__.pyi"""
 from __future__ import annotations
 from typing import Any, TypeVar, Generic, Type
+from sqlalchemy import MetaData
+from sqlalchemy.engine import Engine, Result
 from sqlalchemy.orm import Session
 
 _T = TypeVar("_T", bound="Model")
+_E = TypeVar("_E")
 
 
 class Model:
@@ -13,8 +16,13 @@ class Model:
 class SQLAlchemy:
     Model: Type[Model]
     session: ScopedSession
+    engine: Engine
+    engines: dict[str | None, Engine]
+    metadata: MetaData
 
-    def __init__(self, app: Any = ...) -> None:
+    def __init__(self,
+                 app: Any = ...,
+                 session_options: dict[str, Any] | None = ...) -> None:
         ...
 
     def init_app(self, app: Any) -> None:
@@ -41,11 +49,26 @@ class ScopedSession:
     def add(self, instance: Any) -> None:
         ...
 
+    def get(self, entity: Type[_E], ident: Any) -> _E | None:
+        ...
+
+    def merge(self, instance: _E, load: bool = True) -> _E:
+        ...
+
+    def execute(self,
+                statement: Any,
+                params: Any = ...,
+                **kwargs: Any) -> Result[Any]:
+        ...
+
     def commit(self) -> None:
         ...
 
     def rollback(self) -> None:
         ...
 
+    def expire_all(self) -> None:
+        ...
+
     def close(self) -> None:
         ...
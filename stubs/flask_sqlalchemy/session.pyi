@@ -0,0 +1,20 @@
+"""session.pyi"""
+from __future__ import annotations
+from typing import Any
+from sqlalchemy.engine import Connection, Engine
+from sqlalchemy.orm import Session as _Session
+from . import SQLAlchemy
+
+
+class Session(_Session):
+    _db: SQLAlchemy
+
+    def __init__(self, db: SQLAlchemy, **kwargs: Any) -> None:
+        ...
+
+    def get_bind(self,
+                 mapper: Any | None = ...,
+                 clause: Any | None = ...,
+                 bind: Engine | Connection | None = ...,
+                 **kwargs: Any) -> Engine | Connection:
+        ...
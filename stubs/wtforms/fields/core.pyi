@@ -5,6 +5,8 @@ from typing import Any, Callable
 
 class Field:
     data: Any
+    errors: list[str]
+    validators: list[Callable[[Any, Any], None]]
 
     def __init__(self,
                  label: str = ...,
@@ -0,0 +1,187 @@
+"""template_cache.py"""
+from __future__ import annotations
+import os
+import time
+from dataclasses import dataclass
+from typing import Any
+import click
+from flask import Flask, current_app
+from flask.cli import with_appcontext
+from jinja2 import FileSystemBytecodeCache
+
+
+@dataclass(frozen=True)
+class CompiledTemplate:
+    """
+    The result of compiling one template.
+
+    Attributes:
+        name (str): The template name.
+        seconds (float): Time spent compiling the source to bytecode.
+        size (int): Length of the template source, in characters.
+    """
+    name: str
+    seconds: float
+    size: int
+
+
+def template_sources(app: Flask) -> dict[str, list[str]]:
+    """
+    Map every template name to the loaders that provide it.
+
+    Flask searches the application's `templates` folder first and then each
+    blueprint's, in registration order, so a name provided by more than one
+    loader resolves to whichever comes first.
+
+    Args:
+        app (Flask): The Flask application object.
+
+    Returns:
+        dict[str, list[str]]: Loader owners ("app" or a blueprint name) by
+            template name.
+    """
+    loaders: list[tuple[str, Any]] = [("app", app.jinja_loader)]
+    loaders += [(name, blueprint.jinja_loader)
+                for name, blueprint in app.blueprints.items()]
+    sources: dict[str, list[str]] = {}
+    for owner, loader in loaders:
+        if loader is None:
+            continue
+        names: list[str] = loader.list_templates()
+        for name in names:
+            sources.setdefault(name, []).append(owner)
+    return sources
+
+
+def duplicate_templates(app: Flask) -> dict[str, list[str]]:
+    """
+    Return the template names provided by more than one loader.
+
+    Args:
+        app (Flask): The Flask application object.
+
+    Returns:
+        dict[str, list[str]]: Loader owners by ambiguous template name.
+    """
+    return {
+        name: owners
+        for name, owners in template_sources(app).items() if len(owners) > 1
+    }
+
+
+class TemplateCache:
+    """
+    A Jinja bytecode cache shared by every worker.
+
+    Compiled templates are written to `TEMPLATE_CACHE_DIR` (the
+    `jinja` folder of the instance path by default), so a worker only parses
+    a template's source if no worker has compiled that version of it yet.
+    Run `flask templates compile` at build time to fill the cache. With
+    `TEMPLATE_PRELOAD` set, every template is loaded when the application is
+    created, which moves the remaining cost out of the first requests (and,
+    with `gunicorn --preload`, into the master process).
+
+    The extension must be initialized after the blueprints are registered,
+    so that their templates can be listed.
+
+    Args:
+        app (Flask | None): The Flask application object.
+    """
+
+    def __init__(self, app: Flask | None = None) -> None:
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app: Flask) -> None:
+        """
+        Attach the bytecode cache to an application and preload templates.
+
+        Args:
+            app (Flask): The Flask application object.
+        """
+        app.config.setdefault("TEMPLATE_CACHE_DIR",
+                              os.path.join(app.instance_path, "jinja"))
+        app.config.setdefault("TEMPLATE_PRELOAD", False)
+        directory = app.config["TEMPLATE_CACHE_DIR"]
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+            app.jinja_env.bytecode_cache = FileSystemBytecodeCache(directory)
+        if app.config["TEMPLATE_PRELOAD"]:
+            self.preload(app)
+
+    @staticmethod
+    def preload(app: Flask) -> int:
+        """
+        Load every template into the Jinja environment's in-memory cache.
+
+        Args:
+            app (Flask): The Flask application object.
+
+        Returns:
+            int: The number of templates loaded.
+        """
+        names = app.jinja_env.list_templates()
+        for name in names:
+            app.jinja_env.get_template(name)
+        return len(names)
+
+    @staticmethod
+    def compile_all(app: Flask) -> list[CompiledTemplate]:
+        """
+        Compile every template and store its bytecode in the cache.
+
+        Args:
+            app (Flask): The Flask application object.
+
+        Returns:
+            list[CompiledTemplate]: The compile time of each template.
+        """
+        env = app.jinja_env
+        cache = env.bytecode_cache
+        loader = env.loader
+        assert loader is not None
+        results = []
+        for name in env.list_templates():
+            source, filename, _ = loader.get_source(env, name)
+            start = time.perf_counter()
+            code = env.compile(source, name, filename)
+            seconds = time.perf_counter() - start
+            if cache is not None:
+                bucket = cache.get_bucket(env, name, filename, source)
+                bucket.code = code
+                cache.set_bucket(bucket)
+            results.append(CompiledTemplate(name, seconds, len(source)))
+        return results
+
+
+templates_cli = click.Group("templates", help="Manage the template cache.")
+
+
+@templates_cli.command("compile")
+@with_appcontext
+def compile_templates() -> None:
+    """
+    Precompile every template into the bytecode cache.
+
+    Fails if a template name is provided by more than one templates folder,
+    as which one is used would then depend on the loader search order.
+    """
+    app = current_app
+    duplicates = duplicate_templates(app)
+    if duplicates:
+        raise click.ClickException("Ambiguous templates: " + "; ".join(
+            f"{name} ({', '.join(owners)})"
+            for name, owners in sorted(duplicates.items())))
+    if app.jinja_env.bytecode_cache is None:
+        raise click.ClickException(
+            "TEMPLATE_CACHE_DIR is not set, so there is nowhere to write "
+            "compiled templates.")
+
+    results = TemplateCache.compile_all(app)
+    click.echo(f"{'template':<24} {'chars':>7} {'compile ms':>11}")
+    for result in sorted(results, key=lambda r: r.seconds, reverse=True):
+        click.echo(f"{result.name:<24} {result.size:>7} "
+                   f"{result.seconds * 1000:>11.2f}")
+    total = sum(result.seconds for result in results)
+    click.echo(f"Compiled {len(results)} templates in {total * 1000:.1f} ms "
+               f"into {app.config['TEMPLATE_CACHE_DIR']}")
@@ -0,0 +1,129 @@
+"""bench_compression.py
+
+Measure what gzip costs and saves on the application's pages at each
+compression level: the CPU time to compress each page, the bytes it saves,
+and the bytes saved per millisecond of CPU, to pick `COMPRESSION_LEVEL`.
+Pages are rendered through the test client, plus a synthetic user list the
+size of the admin pages to come. Run it from the repository root with the
+application's environment loaded:
+
+    python -m tests.benchmarks.bench_compression --levels 1 6 9
+"""
+from __future__ import annotations
+import argparse
+import json
+import statistics
+import time
+import zlib
+from pathlib import Path
+from flask import Flask, render_template_string
+from app import create_app
+from compression import GZIP_WBITS
+from config import TestingConfig
+from extensions import db
+
+PAGES = {
+    "home": "/",
+    "login": "/auth/login",
+    "register": "/auth/register",
+    "404": "/no-such-page",
+}
+
+USER_LIST = """{% extends "base.html" %}
+{% block title %}Users{% endblock %}
+{% block content %}
+    <table>
+        <tr><th>ID</th><th>Username</th><th>Admin</th><th>Failed</th></tr>
+        {% for user in users %}
+        <tr>
+            <td>{{ user.id }}</td>
+            <td>
+                <a href="/admin/users/{{ user.id }}">{{ user.username }}</a>
+            </td>
+            <td>{{ "yes" if user.is_admin else "no" }}</td>
+            <td>{{ user.failed }}</td>
+        </tr>
+        {% endfor %}
+    </table>
+{% endblock %}"""
+
+
+class BenchConfig(TestingConfig):
+    """The test profile without response compression."""
+    COMPRESSION_ENABLED = False
+
+
+def pages(app: Flask, rows: int) -> dict[str, bytes]:
+    """Render the pages to compress, uncompressed."""
+    client = app.test_client()
+    bodies = {name: client.get(path).data for name, path in PAGES.items()}
+    users = [{
+        "id": index,
+        "username": f"user{index * 7919 % 100003:05d}",
+        "is_admin": index % 50 == 0,
+        "failed": index % 4,
+    } for index in range(rows)]
+    with app.test_request_context():
+        bodies[f"users ({rows} rows)"] = render_template_string(
+            USER_LIST, users=users).encode()
+    return bodies
+
+
+def compress(body: bytes, level: int) -> bytes:
+    """Gzip a body the way `Compression` does."""
+    compressor = zlib.compressobj(level, zlib.DEFLATED, GZIP_WBITS)
+    return compressor.compress(body) + compressor.flush()
+
+
+def measure(body: bytes, level: int, rounds: int) -> dict[str, float]:
+    """Return the median compression time and the compressed size."""
+    samples = []
+    for _ in range(rounds):
+        start = time.perf_counter()
+        compressed = compress(body, level)
+        samples.append(time.perf_counter() - start)
+    seconds = statistics.median(samples)
+    saved = len(body) - len(compressed)
+    return {
+        "level": level,
+        "bytes": len(body),
+        "gzip_bytes": len(compressed),
+        "ratio": round(len(compressed) / len(body), 3),
+        "median_us": round(seconds * 1e6, 1),
+        "mb_per_s": round(len(body) / seconds / 1e6, 1),
+        "saved_per_ms": round(saved / (seconds * 1000)),
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[2])
+    parser.add_argument("--levels",
+                        type=int,
+                        nargs="+",
+                        default=[1, 3, 6, 9])
+    parser.add_argument("--rounds", type=int, default=200)
+    parser.add_argument("--rows", type=int, default=500)
+    parser.add_argument("--json", type=Path, help="Write the results here")
+    args = parser.parse_args()
+
+    app = create_app(BenchConfig, role="web")
+    with app.app_context():
+        db.create_all()
+    results: dict[str, list[dict[str, float]]] = {}
+    print(f"{'page':<20} {'level':>5} {'bytes':>8} {'gzip':>8} {'ratio':>6} "
+          f"{'median us':>10} {'MB/s':>7} {'saved B/ms':>11}")
+    for name, body in pages(app, args.rows).items():
+        results[name] = [
+            measure(body, level, args.rounds) for level in args.levels
+        ]
+        for result in results[name]:
+            print(f"{name:<20} {result['level']:>5} {result['bytes']:>8} "
+                  f"{result['gzip_bytes']:>8} {result['ratio']:>6.3f} "
+                  f"{result['median_us']:>10.1f} {result['mb_per_s']:>7.1f} "
+                  f"{result['saved_per_ms']:>11}")
+    if args.json:
+        args.json.write_text(json.dumps(results, indent=4) + "\n")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,274 @@
+"""bench_hot_paths.py
+
+Time the application's hot paths one unit at a time: `create_app`,
+`load_user`, form validation, rendering each template, Argon2 hashing, and
+whole requests through the test client on an in-memory database. Results
+are compared with `hot_paths_baseline.json`, and the run fails if a
+benchmark's median is more than `--tolerance` slower than its baseline. Run
+it from the repository root with the application's environment loaded:
+
+    python -m tests.benchmarks.bench_hot_paths --json results.json
+
+After a deliberate change, `--update` stores the run as the new baseline.
+Timings only compare between runs on the same machine, so keep the baseline
+to the machine that checks it.
+"""
+from __future__ import annotations
+import argparse
+import json
+import platform
+import sys
+import time
+from contextlib import AbstractContextManager, nullcontext
+from dataclasses import asdict, dataclass
+from itertools import count
+from pathlib import Path
+from typing import Any, Callable
+from flask import Flask, render_template
+from wtforms.validators import Regexp, ValidationError
+from app import create_app
+from blueprints.auth.forms import LoginForm, RegistrationForm
+from calibrate import percentile
+from config import TestingConfig
+from extensions import db, password_hashing, user_cache
+from models import User, load_user
+
+BASELINE = Path(__file__).with_name("hot_paths_baseline.json")
+USERNAME = "benchuser"
+PASSWORD = "BenchPassword69@!"
+
+
+class BenchConfig(TestingConfig):
+    """The test profile without rate limits."""
+    RATELIMIT_ENABLED = False
+
+
+@dataclass(frozen=True)
+class Result:
+    """
+    The timings of one benchmark.
+
+    Attributes:
+        rounds (int): Number of timed calls.
+        median_us (float): Median call time, in microseconds.
+        p99_us (float): 99th percentile call time, in microseconds.
+    """
+    rounds: int
+    median_us: float
+    p99_us: float
+
+
+class Suite:
+    """Runs benchmarks for a minimum time and number of rounds each."""
+
+    def __init__(self, min_time: float, min_rounds: int,
+                 only: str | None) -> None:
+        self.min_time = min_time
+        self.min_rounds = min_rounds
+        self.only = only
+        self.results: dict[str, Result] = {}
+
+    def run(self,
+            name: str,
+            fn: Callable[[], Any],
+            context: Callable[[], AbstractContextManager[Any]] = nullcontext
+            ) -> None:
+        """Time `fn` inside `context`, after one untimed warm-up call."""
+        if self.only and self.only not in name:
+            return
+        samples: list[float] = []
+        with context():
+            fn()
+            deadline = time.perf_counter() + self.min_time
+            while (len(samples) < self.min_rounds
+                   or time.perf_counter() < deadline):
+                start = time.perf_counter()
+                fn()
+                samples.append(time.perf_counter() - start)
+        samples.sort()
+        self.results[name] = Result(len(samples),
+                                    round(percentile(samples, 50) * 1e6, 1),
+                                    round(percentile(samples, 99) * 1e6, 1))
+        print(f"{name:<32} {self.results[name].median_us:>12.1f} "
+              f"{self.results[name].p99_us:>12.1f} {len(samples):>7}")
+
+
+def make_app() -> tuple[Flask, int]:
+    """Create the benchmark app with one user, returning the user's ID."""
+    app = create_app(BenchConfig, role="web")
+    with app.app_context():
+        db.create_all()
+        user = User(username=USERNAME,
+                    password=password_hashing.generate_password_hash(
+                        PASSWORD))
+        db.session.add(user)
+        db.session.commit()
+        return app, user.id
+
+
+def renderer(name: str,
+             form: Callable[[], Any] | None) -> Callable[[], str]:
+    """Return a function rendering a template, with a new form if given."""
+    return lambda: render_template(name, form=form() if form else None)
+
+
+def bench_units(suite: Suite, app: Flask, user_id: int) -> None:
+    """Benchmark the units that run inside a request."""
+    suite.run("create_app", lambda: create_app(BenchConfig, role="web"))
+
+    def load_user_miss() -> None:
+        user_cache.invalidate(user_id)
+        load_user(str(user_id))
+        db.session.remove()
+
+    suite.run("load_user (cached)", lambda: load_user(str(user_id)),
+              app.app_context)
+    suite.run("load_user (query)", load_user_miss, app.app_context)
+
+    def login_context() -> AbstractContextManager[Any]:
+        return app.test_request_context("/auth/login",
+                                        method="POST",
+                                        data={
+                                            "username": USERNAME,
+                                            "password": PASSWORD
+                                        })
+
+    def register_context() -> AbstractContextManager[Any]:
+        return app.test_request_context("/auth/register",
+                                        method="POST",
+                                        data={
+                                            "username": "newbenchuser",
+                                            "password": PASSWORD,
+                                            "confirm_password": PASSWORD
+                                        })
+
+    suite.run("LoginForm.validate", lambda: LoginForm().validate(),
+              login_context)
+    suite.run("RegistrationForm.validate",
+              lambda: RegistrationForm().validate(), register_context)
+
+    def password_regexp() -> None:
+        form = RegistrationForm()
+        regexp = next(validator for validator in form.password.validators
+                      if isinstance(validator, Regexp))
+        try:
+            regexp(form, form.password)
+        except ValidationError:
+            pass
+
+    suite.run("password Regexp", password_regexp, register_context)
+
+    forms: dict[str, Callable[[], Any]] = {
+        "login.html": LoginForm,
+        "register.html": RegistrationForm
+    }
+    with app.app_context():
+        names = sorted(
+            set(app.jinja_env.list_templates()) - {"base.html"})
+    for name in names:
+        suite.run(f"render {name}", renderer(name, forms.get(name)),
+                  register_context)
+
+    with app.app_context():
+        pw_hash = password_hashing.generate_password_hash(PASSWORD)
+    suite.run("argon2 hash",
+              lambda: password_hashing.generate_password_hash(PASSWORD),
+              app.app_context)
+    suite.run("argon2 verify",
+              lambda: password_hashing.check_password_hash(pw_hash, PASSWORD),
+              app.app_context)
+
+
+def bench_requests(suite: Suite, app: Flask) -> None:
+    """Benchmark whole requests through the test client."""
+    anonymous = app.test_client()
+    suite.run("GET / (anonymous)", lambda: anonymous.get("/"))
+    suite.run("GET /auth/login", lambda: anonymous.get("/auth/login"))
+    suite.run(
+        "POST /auth/login", lambda: app.test_client().post(
+            "/auth/login", data={
+                "username": USERNAME,
+                "password": PASSWORD
+            }))
+
+    usernames = (f"benchuser{index:06d}" for index in count())
+    suite.run(
+        "POST /auth/register", lambda: app.test_client().post(
+            "/auth/register",
+            data={
+                "username": next(usernames),
+                "password": PASSWORD,
+                "confirm_password": PASSWORD
+            }))
+
+    user = app.test_client()
+    user.post("/auth/login",
+              data={
+                  "username": USERNAME,
+                  "password": PASSWORD
+              })
+    suite.run("GET / (logged in)", lambda: user.get("/"))
+    suite.run("GET /dashboard", lambda: user.get("/dashboard"))
+
+
+def compare(results: dict[str, Result], baseline: dict[str, Any],
+            tolerance: float) -> list[str]:
+    """Return the benchmarks slower than baseline by more than tolerance."""
+    regressions = []
+    print(f"\n{'benchmark':<32} {'baseline':>12} {'median':>12} "
+          f"{'change':>8}")
+    for name, result in results.items():
+        base = baseline.get(name)
+        if base is None:
+            print(f"{name:<32} {'-':>12} {result.median_us:>12.1f}")
+            continue
+        change = result.median_us / base["median_us"] - 1
+        flag = " REGRESSED" if change > tolerance else ""
+        print(f"{name:<32} {base['median_us']:>12.1f} "
+              f"{result.median_us:>12.1f} {change:>+8.0%}{flag}")
+        if flag:
+            regressions.append(f"{name} {change:+.0%}")
+    return regressions
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[2])
+    parser.add_argument("--min-time", type=float, default=0.5)
+    parser.add_argument("--min-rounds", type=int, default=5)
+    parser.add_argument("--only", help="Only run benchmarks whose name "
+                        "contains this string")
+    parser.add_argument("--json", type=Path, help="Write the results here")
+    parser.add_argument("--tolerance", type=float, default=0.5)
+    parser.add_argument("--update", action="store_true")
+    args = parser.parse_args()
+
+    suite = Suite(args.min_time, args.min_rounds, args.only)
+    app, user_id = make_app()
+    print(f"{'benchmark':<32} {'median us':>12} {'p99 us':>12} "
+          f"{'rounds':>7}")
+    bench_units(suite, app, user_id)
+    bench_requests(suite, app)
+
+    document = {
+        "python": platform.python_version(),
+        "machine": platform.machine(),
+        "results": {
+            name: asdict(result)
+            for name, result in suite.results.items()
+        },
+    }
+    if args.json:
+        args.json.write_text(json.dumps(document, indent=4) + "\n")
+    if args.update:
+        BASELINE.write_text(json.dumps(document, indent=4) + "\n")
+        print(f"Baseline written to {BASELINE}")
+        return
+    if BASELINE.exists():
+        baseline = json.loads(BASELINE.read_text())["results"]
+        regressions = compare(suite.results, baseline, args.tolerance)
+        if regressions:
+            sys.exit("Slower than baseline: " + "; ".join(regressions))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,151 @@
+"""bench_sessions.py
+
+Measure the per-request cost of the session for each `SESSION_BACKEND`:
+opening and saving a logged in session that did not change (the common
+case), one that changed, one that is not in the worker's cache, and a whole
+request to the dashboard through the test client. "cookie" is Flask's
+signed cookie session, which verifies a signature over the whole cookie on
+every request and signs it again whenever it changes; the server-side
+backends look the session up in the worker's cache by its ID. Run it from
+the repository root with the application's environment loaded:
+
+    python -m tests.benchmarks.bench_sessions --rounds 5000
+
+The database is in memory unless `--database-uri` names one.
+"""
+from __future__ import annotations
+import argparse
+import json
+import statistics
+import time
+from http.cookies import SimpleCookie
+from pathlib import Path
+from typing import Any, Callable
+from flask import Flask
+from werkzeug.test import EnvironBuilder
+from app import create_app
+from calibrate import percentile
+from config import TestingConfig
+from extensions import db
+from models import User
+
+BACKENDS = ["cookie", "memory", "database"]
+# What a logged in session holds: Flask-Login's user ID, freshness and
+# session identifier, and Flask-WTF's CSRF token
+SESSION_DATA = {
+    "_user_id": "1",
+    "_fresh": True,
+    "_id": "0" * 128,
+    "csrf_token": "f" * 40,
+}
+
+
+class BenchConfig(TestingConfig):
+    """The test profile without rate limits."""
+    RATELIMIT_ENABLED = False
+
+
+def timed(function: Callable[[int], None], rounds: int) -> dict[str, float]:
+    """Return the median and 99th percentile time of a call, in us."""
+    samples: list[float] = []
+    for index in range(rounds):
+        start = time.perf_counter()
+        function(index)
+        samples.append((time.perf_counter() - start) * 1e6)
+    samples.sort()
+    return {
+        "median_us": round(statistics.median(samples), 1),
+        "p99_us": round(percentile(samples, 99), 1),
+    }
+
+
+def session_cookie(app: Flask, response: Any) -> str:
+    """Return the session cookie a response sets."""
+    cookies: SimpleCookie = SimpleCookie()
+    for header in response.headers.getlist("Set-Cookie"):
+        cookies.load(header)
+    return cookies[app.config["SESSION_COOKIE_NAME"]].value
+
+
+def open_save(app: Flask, rounds: int, modify: bool,
+              cold: bool) -> dict[str, float]:
+    """Time opening and saving a logged in session, outside of requests."""
+    client: Any = app.test_client()
+    with client.session_transaction() as sess:
+        sess.update(SESSION_DATA)
+    cookie = client.get_cookie(app.config["SESSION_COOKIE_NAME"]).value
+    interface = app.session_interface
+
+    def run(index: int) -> None:
+        nonlocal cookie
+        request = app.request_class(
+            EnvironBuilder(headers={
+                "Cookie": f"session={cookie}"
+            }).get_environ())
+        response = app.response_class()
+        if cold:
+            app.extensions["session_store"].cache.clear()
+        sess = interface.open_session(app, request)
+        assert sess is not None and sess["_user_id"] == "1"
+        if modify:
+            sess["counter"] = index
+        interface.save_session(app, sess, response)
+        if modify:
+            cookie = session_cookie(app, response)
+
+    with app.app_context():
+        return timed(run, rounds)
+
+
+def dashboard(app: Flask, rounds: int) -> dict[str, float]:
+    """Time a logged in request to the dashboard."""
+    client: Any = app.test_client()
+    with client.session_transaction() as sess:
+        sess.update(SESSION_DATA)
+
+    def run(_index: int) -> None:
+        assert client.get("/dashboard").status_code == 200
+
+    return timed(run, rounds)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[2])
+    parser.add_argument("--backends", nargs="+", default=BACKENDS)
+    parser.add_argument("--rounds", type=int, default=2000)
+    parser.add_argument("--database-uri", help="Defaults to in memory")
+    parser.add_argument("--json", type=Path, help="Write the results here")
+    args = parser.parse_args()
+
+    results: dict[str, dict[str, dict[str, float]]] = {}
+    print(f"{'benchmark':<20} {'backend':<10} {'median us':>10} "
+          f"{'p99 us':>10}")
+    for backend in args.backends:
+        settings: dict[str, Any] = {"SESSION_BACKEND": backend}
+        if args.database_uri:
+            settings["SQLALCHEMY_DATABASE_URI"] = args.database_uri
+        app = create_app(type("BenchConfig", (BenchConfig, ), settings),
+                         role="web")
+        with app.app_context():
+            db.create_all()
+            if db.session.get(User, 1) is None:
+                db.session.add(User("benchuser", "unused"))
+                db.session.commit()
+        benchmarks = {
+            "unchanged": open_save(app, args.rounds, False, False),
+            "modified": open_save(app, args.rounds, True, False),
+            "dashboard request": dashboard(app, args.rounds),
+        }
+        if backend != "cookie":
+            benchmarks["not cached"] = open_save(app, args.rounds, False,
+                                                 True)
+        results[backend] = benchmarks
+        for name, result in benchmarks.items():
+            print(f"{name:<20} {backend:<10} {result['median_us']:>10.1f} "
+                  f"{result['p99_us']:>10.1f}")
+    if args.json:
+        args.json.write_text(json.dumps(results, indent=4) + "\n")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,142 @@
+"""bench_sqlite_concurrency.py
+
+Measure SQLite reader throughput while writers update the same table, with
+SQLite's default settings and with the `SQLITE_PRAGMAS` from `config.py`.
+
+The readers look up users by ID, like `load_user` on every request, and the
+writers bump a counter and commit, like a failed login. Run it from the
+repository root with the application's environment loaded:
+
+    python -m tests.benchmarks.bench_sqlite_concurrency --readers 8 \\
+        --writers 2 --duration 5
+"""
+from __future__ import annotations
+import argparse
+import random
+import tempfile
+import threading
+import time
+from pathlib import Path
+from typing import Mapping
+from sqlalchemy import (Column, Engine, Integer, MetaData, String, Table,
+                        create_engine, insert, select, update)
+from calibrate import percentile
+from config import Config
+from database import SQLitePragmas
+
+USERS = 1000
+
+metadata = MetaData()
+users = Table("user", metadata, Column("id", Integer, primary_key=True),
+              Column("username", String(150), unique=True, nullable=False),
+              Column("failed_attempts", Integer, nullable=False))
+
+
+class Counters:
+    """Operations, errors and read latencies gathered by the workers."""
+
+    def __init__(self) -> None:
+        self.lock = threading.Lock()
+        self.reads = 0
+        self.writes = 0
+        self.errors = 0
+        self.latencies: list[float] = []
+
+
+def make_engine(path: Path, pragmas: Mapping[str, str | int]) -> Engine:
+    engine = create_engine(f"sqlite:///{path}", pool_size=32)
+    if pragmas:
+        SQLitePragmas.listen(engine, pragmas)
+    metadata.create_all(engine)
+    with engine.begin() as conn:
+        conn.execute(insert(users), [{
+            "id": index,
+            "username": f"user{index:06d}",
+            "failed_attempts": 0
+        } for index in range(1, USERS + 1)])
+    return engine
+
+
+def reader(engine: Engine, stop: threading.Event, counters: Counters) -> None:
+    latencies = []
+    reads = errors = 0
+    while not stop.is_set():
+        start = time.perf_counter()
+        try:
+            with engine.connect() as conn:
+                conn.execute(
+                    select(users).where(
+                        users.c.id == random.randint(1, USERS))).one()
+        except Exception:  # pylint: disable=broad-except
+            errors += 1
+            continue
+        latencies.append(time.perf_counter() - start)
+        reads += 1
+    with counters.lock:
+        counters.reads += reads
+        counters.errors += errors
+        counters.latencies.extend(latencies)
+
+
+def writer(engine: Engine, stop: threading.Event, counters: Counters) -> None:
+    writes = errors = 0
+    while not stop.is_set():
+        try:
+            with engine.begin() as conn:
+                conn.execute(
+                    update(users).where(
+                        users.c.id == random.randint(1, USERS)).values(
+                            failed_attempts=users.c.failed_attempts + 1))
+        except Exception:  # pylint: disable=broad-except
+            errors += 1
+            continue
+        writes += 1
+    with counters.lock:
+        counters.writes += writes
+        counters.errors += errors
+
+
+def run(label: str, pragmas: Mapping[str, str | int], readers: int,
+        writers: int, duration: float) -> None:
+    with tempfile.TemporaryDirectory() as tmp:
+        engine = make_engine(Path(tmp) / "bench.db", pragmas)
+        stop = threading.Event()
+        counters = Counters()
+        threads = [
+            threading.Thread(target=reader, args=(engine, stop, counters))
+            for _ in range(readers)
+        ] + [
+            threading.Thread(target=writer, args=(engine, stop, counters))
+            for _ in range(writers)
+        ]
+        for thread in threads:
+            thread.start()
+        time.sleep(duration)
+        stop.set()
+        for thread in threads:
+            thread.join()
+        engine.dispose()
+    counters.latencies.sort()
+    print(f"{label:>8} {counters.reads / duration:>10.0f} "
+          f"{percentile(counters.latencies, 50) * 1000:>8.2f} "
+          f"{percentile(counters.latencies, 99) * 1000:>8.2f} "
+          f"{counters.writes / duration:>9.0f} {counters.errors:>7}")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[2])
+    parser.add_argument("--readers", type=int, default=8)
+    parser.add_argument("--writers", type=int, default=2)
+    parser.add_argument("--duration", type=float, default=5.0)
+    args = parser.parse_args()
+    print(f"{args.readers} readers, {args.writers} writers, "
+          f"{args.duration:g}s per run")
+    print(f"{'pragmas':>8} {'reads/s':>10} {'p50 ms':>8} {'p99 ms':>8} "
+          f"{'writes/s':>9} {'errors':>7}")
+    run("default", {}, args.readers, args.writers, args.duration)
+    run("tuned", Config.SQLITE_PRAGMAS, args.readers, args.writers,
+        args.duration)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,115 @@
+"""bench_startup.py
+
+Measure the cold start of each application role, as `create_app` runs in a
+new worker, and fail if it has regressed past the budget in
+`startup_budget.json`. Every run is a fresh interpreter, timed from the
+first import to the configured app, with the peak RSS of the process and
+the packages that took longest to import, from `python -X importtime`. Run
+it from the repository root with the application's environment loaded:
+
+    python -m tests.benchmarks.bench_startup --runs 5
+
+After a deliberate change, `--update` rewrites the budget from the measured
+medians plus `--headroom`.
+"""
+from __future__ import annotations
+import argparse
+import json
+import statistics
+import subprocess
+import sys
+from pathlib import Path
+
+ROLES = ("web", "cli", "worker")
+BUDGET = Path(__file__).with_name("startup_budget.json")
+METRICS = ("startup_ms", "rss_mb")
+
+
+# Runs in a bare interpreter, so that nothing but the application is
+# imported before the timer starts; ru_maxrss is in KiB on Linux
+WORKER = """
+import time
+start = time.perf_counter()
+from app import create_app
+create_app(role={role!r})
+startup = time.perf_counter() - start
+import json, resource, sys
+print(json.dumps({{
+    "startup_ms": startup * 1000,
+    "rss_mb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+    "modules": len(sys.modules),
+}}))
+"""
+
+
+def run(role: str) -> tuple[dict[str, float], dict[str, int]]:
+    """Run one worker, returning its metrics and import time by package."""
+    process = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c",
+         WORKER.format(role=role)],
+        check=True,
+        capture_output=True,
+        text=True)
+    imports: dict[str, int] = {}
+    for line in process.stderr.splitlines():
+        # "import time: self [us] | cumulative | imported package"
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        own, _, module = line[len("import time:"):].split("|")
+        package = module.strip().split(".")[0]
+        imports[package] = imports.get(package, 0) + int(own)
+    return json.loads(process.stdout.splitlines()[-1]), imports
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[2])
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--top", type=int, default=8)
+    parser.add_argument("--update", action="store_true")
+    parser.add_argument("--headroom", type=float, default=0.5)
+    args = parser.parse_args()
+
+    budget = json.loads(BUDGET.read_text()) if BUDGET.exists() else {}
+    measured: dict[str, dict[str, float]] = {}
+    failures = []
+    print(f"Median of {args.runs} fresh workers")
+    print(f"{'role':>7} {'startup ms':>11} {'rss MB':>8} {'modules':>8}")
+    for role in ROLES:
+        results = [run(role) for _ in range(args.runs)]
+        medians = {
+            metric: statistics.median(r[0][metric] for r in results)
+            for metric in (*METRICS, "modules")
+        }
+        measured[role] = medians
+        print(f"{role:>7} {medians['startup_ms']:>11.1f} "
+              f"{medians['rss_mb']:>8.1f} {medians['modules']:>8.0f}")
+        for metric in METRICS:
+            limit = budget.get(role, {}).get(metric)
+            if limit is not None and medians[metric] > limit:
+                failures.append(f"{role} {metric} {medians[metric]:.1f} > "
+                                f"budget {limit}")
+        # The import times of the last run, slowest package first
+        imports = sorted(results[-1][1].items(),
+                         key=lambda item: item[1],
+                         reverse=True)
+        for package, microseconds in imports[:args.top]:
+            print(f"{'':>7} {microseconds / 1000:>11.1f} {package}")
+
+    if args.update:
+        BUDGET.write_text(
+            json.dumps(
+                {
+                    role: {
+                        metric: round(values[metric] * (1 + args.headroom))
+                        for metric in METRICS
+                    }
+                    for role, values in measured.items()
+                },
+                indent=4) + "\n")
+        print(f"Budget written to {BUDGET}")
+    elif failures:
+        sys.exit("Over budget: " + "; ".join(failures))
+
+
+if __name__ == "__main__":
+    main()
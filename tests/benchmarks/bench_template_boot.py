@@ -0,0 +1,101 @@
+"""bench_template_boot.py
+
+Measure how long the first requests of a fresh worker take to render, with
+no template cache, with a precompiled bytecode cache, and with the bytecode
+cache plus `TEMPLATE_PRELOAD`. Every mode runs in a new interpreter, as a
+worker would after a deploy. Run it from the repository root with the
+application's environment loaded:
+
+    python -m tests.benchmarks.bench_template_boot --runs 5
+"""
+from __future__ import annotations
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+from calibrate import percentile
+
+PATHS = ("/", "/auth/login", "/auth/register", "/missing")
+MODES = ("cold", "bytecode", "preload")
+
+
+def worker(mode: str, directory: str) -> None:
+    """Boot an application and time its first request to each path."""
+    # pylint: disable=import-outside-toplevel
+    from app import create_app
+    from config import TestingConfig
+    from extensions import db
+
+    class BenchConfig(TestingConfig):
+        TEMPLATE_CACHE_DIR = directory if mode != "cold" else None
+        TEMPLATE_PRELOAD = mode == "preload"
+
+    start = time.perf_counter()
+    app = create_app(BenchConfig)
+    boot = time.perf_counter() - start
+    with app.app_context():
+        db.create_all()
+    client = app.test_client()
+    timings = {}
+    for path in PATHS:
+        start = time.perf_counter()
+        client.get(path)
+        timings[path] = time.perf_counter() - start
+    print(json.dumps({"boot": boot, "requests": timings}))
+
+
+def run(mode: str, directory: str) -> dict[str, float]:
+    command = [
+        sys.executable, "-m", "tests.benchmarks.bench_template_boot",
+        "--worker", mode, "--directory", directory
+    ]
+    output = subprocess.run(command,
+                            check=True,
+                            capture_output=True,
+                            text=True).stdout
+    result = json.loads(output.splitlines()[-1])
+    return {"boot": result["boot"], **result["requests"]}
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[2])
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--worker", choices=MODES)
+    parser.add_argument("--directory")
+    args = parser.parse_args()
+    if args.worker:
+        worker(args.worker, args.directory)
+        return
+
+    with tempfile.TemporaryDirectory() as directory:
+        compile_templates = [
+            sys.executable, "-m", "flask", "--app", "app", "templates",
+            "compile"
+        ]
+        subprocess.run(compile_templates,
+                       check=True,
+                       capture_output=True,
+                       env={
+                           **os.environ, "TEMPLATE_CACHE_DIR": directory
+                       })
+        print(f"Median of {args.runs} fresh workers, in ms")
+        columns = ("boot", ) + PATHS
+        print(f"{'mode':>9} " + " ".join(f"{c:>14}" for c in columns) +
+              f" {'first 4 total':>14}")
+        for mode in MODES:
+            runs = [run(mode, directory) for _ in range(args.runs)]
+            medians = {
+                column: percentile(sorted(r[column] for r in runs), 50)
+                for column in columns
+            }
+            total = sum(medians[path] for path in PATHS)
+            print(f"{mode:>9} " + " ".join(f"{medians[c] * 1000:>14.1f}"
+                                           for c in columns) +
+                  f" {total * 1000:>14.1f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,23 +1,20 @@
 """conftest.py"""
 from __future__ import annotations
-from typing import Generator, Callable, Any
+from typing import ContextManager, Generator, Callable, Any
 import pytest
 from flask import Flask
+from sqlalchemy import Engine, event
 from app import create_app
+from config import TestingConfig
 from models import User
 from extensions import db, argon2
+from querybudget import query_budget
 
 
 @pytest.fixture
 def app() -> Generator[Flask, None, None]:
     # Create a test version of the app
-    app = create_app()
-    app.config.update({
-        "TESTING": True,
-        "SQLALCHEMY_DATABASE_URI":
-        "sqlite:///:memory:",  # In-memory test database
-        "WTF_CSRF_ENABLED": False,  # Disable CSRF for easier testing
-    })
+    app = create_app(TestingConfig)  # In-memory database, CSRF disabled
 
     with app.app_context():
         db.create_all()  # Create tables for tests
@@ -72,3 +69,47 @@ def auth(
                            **kwargs)
 
     return {"login": login, "logout": logout, "register": register}
+
+
+@pytest.fixture
+def assert_max_queries(
+        app: Flask) -> Callable[..., ContextManager[list[str]]]:
+    # with assert_max_queries(2): ... fails if the block sends more than two
+    # SQL statements (or, given repeat_threshold, repeats one too often)
+    return query_budget.assert_max_queries
+
+
+class FakeClock:
+    """A monotonic clock for caches and rate limiters, moved by `now`."""
+
+    def __init__(self) -> None:
+        self.now = 0.0
+
+    def __call__(self) -> float:
+        return self.now
+
+
+@pytest.fixture
+def clock() -> FakeClock:
+    return FakeClock()
+
+
+@pytest.fixture
+def count_queries() -> Generator[Callable[[], list[str]], None, None]:
+    # statements = count_queries() records the SQL statements the current
+    # app's engine sends from then on, until the end of the test
+    listeners: list[tuple[Engine, Callable[..., None]]] = []
+
+    def start() -> list[str]:
+        statements: list[str] = []
+
+        def before_cursor_execute(*args: Any) -> None:
+            statements.append(args[2])
+
+        event.listen(db.engine, "before_cursor_execute", before_cursor_execute)
+        listeners.append((db.engine, before_cursor_execute))
+        return statements
+
+    yield start
+    for engine, listener in listeners:
+        event.remove(engine, "before_cursor_execute", listener)
@@ -46,3 +46,31 @@ def test_rest_lockout_redirect(client: Any, auth: Any) -> None:
     _ = auth["login"]()
     response = client.post("/admin/reset_lockout/2")
     assert response.status_code == 302
+
+
+def test_reset_lockouts(client: Any, auth: Any) -> None:
+    admin_password, _ = generate_accounts()
+    _ = auth["login"]("testadmin", admin_password)
+    response = client.post("/admin/reset_lockouts/matching",
+                           data={"pattern": "nobody*"})
+    assert response.status_code == 200
+    assert response.get_data(as_text=True) == "Reset 0 accounts\n"
+    assert client.post("/admin/reset_lockouts/matching").status_code == 400
+    response = client.post("/admin/reset_lockouts/all")
+    assert response.mimetype == "text/plain"
+    assert response.get_data(as_text=True).splitlines() == [
+        "Chunk 1: reset 1 accounts (1 total)",
+        "Reset 1 accounts",
+    ]
+    test_user = User.query.filter_by(username="testuser").first()
+    assert test_user is not None
+    db.session.expire_all()
+    assert test_user.lockout_until is None
+    assert test_user.failed_attempts == 0
+    _ = auth["logout"]()
+
+
+def test_reset_lockouts_redirect(client: Any, auth: Any) -> None:
+    _ = auth["login"]()
+    response = client.post("/admin/reset_lockouts/all")
+    assert response.status_code == 302
@@ -0,0 +1,58 @@
+"""test_asgi.py"""
+from __future__ import annotations
+import asyncio
+import importlib
+from typing import Any
+import pytest
+
+pytest.importorskip("a2wsgi")
+
+
+async def call(app: Any, method: str, path: str,
+               body: bytes = b"") -> tuple[int, dict[bytes, bytes], bytes]:
+    """Send one HTTP request through an ASGI application."""
+    scope = {
+        "type": "http",
+        "asgi": {
+            "version": "3.0"
+        },
+        "http_version": "1.1",
+        "method": method,
+        "scheme": "http",
+        "path": path,
+        "raw_path": path.encode(),
+        "query_string": b"",
+        "root_path": "",
+        "headers": [(b"host", b"testserver"),
+                    (b"content-type", b"application/x-www-form-urlencoded")],
+        "server": ("testserver", 80),
+        "client": ("127.0.0.1", 50000),
+    }
+    messages: list[dict[str, Any]] = []
+
+    async def receive() -> dict[str, Any]:
+        return {"type": "http.request", "body": body, "more_body": False}
+
+    async def send(message: dict[str, Any]) -> None:
+        messages.append(message)
+
+    await app(scope, receive, send)
+    start = messages[0]
+    return (start["status"], dict(start["headers"]),
+            b"".join(message.get("body", b"") for message in messages[1:]))
+
+
+def test_asgi_app(monkeypatch: Any) -> None:
+    monkeypatch.setenv("ENVIRONMENT", "test")
+    module = importlib.import_module("asgi")
+    assert module.application.config["APP_ROLE"] == "web"
+
+    status, _, body = asyncio.run(call(module.app, "GET", "/"))
+    assert status == 200
+    assert b"Welcome to the Home Page!" in body
+
+    status, headers, _ = asyncio.run(
+        call(module.app, "POST", "/auth/login",
+             b"username=nobody&password=Wrong-Passw0rd"))
+    assert status == 200
+    assert headers[b"content-type"].startswith(b"text/html")
@@ -0,0 +1,199 @@
+"""test_audit.py"""
+from __future__ import annotations
+import json
+import time
+from pathlib import Path
+from typing import Any
+import pytest
+from flask import Flask
+from sqlalchemy import event, select
+from app import create_app
+from audit import LOGIN_FAILURE, audit
+from config import TestingConfig
+from extensions import db
+from models import AuditEvent, User
+
+
+def logged() -> list[tuple[str, str | None]]:
+    audit.flush()
+    return [(row.event, row.username)
+            for row in db.session.execute(
+                select(AuditEvent).order_by(AuditEvent.id)).scalars()]
+
+
+def test_login_events(app: Flask, client: Any, auth: Any) -> None:
+    app.config["LOCKOUT_THRESHOLD"] = 2
+    _ = auth["register"]("audituser", "Secret-Pass1!")
+    _ = auth["login"]("audituser", "wrong")
+    _ = auth["login"]("nosuchuser", "wrong")
+    _ = auth["login"]("audituser", "wrong")
+    _ = auth["login"]("audituser", "Secret-Pass1!")
+    _ = auth["login"]()
+    _ = auth["logout"]()
+    # Nothing is written on the request path
+    assert not db.session.execute(select(AuditEvent)).first()
+    assert logged() == [
+        ("register", "audituser"),
+        ("login_failure", "audituser"),
+        ("login_failure", "nosuchuser"),
+        ("login_failure", "audituser"),
+        ("lockout", "audituser"),
+        ("login_locked", "audituser"),
+        ("login_success", "testuser"),
+        ("logout", "testuser"),
+    ]
+    first = db.session.execute(select(AuditEvent)).scalars().first()
+    assert first is not None
+    assert first.remote_addr == "127.0.0.1"
+    user = User.query.filter_by(username="audituser").one()
+    assert first.user_id == user.id
+
+
+def test_reset_lockout_events(app: Flask, client: Any, auth: Any) -> None:
+    admin = User.query.filter_by(username="testuser").one()
+    admin.is_admin = True
+    db.session.commit()
+    _ = auth["login"]()
+    client.post(f"/admin/reset_lockout/{admin.id}")
+    client.post("/admin/reset_lockouts/matching", data={"pattern": "test*"})
+    audit.flush()
+    resets = db.session.execute(
+        select(AuditEvent).where(AuditEvent.event == "lockout_reset").order_by(
+            AuditEvent.id)).scalars()
+    assert [(row.username, row.detail) for row in resets] == [
+        ("testuser", "by testuser"),
+        ("test*", "matching, 0 accounts, by testuser"),
+    ]
+
+
+@pytest.mark.parametrize("policy,kept", [
+    ("drop_newest", ["event0", "event1", "event2"]),
+    ("drop_oldest", ["event2", "event3", "event4"]),
+    ("block", ["event0", "event1", "event2"]),
+])
+def test_overflow(monkeypatch: Any, policy: str, kept: list[str]) -> None:
+    monkeypatch.setattr(TestingConfig, "AUDIT_QUEUE_SIZE", 3)
+    monkeypatch.setattr(TestingConfig, "AUDIT_OVERFLOW", policy)
+    monkeypatch.setattr(TestingConfig, "AUDIT_BLOCK_TIMEOUT", 0.001)
+    app = create_app(TestingConfig)
+    with app.app_context():
+        db.create_all()
+        for index in range(5):
+            audit.record(LOGIN_FAILURE, f"event{index}")
+        assert audit.stats()["dropped"] == 2
+        assert [username for _, username in logged()] == kept
+        assert audit.stats()["written"] == 3
+
+
+def test_batches(app: Flask) -> None:
+    app.extensions["audit"].batch_size = 4
+    statements: list[str] = []
+    for index in range(10):
+        audit.record(LOGIN_FAILURE, f"event{index}")
+
+    def record(*args: Any) -> None:
+        statements.append(args[2])
+
+    event.listen(db.engine, "before_cursor_execute", record)
+    try:
+        assert audit.flush() == 10
+    finally:
+        event.remove(db.engine, "before_cursor_execute", record)
+    # One executemany INSERT per batch
+    assert sum("INSERT INTO audit_event" in statement
+               for statement in statements) == 3
+    assert len(logged()) == 10
+
+
+def test_flusher_thread(monkeypatch: Any, tmp_path: Path) -> None:
+    monkeypatch.setattr(TestingConfig, "AUDIT_FLUSHER", "thread")
+    monkeypatch.setattr(TestingConfig, "AUDIT_FLUSH_INTERVAL", 0.05)
+    monkeypatch.setattr(TestingConfig, "AUDIT_BACKEND", "file")
+    monkeypatch.setattr(TestingConfig, "AUDIT_FILE",
+                        str(tmp_path / "logs" / "audit.log"))
+    app = create_app(TestingConfig)
+    log = tmp_path / "logs" / "audit.log"
+    with app.app_context():
+        audit.record(LOGIN_FAILURE, "first", detail="written by time")
+        deadline = time.monotonic() + 5
+        while audit.stats()["written"] < 1 and time.monotonic() < deadline:
+            time.sleep(0.01)
+        assert json.loads(log.read_text())["username"] == "first"
+
+        # Written on shutdown
+        audit.record(LOGIN_FAILURE, "second")
+        audit.close()
+        lines = [json.loads(line) for line in log.read_text().splitlines()]
+        assert [line["username"] for line in lines] == ["first", "second"]
+        assert lines[0]["detail"] == "written by time"
+        assert lines[0]["created"].endswith("+00:00")
+        assert audit.stats() == {
+            "queued": 0,
+            "written": 2,
+            "dropped": 0,
+            "failed": 0
+        }
+
+
+def test_flusher_survives_bad_batch(monkeypatch: Any, tmp_path: Path) -> None:
+    monkeypatch.setattr(TestingConfig, "AUDIT_FLUSHER", "thread")
+    monkeypatch.setattr(TestingConfig, "AUDIT_FLUSH_INTERVAL", 0.05)
+    monkeypatch.setattr(TestingConfig, "AUDIT_BACKEND", "file")
+    monkeypatch.setattr(TestingConfig, "AUDIT_FILE",
+                        str(tmp_path / "audit.log"))
+    app = create_app(TestingConfig)
+    with app.app_context():
+
+        def wait_for(outcome: str) -> None:
+            deadline = time.monotonic() + 5
+            while audit.stats()[outcome] < 1 and time.monotonic() < deadline:
+                time.sleep(0.01)
+
+        # Fails to serialize, which is neither an OSError nor a database
+        # error
+        audit.record(LOGIN_FAILURE, "first", detail=b"bad")  # type: ignore
+        wait_for("failed")
+        audit.record(LOGIN_FAILURE, "second")
+        wait_for("written")
+        thread = app.extensions["audit"].thread
+        assert thread is not None and thread.is_alive()
+        audit.close()
+        assert audit.stats()["failed"] == 1
+        lines = (tmp_path / "audit.log").read_text().splitlines()
+        assert [json.loads(line)["username"] for line in lines] == ["second"]
+
+
+def test_long_values_truncated(app: Flask) -> None:
+    audit.record(LOGIN_FAILURE, "p" * 400, detail="d" * 400)
+    audit.flush()
+    event = db.session.execute(select(AuditEvent)).scalars().one()
+    assert event.username == "p" * 150
+    assert event.detail == "d" * 255
+
+
+def test_record_latency(app: Flask) -> None:
+    app.extensions["audit"].queue.maxsize = 0
+    count = 10_000
+    start = time.perf_counter()
+    for _ in range(count):
+        audit.record(LOGIN_FAILURE, "someuser", 1)
+    per_event = (time.perf_counter() - start) / count
+    # Microseconds, not a database round trip
+    assert per_event < 50e-6, per_event
+
+
+def test_disabled(app: Flask) -> None:
+    app.config["AUDIT_ENABLED"] = False
+    audit.record(LOGIN_FAILURE, "someuser")
+    assert audit.stats()["queued"] == 0
+
+
+def test_metrics(app: Flask, client: Any, auth: Any) -> None:
+    _ = auth["login"]("nosuchuser", "wrong")
+    audit.flush()
+    admin = User.query.filter_by(username="testuser").one()
+    admin.is_admin = True
+    db.session.commit()
+    _ = auth["login"]()
+    body = client.get("/admin/metrics").get_data(as_text=True)
+    assert 'audit_events_total{outcome="written"} 1' in body
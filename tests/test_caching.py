@@ -0,0 +1,116 @@
+"""test_caching.py"""
+from __future__ import annotations
+from typing import Any, Callable
+from flask import Flask
+from caching import TTLCache
+from extensions import db, user_cache
+from models import User, load_user
+
+
+def test_ttl_cache_lru_eviction() -> None:
+    cache: TTLCache[str, int] = TTLCache(maxsize=2, ttl=10)
+    cache.set("a", 1)
+    cache.set("b", 2)
+    assert cache.get("a") == 1  # "b" is now least recently used
+    cache.set("c", 3)
+    assert cache.get("b") is None
+    assert cache.get("a") == 1
+    assert cache.get("c") == 3
+    assert cache.stats() == {
+        "size": 2,
+        "hits": 3,
+        "misses": 1,
+        "evictions": 1,
+        "expirations": 0,
+        "invalidations": 0,
+    }
+
+
+def test_ttl_cache_expiry(clock: Any) -> None:
+    cache: TTLCache[str, int] = TTLCache(maxsize=2, ttl=10, clock=clock)
+    cache.set("a", 1)
+    clock.now = 9.9
+    assert cache.get("a") == 1
+    clock.now = 10
+    assert cache.get("a") is None
+    assert len(cache) == 0
+    assert cache.stats()["expirations"] == 1
+
+
+def test_ttl_cache_invalidate_and_clear() -> None:
+    cache: TTLCache[str, int] = TTLCache(maxsize=4, ttl=10)
+    cache.set("a", 1)
+    cache.set("b", 2)
+    cache.invalidate("a")
+    cache.invalidate("missing")
+    assert cache.get("a") is None
+    cache.clear()
+    assert len(cache) == 0
+    assert cache.stats()["invalidations"] == 2
+
+
+def test_ttl_cache_disabled() -> None:
+    cache: TTLCache[str, int] = TTLCache(maxsize=0, ttl=10)
+    cache.set("a", 1)
+    assert cache.get("a") is None
+
+
+def test_load_user_cached(app: Flask,
+                          count_queries: Callable[[], list[str]]) -> None:
+    user = User.query.filter_by(username="testuser").first()
+    assert user is not None
+    user_id = str(user.id)
+    db.session.remove()
+
+    statements = count_queries()
+    first = load_user(user_id)
+    assert first is not None
+    assert len(statements) == 1
+    db.session.remove()
+
+    second = load_user(user_id)
+    assert second is not None
+    assert second.username == "testuser"
+    assert second.is_admin is False
+    assert len(statements) == 1
+    assert user_cache.stats()["hits"] == 1
+
+    # A cached user is attached to the session and can be updated
+    second.failed_attempts = 2
+    db.session.commit()
+    user_cache.invalidate(second.id)
+    reloaded = load_user(user_id)
+    assert reloaded is not None
+    assert reloaded.failed_attempts == 2
+
+
+def test_load_user_missing(app: Flask) -> None:
+    assert load_user("12345") is None
+    assert user_cache.stats()["size"] == 0
+
+
+def get_dashboard(app: Flask, client: Any) -> Any:
+    # Requests reuse the fixture's app context, so use a fresh one to make
+    # Flask-Login load the user again instead of reading it from `g`
+    with app.app_context():
+        return client.get("/dashboard")
+
+
+def test_dashboard_uses_cache(app: Flask, client: Any, auth: Any,
+                              count_queries: Callable[[],
+                                                      list[str]]) -> None:
+    auth["login"]()
+    get_dashboard(app, client)
+    statements = count_queries()
+    response = get_dashboard(app, client)
+    assert response.status_code == 200
+    assert statements == []
+    assert user_cache.stats()["hits"] == 1
+
+
+def test_invalidated_on_login(app: Flask, client: Any, auth: Any) -> None:
+    auth["login"]()
+    get_dashboard(app, client)
+    assert user_cache.stats()["size"] == 1
+    auth["login"]("testuser", "WrongPassword!")
+    assert user_cache.stats()["size"] == 0
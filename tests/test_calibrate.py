@@ -0,0 +1,52 @@
+"""test_calibrate.py"""
+from __future__ import annotations
+from typing import Any
+from calibrate import benchmark, percentile
+
+
+def test_percentile() -> None:
+    samples = [float(value) for value in range(1, 101)]
+    assert percentile(samples, 50) == 50
+    assert percentile(samples, 99) == 99
+    assert percentile(samples, 100) == 100
+    assert percentile([], 50) == 0
+
+
+def test_benchmark() -> None:
+    result = benchmark(1, 8, 1, samples=3)
+    assert result.p50 <= result.p99
+    assert result.per_core_throughput > 0
+    assert result.strength == 8
+
+
+def test_argon2_calibrate(runner: Any) -> None:
+    result = runner.invoke(args=[
+        "argon2-calibrate", "--time-cost", "1,2", "--memory-cost", "8,16",
+        "--parallelism", "1", "--samples", "3", "--p50-ms", "1000",
+        "--p99-ms", "1000"
+    ])
+    assert result.exit_code == 0
+    assert "ARGON2_TIME_COST=2" in result.output
+    assert "ARGON2_MEMORY_COST=16" in result.output
+    assert "ARGON2_PARALLELISM=1" in result.output
+
+
+def test_argon2_calibrate_no_match(runner: Any) -> None:
+    result = runner.invoke(args=[
+        "argon2-calibrate", "--time-cost", "1", "--memory-cost", "8",
+        "--parallelism", "1", "--samples", "1", "--p50-ms", "0",
+        "--p99-ms", "0"
+    ])
+    assert result.exit_code != 0
+    assert "No parameter set met the latency targets" in result.output
+
+
+def test_argon2_calibrate_bad_list(runner: Any) -> None:
+    result = runner.invoke(args=["argon2-calibrate", "--time-cost", "x"])
+    assert result.exit_code != 0
+
+
+def test_argon2_calibrate_no_samples(runner: Any) -> None:
+    result = runner.invoke(args=["argon2-calibrate", "--samples", "0"])
+    assert result.exit_code == 2
+    assert "Invalid value for '--samples'" in result.output
@@ -0,0 +1,100 @@
+"""test_compression.py"""
+from __future__ import annotations
+import gzip
+import zlib
+from typing import Any, Iterator
+from flask import Flask, Response
+from app import create_app
+from config import TestingConfig
+
+GZIP = {"Accept-Encoding": "gzip, deflate, br"}
+
+
+def test_compressed_page(client: Any) -> None:
+    plain = client.get("/auth/register")
+    assert plain.headers.get("Content-Encoding") is None
+    assert "Accept-Encoding" in plain.headers["Vary"]
+
+    response = client.get("/auth/register", headers=GZIP)
+    assert response.status_code == 200
+    assert response.headers["Content-Encoding"] == "gzip"
+    assert response.headers["Vary"] == "Accept-Encoding, Cookie"
+    assert int(response.headers["Content-Length"]) == len(response.data)
+    assert len(response.data) < len(plain.data)
+    assert gzip.decompress(response.data) == plain.data
+
+
+def test_not_compressed(client: Any) -> None:
+    # Shorter than COMPRESSION_MIN_SIZE
+    response = client.get("/auth/username-available?username=someone",
+                          headers=GZIP)
+    assert response.headers.get("Content-Encoding") is None
+    assert "Accept-Encoding" in response.headers["Vary"]
+    # Refused by the client
+    response = client.get("/auth/register",
+                          headers={"Accept-Encoding": "gzip;q=0"})
+    assert response.headers.get("Content-Encoding") is None
+    # Files are left to flask assets build
+    response = client.get("/auth/static/username-availability.js",
+                          headers=GZIP)
+    assert response.headers.get("Content-Encoding") is None
+    assert "Accept-Encoding" not in response.headers.get("Vary", "")
+    response.close()
+
+
+def test_cached_page_etag_weakened(app: Flask, client: Any) -> None:
+    app.config["COMPRESSION_MIN_SIZE"] = 0
+    plain = client.get("/")
+    assert not plain.headers["ETag"].startswith("W/")
+
+    response = client.get("/", headers=GZIP)
+    assert response.headers["Content-Encoding"] == "gzip"
+    etag = response.headers["ETag"]
+    assert etag == f"W/{plain.headers['ETag']}"
+
+    response = client.get("/", headers={**GZIP, "If-None-Match": etag})
+    assert response.status_code == 304
+    assert response.headers["ETag"] == etag
+    assert "Accept-Encoding" in response.headers["Vary"]
+
+
+def test_streamed_response(app: Flask) -> None:
+    produced: list[int] = []
+    closed: list[bool] = []
+
+    class Body:
+
+        def __iter__(self) -> Iterator[bytes]:
+            for index in range(3):
+                produced.append(index)
+                yield f"chunk {index}\n".encode() * 10
+
+        def close(self) -> None:
+            closed.append(True)
+
+    @app.route("/stream")
+    def stream() -> Response:
+        return Response(Body(), mimetype="text/plain")
+
+    response = app.test_client().get("/stream",
+                                     headers=GZIP,
+                                     buffered=False)
+    assert response.headers["Content-Encoding"] == "gzip"
+    assert "Content-Length" not in response.headers
+    chunks = iter(response.response)
+    decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+    # Each chunk arrives as soon as it is produced
+    assert decompressor.decompress(next(chunks)) == b"chunk 0\n" * 10
+    assert produced == [0]
+    rest = b"".join(decompressor.decompress(chunk) for chunk in chunks)
+    assert rest == b"chunk 1\n" * 10 + b"chunk 2\n" * 10
+    response.close()
+    assert closed == [True]
+
+
+def test_compression_disabled(monkeypatch: Any) -> None:
+    monkeypatch.setattr(TestingConfig, "COMPRESSION_ENABLED", False)
+    response = create_app(TestingConfig).test_client().get("/auth/login",
+                                                           headers=GZIP)
+    assert response.headers.get("Content-Encoding") is None
+    assert "Accept-Encoding" not in response.headers["Vary"]
@@ -66,8 +66,11 @@ def test_run_create_admin_new_account(app_with_context: Flask) -> None:
     # Ensure no admin exists initially
     assert User.query.filter_by(is_admin=True).first() is None
 
-    # Mock the print function to capture the output
-    with mock.patch("builtins.print") as mock_print:
+    # Mock the print function to capture the output, and run the script
+    # against the test application and its database
+    with mock.patch("builtins.print") as mock_print, \
+            mock.patch("create_admin.create_app",
+                       return_value=app_with_context):
         run_create_admin()
 
         # Check that the admin account was created
@@ -91,8 +94,11 @@ def test_run_create_admin_existing_account(app_with_context: Flask) -> None:
     # First, create an admin account
     _, _ = create_admin_account()
 
-    # Mock the print function to capture the output
-    with mock.patch("builtins.print") as mock_print:
+    # Mock the print function to capture the output, and run the script
+    # against the test application and its database
+    with mock.patch("builtins.print") as mock_print, \
+            mock.patch("create_admin.create_app",
+                       return_value=app_with_context):
         run_create_admin()
 
         # Ensure the admin already exists and wasn't recreated
@@ -0,0 +1,54 @@
+"""test_database.py"""
+from __future__ import annotations
+from pathlib import Path
+from typing import Any
+import pytest
+from flask import Flask
+from sqlalchemy import text
+from app import create_app
+from config import (Config, DevelopmentConfig, ProductionConfig,
+                    TestingConfig, config_for, engine_options)
+from extensions import db
+
+
+def test_config_for() -> None:
+    assert config_for("dev") is DevelopmentConfig
+    assert config_for("prod") is ProductionConfig
+    assert config_for("test") is TestingConfig
+    with pytest.raises(ValueError, match="Unknown ENVIRONMENT"):
+        config_for("staging")
+
+
+def test_engine_options(monkeypatch: Any) -> None:
+    assert not engine_options("sqlite:///site.db")
+    assert not engine_options(None)
+    monkeypatch.setenv("DB_POOL_SIZE", "5")
+    options = engine_options("postgresql://app@db/app")
+    assert options["pool_size"] == 5
+    assert options["max_overflow"] == 20
+    assert options["pool_recycle"] == 1800
+    assert options["pool_pre_ping"] is True
+
+
+def test_testing_config_uses_memory_database(app: Flask) -> None:
+    assert app.testing
+    assert db.engine.url.database in (None, "", ":memory:")
+
+
+def test_sqlite_pragmas(tmp_path: Path, monkeypatch: Any) -> None:
+    monkeypatch.setattr(TestingConfig, "SQLALCHEMY_DATABASE_URI",
+                        f"sqlite:///{tmp_path / 'pragmas.db'}")
+    app = create_app(TestingConfig)
+    with app.app_context():
+        with db.engine.connect() as conn:
+
+            def pragma(name: str) -> Any:
+                return conn.execute(text(f"PRAGMA {name}")).scalar()
+
+            assert pragma("auto_vacuum") == 2  # INCREMENTAL
+            assert pragma("journal_mode") == "wal"
+            assert pragma("synchronous") == 1  # NORMAL
+            assert pragma("busy_timeout") == \
+                Config.SQLITE_PRAGMAS["busy_timeout"]
+            assert pragma("cache_size") == Config.SQLITE_PRAGMAS["cache_size"]
+        db.engine.dispose()
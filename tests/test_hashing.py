@@ -0,0 +1,178 @@
+"""test_hashing.py"""
+from __future__ import annotations
+import threading
+import time
+from typing import Any
+import pytest
+from argon2 import PasswordHasher
+from flask import Flask
+from extensions import db, password_hashing, argon2
+from hashing import HashingQueueFull
+from models import User
+
+TEST_USER_PASS = "TestPassword69@!"
+
+
+@pytest.mark.parametrize("mode", ["process", "thread", "inline"])
+def test_hash_and_verify(app: Flask, mode: str) -> None:
+    app.config.update({"HASHING_EXECUTOR": mode, "HASHING_WORKERS": 1})
+    try:
+        pw_hash = password_hashing.generate_password_hash(TEST_USER_PASS)
+        assert pw_hash != TEST_USER_PASS
+        assert argon2.check_password_hash(pw_hash, TEST_USER_PASS)
+        assert password_hashing.check_password_hash(pw_hash, TEST_USER_PASS)
+        assert not password_hashing.check_password_hash(pw_hash, "Wrong!")
+        assert not password_hashing.check_password_hash("bogus", "Wrong!")
+    finally:
+        password_hashing.shutdown()
+
+
+def test_empty_password(app: Flask) -> None:
+    with pytest.raises(ValueError, match="Password must be non-empty"):
+        password_hashing.generate_password_hash("")
+
+
+def test_stats(app: Flask, auth: Any) -> None:
+    auth["login"]()
+    auth["login"]("testuser", "WrongPassword!")
+    stats = password_hashing.stats()
+    assert stats["submitted"] == 2
+    assert stats["completed"] == 2
+    assert stats["in_flight"] == 0
+    assert stats["rejected"] == 0
+    assert stats["queue_wait_seconds_max"] >= 0
+    assert stats["hash_seconds_total"] > 0
+
+
+def test_queue_full(app: Flask, client: Any, auth: Any) -> None:
+    app.config.update({
+        "HASHING_EXECUTOR": "thread",
+        "HASHING_WORKERS": 1,
+        "HASHING_QUEUE_DEPTH": 0,
+        "HASHING_RETRY_AFTER": 3,
+    })
+    _, slots = app.extensions["password_hashing"].start()
+    assert slots.acquire(blocking=False)
+    try:
+        with pytest.raises(HashingQueueFull):
+            password_hashing.check_password_hash("hash", TEST_USER_PASS)
+        response = auth["login"]()
+        assert response.status_code == 503
+        assert response.headers["Retry-After"] == "3"
+        assert b"Service Unavailable" in response.data
+        assert password_hashing.stats()["rejected"] == 2
+    finally:
+        slots.release()
+        password_hashing.shutdown()
+
+    # Other pages are unaffected by a saturated hashing pool
+    assert client.get("/").status_code == 200
+
+
+def test_shutdown_with_jobs_in_flight(app: Flask) -> None:
+    app.config.update({
+        "HASHING_EXECUTOR": "thread",
+        "HASHING_WORKERS": 1,
+        "HASHING_QUEUE_DEPTH": 2,
+    })
+    state = app.extensions["password_hashing"]
+    executor, _ = state.start()
+    release = threading.Event()
+    # Keeps the only worker busy, so that the hashes below wait in the queue
+    executor.submit(release.wait)
+    errors: list[BaseException] = []
+
+    def hash_password() -> None:
+        with app.app_context():
+            try:
+                password_hashing.generate_password_hash(TEST_USER_PASS)
+            except HashingQueueFull as exc:
+                errors.append(exc)
+
+    callers = [threading.Thread(target=hash_password) for _ in range(2)]
+    for caller in callers:
+        caller.start()
+    while password_hashing.stats()["in_flight"] < 2:
+        time.sleep(0.001)
+    stopper = threading.Thread(target=state.shutdown)
+    stopper.start()
+    for caller in callers:
+        caller.join(timeout=5)
+    release.set()
+    stopper.join(timeout=5)
+    assert not stopper.is_alive()
+    # Cancelled, and turned into a 503 rather than a 500
+    assert len(errors) == 2
+    assert password_hashing.stats()["in_flight"] == 0
+
+
+def test_rehash_on_login(app: Flask, auth: Any) -> None:
+    outdated = PasswordHasher(time_cost=1, memory_cost=8,
+                              parallelism=1).hash(TEST_USER_PASS)
+    user = User.query.filter_by(username="testuser").first()
+    assert user is not None
+    user.password = outdated
+    db.session.commit()
+    assert password_hashing.needs_rehash(outdated)
+
+    response = auth["login"]()
+    assert response.status_code == 302
+    user = User.query.filter_by(username="testuser").first()
+    assert user is not None
+    assert user.password != outdated
+    assert not password_hashing.needs_rehash(user.password)
+    assert argon2.check_password_hash(user.password, TEST_USER_PASS)
+
+
+def test_rehash_skipped_when_busy(app: Flask, auth: Any,
+                                  monkeypatch: Any) -> None:
+    outdated = PasswordHasher(time_cost=1, memory_cost=8,
+                              parallelism=1).hash(TEST_USER_PASS)
+    user = User.query.filter_by(username="testuser").first()
+    assert user is not None
+    user.password = outdated
+    db.session.commit()
+    app.config.update({"HASHING_WORKERS": 1, "HASHING_QUEUE_DEPTH": 0})
+    _, slots = app.extensions["password_hashing"].start()
+    check = password_hashing.check_password_hash
+
+    def check_then_fill(pw_hash: str, password: str) -> bool:
+        # Other logins take every slot once the password has been verified
+        verified = check(pw_hash, password)
+        assert slots.acquire(blocking=False)
+        return verified
+
+    monkeypatch.setattr(password_hashing, "check_password_hash",
+                        check_then_fill)
+    try:
+        response = auth["login"]()
+    finally:
+        slots.release()
+        password_hashing.shutdown()
+    assert response.status_code == 302
+    assert password_hashing.stats()["rejected"] == 1
+    user = User.query.filter_by(username="testuser").first()
+    assert user is not None
+    assert user.password == outdated
+
+    # Upgraded on the next login instead
+    monkeypatch.undo()
+    auth["logout"]()
+    assert auth["login"]().status_code == 302
+    user = User.query.filter_by(username="testuser").first()
+    assert user is not None
+    assert not password_hashing.needs_rehash(user.password)
+
+
+def test_no_rehash_on_failed_login(app: Flask, auth: Any) -> None:
+    outdated = PasswordHasher(time_cost=1, memory_cost=8,
+                              parallelism=1).hash(TEST_USER_PASS)
+    user = User.query.filter_by(username="testuser").first()
+    assert user is not None
+    user.password = outdated
+    db.session.commit()
+
+    auth["login"]("testuser", "WrongPassword!")
+    user = User.query.filter_by(username="testuser").first()
+    assert user is not None
+    assert user.password == outdated
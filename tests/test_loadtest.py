@@ -0,0 +1,82 @@
+"""test_loadtest.py"""
+from __future__ import annotations
+import threading
+from typing import Any
+from flask import Flask
+from werkzeug.serving import make_server
+from loadtest import (EndpointStats, HTTPTransport, IdleConnections,
+                      LatencyHistogram)
+
+
+def test_histogram_precision() -> None:
+    histogram = LatencyHistogram()
+    for micros in range(1, 100_001):
+        histogram.record(micros / 1_000_000)
+    assert histogram.total == 100_000
+    for pct in (50, 90, 99, 99.9):
+        exact = pct / 100 * 100_000 / 1_000_000
+        assert abs(histogram.percentile(pct) - exact) <= exact / 64
+    assert histogram.percentile(100) == 0.1
+    assert len(histogram.counts) < 1000
+    assert LatencyHistogram().percentile(50) == 0
+
+
+def test_histogram_merge() -> None:
+    fast, slow = EndpointStats(), EndpointStats()
+    for _ in range(99):
+        fast.latencies.record(0.001)
+    slow.latencies.record(1.0)
+    slow.errors = 1
+    slow.statuses[500] = 1
+    fast.merge(slow)
+    assert fast.latencies.total == 100
+    assert fast.latencies.percentile(50) < 0.0011
+    assert fast.latencies.percentile(100) == 1.0
+    assert fast.errors == 1
+    assert fast.statuses == {500: 1}
+
+
+def test_loadtest(runner: Any) -> None:
+    result = runner.invoke(args=[
+        "loadtest", "--duration", "0.3", "--concurrency", "2", "--mix",
+        "home=2,dashboard=2,login_failed=1", "--seed", "1", "--histograms"
+    ])
+    assert result.exit_code == 0, result.output
+    table = result.output.split("\n\n")[0]
+    lines = {line.split()[0]: line.split() for line in table.splitlines()}
+    for scenario in ("home", "dashboard", "login_failed", "total"):
+        assert lines[scenario][3] == "0.0%"
+    assert int(lines["total"][1]) > 0
+    assert "unexpected statuses" not in result.output
+    assert "99.9" in result.output
+
+
+def test_loadtest_bad_mix(runner: Any) -> None:
+    result = runner.invoke(args=["loadtest", "--mix", "home=1,checkout=2"])
+    assert result.exit_code != 0
+    assert "name=weight" in result.output
+
+
+def test_idle_connections() -> None:
+    app = Flask(__name__)
+    app.add_url_rule("/", "home", lambda: "home")
+    server = make_server("127.0.0.1", 0, app, threaded=True)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    url = f"http://127.0.0.1:{server.server_port}"
+    try:
+        with IdleConnections(url, 3) as idle:
+            assert len(idle.sockets) == 3
+            # The threaded server gives each its own thread
+            assert HTTPTransport(url).request("GET", "/", None) == (200,
+                                                                    "home")
+            assert idle.open() == 3
+        assert not idle.sockets
+    finally:
+        server.shutdown()
+
+
+def test_idle_connections_need_url(runner: Any) -> None:
+    result = runner.invoke(args=["loadtest", "--idle-connections", "5"])
+    assert result.exit_code != 0
+    assert "needs --url" in result.output
@@ -0,0 +1,203 @@
+"""test_lockout.py"""
+from __future__ import annotations
+import threading
+from typing import Any, Generator
+from datetime import datetime, timedelta, timezone
+from pathlib import Path
+import pytest
+from flask import Flask
+from app import create_app
+from config import TestingConfig
+from extensions import db, argon2
+from lockout import LockoutState, lockout
+from models import User
+from querybudget import query_budget
+
+THREADS = 20
+THRESHOLD = 5
+
+
+@pytest.fixture(params=["database", "memory"])
+def file_app(request: Any, tmp_path: Path,
+             monkeypatch: Any) -> Generator[Flask, None, None]:
+    # Threads need their own connections, so use a database file
+    monkeypatch.setattr(TestingConfig, "SQLALCHEMY_DATABASE_URI",
+                        f"sqlite:///{tmp_path / 'lockout.db'}")
+    monkeypatch.setattr(TestingConfig,
+                        "LOCKOUT_BACKEND",
+                        request.param,
+                        raising=False)
+    app = create_app(TestingConfig)
+    app.config["LOCKOUT_THRESHOLD"] = THRESHOLD
+    with app.app_context():
+        db.create_all()
+        db.session.add(
+            User(username="lockoutuser",
+                 password=argon2.generate_password_hash("Password123!")))
+        db.session.commit()
+        yield app
+        db.session.remove()
+        db.drop_all()
+
+
+def get_user() -> User:
+    user: User | None = User.query.filter_by(username="lockoutuser").first()
+    assert user is not None
+    return user
+
+
+def test_concurrent_failures(file_app: Flask) -> None:
+    user_id = get_user().id
+    now = datetime.now(timezone.utc)
+    barrier = threading.Barrier(THREADS)
+    states: list[LockoutState] = []
+    errors: list[BaseException] = []
+
+    def fail() -> None:
+        try:
+            with file_app.app_context():
+                barrier.wait()
+                states.append(lockout.record_failure(user_id, now))
+                db.session.remove()
+        except BaseException as exc:  # pylint: disable=broad-except
+            errors.append(exc)
+
+    threads = [threading.Thread(target=fail) for _ in range(THREADS)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert not errors
+    # Every failure was counted exactly once
+    assert sorted(state.failed_attempts
+                  for state in states) == list(range(1, THREADS + 1))
+    for state in states:
+        assert state.locked == (state.failed_attempts >= THRESHOLD)
+
+    db.session.expire_all()
+    user = get_user()
+    locked_until = lockout.locked_until(user, now)
+    assert locked_until == now + file_app.config["LOCKOUT_DURATION"]
+    if file_app.config["LOCKOUT_BACKEND"] == "database":
+        assert user.failed_attempts == THREADS
+
+
+def test_lockout_threshold(file_app: Flask) -> None:
+    user = get_user()
+    now = datetime.now(timezone.utc)
+    for attempt in range(1, THRESHOLD):
+        state = lockout.record_failure(user.id, now)
+        assert state == LockoutState(attempt, None)
+        assert lockout.locked_until(get_user(), now) is None
+
+    state = lockout.record_failure(user.id, now)
+    assert state.failed_attempts == THRESHOLD
+    assert state.lockout_until == now + timedelta(minutes=15)
+    assert lockout.locked_until(get_user(), now) == state.lockout_until
+
+
+def test_expired_lockout_restarts_count(file_app: Flask) -> None:
+    user = get_user()
+    now = datetime.now(timezone.utc)
+    for _ in range(THRESHOLD):
+        lockout.record_failure(user.id, now)
+
+    later = now + timedelta(minutes=15, seconds=1)
+    assert lockout.locked_until(get_user(), later) is None
+    assert lockout.record_failure(user.id, later) == LockoutState(1, None)
+    assert lockout.locked_until(get_user(), later) is None
+
+
+def test_reset(file_app: Flask) -> None:
+    now = datetime.now(timezone.utc)
+    assert lockout.reset(get_user()) is False
+    for _ in range(THRESHOLD):
+        lockout.record_failure(get_user().id, now)
+    assert lockout.reset(get_user()) is True
+    assert lockout.locked_until(get_user(), now) is None
+    assert lockout.record_failure(get_user().id, now) == LockoutState(1, None)
+
+
+def lock_users(names: list[str], now: datetime) -> None:
+    for name in names:
+        user = User(username=name, password="unused")
+        db.session.add(user)
+        db.session.commit()
+        for _ in range(THRESHOLD):
+            lockout.record_failure(user.id, now)
+
+
+def test_reset_many_chunks(file_app: Flask) -> None:
+    now = datetime.now(timezone.utc)
+    lock_users([f"bot-{index}" for index in range(7)], now)
+    with query_budget.capture() as log:
+        assert list(lockout.reset_many(chunk_size=3)) == [3, 3, 1]
+    if file_app.config["LOCKOUT_BACKEND"] == "database":
+        # One UPDATE per chunk, no rows loaded
+        assert len(log) == 3
+        assert all(statement.startswith("UPDATE") for statement in log)
+    db.session.expire_all()
+    for user in User.query.all():
+        assert lockout.locked_until(user, now) is None
+    assert not list(lockout.reset_many())
+
+
+def test_reset_many_filters(file_app: Flask) -> None:
+    now = datetime.now(timezone.utc)
+    earlier = now - file_app.config["LOCKOUT_DURATION"] - timedelta(seconds=1)
+    lock_users(["bot_1", "botx1"], now)
+    lock_users(["bot_2", "human"], earlier)
+    # "_" is literal, unlike in LIKE
+    assert list(lockout.reset_many("bot_*", expired=True, now=now)) == [1]
+    assert list(lockout.reset_many("bot_*", now=now)) == [1]
+    assert list(lockout.reset_many(expired=True, now=now)) == [1]
+    db.session.expire_all()
+    botx1 = User.query.filter_by(username="botx1").one()
+    assert lockout.locked_until(botx1, now) is not None
+    assert list(lockout.reset_many(now=now)) == [1]
+
+
+def test_reset_lockouts_command(file_app: Flask) -> None:
+    lock_users(["bot-1", "bot-2", "bot-3"], datetime.now(timezone.utc))
+    runner = file_app.test_cli_runner()
+    result = runner.invoke(args=["lockout", "reset"])
+    assert result.exit_code == 2
+    assert "Pass either --all" in result.output
+    result = runner.invoke(
+        args=["lockout", "reset", "--match", "bot-*", "--chunk-size", "2"])
+    assert result.exit_code == 0, result.output
+    assert result.output.splitlines() == [
+        "Chunk 1: reset 2 accounts (2 total)",
+        "Chunk 2: reset 1 accounts (3 total)",
+        "Reset 3 accounts",
+    ]
+
+
+def test_login_lockout(file_app: Flask) -> None:
+    client = file_app.test_client()
+    for _ in range(THRESHOLD):
+        client.post("/auth/login",
+                    data={
+                        "username": "lockoutuser",
+                        "password": "WrongPassword!"
+                    })
+    db.session.expire_all()
+    assert lockout.locked_until(get_user()) is not None
+
+    # The correct password is refused while the account is locked
+    response = client.post("/auth/login",
+                           data={
+                               "username": "lockoutuser",
+                               "password": "Password123!"
+                           })
+    assert response.status_code == 200
+
+
+def test_unknown_backend(monkeypatch: Any) -> None:
+    monkeypatch.setattr(TestingConfig,
+                        "LOCKOUT_BACKEND",
+                        "redis",
+                        raising=False)
+    with pytest.raises(ValueError, match="Unknown LOCKOUT_BACKEND"):
+        create_app(TestingConfig)
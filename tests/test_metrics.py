@@ -0,0 +1,116 @@
+"""test_metrics.py"""
+from __future__ import annotations
+import gc
+import threading
+from typing import Any
+from flask import Flask
+from app import create_app
+from config import TestingConfig
+from extensions import argon2, db
+from metrics import render
+from models import User
+
+ADMIN_PASSWORD = "AdminPassword69@!"
+
+
+def add_admin() -> None:
+    db.session.add(
+        User(username="metricsadmin",
+             password=argon2.generate_password_hash(ADMIN_PASSWORD),
+             is_admin=True))
+    db.session.commit()
+
+
+def scrape(client: Any, **kwargs: Any) -> str:
+    response = client.get("/admin/metrics", **kwargs)
+    assert response.status_code == 200
+    assert response.mimetype == "text/plain"
+    return str(response.get_data(as_text=True))
+
+
+def test_metrics_require_admin(client: Any, auth: Any) -> None:
+    response = client.get("/admin/metrics")
+    assert response.status_code == 302
+    assert "/auth/login" in response.location
+    auth["login"]()
+    response = client.get("/admin/metrics")
+    assert response.status_code == 302
+    assert response.location.endswith("/")
+
+
+def test_metrics_exposition(client: Any, auth: Any) -> None:
+    add_admin()
+    client.get("/")
+    auth["login"]("testuser", "WrongPassword69@!")
+    auth["login"]("nosuchuser", "WrongPassword69@!")
+    auth["login"]("metricsadmin", ADMIN_PASSWORD)
+    text = scrape(client)
+    assert "# TYPE http_requests_total counter" in text
+    assert ('http_requests_total{endpoint="main.home",method="GET",'
+            'status="200"} 1') in text
+    assert ('http_request_duration_seconds_bucket{endpoint="auth.login",'
+            'le="+Inf"} 3') in text
+    assert 'login_attempts_total{outcome="failure"} 2' in text
+    assert 'login_attempts_total{outcome="success"} 1' in text
+    assert 'password_hash_duration_seconds_count{operation="verify"} 2' \
+        in text
+    assert 'db_query_duration_seconds_count{engine="primary"}' in text
+    assert 'db_pool_checkout_duration_seconds_count{engine="primary"}' \
+        in text
+
+
+def test_metrics_locked_outcome(app: Flask, client: Any, auth: Any) -> None:
+    for _ in range(app.config["LOCKOUT_THRESHOLD"] + 1):
+        auth["login"]("testuser", "WrongPassword69@!")
+    add_admin()
+    auth["login"]("metricsadmin", ADMIN_PASSWORD)
+    assert 'login_attempts_total{outcome="locked"} 1' in scrape(client)
+
+
+def test_metrics_token(monkeypatch: Any) -> None:
+    monkeypatch.setattr(TestingConfig, "METRICS_TOKEN", "s3cret")
+    app = create_app(TestingConfig)
+    with app.app_context():
+        # The redirect to the login page stores a flashed message
+        db.create_all()
+    client = app.test_client()
+    text = scrape(client, headers={"Authorization": "Bearer s3cret"})
+    assert "# TYPE login_attempts_total counter" in text
+    response = client.get("/admin/metrics",
+                          headers={"Authorization": "Bearer wrong"})
+    assert response.status_code == 302
+
+
+def test_metrics_disabled(monkeypatch: Any) -> None:
+    monkeypatch.setattr(TestingConfig, "METRICS_ENABLED", False)
+    app = create_app(TestingConfig)
+    assert "metrics" not in app.extensions
+    with app.test_request_context():
+        app.test_client().get("/")
+
+
+def test_thread_shards(app: Flask) -> None:
+    state = app.extensions["metrics"]
+    shards = len(state.shards)
+
+    def record() -> None:
+        for _ in range(1000):
+            state.inc("login_attempts_total", ("success", ))
+            state.observe("password_hash_duration_seconds", ("hash", ), 0.03)
+
+    threads = [threading.Thread(target=record) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    del threads, thread
+    gc.collect()
+    # Finished threads are folded into `retired`
+    assert len(state.shards) == shards
+    text = render(state.collect())
+    assert 'login_attempts_total{outcome="success"} 4000' in text
+    assert ('password_hash_duration_seconds_bucket{operation="hash",'
+            'le="0.025"} 0') in text
+    assert ('password_hash_duration_seconds_bucket{operation="hash",'
+            'le="0.05"} 4000') in text
+    assert 'password_hash_duration_seconds_sum{operation="hash"} 120' in text
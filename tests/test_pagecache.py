@@ -0,0 +1,73 @@
+"""test_pagecache.py"""
+from __future__ import annotations
+from typing import Any
+from unittest import mock
+from flask import Flask, render_template
+from extensions import page_cache
+
+
+def test_home_is_cached(app: Flask, client: Any) -> None:
+    with mock.patch("blueprints.main.routes.render_template",
+                    wraps=render_template) as render:
+        first = client.get("/")
+        second = client.get("/")
+    assert render.call_count == 1
+    assert first.data == second.data
+    assert b"Welcome" in second.data
+    etag, weak = second.get_etag()
+    assert etag and not weak
+    assert "Cookie" in second.headers["Vary"]
+    assert page_cache.stats()["hits"] == 1
+
+
+def test_if_none_match(client: Any) -> None:
+    etag = client.get("/").get_etag()[0]
+    response = client.get("/", headers={"If-None-Match": f'"{etag}"'})
+    assert response.status_code == 304
+    assert response.data == b""
+    assert response.get_etag()[0] == etag
+    response = client.get("/", headers={"If-None-Match": '"stale"'})
+    assert response.status_code == 200
+
+
+def test_bypass_with_pending_flashes(app: Flask, client: Any) -> None:
+    client.get("/")
+    with client.session_transaction() as session:
+        session["_flashes"] = [("info", "Flashed message")]
+    response = client.get("/")
+    assert b"Flashed message" in response.data
+    assert page_cache.stats()["bypassed"] == 1
+    # The message was shown, so the cached page is served again
+    assert b"Flashed message" not in client.get("/").data
+
+
+def test_bypass_when_authenticated(app: Flask, client: Any,
+                                   auth: Any) -> None:
+    client.get("/")
+    auth["login"]()
+    with app.app_context():
+        response = client.get("/")
+    assert b"Hello, testuser!" in response.data
+    assert response.get_etag() == (None, None)
+
+
+def test_404_pages_share_an_entry(app: Flask, client: Any) -> None:
+    for path in ("/wp-admin", "/.env", "/phpmyadmin/index.php"):
+        response = client.get(path)
+        assert response.status_code == 404
+        assert b"Page Not Found" in response.data
+    stats = page_cache.stats()
+    assert stats["size"] == 1
+    assert stats["hits"] == 2
+    etag = response.get_etag()[0]
+    # Conditional requests only apply to successful responses
+    response = client.get("/.git/config",
+                          headers={"If-None-Match": f'"{etag}"'})
+    assert response.status_code == 404
+
+
+def test_disabled(app: Flask, client: Any) -> None:
+    app.config["PAGE_CACHE_ENABLED"] = False
+    client.get("/")
+    client.get("/")
+    assert page_cache.stats()["size"] == 0
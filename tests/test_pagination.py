@@ -0,0 +1,172 @@
+"""test_pagination.py"""
+from __future__ import annotations
+import re
+import statistics
+import time
+from datetime import datetime, timedelta, timezone
+from typing import Any
+import pytest
+from flask import Flask
+from sqlalchemy import event, insert, select
+from blueprints.admin import routes
+from extensions import db
+from models import User
+from pagination import (decode_cursor, encode_cursor, keyset_page,
+                        starts_with)
+
+SEEDED = 50_000
+START = datetime(2024, 1, 1)
+
+
+def seed(count: int) -> None:
+    now = datetime.now(timezone.utc)
+    db.session.execute(insert(User), [{
+        "username": f"user{index:06d}",
+        "password": "unused",
+        "created": START + timedelta(seconds=index),
+        "failed_attempts": 5 if index % 10 == 0 else 0,
+        "lockout_until": (now + timedelta(minutes=index % 15 + 1)
+                          if index % 10 == 0 else None),
+        "is_admin": False,
+    } for index in range(count)])
+    db.session.commit()
+
+
+def login_admin(auth: Any) -> None:
+    user = User.query.filter_by(username="testuser").one()
+    user.is_admin = True
+    db.session.commit()
+    _ = auth["login"]()
+
+
+def listed(page: str) -> list[str]:
+    return re.findall(r"<td>(user\d+)</td>", page)
+
+
+def next_url(page: str) -> str | None:
+    match = re.search(r'<a href="([^"]+)">Next page</a>', page)
+    return match.group(1).replace("&amp;", "&") if match else None
+
+
+def test_cursor_round_trip() -> None:
+    created = datetime(2024, 5, 6, 7, 8, 9, 123456)
+    cursor = encode_cursor([created, 42])
+    assert re.fullmatch(r"[A-Za-z0-9_-]+", cursor)
+    assert decode_cursor(cursor, [User.created, User.id]) == [created, 42]
+    for malformed in ("!!", encode_cursor([1]), "e30",
+                      encode_cursor([1, 1]), encode_cursor([{"a": 1}, 1]),
+                      encode_cursor(["yesterday", 1]),
+                      encode_cursor([created, "1"]),
+                      encode_cursor([created, True])):
+        with pytest.raises(ValueError, match="Malformed cursor"):
+            decode_cursor(malformed, [User.created, User.id])
+    assert decode_cursor(encode_cursor(["user1"]),
+                         [User.username]) == ["user1"]
+
+
+def test_starts_with(app: Flask) -> None:
+    seed(120)
+    names = db.session.execute(
+        select(User.username).where(starts_with(
+            User.username, "user0001")).order_by(User.username)).scalars()
+    assert list(names) == [f"user{index:06d}" for index in range(100, 120)]
+    # Code points without a usable successor
+    for name in ("user\U0010ffff\U0010ffff", "\U0010ffffuser",
+                 "user\ud7ffname"):
+        db.session.add(User(username=name, password="unused"))
+    db.session.commit()
+    for prefix, expected in (
+        ("user\U0010ffff", ["user\U0010ffff\U0010ffff"]),
+        ("\U0010ffff", ["\U0010ffffuser"]),
+        ("user\ud7ff", ["user\ud7ffname"]),
+    ):
+        assert list(
+            db.session.execute(
+                select(User.username).where(
+                    starts_with(User.username, prefix))).scalars()) == expected
+
+
+@pytest.mark.parametrize("query,expected", [
+    ("", [f"user{index:06d}" for index in reversed(range(25))]),
+    # By the end of the lockout, 1, 11 and 6 minutes from now
+    ("?locked=1", [f"user{index:06d}" for index in (0, 20, 10)]),
+    ("?prefix=user00001", [f"user{index:06d}" for index in range(10, 20)]),
+])
+def test_users_pages(app: Flask, client: Any, auth: Any, monkeypatch: Any,
+                     query: str, expected: list[str]) -> None:
+    monkeypatch.setattr(routes, "USERS_PER_PAGE", 4)
+    seed(25)
+    login_admin(auth)
+    url: str | None = f"/admin/users{query}"
+    seen: list[str] = []
+    while url is not None:
+        response = client.get(url)
+        assert response.status_code == 200
+        page = response.get_data(as_text=True)
+        assert 0 < len(listed(page)) <= 4
+        seen += listed(page)
+        url = next_url(page)
+    assert seen == expected
+
+
+def test_users_bad_cursor(app: Flask, client: Any, auth: Any) -> None:
+    login_admin(auth)
+    assert client.get("/admin/users?after=garbage").status_code == 400
+    # Well formed, but not a (created, id) key
+    after = encode_cursor([1, 1])
+    assert client.get(f"/admin/users?after={after}").status_code == 400
+    assert client.get("/admin/users?prefix=%F4%8F%BF%BF").status_code == 200
+
+
+def test_users_redirect(client: Any, auth: Any) -> None:
+    _ = auth["login"]()
+    assert client.get("/admin/users").status_code == 302
+
+
+def test_constant_page_latency(app: Flask, client: Any, auth: Any) -> None:
+    seed(SEEDED)
+    login_admin(auth)
+    statements: list[tuple[str, Any]] = []
+
+    def record(_conn: Any, _cursor: Any, statement: str, parameters: Any,
+               *_args: Any) -> None:
+        statements.append((statement, parameters))
+
+    event.listen(db.engine, "before_cursor_execute", record)
+    try:
+        for query in ("", "?locked=1", "?prefix=user04"):
+            # Walk deep into the list, then check how the page is read
+            url: str | None = f"/admin/users{query}"
+            for _ in range(20):
+                assert url is not None
+                url = next_url(client.get(url).get_data(as_text=True))
+            statements.clear()
+            client.get(url)
+            statement, parameters = statements[-1]
+            plan = " ".join(row[-1] for row in db.session().connection(
+            ).exec_driver_sql(f"EXPLAIN QUERY PLAN {statement}", parameters))
+            # A seek into an index, not a scan
+            assert plan.startswith("SEARCH user USING INDEX"), plan
+            assert "TEMP B-TREE" not in plan, plan
+    finally:
+        event.remove(db.engine, "before_cursor_execute", record)
+
+    columns = [User.created, User.id]
+    last = db.session.execute(
+        select(User.created, User.id).order_by(User.created,
+                                               User.id).offset(100)).first()
+    assert last is not None
+    deep_cursor = encode_cursor(list(last))
+
+    def timed(cursor: str | None) -> float:
+        samples = []
+        for _ in range(20):
+            start = time.perf_counter()
+            keyset_page(select(User), columns, cursor, 50, descending=True)
+            samples.append(time.perf_counter() - start)
+            db.session().expunge_all()
+        return statistics.median(samples)
+
+    # The 100th oldest user is close to the last page, yet it is read as
+    # quickly as the first
+    assert timed(deep_cursor) < timed(None) * 3 + 0.002
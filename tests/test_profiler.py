@@ -0,0 +1,148 @@
+"""test_profiler.py"""
+from __future__ import annotations
+import pstats
+import time
+from collections import Counter
+from pathlib import Path
+from typing import Any
+import pytest
+from flask import Flask
+from app import create_app
+from config import TestingConfig
+from extensions import argon2, db
+from models import User
+from profiler import Profile
+
+ADMIN_PASSWORD = "AdminPassword69@!"
+
+
+def busy(seconds: float) -> None:
+    deadline = time.perf_counter() + seconds
+    while time.perf_counter() < deadline:
+        pass
+
+
+@pytest.fixture
+def profiled_app(monkeypatch: Any) -> Any:
+    monkeypatch.setattr(TestingConfig, "PROFILER_ENABLED", True)
+    monkeypatch.setattr(TestingConfig, "PROFILER_THRESHOLD", 0.05)
+    monkeypatch.setattr(TestingConfig, "PROFILER_SAMPLE_RATE", 0.0)
+    monkeypatch.setattr(TestingConfig, "PROFILER_INTERVAL", 0.001)
+    app = create_app(TestingConfig)
+
+    @app.route("/slow")
+    def slow() -> str:
+        busy(0.1)
+        return "slow"
+
+    @app.route("/fast")
+    def fast() -> str:
+        return "fast"
+
+    with app.app_context():
+        db.create_all()
+        db.session.add(
+            User(username="profileadmin",
+                 password=argon2.generate_password_hash(ADMIN_PASSWORD),
+                 is_admin=True))
+        db.session.commit()
+        yield app
+
+
+def load_stats(path: Path) -> dict[tuple[str, int, str], Any]:
+    # The typeshed stub leaves out the loaded statistics
+    loaded: Any = pstats.Stats(str(path))
+    stats: dict[tuple[str, int, str], Any] = loaded.stats
+    return stats
+
+
+def admin_client(app: Flask) -> Any:
+    client = app.test_client()
+    client.post("/auth/login",
+                data={
+                    "username": "profileadmin",
+                    "password": ADMIN_PASSWORD
+                })
+    return client
+
+
+def test_profile_formats(tmp_path: Path) -> None:
+    view = ("/app/views.py", 10, "view", "views")
+    query = ("/app/db.py", 20, "query", "db")
+    render = ("/app/views.py", 30, "render", "views")
+    profile = Profile(1, "main.home", "GET", 200, 0.0, 0.5, 0.01,
+                      Counter({
+                          (view, query): 3,
+                          (view, render): 1,
+                          (view, ): 1
+                      }))
+    assert profile.samples == 5
+    assert profile.collapsed() == ("views:view;db:query 3\n"
+                                   "views:view;views:render 1\n"
+                                   "views:view 1\n")
+
+    path = tmp_path / "profile.pstats"
+    path.write_bytes(profile.pstats())
+    stats = load_stats(path)
+    calls, _, own, total, callers = stats[view[:3]]
+    assert (calls, own, total, callers) == (5, pytest.approx(0.01),
+                                            pytest.approx(0.05), {})
+    calls, _, own, total, callers = stats[query[:3]]
+    assert (calls, own, total) == (3, pytest.approx(0.03),
+                                   pytest.approx(0.03))
+    assert callers[view[:3]][0] == 3
+
+
+def test_slow_requests_kept(profiled_app: Flask) -> None:
+    client = profiled_app.test_client()
+    assert client.get("/fast").status_code == 200
+    assert client.get("/slow").status_code == 200
+    state = profiled_app.extensions["profiler"]
+    assert [profile.endpoint for profile in state.profiles] == ["slow"]
+    profile = state.profiles[0]
+    assert profile.duration >= 0.1
+    assert profile.samples > 10
+    assert "test_profiler:busy" in profile.collapsed()
+    # The sampler stops once no request is in flight
+    time.sleep(0.01)
+    assert state.sampler is None and not state.active
+
+
+def test_profile_downloads(profiled_app: Flask, tmp_path: Path) -> None:
+    client = admin_client(profiled_app)
+    client.get("/slow")
+    listed = client.get("/admin/profiles").get_json()["profiles"]
+    profile = next(entry for entry in listed if entry["endpoint"] == "slow")
+    assert profile["status"] == 200 and profile["duration_ms"] >= 100
+
+    response = client.get(profile["collapsed"])
+    assert response.status_code == 200
+    assert response.mimetype == "text/plain"
+    assert "attachment" in response.headers["Content-Disposition"]
+    assert "<locals>.slow;test_profiler:busy" in response.get_data(
+        as_text=True)
+
+    response = client.get(profile["pstats"])
+    assert response.status_code == 200
+    path = tmp_path / "slow.pstats"
+    path.write_bytes(response.data)
+    assert any(name == "busy" for _, _, name in load_stats(path))
+
+    assert client.get("/admin/profiles/9999.collapsed").status_code == 404
+    assert client.get(profile["collapsed"].replace(
+        ".collapsed", ".svg")).status_code == 404
+
+
+def test_profiles_require_admin(client: Any, auth: Any) -> None:
+    response = client.get("/admin/profiles")
+    assert response.status_code == 302
+    assert "/auth/login" in response.location
+    auth["login"]()
+    response = client.get("/admin/profiles/1.pstats")
+    assert response.status_code == 302
+    assert response.location.endswith("/")
+
+
+def test_profiler_disabled(app: Flask, client: Any) -> None:
+    client.get("/")
+    assert "profiler" not in app.extensions
@@ -0,0 +1,145 @@
+"""test_provisioning.py"""
+from __future__ import annotations
+import csv
+import json
+from pathlib import Path
+from typing import Any, Iterator
+import pytest
+from flask import Flask
+from sqlalchemy import func, select
+from extensions import argon2, db
+from hashing import HasherParams, InlineExecutor
+from models import User
+from provisioning import ImportStats, UserImporter
+
+CHEAP: HasherParams = (1, 8, 1, 16, 16, "utf-8")
+
+
+@pytest.fixture(autouse=True)
+def cheap_hashing(monkeypatch: Any) -> None:
+    monkeypatch.setattr(argon2, "time_cost", 1)
+    monkeypatch.setattr(argon2, "memory_cost", 8)
+    monkeypatch.setattr(argon2, "parallelism", 1)
+
+
+def user(username: str) -> User | None:
+    found: User | None = User.query.filter_by(username=username).first()
+    return found
+
+
+def write_jsonl(path: Path, records: list[dict[str, Any]]) -> str:
+    path.write_text("".join(json.dumps(record) + "\n" for record in records))
+    return str(path)
+
+
+def test_import_csv(app: Flask, runner: Any, tmp_path: Path) -> None:
+    source = tmp_path / "users.csv"
+    source.write_text("username,password,is_admin\n"
+                      "importedone,Secret-Pass1,true\n"
+                      "importedtwo,,\n"
+                      "short,Secret-Pass1,\n"
+                      "importedone,Other-Pass1,\n"
+                      "testuser,Secret-Pass1,\n")
+    generated = tmp_path / "generated.csv"
+    result = runner.invoke(args=[
+        "users", "import",
+        str(source), "--generated",
+        str(generated), "--workers", "0", "--batch-size", "2"
+    ])
+    assert result.exit_code == 0, result.output
+    assert "Record 3: username must be 8 to 150 characters" in result.output
+    assert "5 records, 2 created, 2 existing, 1 invalid" in result.output
+    assert "Imported 2 users" in result.output
+
+    one = user("importedone")
+    assert one is not None and one.is_admin
+    assert argon2.check_password_hash(one.password, "Secret-Pass1")
+    two = user("importedtwo")
+    assert two is not None and not two.is_admin
+    assert generated.stat().st_mode & 0o777 == 0o600
+    rows = list(csv.reader(generated.open()))
+    assert [row[0] for row in rows] == ["importedtwo"]
+    assert argon2.check_password_hash(two.password, rows[0][1])
+    assert user("short") is None
+
+
+def test_import_requires_generated(app: Flask, runner: Any,
+                                   tmp_path: Path) -> None:
+    source = write_jsonl(tmp_path / "users.jsonl", [
+        {
+            "username": "importedone",
+            "password": "Secret-Pass1"
+        },
+        {
+            "username": "importedtwo"
+        },
+    ])
+    result = runner.invoke(
+        args=["users", "import", source, "--workers", "0"])
+    assert result.exit_code == 1
+    assert "record 2 has no password" in result.output
+    assert user("importedtwo") is None
+
+
+def test_import_resume(app: Flask, runner: Any, tmp_path: Path) -> None:
+    source = write_jsonl(tmp_path / "users.jsonl", [{
+        "username": f"imported{index}",
+        "password": "Secret-Pass1"
+    } for index in range(6)])
+    checkpoint = tmp_path / "checkpoint.json"
+    checkpoint.write_text(json.dumps({"input": source, "position": 4}))
+    result = runner.invoke(args=[
+        "users", "import", source, "--checkpoint",
+        str(checkpoint), "--workers", "0"
+    ])
+    assert result.exit_code == 0, result.output
+    assert "Resumed after record 4" in result.output
+    assert user("imported3") is None
+    assert user("imported4") is not None
+    assert user("imported5") is not None
+    assert json.loads(checkpoint.read_text())["position"] == 6
+
+    checkpoint.write_text(json.dumps({"input": "other.csv", "position": 1}))
+    result = runner.invoke(args=[
+        "users", "import", source, "--checkpoint",
+        str(checkpoint), "--workers", "0"
+    ])
+    assert result.exit_code == 1
+    assert "is for other.csv" in result.output
+
+
+def test_import_process_pool(app: Flask, runner: Any,
+                             tmp_path: Path) -> None:
+    source = write_jsonl(tmp_path / "users.jsonl", [{
+        "username": f"imported{index}",
+        "password": f"Secret-Pass{index}"
+    } for index in range(3)])
+    result = runner.invoke(
+        args=["users", "import", source, "--workers", "1"])
+    assert result.exit_code == 0, result.output
+    imported = user("imported2")
+    assert imported is not None
+    assert argon2.check_password_hash(imported.password, "Secret-Pass2")
+
+
+def test_bounded_memory(app: Flask) -> None:
+    read = 0
+    ahead: list[int] = []
+
+    def records() -> Iterator[dict[str, Any]]:
+        nonlocal read
+        for index in range(1000):
+            read += 1
+            yield {"username": f"imported{index:04d}", "password": "x"}
+
+    def on_batch(stats: ImportStats, _passwords: dict[str, str]) -> None:
+        ahead.append(read - stats.position)
+
+    importer = UserImporter(InlineExecutor(), CHEAP, 50, 3,
+                            lambda *_: None, on_batch)
+    stats = importer.run(records())
+    assert stats.created == 1000
+    assert db.session.execute(select(
+        func.count()).select_from(User)).scalar() == 1001
+    # Never more than the batches being hashed and inserted
+    assert max(ahead) <= (3 + 1) * 50
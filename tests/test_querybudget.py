@@ -0,0 +1,106 @@
+"""test_querybudget.py"""
+from __future__ import annotations
+from typing import Any, Callable, ContextManager
+import pytest
+from flask import Flask
+from app import create_app
+from config import TestingConfig
+from extensions import db
+from models import User
+from querybudget import (QueryBudgetExceeded, QueryBudgetWarning,
+                         query_budget, statement_shape)
+
+
+def add_views(app: Flask) -> None:
+
+    @app.route("/two-queries")
+    @query_budget.limit(1)
+    def two_queries() -> str:
+        User.query.filter_by(username="a").first()
+        User.query.filter_by(username="b").first()
+        return "ok"
+
+    @app.route("/n-plus-one")
+    def n_plus_one() -> str:
+        for ident in range(5):
+            db.session.get(User, ident + 100)
+        return "ok"
+
+
+def test_statement_shape() -> None:
+    assert statement_shape("SELECT * FROM user WHERE id = 5 AND name = 'x'"
+                           ) == "SELECT * FROM user WHERE id = ? AND name = ?"
+    assert statement_shape("SELECT id FROM user\n WHERE id IN (?, ?, ?)"
+                           ) == "SELECT id FROM user WHERE id IN (?)"
+    assert statement_shape("SELECT anon_1.id FROM t1 AS anon_1"
+                           ) == "SELECT anon_1.id FROM t1 AS anon_1"
+
+
+def test_declared_budgets(app: Flask) -> None:
+    assert query_budget.budget("auth.login") == 5
+    # Declared under login_required and page_cache.cached
+    assert query_budget.budget("main.dashboard") == 1
+    assert query_budget.budget("main.home") == 1
+    assert query_budget.budget("static") is None
+
+
+def test_login_within_budget(
+        auth: Any,
+        assert_max_queries: Callable[..., ContextManager[list[str]]]) -> None:
+    with assert_max_queries(5, repeat_threshold=3) as statements:
+        response = auth["login"]()
+    assert response.status_code == 302
+    assert statements
+
+
+def test_assert_max_queries_fails(
+        assert_max_queries: Callable[..., ContextManager[list[str]]]) -> None:
+    with pytest.raises(QueryBudgetExceeded, match="budget is 1"):
+        with assert_max_queries(1):
+            User.query.all()
+            User.query.all()
+    with pytest.raises(QueryBudgetExceeded, match="same statement 2 times"):
+        with assert_max_queries(5, repeat_threshold=2):
+            User.query.all()
+            User.query.all()
+
+
+def test_budget_exceeded_raises(app: Flask, client: Any) -> None:
+    add_views(app)
+    with pytest.raises(QueryBudgetExceeded, match="two_queries sent 2 SQL"):
+        client.get("/two-queries")
+    with pytest.raises(QueryBudgetExceeded, match="same statement 5 times"):
+        client.get("/n-plus-one")
+
+
+def test_budget_override(app: Flask, client: Any) -> None:
+    add_views(app)
+    app.config["QUERY_BUDGETS"] = {"two_queries": 2}
+    assert client.get("/two-queries").status_code == 200
+    app.config["QUERY_REPEAT_THRESHOLD"] = 6
+    assert client.get("/n-plus-one").status_code == 200
+
+
+def test_budget_warns(monkeypatch: Any) -> None:
+    monkeypatch.setattr(TestingConfig, "QUERY_BUDGET_MODE", "warn")
+    app = create_app(TestingConfig)
+    add_views(app)
+    with app.app_context():
+        db.create_all()
+    with pytest.warns(QueryBudgetWarning, match="budget is 1"):
+        assert app.test_client().get("/two-queries").status_code == 200
+
+
+def test_budget_off(monkeypatch: Any) -> None:
+    monkeypatch.setattr(TestingConfig, "QUERY_BUDGET_MODE", "off")
+    app = create_app(TestingConfig)
+    add_views(app)
+    with app.app_context():
+        db.create_all()
+    assert app.test_client().get("/n-plus-one").status_code == 200
+
+
+def test_unknown_mode(monkeypatch: Any) -> None:
+    monkeypatch.setattr(TestingConfig, "QUERY_BUDGET_MODE", "fail")
+    with pytest.raises(ValueError, match="Unknown QUERY_BUDGET_MODE"):
+        create_app(TestingConfig)
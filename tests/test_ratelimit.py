@@ -0,0 +1,120 @@
+"""test_ratelimit.py"""
+from __future__ import annotations
+from typing import Any
+import pytest
+from flask import Flask
+from app import create_app
+from config import TestingConfig
+from extensions import db, password_hashing, ratelimiter
+from ratelimit import TokenBuckets, parse_rule
+
+
+@pytest.mark.parametrize("rule, expected", [
+    ("10/minute", (10, 60)),
+    ("5/second", (5, 1)),
+    ("100 / 5m", (100, 300)),
+    ("1/h", (1, 3600)),
+    ("2/day", (2, 86400)),
+])
+def test_parse_rule(rule: str, expected: tuple[int, float]) -> None:
+    assert parse_rule(rule) == expected
+
+
+@pytest.mark.parametrize("rule", ["ten per minute", "0/minute", "5/0m"])
+def test_parse_rule_invalid(rule: str) -> None:
+    with pytest.raises(ValueError, match="Invalid rate limit rule"):
+        parse_rule(rule)
+
+
+def test_token_buckets(clock: Any) -> None:
+    buckets = TokenBuckets(max_keys=10, clock=clock)
+    assert buckets.hit("a", 2, 60) == 0
+    assert buckets.hit("a", 2, 60) == 0
+    assert buckets.hit("a", 2, 60) == pytest.approx(30)
+    assert buckets.hit("b", 2, 60) == 0
+
+    # A token is refilled every 30 seconds
+    clock.now = 30
+    assert buckets.hit("a", 2, 60) == 0
+    assert buckets.hit("a", 2, 60) > 0
+    assert (buckets.allowed, buckets.rejected) == (4, 2)
+
+
+def test_token_buckets_bounded() -> None:
+    buckets = TokenBuckets(max_keys=2)
+    for key in ("a", "b", "c"):
+        buckets.hit(key, 1, 60)
+    assert len(buckets) == 2
+    # "a" was evicted and starts with a full bucket again
+    assert buckets.hit("a", 1, 60) == 0
+    assert buckets.hit("c", 1, 60) > 0
+
+
+def login(client: Any, username: str = "testuser", **kwargs: Any) -> Any:
+    return client.post("/auth/login",
+                       data={
+                           "username": username,
+                           "password": "WrongPassword!"
+                       },
+                       **kwargs)
+
+
+def test_login_username_limit(app: Flask, client: Any) -> None:
+    app.config["RATELIMIT_LOGIN_USERNAME"] = "2/minute"
+    assert login(client).status_code == 200
+    assert login(client).status_code == 200
+    # Usernames are compared case-insensitively
+    response = login(client, "TestUser")
+    assert response.status_code == 429
+    assert int(response.headers["Retry-After"]) >= 1
+    assert b"Too Many Requests" in response.data
+
+    # Rejected attempts never reach Argon2
+    assert password_hashing.stats()["submitted"] == 2
+    assert ratelimiter.stats()["login_username"] == {
+        "allowed": 2,
+        "rejected": 1,
+        "keys": 1,
+    }
+    assert login(client, "otheruser").status_code == 200
+
+
+def test_login_ip_limit(app: Flask, client: Any) -> None:
+    app.config["RATELIMIT_LOGIN_IP"] = "1/minute"
+    first = {"REMOTE_ADDR": "203.0.113.1"}
+    second = {"REMOTE_ADDR": "203.0.113.2"}
+    assert login(client, environ_base=first).status_code == 200
+    assert login(client, "other", environ_base=first).status_code == 429
+    assert login(client, "other", environ_base=second).status_code == 200
+    # Not behind a proxy, so a forged X-Forwarded-For changes nothing
+    forged = {**first, "HTTP_X_FORWARDED_FOR": "198.51.100.7"}
+    assert login(client, "other", environ_base=forged).status_code == 429
+
+
+def test_login_ip_limit_behind_proxy(monkeypatch: Any) -> None:
+    monkeypatch.setattr(TestingConfig, "PROXY_FIX_X_FOR", 1)
+    monkeypatch.setattr(TestingConfig, "RATELIMIT_LOGIN_IP", "1/minute")
+    app = create_app(TestingConfig)
+    with app.app_context():
+        db.create_all()
+    client = app.test_client()
+    first = {"HTTP_X_FORWARDED_FOR": "203.0.113.1"}
+    second = {"HTTP_X_FORWARDED_FOR": "203.0.113.2"}
+    assert login(client, environ_base=first).status_code == 200
+    assert login(client, "other", environ_base=first).status_code == 429
+    assert login(client, "other", environ_base=second).status_code == 200
+
+
+def test_get_not_limited(app: Flask, client: Any) -> None:
+    app.config["RATELIMIT_LOGIN_IP"] = "1/minute"
+    for _ in range(3):
+        assert client.get("/auth/login").status_code == 200
+
+
+def test_disabled(app: Flask, client: Any) -> None:
+    app.config.update({
+        "RATELIMIT_ENABLED": False,
+        "RATELIMIT_LOGIN_USERNAME": "1/minute"
+    })
+    for _ in range(3):
+        assert login(client).status_code == 200
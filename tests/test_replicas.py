@@ -0,0 +1,159 @@
+"""test_replicas.py"""
+from __future__ import annotations
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import Any, Generator
+import pytest
+from flask import Flask
+from sqlalchemy import insert, select, update
+from app import create_app
+from config import TestingConfig
+from extensions import db, replicas, user_cache
+from lockout import lockout
+from models import User, load_user
+
+
+@pytest.fixture
+def replica_app(tmp_path: Path,
+                monkeypatch: Any) -> Generator[Flask, None, None]:
+    # Two SQLite files stand in for replicas; their rows differ from the
+    # primary's so that each query shows where it was sent
+    monkeypatch.setattr(TestingConfig, "SQLALCHEMY_DATABASE_URI",
+                        f"sqlite:///{tmp_path / 'primary.db'}")
+    monkeypatch.setattr(TestingConfig,
+                        "SQLALCHEMY_REPLICA_URIS", [
+                            f"sqlite:///{tmp_path / 'replica0.db'}",
+                            f"sqlite:///{tmp_path / 'replica1.db'}",
+                        ],
+                        raising=False)
+    app = create_app(TestingConfig)
+    with app.app_context():
+        engines = replicas.engines()
+        for engine, usernames in (
+            (db.engine, ["primaryuser", "newprimaryuser"]),
+            (engines["replica0"], ["replicauser0"]),
+            (engines["replica1"], ["replicauser1"]),
+        ):
+            db.metadata.create_all(engine)
+            with engine.begin() as conn:
+                conn.execute(insert(User), [{
+                    "username": username,
+                    "password": "x",
+                    "failed_attempts": 0,
+                    "is_admin": False,
+                    "created": datetime.now(timezone.utc)
+                } for username in usernames])
+        yield app
+        for engine in engines.values():
+            engine.dispose()
+
+
+def usernames() -> list[str]:
+    return list(
+        db.session.execute(select(User.username).order_by(User.id)).scalars())
+
+
+def test_reads_outside_read_only_use_primary(replica_app: Flask) -> None:
+    assert usernames() == ["primaryuser", "newprimaryuser"]
+
+
+def test_round_robin(replica_app: Flask) -> None:
+    with replicas.read_only():
+        seen = [usernames() for _ in range(4)]
+    assert sorted(seen) == [["replicauser0"], ["replicauser0"],
+                            ["replicauser1"], ["replicauser1"]]
+    assert seen[0] != seen[1]
+
+
+def test_read_after_write_stays_on_primary(replica_app: Flask) -> None:
+    with replica_app.app_context():
+        with replicas.read_only():
+            assert usernames()[0].startswith("replicauser")
+            db.session.add(User(username="writtenuser", password="x"))
+            db.session.commit()
+            assert "writtenuser" in usernames()
+    with replica_app.app_context(), replicas.read_only():
+        # A new request starts on the replicas again
+        assert usernames()[0].startswith("replicauser")
+
+
+def test_failover(replica_app: Flask) -> None:
+    replicas.mark_down("replica0")
+    assert replicas.health() == {"replica0": False, "replica1": True}
+    with replicas.read_only():
+        assert [usernames() for _ in range(3)] == [["replicauser1"]] * 3
+    replicas.mark_down("replica1")
+    with replicas.read_only():
+        assert usernames() == ["primaryuser", "newprimaryuser"]
+
+
+def test_unreachable_replica(tmp_path: Path, monkeypatch: Any) -> None:
+    monkeypatch.setattr(TestingConfig,
+                        "SQLALCHEMY_REPLICA_URIS",
+                        [f"sqlite:///{tmp_path / 'missing' / 'replica.db'}"],
+                        raising=False)
+    app = create_app(TestingConfig)
+    with app.app_context():
+        db.create_all()
+        db.session.add(User(username="primaryuser", password="x"))
+        db.session.commit()
+    with app.app_context(), replicas.read_only():
+        assert usernames() == ["primaryuser"]
+        assert replicas.health() == {"replica0": False}
+
+
+def test_load_user_falls_back_to_primary(replica_app: Flask) -> None:
+    user_cache.clear()
+    with replica_app.app_context():
+        user = load_user("1")
+        assert user is not None and user.username == "replicauser0"
+    with replica_app.app_context():
+        # Not replicated yet, so read from the primary
+        user = load_user("2")
+        assert user is not None and user.username == "newprimaryuser"
+
+
+def kill(engine: Any) -> None:
+    # Later connections fail, like those to a replica that went away
+    engine.dispose()
+    path = Path(engine.url.database)
+    path.unlink()
+    path.mkdir()
+
+
+def test_replica_killed_mid_request(replica_app: Flask) -> None:
+    user_cache.clear()
+    engines = replicas.engines()
+    with replicas.read_only():
+        # Both replicas are checked and in rotation
+        assert sorted(usernames() for _ in range(2)) == [["replicauser0"],
+                                                         ["replicauser1"]]
+    kill(engines["replica0"])
+    with replica_app.app_context():
+        # Retried on the other replica rather than failing the request
+        user = load_user("1")
+        assert user is not None and user.username == "replicauser1"
+    assert replicas.health() == {"replica0": False, "replica1": True}
+
+    user_cache.clear()
+    kill(engines["replica1"])
+    with replica_app.app_context():
+        user = load_user("1")
+        assert user is not None and user.username == "primaryuser"
+        with replicas.read_only():
+            assert usernames() == ["primaryuser", "newprimaryuser"]
+    assert replicas.health() == {"replica0": False, "replica1": False}
+
+
+def test_lockout_reset_uses_primary(replica_app: Flask) -> None:
+    db.session.execute(update(User).where(User.id == 1).values(
+        failed_attempts=2))
+    db.session.commit()
+    with replica_app.app_context():
+        with replicas.read_only():
+            user = db.session.get(User, 1)
+        # The replica has not seen the failed attempts yet
+        assert user is not None and user.failed_attempts == 0
+        assert lockout.reset(user)
+    assert db.session.execute(
+        select(User.failed_attempts).where(User.id == 1)).scalar() == 0
@@ -0,0 +1,226 @@
+"""test_scheduler.py"""
+from __future__ import annotations
+from datetime import datetime, timedelta, timezone
+import threading
+from pathlib import Path
+from typing import Any, Generator
+import pytest
+from flask import Flask
+from sqlalchemy import insert, select, text
+from app import create_app
+from config import TestingConfig
+from extensions import db
+from models import JobLease, User
+from scheduler import Job, JobRun, Scheduler, acquire_lease, scheduler
+
+NOW = datetime(2024, 1, 1, tzinfo=timezone.utc)
+
+
+@pytest.fixture
+def file_app(tmp_path: Path,
+             monkeypatch: Any) -> Generator[Flask, None, None]:
+    # The PRAGMA jobs need a database file
+    monkeypatch.setattr(TestingConfig, "SQLALCHEMY_DATABASE_URI",
+                        f"sqlite:///{tmp_path / 'scheduler.db'}")
+    app = create_app(TestingConfig)
+    with app.app_context():
+        db.create_all()
+        yield app
+        db.session.remove()
+        db.engine.dispose()
+
+
+def by_name(runs: list[JobRun]) -> dict[str, JobRun]:
+    return {run.name: run for run in runs}
+
+
+def test_lease(app: Flask) -> None:
+    minute = timedelta(minutes=1)
+    assert acquire_lease("job", "one", NOW, minute)
+    assert not acquire_lease("job", "two", NOW, minute)
+    assert not acquire_lease("job", "two", NOW + minute / 2, minute)
+    # Free again once it expires
+    assert acquire_lease("job", "two", NOW + minute, minute)
+    lease = db.session.get(JobLease, "job")
+    assert lease is not None and lease.holder == "two"
+
+
+def test_tick_runs_once_across_workers(file_app: Flask) -> None:
+    calls: list[str] = []
+    jobs = Scheduler()
+
+    @jobs.job("counted", 60)
+    def counted() -> int:
+        calls.append("counted")
+        return 3
+
+    @jobs.job("failing", 60)
+    def failing() -> int:
+        raise RuntimeError("boom")
+
+    @jobs.job("disabled", 60)
+    def disabled() -> int:
+        calls.append("disabled")
+        return 0
+
+    file_app.config["SCHEDULER_INTERVALS"] = {"disabled": 0}
+    # Two workers sharing the database
+    workers = [Flask(__name__), Flask(__name__)]
+    for worker in workers:
+        worker.config.update(file_app.config)
+        worker.config["APP_ROLE"] = "cli"
+        db.init_app(worker)
+        jobs.init_app(worker)
+    try:
+        with workers[0].app_context():
+            runs = by_name(jobs.tick(NOW))
+        with workers[1].app_context():
+            assert not jobs.tick(NOW + timedelta(seconds=30))
+        assert calls == ["counted"]
+        assert runs["counted"].outcome == "success"
+        assert runs["counted"].rows == 3
+        assert runs["failing"].outcome == "error"
+        assert runs["failing"].error == "RuntimeError: boom"
+
+        # Due again once the lease expires, at the second worker's next
+        # check, when the first worker finds it taken
+        workers[1].extensions["scheduler"].next_due.clear()
+        workers[0].extensions["scheduler"].next_due.clear()
+        with workers[1].app_context():
+            assert set(by_name(jobs.tick(NOW + timedelta(seconds=60)))) == {
+                "counted", "failing"
+            }
+        with workers[0].app_context():
+            assert not jobs.tick(NOW + timedelta(seconds=90))
+    finally:
+        for worker in workers:
+            with worker.app_context():
+                db.session.remove()
+
+    lease = db.session.get(JobLease, "failing")
+    assert lease is not None
+    assert lease.last_error == "RuntimeError: boom"
+    assert lease.last_rows is None
+
+
+def test_builtin_jobs(file_app: Flask) -> None:
+    now = datetime.now(timezone.utc)
+    db.session.execute(text("CREATE TABLE filler (data TEXT)"))
+    db.session.execute(text("INSERT INTO filler VALUES (:data)"),
+                       [{"data": "x" * 1000}] * 500)
+    db.session.execute(insert(User), [{
+        "username": f"locked{index:04d}",
+        "password": "unused",
+        "created": now,
+        "failed_attempts": 5,
+        "lockout_until": now + timedelta(minutes=-1 if index % 2 else 1),
+        "is_admin": False,
+    } for index in range(10)])
+    db.session.commit()
+    db.session.execute(text("DELETE FROM filler"))
+    db.session.commit()
+
+    runs = by_name(scheduler.tick())
+    assert set(runs) == {job.name for job in scheduler.jobs}
+    assert runs["clear_expired_lockouts"].rows == 5
+    assert runs["wal_checkpoint"].outcome == "success"
+    assert runs["optimize"].outcome == "success"
+    freed = runs["incremental_vacuum"].rows
+    assert freed is not None and freed > 100
+    assert db.session.execute(text("PRAGMA freelist_count")).scalar() == 0
+    locked = db.session.execute(
+        text("SELECT count(*) FROM user WHERE failed_attempts > 0")).scalar()
+    assert locked == 5
+
+
+def test_builtin_jobs_skipped(app: Flask) -> None:
+    # An in-memory database has no write-ahead log
+    runs = by_name(scheduler.tick())
+    assert runs["wal_checkpoint"].outcome == "skipped"
+    assert runs["clear_expired_lockouts"].rows == 0
+
+
+def test_metrics(app: Flask, client: Any, auth: Any) -> None:
+    scheduler.tick()
+    user = User.query.filter_by(username="testuser").one()
+    user.is_admin = True
+    db.session.commit()
+    _ = auth["login"]()
+    body = client.get("/admin/metrics").get_data(as_text=True)
+    assert 'scheduler_job_runs_total{job="optimize",outcome="success"} 1' \
+        in body
+    assert 'scheduler_job_duration_seconds_count{job="optimize"} 1' in body
+    assert 'scheduler_job_rows_total{job="clear_expired_lockouts"} 0' in body
+
+
+def test_cli(app: Flask, runner: Any) -> None:
+    result = runner.invoke(args=["scheduler", "run-job", "optimize"])
+    assert result.exit_code == 0, result.output
+    assert "optimize: success in" in result.output
+
+    result = runner.invoke(args=["scheduler", "run-job", "nope"])
+    assert result.exit_code == 1
+    assert "Unknown job 'nope'" in result.output
+
+    # Not run while another worker holds the lease, unless forced
+    assert acquire_lease("incremental_vacuum", "otherhost:1",
+                         datetime.now(timezone.utc), timedelta(hours=1))
+    result = runner.invoke(args=["scheduler", "run-job", "incremental_vacuum"])
+    assert result.exit_code == 1
+    assert "incremental_vacuum is leased by otherhost:1 until" in result.output
+    lease = db.session.get(JobLease, "incremental_vacuum")
+    assert lease is not None and lease.last_started is None
+    result = runner.invoke(
+        args=["scheduler", "run-job", "incremental_vacuum", "--force"])
+    assert result.exit_code == 0, result.output
+    assert "running it anyway" in result.output
+    assert db.session.execute(
+        select(JobLease.last_started).where(
+            JobLease.name == "incremental_vacuum")).scalar() is not None
+
+    result = runner.invoke(args=["scheduler", "status"])
+    assert result.exit_code == 0, result.output
+    lines = {line.split()[0]: line for line in result.output.splitlines()}
+    assert set(lines) == {"job"} | {job.name for job in scheduler.jobs}
+    assert "3600" in lines["optimize"]
+    assert lines["wal_checkpoint"].split()[2:] == ["-"] * 5
+
+
+def test_thread(monkeypatch: Any) -> None:
+    monkeypatch.setattr(TestingConfig, "SCHEDULER_ENABLED", True)
+    monkeypatch.setattr(TestingConfig, "SCHEDULER_INTERVALS",
+                        {job.name: 0
+                         for job in scheduler.jobs})
+    app = create_app(TestingConfig, role="web")
+    state = app.extensions["scheduler"]
+    assert state.thread is None
+    # Started by the first request, once
+    app.test_client().get("/")
+    thread = state.thread
+    assert thread is not None and thread.is_alive()
+    app.test_client().get("/")
+    assert state.thread is thread
+    # A running thread is found without taking the lock
+    with state.lock:
+        checker = threading.Thread(target=state.start)
+        checker.start()
+        checker.join(timeout=5)
+        assert not checker.is_alive()
+    with app.app_context():
+        scheduler.stop()
+    assert not thread.is_alive()
+    # Only web workers run it
+    cli_app = create_app(TestingConfig)
+    assert cli_app.extensions["scheduler"].start not in \
+        cli_app.before_request_funcs[None]
+
+
+def test_job_registration() -> None:
+    jobs = Scheduler()
+
+    @jobs.job("named", 5)
+    def named() -> None:
+        return None
+
+    assert jobs.get("named") == Job("named", 5, named)
+    assert jobs.get("other") is None
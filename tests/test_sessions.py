@@ -0,0 +1,207 @@
+"""test_sessions.py"""
+from __future__ import annotations
+import re
+from datetime import datetime, timedelta, timezone
+from pathlib import Path
+from typing import Any
+import pytest
+from flask import Flask, flash
+from flask.sessions import SecureCookieSessionInterface
+from sqlalchemy import event, select
+from app import create_app
+from config import TestingConfig
+from extensions import db
+from models import User, UserSession
+from sessions import StoredSession, session_key, session_store
+
+
+def cookie(client: Any) -> str:
+    value: str = client.get_cookie("session").value
+    return value
+
+
+def rows() -> list[UserSession]:
+    return list(db.session.execute(select(UserSession)).scalars())
+
+
+def logged_in(client: Any) -> bool:
+    # Flask-Login keeps the user on the app context the fixture shares
+    # between requests, so ask the session
+    with client.session_transaction() as sess:
+        return "_user_id" in sess
+
+
+def test_opaque_cookie(app: Flask, client: Any, auth: Any) -> None:
+    _ = auth["login"]()
+    sid, version = cookie(client).split(".")
+    assert re.fullmatch(r"[A-Za-z0-9_-]{43}", sid)
+    # The data stays on the server, stored under a hash of the ID
+    (row, ) = rows()
+    assert row.key == session_key(sid) != sid
+    assert row.version == int(version)
+    assert row.user_id == User.query.filter_by(username="testuser").one().id
+    assert client.get("/dashboard").status_code == 200
+
+
+def test_rotated_on_login(app: Flask, client: Any, auth: Any) -> None:
+    with client.session_transaction() as sess:
+        sess["theme"] = "dark"
+    before = cookie(client).split(".")[0]
+    _ = auth["login"]()
+    after = cookie(client).split(".")[0]
+    assert after != before
+    (row, ) = rows()
+    assert row.key == session_key(after)
+    with client.session_transaction() as sess:
+        assert sess["theme"] == "dark"
+
+
+def test_cache_tier(app: Flask, client: Any, auth: Any) -> None:
+    _ = auth["login"]()
+    client.get("/dashboard")
+    statements: list[str] = []
+
+    def record(*args: Any) -> None:
+        statements.append(args[2])
+
+    event.listen(db.engine, "before_cursor_execute", record)
+    try:
+        response = client.get("/dashboard")
+    finally:
+        event.remove(db.engine, "before_cursor_execute", record)
+    assert response.status_code == 200
+    # Read from the cache and not written back, so no Set-Cookie either
+    assert not any("user_session" in statement for statement in statements)
+    assert "Set-Cookie" not in response.headers
+    assert session_store.stats()["hits"] >= 2
+
+
+def test_workers_share_sessions(tmp_path: Path, monkeypatch: Any) -> None:
+    monkeypatch.setattr(TestingConfig, "SQLALCHEMY_DATABASE_URI",
+                        f"sqlite:///{tmp_path / 'sessions.db'}")
+    workers = [create_app(TestingConfig), create_app(TestingConfig)]
+    with workers[0].app_context():
+        db.create_all()
+        db.session.add(User("testuser", "unused"))
+        db.session.commit()
+
+    @workers[1].route("/flash")
+    def flash_message() -> str:
+        flash("From the other worker")
+        return ""
+
+    clients: list[Any] = [worker.test_client() for worker in workers]
+    with clients[0].session_transaction() as sess:
+        sess["_user_id"] = "1"
+    # Cached by the first worker, then changed by the second
+    assert clients[0].get("/dashboard").status_code == 200
+    clients[1].set_cookie("session", cookie(clients[0]))
+    assert clients[1].get("/dashboard").status_code == 200
+    clients[1].get("/flash")
+    clients[0].set_cookie("session", cookie(clients[1]))
+    # The newer version in the cookie makes the first worker reload it
+    with clients[0].session_transaction() as sess:
+        assert sess["_flashes"] == [("message", "From the other worker")]
+    for worker in workers:
+        with worker.app_context():
+            db.engine.dispose()
+
+
+def test_revoke(app: Flask, auth: Any, runner: Any) -> None:
+    user = User.query.filter_by(username="testuser").one()
+    user.is_admin = True
+    db.session.commit()
+    clients = [app.test_client() for _ in range(3)]
+    for client in clients:
+        client.post("/auth/login",
+                    data={
+                        "username": "testuser",
+                        "password": "TestPassword69@!"
+                    })
+        assert logged_in(client)
+
+    # Resetting the lockout logs the user out everywhere else
+    clients[0].post(f"/admin/reset_lockout/{user.id}")
+    assert len(rows()) == 1
+    assert logged_in(clients[0])
+    assert not logged_in(clients[1])
+    assert not logged_in(clients[2])
+
+    result = runner.invoke(args=["sessions", "revoke", "testuser"])
+    assert result.exit_code == 0, result.output
+    assert "Revoked 1 sessions" in result.output
+    assert not logged_in(clients[0])
+    result = runner.invoke(args=["sessions", "revoke", "nobody"])
+    assert "No user named 'nobody'" in result.output
+
+
+def test_logout_deletes(app: Flask, client: Any, auth: Any) -> None:
+    _ = auth["login"]()
+    _ = auth["logout"]()
+    # Shows, then drops, the flashed message
+    client.get("/")
+    assert not rows()
+    assert client.get_cookie("session") is None
+
+
+def test_anonymous_sessions_not_stored(app: Flask) -> None:
+    app.config["WTF_CSRF_ENABLED"] = True
+    clients: list[Any] = [app.test_client() for _ in range(3)]
+    for client in clients:
+        for path in ("/auth/login", "/auth/register", "/auth/login"):
+            assert client.get(path).status_code == 200
+    # The CSRF token is in a signed cookie rather than a stored session
+    assert not rows()
+    client = clients[0]
+    assert not re.fullmatch(r"[\w-]{43}\.\d+", cookie(client))
+    page = client.get("/auth/login").get_data(as_text=True)
+    match = re.search(r'name="csrf_token" type="hidden" value="([^"]+)"',
+                      page)
+    assert match is not None
+    response = client.post("/auth/login",
+                           data={
+                               "username": "testuser",
+                               "password": "TestPassword69@!",
+                               "csrf_token": match.group(1)
+                           })
+    assert response.status_code == 302
+    (row, ) = rows()
+    assert row.key == session_key(cookie(client).split(".")[0])
+    # Back in a signed cookie once logged out and the message is shown
+    client.get("/auth/logout")
+    client.get("/")
+    assert not rows()
+    assert client.get("/auth/login").status_code == 200
+
+
+@pytest.mark.parametrize("backend", ["database", "memory"])
+def test_expire(monkeypatch: Any, backend: str) -> None:
+    monkeypatch.setattr(TestingConfig, "SESSION_BACKEND", backend)
+    monkeypatch.setattr(TestingConfig, "SESSION_EXPIRE_CHUNK_SIZE", 2)
+    app = create_app(TestingConfig)
+    now = datetime.now(timezone.utc)
+    with app.app_context():
+        db.create_all()
+        store = app.extensions["session_store"].backend
+        for index in range(7):
+            expires = now + timedelta(minutes=-1 if index < 5 else 1)
+            store.create(f"key{index}", StoredSession("{}", 1, None, expires))
+        assert list(session_store.expire(now)) == [2, 2, 1]
+        assert store.load("key4") is None
+        assert store.load("key5") is not None
+        # Also run by the scheduler
+        store.create("key7", StoredSession("{}", 1, None, now))
+        (run, ) = [
+            run for run in app.extensions["scheduler"].tick()
+            if run.name == "expire_sessions"
+        ]
+        assert run.rows == 1
+
+
+def test_cookie_backend(monkeypatch: Any) -> None:
+    monkeypatch.setattr(TestingConfig, "SESSION_BACKEND", "cookie")
+    app = create_app(TestingConfig)
+    assert isinstance(app.session_interface, SecureCookieSessionInterface)
+    assert "session_store" not in app.extensions
+    with app.app_context():
+        assert session_store.revoke_user(1) == 0
@@ -0,0 +1,60 @@
+"""test_startup.py"""
+from __future__ import annotations
+import json
+import subprocess
+import sys
+import pytest
+from flask import Flask
+from app import create_app
+from config import TestingConfig
+
+HEAVY_MODULES = ("flask_migrate", "alembic", "multiprocessing", "dotenv",
+                 "calibrate", "loadtest")
+
+
+def loaded_modules(role: str) -> set[str]:
+    """Create an app with the given role in a new interpreter."""
+    code = ("import json, sys\n"
+            "from app import create_app\n"
+            "from config import TestingConfig\n"
+            f"create_app(TestingConfig, role={role!r})\n"
+            "print(json.dumps(sorted(sys.modules)))\n")
+    output = subprocess.run([sys.executable, "-c", code],
+                            check=True,
+                            capture_output=True,
+                            text=True).stdout
+    return set(json.loads(output.splitlines()[-1]))
+
+
+def test_web_role_skips_cli_only_modules() -> None:
+    modules = loaded_modules("web")
+    assert "blueprints.auth.routes" in modules
+    assert not modules.intersection(HEAVY_MODULES)
+
+
+def test_worker_role_skips_views() -> None:
+    modules = loaded_modules("worker")
+    assert "extensions" in modules
+    assert not any(name.startswith("blueprints") for name in modules)
+    assert "forms" not in modules
+
+
+def test_roles(app: Flask) -> None:
+    assert app.config["APP_ROLE"] == "cli"
+    assert "migrate" in app.extensions
+    assert "templates" in app.cli.commands
+
+    web = create_app(TestingConfig, role="web")
+    assert "migrate" not in web.extensions
+    assert not web.cli.commands
+    assert "auth" in web.blueprints
+
+    worker = create_app(TestingConfig, role="worker")
+    assert not worker.blueprints
+    assert "replicas" in worker.extensions
+    assert "csrf" not in worker.extensions
+
+
+def test_unknown_role() -> None:
+    with pytest.raises(ValueError, match="Unknown role"):
+        create_app(TestingConfig, role="scheduler")
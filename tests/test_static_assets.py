@@ -0,0 +1,110 @@
+"""test_static_assets.py"""
+from __future__ import annotations
+import gzip
+import json
+import re
+from pathlib import Path
+from typing import Any
+import pytest
+from flask import Flask
+from app import create_app
+from config import TestingConfig
+from extensions import db
+
+SCRIPT = Path(__file__).parent.parent.joinpath("blueprints", "auth", "static",
+                                               "username-availability.js")
+
+
+@pytest.fixture
+def built_app(monkeypatch: Any, tmp_path: Path) -> Flask:
+    monkeypatch.setattr(TestingConfig, "STATIC_ASSETS_DIR", str(tmp_path))
+    result = create_app(TestingConfig).test_cli_runner().invoke(
+        args=["assets", "build"])
+    assert result.exit_code == 0, result.output
+    assert "Built 1 assets" in result.output
+    app = create_app(TestingConfig)
+    with app.app_context():
+        db.create_all()
+    return app
+
+
+def script_url(app: Flask) -> str:
+    page = app.test_client().get("/auth/register").get_data(as_text=True)
+    match = re.search(r'<script src="([^"]+)"', page)
+    assert match is not None
+    return match.group(1)
+
+
+def test_build(built_app: Flask, tmp_path: Path) -> None:
+    manifest = json.loads((tmp_path / "manifest.json").read_text())
+    asset = manifest["auth.static"]["username-availability.js"]
+    assert re.fullmatch(r"auth/username-availability\.[0-9a-f]{12}\.js",
+                        asset["path"])
+    content = SCRIPT.read_bytes()
+    assert (tmp_path / asset["path"]).read_bytes() == content
+    compressed = (tmp_path / f"{asset['path']}.gz").read_bytes()
+    assert gzip.decompress(compressed) == content
+    assert asset["size"] == len(content)
+    assert asset["gzip_size"] == len(compressed) < len(content)
+
+
+def test_fingerprinted_url(built_app: Flask, tmp_path: Path) -> None:
+    path = json.loads((tmp_path / "manifest.json").read_text()
+                      )["auth.static"]["username-availability.js"]["path"]
+    assert script_url(built_app) == f"/assets/{path}"
+
+
+def test_serve_gzip(built_app: Flask) -> None:
+    client = built_app.test_client()
+    url = script_url(built_app)
+    response = client.get(url, headers={"Accept-Encoding": "gzip, br"})
+    assert response.status_code == 200
+    assert response.content_encoding == "gzip"
+    assert response.mimetype == "text/javascript"
+    assert gzip.decompress(response.data) == SCRIPT.read_bytes()
+    assert response.cache_control.immutable
+    assert response.cache_control.max_age == 31536000
+    assert response.headers["Vary"] == "Accept-Encoding"
+    response.close()
+
+    response = client.get(url,
+                          headers={
+                              "Accept-Encoding": "gzip",
+                              "If-None-Match": response.headers["ETag"]
+                          })
+    assert response.status_code == 304
+
+
+def test_serve_identity(built_app: Flask) -> None:
+    client = built_app.test_client()
+    url = script_url(built_app)
+    for headers in ({}, {"Accept-Encoding": "gzip;q=0, identity"}):
+        response = client.get(url, headers=headers)
+        assert response.status_code == 200
+        assert response.content_encoding is None
+        assert response.data == SCRIPT.read_bytes()
+        assert response.cache_control.immutable
+        response.close()
+
+
+def test_unknown_assets(built_app: Flask) -> None:
+    client = built_app.test_client()
+    assert client.get("/assets/auth/username-availability.js"
+                      ).status_code == 404
+    assert client.get("/assets/manifest.json").status_code == 404
+    assert client.get("/assets/../config.py").status_code == 404
+
+
+def test_unbuilt_fallback(app: Flask, client: Any) -> None:
+    url = script_url(app)
+    assert url == "/auth/static/username-availability.js"
+    response = client.get(url)
+    assert response.status_code == 200
+    assert response.data == SCRIPT.read_bytes()
+    response.close()
+
+
+def test_build_needs_directory(runner: Any) -> None:
+    result = runner.invoke(args=["assets", "build"])
+    assert result.exit_code == 1
+    assert "STATIC_ASSETS_DIR is not set" in result.output
@@ -0,0 +1,58 @@
+"""test_template_cache.py"""
+from __future__ import annotations
+from pathlib import Path
+from typing import Any
+from unittest import mock
+from flask import Blueprint, Flask
+from app import create_app
+from config import TestingConfig
+from template_cache import duplicate_templates, template_sources
+
+
+def cached_app(directory: Path, monkeypatch: Any, **config: Any) -> Flask:
+    monkeypatch.setattr(TestingConfig, "TEMPLATE_CACHE_DIR", str(directory))
+    for key, value in config.items():
+        monkeypatch.setattr(TestingConfig, key, value, raising=False)
+    return create_app(TestingConfig)
+
+
+def test_templates_resolve_to_one_folder(app: Flask) -> None:
+    sources = template_sources(app)
+    assert sources["base.html"] == ["app"]
+    assert sources["home.html"] == ["main"]
+    assert not duplicate_templates(app)
+
+
+def test_duplicates_detected(app: Flask, tmp_path: Path) -> None:
+    (tmp_path / "base.html").write_text("{% block content %}{% endblock %}")
+    app.register_blueprint(
+        Blueprint("shadow", __name__, template_folder=str(tmp_path)))
+    assert duplicate_templates(app) == {"base.html": ["app", "shadow"]}
+
+
+def test_compile(tmp_path: Path, monkeypatch: Any) -> None:
+    app = cached_app(tmp_path, monkeypatch)
+    result = app.test_cli_runner().invoke(args=["templates", "compile"])
+    assert result.exit_code == 0, result.output
+    assert "register.html" in result.output
+    assert "Compiled 10 templates" in result.output
+    assert len(list(tmp_path.iterdir())) == 10
+
+    # A new worker loads the bytecode instead of compiling the sources
+    app = cached_app(tmp_path, monkeypatch)
+    with mock.patch.object(app.jinja_env,
+                           "compile",
+                           side_effect=AssertionError("compiled")):
+        response = app.test_client().get("/auth/login")
+    assert response.status_code == 200
+
+
+def test_compile_requires_cache_dir(runner: Any) -> None:
+    result = runner.invoke(args=["templates", "compile"])
+    assert result.exit_code != 0
+    assert "TEMPLATE_CACHE_DIR is not set" in result.output
+
+
+def test_preload(tmp_path: Path, monkeypatch: Any) -> None:
+    app = cached_app(tmp_path, monkeypatch, TEMPLATE_PRELOAD=True)
+    assert len(app.jinja_env.cache or {}) == 10
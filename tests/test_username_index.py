@@ -0,0 +1,110 @@
+"""test_username_index.py"""
+from __future__ import annotations
+from pathlib import Path
+from typing import Any, Callable
+from flask import Flask
+from app import create_app
+from config import TestingConfig
+from extensions import db, argon2
+from models import User
+from username_index import BloomFilter, username_index
+
+
+def test_bloom_filter() -> None:
+    bloom = BloomFilter(capacity=1000, error_rate=0.01)
+    names = [f"user{index:05d}" for index in range(1000)]
+    for name in names:
+        bloom.add(name)
+    assert all(name in bloom for name in names)
+    false_positives = sum(f"other{index:05d}" in bloom
+                          for index in range(10000))
+    assert false_positives < 300
+    assert 1 not in bloom
+
+
+def test_is_available(app: Flask,
+                      count_queries: Callable[[], list[str]]) -> None:
+    assert username_index.refresh() == 1
+    statements = count_queries()
+    assert username_index.is_available("brandnewuser")
+    assert statements == []
+    assert not username_index.is_available("testuser")
+    assert len(statements) == 1
+
+
+def test_refresh_picks_up_new_users(app: Flask) -> None:
+    username_index.refresh()
+    db.session.add(User(username="otherworker", password="x"))
+    db.session.commit()
+    assert username_index.refresh() == 0
+    assert username_index.refresh(force=True) == 1
+    assert not username_index.is_available("otherworker")
+
+
+def test_username_available_endpoint(client: Any) -> None:
+    response = client.get("/auth/username-available?username=brandnewuser")
+    assert response.json == {
+        "username": "brandnewuser",
+        "valid": True,
+        "available": True
+    }
+    response = client.get("/auth/username-available?username=testuser")
+    assert response.json["available"] is False
+    response = client.get("/auth/username-available?username=short")
+    assert response.json == {
+        "username": "short",
+        "valid": False,
+        "available": False
+    }
+
+
+def test_username_available_rate_limited(app: Flask, client: Any) -> None:
+    app.config["RATELIMIT_USERNAME_AVAILABLE_IP"] = "1/minute"
+    url = "/auth/username-available?username=brandnewuser"
+    assert client.get(url).status_code == 200
+    assert client.get(url).status_code == 429
+
+
+def test_register_adds_to_index(app: Flask, auth: Any) -> None:
+    response = auth["register"]("registereduser", "Password123!")
+    assert response.status_code == 302
+    assert username_index.might_exist("registereduser")
+
+
+def test_register_duplicate_race(app: Flask, client: Any, auth: Any) -> None:
+    username_index.refresh()
+    # Another worker registers the name after this worker's index refreshed
+    db.session.add(
+        User(username="racinguser",
+             password=argon2.generate_password_hash("Password123!")))
+    db.session.commit()
+    assert username_index.is_available("racinguser")
+
+    response = auth["register"]("racinguser", "Password123!")
+    assert response.status_code == 200
+    assert b"Username is already taken." in response.data
+    assert User.query.filter_by(username="racinguser").count() == 1
+    assert not username_index.is_available("racinguser")
+
+
+def test_warmed_at_startup(tmp_path: Path, monkeypatch: Any,
+                           count_queries: Callable[[], list[str]]) -> None:
+    # Before the tables exist the index is left to be built on first use
+    assert create_app(TestingConfig, role="web").extensions[
+        "username_index"].refreshed_at is None
+    monkeypatch.setattr(TestingConfig, "SQLALCHEMY_DATABASE_URI",
+                        f"sqlite:///{tmp_path / 'users.db'}")
+    with create_app(TestingConfig).app_context():
+        db.create_all()
+        db.session.add(User(username="existinguser", password="x"))
+        db.session.commit()
+        db.engine.dispose()
+    web = create_app(TestingConfig, role="web")
+    assert web.extensions["username_index"].last_id == 1
+    with web.app_context():
+        statements = count_queries()
+        assert username_index.is_available("brandnewuser")
+        assert not username_index.might_exist("brandnewuser")
+        assert username_index.might_exist("existinguser")
+        assert statements == []
+        db.engine.dispose()
@@ -0,0 +1,204 @@
+"""username_index.py"""
+from __future__ import annotations
+import hashlib
+import math
+import threading
+import time
+from flask import Flask, current_app
+from sqlalchemy import select
+from sqlalchemy.exc import SQLAlchemyError
+from extensions import db
+from models import User
+
+
+class BloomFilter:
+    """
+    A fixed-size Bloom filter of strings.
+
+    Membership tests can return false positives (at roughly `error_rate`
+    once `capacity` items have been added) but never false negatives, so a
+    miss means the item was definitely never added.
+
+    Args:
+        capacity (int): The number of items the filter is sized for.
+        error_rate (float): The target false positive rate at capacity.
+    """
+
+    def __init__(self, capacity: int, error_rate: float) -> None:
+        capacity = max(capacity, 1)
+        self.size = max(
+            int(math.ceil(-capacity * math.log(error_rate) /
+                          (math.log(2)**2))), 8)
+        self.hashes = max(int(round(self.size / capacity * math.log(2))), 1)
+        self.bits = bytearray((self.size + 7) // 8)
+        self.count = 0
+
+    def _positions(self, item: str) -> list[int]:
+        digest = hashlib.blake2b(item.encode("utf-8"), digest_size=16).digest()
+        first = int.from_bytes(digest[:8], "little")
+        second = int.from_bytes(digest[8:], "little") | 1
+        return [(first + i * second) % self.size for i in range(self.hashes)]
+
+    def add(self, item: str) -> None:
+        """
+        Add an item to the filter.
+
+        Args:
+            item (str): The item to add.
+        """
+        for position in self._positions(item):
+            self.bits[position >> 3] |= 1 << (position & 7)
+        self.count += 1
+
+    def __contains__(self, item: object) -> bool:
+        if not isinstance(item, str):
+            return False
+        return all(self.bits[position >> 3] & (1 << (position & 7))
+                   for position in self._positions(item))
+
+
+class _IndexState:
+    """The Bloom filter of one application and how far it has been built."""
+
+    def __init__(self, capacity: int, error_rate: float) -> None:
+        self.bloom = BloomFilter(capacity, error_rate)
+        self.lock = threading.Lock()
+        self.last_id = 0
+        self.refreshed_at: float | None = None
+
+
+class UsernameIndex:
+    """
+    An in-process index of taken usernames.
+
+    The index is a Bloom filter built from the `user` table when a web
+    worker starts (otherwise on first use) and then topped up with rows
+    added since (by ID) at most every `USERNAME_INDEX_REFRESH` seconds, so
+    that users registered by other workers are picked up. A username absent
+    from the filter is definitely free and is reported as such without
+    touching the database; only possible matches are confirmed with a query.
+
+    The index is an optimization, not a guarantee: the unique constraint on
+    `user.username` remains the source of truth when inserting.
+
+    Args:
+        app (Flask | None): The Flask application object.
+    """
+
+    def __init__(self, app: Flask | None = None) -> None:
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app: Flask) -> None:
+        """
+        Initialize the index for an application.
+
+        For the "web" role the index is built here, so that the first
+        request of each worker does not read every username. Without a
+        `user` table yet it is left to be built on first use.
+
+        Args:
+            app (Flask): The Flask application object.
+        """
+        app.config.setdefault("USERNAME_INDEX_CAPACITY", 1000000)
+        app.config.setdefault("USERNAME_INDEX_ERROR_RATE", 0.01)
+        app.config.setdefault("USERNAME_INDEX_REFRESH", 30.0)
+        app.extensions["username_index"] = _IndexState(
+            int(app.config["USERNAME_INDEX_CAPACITY"]),
+            float(app.config["USERNAME_INDEX_ERROR_RATE"]))
+        if app.config.get("APP_ROLE") == "web":
+            with app.app_context():
+                try:
+                    self.refresh(force=True)
+                except SQLAlchemyError:
+                    db.session.rollback()
+
+    @staticmethod
+    def _state() -> _IndexState:
+        state: _IndexState = current_app.extensions["username_index"]
+        return state
+
+    def refresh(self, force: bool = False) -> int:
+        """
+        Add usernames inserted since the last refresh to the index.
+
+        The first call loads every username; later calls only read rows with
+        a higher ID, and are skipped unless the refresh interval has passed
+        or `force` is set.
+
+        Args:
+            force (bool): Refresh even if the interval has not passed.
+
+        Returns:
+            int: The number of usernames added.
+        """
+        state = self._state()
+        interval = float(current_app.config["USERNAME_INDEX_REFRESH"])
+
+        def fresh() -> bool:
+            return not force and state.refreshed_at is not None and \
+                time.monotonic() - state.refreshed_at < interval
+
+        if fresh():
+            return 0
+        with state.lock:
+            if fresh():
+                return 0
+            rows = db.session.execute(
+                select(User.id, User.username).where(
+                    User.id > state.last_id).order_by(
+                        User.id).execution_options(yield_per=5000))
+            added = 0
+            for row in rows:
+                state.bloom.add(row.username)
+                state.last_id = row.id
+                added += 1
+            state.refreshed_at = time.monotonic()
+            return added
+
+    def add(self, username: str) -> None:
+        """
+        Record a username as taken.
+
+        Args:
+            username (str): The username that was just inserted.
+        """
+        state = self._state()
+        with state.lock:
+            state.bloom.add(username)
+
+    def might_exist(self, username: str) -> bool:
+        """
+        Check the index alone for a username.
+
+        Args:
+            username (str): The username to look up.
+
+        Returns:
+            bool: `False` if the username is definitely free, `True` if it may
+            be taken.
+        """
+        self.refresh()
+        return username in self._state().bloom
+
+    def is_available(self, username: str) -> bool:
+        """
+        Check whether a username is free.
+
+        Only usernames the index cannot rule out are looked up in the
+        database.
+
+        Args:
+            username (str): The username to check.
+
+        Returns:
+            bool: `True` if no user has this username.
+        """
+        if not self.might_exist(username):
+            return True
+        exists = db.session.execute(
+            select(User.id).where(User.username == username).limit(1)).first()
+        return exists is None
+
+
+username_index: UsernameIndex = UsernameIndex()
@@ -2,4 +2,4 @@
 from __future__ import annotations
 from app import create_app
 
-app = create_app()
+app = create_app(role="web")